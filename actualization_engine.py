@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Set-based актуалізація контактних даних компаній з другого файлу.
+
+Файл читається потоково (default_reader з ingestion_pipeline), контактні поля
+очищуються колонками і всі рядки йдуть одним потоком COPY FROM STDIN у
+тимчасову staging-таблицю (тимчасові таблиці не пишуть WAL). Далі один
+UPDATE companies ... FROM staging з COALESCE-семантикою попереднього
+построкового оновлення, тож карту edrpou → id у Python будувати не потрібно.
+
+Текст зберігається як є (clean_text_column): стара актуалізація подвоювала
+апострофи (O''Brien), такі рядки виправляє разова міграція
+python schema_migrations.py actualization_quotes.
+"""
+
+import io
+import itertools
+import logging
+
+import numpy as np
+import pandas as pd
+
+from import_engine import copy_escape
+from ingestion_pipeline import EDRPOU_PATTERN, dataframe_records, default_reader, normalize_header
+from vectorized_cleaning import clean_text_column
+
+# Поле companies → варіанти заголовків у порядку пріоритету
+TEXT_FIELD_VARIANTS = {
+    'first_name': ["Ім'я", 'Имя', 'First Name', 'first_name', "Ім'я директора"],
+    'middle_name': ['По батькові', 'Отчество', 'Middle Name', 'middle_name', 'По батькові директора'],
+    'last_name': ['Прізвище', 'Фамилия', 'Last Name', 'last_name', 'Прізвище директора'],
+    'work_phone': ['Робочий телефон', 'Рабочий телефон', 'Work Phone', 'work_phone', 'Тел. роб'],
+    'corporate_site': ['Корпоративний сайт', 'Корпоративный сайт', 'Corporate Site', 'corporate_site', 'Сайт'],
+    'work_email': ['Робочий e-mail', 'Рабочий e-mail', 'Work Email', 'work_email', 'Email'],
+    'company_status': ['Стан компанії', 'Статус компании', 'Company Status', 'company_status', 'Статус'],
+    'director': ['Директор', 'Director', 'director', 'Керівник', 'ПІБ директора'],
+    'initials': ['Инициалы в падеже', 'Ініціали в відмінку', 'Initials', 'initials', 'Ініціали'],
+}
+GOVERNMENT_PURCHASES_VARIANTS = ['Участь у держзакупівлях (на 01.04.2020)', 'Участие в госзакупках',
+                                 'Government Purchases', 'government_purchases', 'Держзакупівлі']
+TENDER_COUNT_VARIANTS = ['Кількість тендерів', 'Количество тендеров', 'Tender Count']
+EDRPOU_KEYWORDS = ['ЄДРПОУ', 'EDRPOU']
+
+YES_VALUES = ['так', 'да', 'yes', '1', 'true']
+NO_VALUES = ['ні', 'нет', 'no', '0', 'false']
+
+TEXT_FIELDS = list(TEXT_FIELD_VARIANTS)
+STAGING_COLUMNS = ['row_num', 'edrpou'] + TEXT_FIELDS + ['government_purchases', 'tender_count']
+
+ACTUALIZED_VALUE = 'так'
+COPY_READ_SIZE = 1 << 20
+
+STAGING_DDL = """
+    CREATE TEMP TABLE staging_actualization (
+        row_num INTEGER,
+        edrpou TEXT,
+        first_name TEXT,
+        middle_name TEXT,
+        last_name TEXT,
+        work_phone TEXT,
+        corporate_site TEXT,
+        work_email TEXT,
+        company_status TEXT,
+        director TEXT,
+        initials TEXT,
+        government_purchases NUMERIC(15,2),
+        tender_count INTEGER
+    ) ON COMMIT DROP
+"""
+
+# Кілька рядків з одним ЄДРПОУ зводяться до одного: для кожного поля береться
+# останнє непорожнє значення у файлі - так само, як послідовні построкові
+# UPDATE з COALESCE. UPDATE ... FROM з дублікатами оновив би рядок недетерміновано.
+LATEST_VALUES_SQL = ',\n'.join(
+    f"        (array_agg({field} ORDER BY row_num DESC) FILTER (WHERE {field} IS NOT NULL))[1] AS {field}"
+    for field in STAGING_COLUMNS[2:]
+)
+
+UPDATE_SQL = f"""
+    UPDATE companies c SET
+        first_name = COALESCE(s.first_name, c.first_name),
+        middle_name = COALESCE(s.middle_name, c.middle_name),
+        last_name = COALESCE(s.last_name, c.last_name),
+        work_phone = COALESCE(s.work_phone, c.work_phone),
+        corporate_site = COALESCE(s.corporate_site, c.corporate_site),
+        work_email = COALESCE(s.work_email, c.work_email),
+        company_status = COALESCE(s.company_status, c.company_status),
+        director = COALESCE(s.director, c.director),
+        government_purchases = COALESCE(s.government_purchases, c.government_purchases),
+        tender_count = COALESCE(s.tender_count, c.tender_count),
+        initials = COALESCE(s.initials, c.initials),
+        actualized = %(actualized)s,
+        is_actualized = true,
+        actualized_at = CURRENT_TIMESTAMP,
+        updated_at = CURRENT_TIMESTAMP
+    FROM (
+        SELECT edrpou,
+{LATEST_VALUES_SQL}
+        FROM staging_actualization
+        GROUP BY edrpou
+    ) s
+    WHERE c.edrpou = s.edrpou
+"""
+
+RESULT_SQL = """
+    COPY (
+        SELECT DISTINCT s.edrpou, 'updated' AS status, 'all_fields' AS updated_fields
+        FROM staging_actualization s
+        JOIN companies c ON c.edrpou = s.edrpou
+        ORDER BY s.edrpou
+    ) TO STDOUT WITH CSV HEADER
+"""
+
+
+class CopyStream:
+    """Файлоподібний об'єкт для copy_expert поверх генератора текстових блоків"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._current = io.StringIO()
+
+    def read(self, size=-1):
+        parts = []
+        while True:
+            data = self._current.read(size)
+            parts.append(data)
+            if size >= 0:
+                size -= len(data)
+                if size == 0:
+                    break
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._current = io.StringIO(chunk)
+        return ''.join(parts)
+
+
+def find_edrpou_column(columns):
+    """Колонка з ЄДРПОУ (гнучкий пошук за ключовими словами) або None"""
+    for column in columns:
+        if any(keyword in str(column).upper() for keyword in EDRPOU_KEYWORDS):
+            return column
+    return None
+
+
+def _first_present(variants, normalized):
+    """Колонки файлу, що відповідають variants, у порядку пріоритету"""
+    wanted = [normalize_header(variant) for variant in variants]
+    return [normalized[name] for name in wanted if name in normalized]
+
+
+def _coalesce(columns):
+    """Перше ненульове значення з кількох колонок (як ланцюжок row.get(a) or row.get(b))"""
+    result = columns[0]
+    for column in columns[1:]:
+        result = result.where(result.notna(), column)
+    return result
+
+
+def _government_purchases(series):
+    """так/да/yes/1/true → 1, ні/нет/no/0/false → 0, інше → None"""
+    text = series.astype(str).str.strip().str.lower()
+    return pd.Series(np.where(text.isin(YES_VALUES), 1.0, np.where(text.isin(NO_VALUES), 0.0, np.nan)),
+                     index=series.index)
+
+
+def _tender_count(series):
+    """Кількість тендерів: ціле невід'ємне число, 'ні'/'немає'/некоректне → None"""
+    text = series.where(series.notna(), '').astype(str).str.strip()
+    numbers = np.trunc(pd.to_numeric(text, errors='coerce'))
+    return numbers.where(numbers >= 0).astype('Int64')
+
+
+def prepare_batch(df, row_offset):
+    """
+    Очистити батч файлу актуалізації. Повертає (DataFrame з STAGING_COLUMNS,
+    кількість відхилених рядків без валідного ЄДРПОУ).
+    """
+    edrpou_column = find_edrpou_column(df.columns)
+    if edrpou_column is None:
+        raise ValueError("Колонка ЄДРПОУ не знайдена в файлі актуалізації")
+
+    normalized = {}
+    for column in df.columns:
+        normalized.setdefault(normalize_header(column), column)
+
+    staged = pd.DataFrame(index=df.index)
+    staged['row_num'] = np.arange(row_offset + 1, row_offset + len(df) + 1)
+    # ЄДРПОУ з Excel приходить як число: 12345678.0 → 12345678
+    edrpou = clean_text_column(df[edrpou_column], 20)
+    staged['edrpou'] = edrpou.str.replace(r'\.0$', '', regex=True)
+
+    for field, variants in TEXT_FIELD_VARIANTS.items():
+        columns = _first_present(variants, normalized)
+        staged[field] = _coalesce([clean_text_column(df[c]) for c in columns]) if columns else None
+
+    columns = _first_present(GOVERNMENT_PURCHASES_VARIANTS, normalized)
+    staged['government_purchases'] = (_coalesce([_government_purchases(df[c]) for c in columns])
+                                      if columns else None)
+    columns = _first_present(TENDER_COUNT_VARIANTS, normalized)
+    staged['tender_count'] = _coalesce([_tender_count(df[c]) for c in columns]) if columns else None
+
+    valid = staged['edrpou'].notna() & staged['edrpou'].astype('string').str.fullmatch(EDRPOU_PATTERN).fillna(False)
+    valid = valid.astype(bool)
+    return staged.loc[valid, STAGING_COLUMNS], int((~valid).sum())
+
+
+def actualize_batches(connection, batches, result_path=None, progress=None):
+    """
+    Актуалізувати companies з ітерованого набору DataFrame одним COPY і одним UPDATE.
+
+    result_path - необов'язковий CSV зі списком оновлених ЄДРПОУ
+    (edrpou,status,updated_fields). progress(rows_read) викликається після
+    кожного батчу. Транзакція комітиться в кінці, при помилці - rollback.
+    Повертає rows_read/rows_rejected/staged/matched/unmatched.
+    """
+    stats = {'rows_read': 0, 'rows_rejected': 0, 'staged': 0, 'matched': 0, 'unmatched': 0}
+
+    # Заголовок перевіряється до COPY: помилка всередині потоку COPY втрачає текст
+    batches = iter(batches)
+    first = next(batches, None)
+    if first is None:
+        return stats
+    if find_edrpou_column(first.columns) is None:
+        raise ValueError("Колонка ЄДРПОУ не знайдена в файлі актуалізації")
+    batches = itertools.chain([first], batches)
+
+    def copy_chunks():
+        for df in batches:
+            staged, rejected = prepare_batch(df, stats['rows_read'])
+            stats['rows_read'] += len(df)
+            stats['rows_rejected'] += rejected
+            if progress:
+                progress(stats['rows_read'])
+            yield ''.join('\t'.join(copy_escape(v) for v in record) + '\n'
+                          for record in dataframe_records(staged))
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute(STAGING_DDL)
+        cursor.copy_expert(
+            f"COPY staging_actualization ({', '.join(STAGING_COLUMNS)}) FROM STDIN",
+            CopyStream(copy_chunks()), size=COPY_READ_SIZE
+        )
+        cursor.execute("ANALYZE staging_actualization")
+        cursor.execute("SELECT COUNT(DISTINCT edrpou) FROM staging_actualization")
+        stats['staged'] = cursor.fetchone()[0]
+
+        cursor.execute(UPDATE_SQL, {'actualized': ACTUALIZED_VALUE})
+        stats['matched'] = cursor.rowcount
+        stats['unmatched'] = stats['staged'] - stats['matched']
+
+        if result_path:
+            with open(result_path, 'w', newline='', encoding='utf-8') as result_file:
+                cursor.copy_expert(RESULT_SQL, result_file)
+
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    logging.info(f"Actualization done: {stats}")
+    return stats
+
+
+def actualize_file(connection, file_path, result_path=None, progress=None):
+    """Актуалізувати companies з файлу (xlsx/xls/csv), див. actualize_batches"""
+    return actualize_batches(connection, default_reader(file_path), result_path, progress)
@@ -0,0 +1,32 @@
+"""
+Типізований стан актуалізації компанії.
+
+companies.actualized - текст з файлів і старих записів ('так', 'ні', 'yes',
+'ОК', ...), який показується і експортується як є. Для умов і лічильників
+використовується companies.is_actualized (boolean) і actualized_at -
+час останньої актуалізації. Їх підтримують усі записи: актуалізація
+(actualization_engine, data_processor_full), імпорти (import_engine,
+ingestion_pipeline) і рейтинг старого data_processor. Лічильники
+«Актуалізовано» (dashboard_stats) читають частковий індекс
+idx_companies_actualized (db_indexes.py) без сканування таблиці.
+
+Існуючі рядки заповнюються разовою міграцією за текстовим значенням
+(LEGACY_ACTUALIZED_CONDITION, python schema_migrations.py is_actualized),
+яка також робить колонку NOT NULL. До неї is_actualized може бути NULL -
+це читається як «не актуалізовано» (WHERE is_actualized, bool(...)).
+"""
+
+# Текстові значення companies.actualized, що означають «актуалізовано»
+ACTUALIZED_VALUES = ('так', 'yes', 'true', '1', 'актуалізовано', 'updated', 'ok')
+
+# Та сама перевірка в SQL - тільки для перенесення старих значень, не для запитів
+LEGACY_ACTUALIZED_CONDITION = "LOWER(TRIM(actualized)) IN (%s)" % ', '.join(
+    f"'{value}'" for value in ACTUALIZED_VALUES
+)
+
+
+def is_actualized_value(value):
+    """Чи означає текстове значення actualized актуалізовану компанію"""
+    if not value:
+        return False
+    return str(value).strip().lower() in ACTUALIZED_VALUES
@@ -28,42 +28,42 @@ def get_companies():
         sort_by = request.args.get('sort_by', 'name')
         sort_order = request.args.get('sort_order', 'asc')
         
-        # Build query using SQLAlchemy 2.x syntax
-        from sqlalchemy import select
-        query = select(Company)
+        from pagination import keyset_page, offset_page, count_rows, SORT_COLUMNS, DEFAULT_SORT
         
-        # Apply filters
+        # Filters as conditions: the same list is used for the page query and the count
+        conditions = []
         if region_id:
-            query = query.where(Company.region_name == region_id)
+            conditions.append(Company.region_name == region_id)
         
         if kved_id:
-            query = query.where(Company.kved_code == kved_id)
+            conditions.append(Company.kved_code == kved_id)
         
         if size_id:
-            query = query.where(Company.company_size_name == size_id)
+            conditions.append(Company.company_size_name == size_id)
         
         if min_employees:
-            query = query.where(Company.personnel_2019 >= min_employees)
+            conditions.append(Company.personnel_2019 >= min_employees)
         
         if min_revenue:
-            query = query.where(Company.revenue_2019 >= min_revenue)
-        
-        # Apply sorting
-        if sort_by == 'revenue':
-            query = query.order_by(desc(Company.revenue_2019) if sort_order == 'desc' else asc(Company.revenue_2019))
-        elif sort_by == 'profit':
-            query = query.order_by(desc(Company.profit_2019) if sort_order == 'desc' else asc(Company.profit_2019))
-        elif sort_by == 'personnel':
-            query = query.order_by(desc(Company.personnel_2019) if sort_order == 'desc' else asc(Company.personnel_2019))
-        elif sort_by == 'ranking':
-            query = query.order_by(asc(Company.ranking) if sort_order == 'asc' else desc(Company.ranking))
-        else:
-            query = query.order_by(asc(Company.name) if sort_order == 'asc' else desc(Company.name))
+            conditions.append(Company.revenue_2019 >= min_revenue)
+        
+        # Sorting: name, revenue(_2019), profit(_2019), personnel(_2019), ranking; id - stable tiebreak
+        if sort_by not in SORT_COLUMNS:
+            sort_by = DEFAULT_SORT
+        sort_order = 'desc' if sort_order == 'desc' else 'asc'
         
-        # Execute query with pagination
-        offset = (page - 1) * per_page
-        companies = db.session.execute(query.offset(offset).limit(per_page)).scalars().all()
-        total = db.session.execute(select(func.count()).select_from(query.subquery())).scalar()
+        # Keyset pagination by cursor (after/before); OFFSET only for ?page=N without cursor
+        query = db.select(Company).where(*conditions)
+        after = request.args.get('after', type=str)
+        before = request.args.get('before', type=str)
+        if after or before or page <= 1:
+            result_page = keyset_page(query, sort_by, sort_order, per_page, after=after, before=before)
+        else:
+            result_page = offset_page(query, sort_by, sort_order, page, per_page)
+        companies = result_page.items
+        # Total from SQL, consistent with the live rows above (the in-memory snapshot can be
+        # up to SNAPSHOT_MAX_AGE stale - it serves only the live /companies/count counter)
+        total, total_estimated = count_rows(conditions)
         
         # Format response
         companies_data = []
@@ -82,14 +82,13 @@ def get_companies():
                 'company_size_name': company.company_size_name,
                 'revenue_2019': float(company.revenue_2019) if company.revenue_2019 else None,
                 'profit_2019': float(company.profit_2019) if company.profit_2019 else None,
-                'actualized': company.actualized or 'ні'
+                'actualized': company.actualized or 'ні',
+                'is_actualized': bool(company.is_actualized)
             }
             companies_data.append(company_data)
         
         # Calculate pagination
         pages = (total + per_page - 1) // per_page
-        has_next = page < pages
-        has_prev = page > 1
         
         response = {
             'companies': companies_data,
@@ -97,9 +96,12 @@ def get_companies():
                 'page': page,
                 'per_page': per_page,
                 'total': total,
+                'total_estimated': total_estimated,
                 'pages': pages,
-                'has_next': has_next,
-                'has_prev': has_prev
+                'has_next': result_page.has_next,
+                'has_prev': result_page.has_prev,
+                'next_cursor': result_page.next_cursor,
+                'prev_cursor': result_page.prev_cursor
             }
         }
         
@@ -109,6 +111,84 @@ def get_companies():
         logging.error(f"API error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@api.route('/companies/count', methods=['GET'])
+@login_required
+def count_companies_route():
+    """
+    Live counter for the filter page: companies matching the filter form
+    (min_employees, min_revenue, min_profit, region_filter, kved_filter,
+    size_filter). ?top=N&criteria=revenue&sort_order=desc adds the top-N.
+    """
+    if not current_user.has_permission('view'):
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    
+    try:
+        from company_snapshot import get_snapshot, parse_filters, sql_count
+        
+        filters = parse_filters(request.args)
+        snapshot = get_snapshot()
+        if snapshot is None:
+            return jsonify({'count': sql_count(filters), 'engine': 'sql'})
+        
+        response = {
+            'count': snapshot.count(filters),
+            'total': len(snapshot),
+            'generation': snapshot.generation,
+            'engine': 'snapshot'
+        }
+        top = request.args.get('top', 0, type=int)
+        if top > 0:
+            criteria = request.args.get('criteria', 'revenue')
+            indices = snapshot.top_k(criteria, top, request.args.get('sort_order', 'desc'), filters)
+            response['top'] = snapshot.companies(indices, criteria)
+        return jsonify(response)
+        
+    except Exception as e:
+        logging.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api.route('/companies/suggest', methods=['GET'])
+@login_required
+def suggest_companies_route():
+    """
+    Autocomplete by EDRPOU or company name: ?q=...&limit=10 (max 50).
+    EDRPOU/name prefix matches first, then substring matches when pg_trgm is available.
+    """
+    if not current_user.has_permission('view'):
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    
+    try:
+        from company_search import DEFAULT_LIMIT, suggest_companies, trigram_available
+        
+        query = request.args.get('q', '', type=str)
+        limit = request.args.get('limit', DEFAULT_LIMIT, type=int)
+        return jsonify({
+            'query': query,
+            'results': suggest_companies(query, limit),
+            'trigram': trigram_available()
+        })
+        
+    except Exception as e:
+        logging.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@api.route('/companies/<int:company_id>/financials', methods=['GET'])
+@login_required
+def company_financials_route(company_id):
+    """Financial metrics of a company by year with year-over-year growth"""
+    if not current_user.has_permission('view'):
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    
+    try:
+        if db.session.get(Company, company_id) is None:
+            return jsonify({'error': 'Company not found'}), 404
+        from financials import company_financials
+        return jsonify(company_financials(company_id))
+        
+    except Exception as e:
+        logging.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 # Note: Region, KVED, and CompanySize endpoints moved to api_endpoints.py
 # This avoids import errors with non-existent model classes
 
@@ -324,3 +404,161 @@ def get_ranking(ranking_id):
     except Exception as e:
         logging.error(f"API error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
+
+# Фонові задачі (jobs.py): тип задачі → право, потрібне для запуску через API
+JOB_SUBMIT_PERMISSIONS = {
+    'merge': 'upload',
+    'process_csv': 'upload',
+    'import_processed_csv': 'upload',
+    'actualize': 'actualize',
+    'export_ranking_pdf': 'export',
+    'export_rankings_pdf_bundle': 'export',
+    'refresh_rankings': 'edit',
+}
+
+def _can_access_job(job):
+    return current_user.has_permission('upload') or job.created_by == current_user.id
+
+@api.route('/jobs', methods=['GET'])
+@login_required
+def list_jobs():
+    """Список останніх фонових задач (адміністратор - всі, інші - власні)"""
+    from jobs import list_jobs as recent_jobs, job_to_dict
+    
+    limit = min(request.args.get('limit', 50, type=int), 200)
+    jobs = recent_jobs(limit, request.args.get('status'), request.args.get('kind'))
+    return jsonify({'jobs': [job_to_dict(job) for job in jobs if _can_access_job(job)]})
+
+@api.route('/jobs', methods=['POST'])
+@login_required
+def create_job():
+    """Поставити задачу в чергу: {"kind": "...", "params": {...}}"""
+    from jobs import submit_job, job_to_dict
+    
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+    params = data.get('params') or {}
+    permission = JOB_SUBMIT_PERMISSIONS.get(kind)
+    if permission is None:
+        return jsonify({'error': f'Unknown job kind: {kind}'}), 400
+    if not current_user.has_permission(permission):
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    
+    target = params.get('filename') or params.get('main_file') or params.get('ranking_id')
+    try:
+        job = submit_job(kind, params, target=str(target) if target is not None else None,
+                         user_id=current_user.id)
+        return jsonify(job_to_dict(job)), 202
+    except Exception as e:
+        logging.error(f"API error: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+@api.route('/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def get_job_status(job_id):
+    """Стан задачі: прогрес (rows_done/rows_total), швидкість, ETA, результат"""
+    from jobs import get_job, job_to_dict
+    
+    job = get_job(job_id)
+    if job is None or not _can_access_job(job):
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_to_dict(job))
+
+@api.route('/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job_route(job_id):
+    """Скасувати задачу в черзі або запросити зупинку задачі, що виконується"""
+    from jobs import get_job, cancel_job, job_to_dict
+    
+    job = get_job(job_id)
+    if job is None or not _can_access_job(job):
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job_to_dict(cancel_job(job_id)))
+
+@api.route('/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+def retry_job_route(job_id):
+    """Повторити задачу, що завершилась помилкою або скасована"""
+    from jobs import get_job, retry_job, job_to_dict, FAILED, CANCELLED
+    
+    job = get_job(job_id)
+    if job is None or not _can_access_job(job):
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status not in (FAILED, CANCELLED):
+        return jsonify({'error': f'Job is {job.status}'}), 409
+    return jsonify(job_to_dict(retry_job(job_id)))
+
+@api.route('/selections/combine', methods=['POST'])
+@login_required
+def combine_selections_route():
+    """Нова база відбору з двох існуючих: {"left": id, "right": id, "operation": "and|or|andnot"}"""
+    if not current_user.has_permission('edit'):
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    from selection_bitmap import OPERATIONS, combine_selections
+    
+    data = request.get_json(silent=True) or {}
+    operation = (data.get('operation') or '').lower()
+    if operation not in OPERATIONS:
+        return jsonify({'error': f'Unknown operation: {operation}'}), 400
+    try:
+        left, right = int(data['left']), int(data['right'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'left and right selection base ids are required'}), 400
+    
+    try:
+        selection_base = combine_selections(left, right, operation, name=data.get('name'))
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    try:
+        from dashboard_stats import refresh_selection_stats
+        refresh_selection_stats(selection_base.id)
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Dashboard stats refresh failed: {e}")
+    
+    return jsonify({
+        'id': selection_base.id,
+        'name': selection_base.name,
+        'companies_count': selection_base.companies_count,
+        'operation': operation,
+        'left': left,
+        'right': right
+    }), 201
+
+@api.route('/rankings/<int:ranking_id>/refresh', methods=['POST'])
+@login_required
+def refresh_ranking_route(ranking_id):
+    """Оновити позиції рейтингу після змін компаній: {"full": false}"""
+    if not current_user.has_permission('edit'):
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    from ranking_refresh import refresh_ranking
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        stats = refresh_ranking(ranking_id, full=bool(data.get('full')))
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"API error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+    
+    if stats['positions_changed']:
+        try:
+            from dashboard_stats import refresh_ranking_stats
+            refresh_ranking_stats()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Dashboard stats refresh failed: {e}")
+    
+    stats['since'] = stats['since'].isoformat() if stats['since'] else None
+    return jsonify(stats)
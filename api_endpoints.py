@@ -1,33 +1,24 @@
 """Additional API endpoints for filter options"""
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request
 from flask_login import login_required, current_user
 from models_full import Company
 from app import db
 from sqlalchemy import func
+from facets import facet_response
 import logging
 
 api_filters = Blueprint('api_filters', __name__)
 
 @api_filters.route('/api/regions', methods=['GET'])
 def get_regions():
-    """API endpoint to get distinct regions"""
+    """API endpoint to get distinct regions (кешований фасет з кількістю компаній, ETag)"""
     
     try:
-        regions = db.session.execute(
-            db.select(Company.region_name)
-            .distinct()
-            .where(Company.region_name.isnot(None))
-            .order_by(Company.region_name)
-        ).scalars().all()
-        
-        result = []
-        for region in regions:
-            result.append({
-                'id': region,  # Use region name as ID
-                'name': region
-            })
-        
-        return jsonify({'regions': result})
+        return facet_response('regions', lambda rows: {'regions': [{
+            'id': region,  # Use region name as ID
+            'name': region,
+            'count': count
+        } for region, count in rows]})
         
     except Exception as e:
         logging.error(f"API error getting regions: {str(e)}")
@@ -36,25 +27,15 @@ def get_regions():
 
 @api_filters.route('/api/kved', methods=['GET'])
 def get_kved():
-    """API endpoint to get distinct KVED codes"""
+    """API endpoint to get distinct KVED codes (кешований фасет з кількістю компаній, ETag)"""
     
     try:
-        kved_data = db.session.execute(
-            db.select(Company.kved_code, Company.kved_description)
-            .distinct()
-            .where(Company.kved_code.isnot(None))
-            .order_by(Company.kved_code)
-        ).all()
-        
-        result = []
-        for kved_code, kved_description in kved_data:
-            result.append({
-                'id': kved_code,  # Use KVED code as ID
-                'code': kved_code,
-                'description': kved_description or 'Опис відсутній'
-            })
-        
-        return jsonify({'kved': result})
+        return facet_response('kved', lambda rows: {'kved': [{
+            'id': kved_code,  # Use KVED code as ID
+            'code': kved_code,
+            'description': kved_description or 'Опис відсутній',
+            'count': count
+        } for kved_code, kved_description, count in rows]})
         
     except Exception as e:
         logging.error(f"API error getting KVED: {str(e)}")
@@ -63,29 +44,34 @@ def get_kved():
 
 @api_filters.route('/api/company_sizes', methods=['GET'])
 def get_company_sizes():
-    """API endpoint to get distinct company sizes"""
+    """API endpoint to get distinct company sizes (кешований фасет з кількістю компаній, ETag)"""
     
     try:
-        sizes = db.session.execute(
-            db.select(Company.company_size_name)
-            .distinct()
-            .where(Company.company_size_name.isnot(None))
-            .order_by(Company.company_size_name)
-        ).scalars().all()
-        
-        result = []
-        for size in sizes:
-            result.append({
-                'id': size,  # Use size name as ID
-                'size_name': size
-            })
-        
-        return jsonify({'company_sizes': result})
+        return facet_response('sizes', lambda rows: {'company_sizes': [{
+            'id': size,  # Use size name as ID
+            'size_name': size,
+            'count': count
+        } for size, count in rows]})
         
     except Exception as e:
         logging.error(f"API error getting company sizes: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
+
+@api_filters.route('/api/financial_years', methods=['GET'])
+def get_financial_years():
+    """API endpoint to get years with financial data (кешований фасет company_financials, ETag)"""
+    
+    try:
+        return facet_response('financial_years', lambda rows: {'years': [{
+            'year': year,
+            'count': count
+        } for year, count in rows]})
+        
+    except Exception as e:
+        logging.error(f"API error getting financial years: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
 @api_filters.route('/api/selection-stats')
 def get_selection_stats():
     """Get selection database statistics"""
@@ -115,22 +101,19 @@ def get_database_stats():
     """Get comprehensive database statistics for infographic"""
     try:
         from flask import session
-        from sqlalchemy import func
+        from dashboard_stats import get_dashboard_stats
+        dashboard = get_dashboard_stats()
         
         # Total companies in database
-        total_in_database = db.session.execute(
-            db.select(func.count(Company.id))
-        ).scalar() or 0
+        total_in_database = dashboard['total_companies']
         
-        # Companies in current selection (from session)
-        selected_company_ids = session.get('selected_company_ids', [])
-        total_in_selection = len(selected_company_ids)
+        # Companies in the active selection base (size of its snapshot)
+        from selection_snapshot import active_selection_base
+        active_selection = active_selection_base()
+        total_in_selection = active_selection.companies_count or 0 if active_selection else 0
         
         # Companies with ranking (have ranking assigned)
-        companies_with_ranking = db.session.execute(
-            db.select(func.count(Company.id))
-            .where(Company.ranking.isnot(None))
-        ).scalar() or 0
+        companies_with_ranking = dashboard['companies_with_ranking']
         
         # Selection criteria from session
         selection_criteria = session.get('selection_criteria', 'Критерії не задано')
@@ -155,24 +138,13 @@ def get_stats():
         return jsonify({'error': 'Insufficient permissions'}), 403
     
     try:
-        total_companies = db.session.execute(
-            db.select(func.count(Company.id))
-        ).scalar() or 0
+        from dashboard_stats import get_dashboard_stats
+        dashboard = get_dashboard_stats()
         
-        companies_with_ranking = db.session.execute(
-            db.select(func.count(Company.id))
-            .where(Company.ranking.isnot(None))
-        ).scalar() or 0
-        
-        total_regions = db.session.execute(
-            db.select(func.count(func.distinct(Company.region_name)))
-            .where(Company.region_name.isnot(None))
-        ).scalar() or 0
-        
-        total_kved = db.session.execute(
-            db.select(func.count(func.distinct(Company.kved_code)))
-            .where(Company.kved_code.isnot(None))
-        ).scalar() or 0
+        total_companies = dashboard['total_companies']
+        companies_with_ranking = dashboard['companies_with_ranking']
+        total_regions = dashboard['total_regions']
+        total_kved = dashboard['total_kved']
         
         return jsonify({
             'stats': {
@@ -204,7 +176,6 @@ def get_selection_base_info():
     try:
         from flask import session
         # Get selection info from session
-        selected_ids = session.get('selected_company_ids', [])
         selection_criteria = session.get('selection_criteria', 'Не створена')
         selection_count = session.get('selection_count', 0)
         
@@ -285,86 +256,51 @@ def export_ranking():
         return jsonify({'error': 'Insufficient permissions'}), 403
     
     try:
-        from flask import Response
-        import csv
-        import io
+        from export_stream import FORMATS, ranking_export_response
         
-        # Get companies with rankings - only those in current ranking
-        companies_with_rankings = db.session.execute(
-            db.select(Company)
-            .where(Company.ranking.isnot(None))
-            .order_by(Company.ranking.asc())
-        ).scalars().all()
+        export_format = request.args.get('format', 'csv')
+        if export_format not in FORMATS:
+            return jsonify({'error': f'Unknown export format: {export_format}'}), 400
         
-        if not companies_with_rankings:
+        has_ranking = db.session.execute(
+            db.select(Company.id).where(Company.ranking.isnot(None)).limit(1)
+        ).first()
+        if not has_ranking:
             return jsonify({'error': 'No ranking data to export'}), 400
         
-        # Create CSV with all fields
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header with all 33 fields from models_full.py
-        headers = [
-            'Місце в рейтингу', 'ЄДРПОУ', 'Назва компанії', 'КВЕД код', 'КВЕД опис', 'Регіон',
-            'Дохід 2019 (тис. грн)', 'Прибуток 2019 (тис. грн)', 'Персонал 2019', 'Статус актуалізації',
-            'Розмір компанії', 'Адреса', 'Телефон', 'Email', 'Веб-сайт',
-            'Рік заснування', 'Форма власності', 'ПДВ номер', 'Банк', 'МФО',
-            'Рахунок', 'Директор', 'Бухгалтер', 'Основний вид діяльності',
-            'Додаткові види діяльності', 'Ліцензії', 'Сертифікати', 'Експорт',
-            'Імпорт', 'Примітки', 'Дата створення запису', 'Дата оновлення запису', 'Джерело даних'
-        ]
-        writer.writerow(headers)
+        # Rows are streamed from a server-side cursor in batches
+        return ranking_export_response(
+            None,
+            export_format,
+            bom=request.args.get('bom') in ('1', 'true'),
+            filename=f'rating_ukraine_companies.{export_format}'
+        )
         
-        # Write data rows with all available fields
-        for company in companies_with_rankings:
-            row = [
-                company.ranking or '',
-                company.edrpou or '',
-                company.name or '',
-                company.kved_code or '',
-                company.kved_description or '',
-                company.region_name or '',
-                company.revenue_2019 or 0,
-                company.profit_2019 or 0,
-                company.personnel_2019 or 0,
-                company.actualized or 'ні',
-                company.company_size_name or '',
-                getattr(company, 'address', '') or '',
-                getattr(company, 'phone', '') or '',
-                getattr(company, 'email_company', '') or '',
-                getattr(company, 'website', '') or '',
-                getattr(company, 'founding_year', '') or '',
-                getattr(company, 'ownership_form', '') or '',
-                getattr(company, 'vat_number', '') or '',
-                getattr(company, 'bank_name', '') or '',
-                getattr(company, 'bank_mfo', '') or '',
-                getattr(company, 'bank_account', '') or '',
-                getattr(company, 'director_name', '') or '',
-                getattr(company, 'accountant_name', '') or '',
-                getattr(company, 'main_activity', '') or '',
-                getattr(company, 'additional_activities', '') or '',
-                getattr(company, 'licenses', '') or '',
-                getattr(company, 'certificates', '') or '',
-                getattr(company, 'export_countries', '') or '',
-                getattr(company, 'import_countries', '') or '',
-                getattr(company, 'notes', '') or '',
-                company.created_at.strftime('%d.%m.%Y') if company.created_at else '',
-                company.updated_at.strftime('%d.%m.%Y') if company.updated_at else '',
-                'Рейтинг України 2025'
-            ]
-            writer.writerow(row)
+    except Exception as e:
+        logging.error(f"API error exporting ranking: {str(e)}")
+        return jsonify({'error': 'Export failed'}), 500
+
+
+@api_filters.route('/api/rankings/<int:ranking_id>/export', methods=['GET'])
+@login_required
+def export_saved_ranking(ranking_id):
+    """Streaming export of a saved ranking: ?format=csv|xlsx&bom=1"""
+    if not current_user.has_permission('export'):
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    
+    try:
+        from export_stream import FORMATS, ranking_export_response
+        from models_full import Ranking
         
-        output.seek(0)
+        export_format = request.args.get('format', 'csv')
+        if export_format not in FORMATS:
+            return jsonify({'error': f'Unknown export format: {export_format}'}), 400
+        if db.session.get(Ranking, ranking_id) is None:
+            return jsonify({'error': 'Ranking not found'}), 404
         
-        return Response(
-            output.getvalue(),
-            mimetype='text/csv; charset=utf-8',
-            headers={
-                'Content-Disposition': f'attachment; filename=rating_ukraine_{len(companies_with_rankings)}_companies.csv',
-                'Content-Type': 'text/csv; charset=utf-8'
-            }
-        )
+        return ranking_export_response(ranking_id, export_format,
+                                       bom=request.args.get('bom') in ('1', 'true'))
         
     except Exception as e:
-        logging.error(f"API error exporting ranking: {str(e)}")
+        logging.error(f"API error exporting ranking {ranking_id}: {str(e)}")
         return jsonify({'error': 'Export failed'}), 500
\ No newline at end of file
@@ -1,4 +1,5 @@
 import os
+import sys
 import logging
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
@@ -63,6 +64,10 @@ def initialize_app():
                 logging.error(f"Error creating database tables: {e}")
                 # Don't fail completely, tables might already exist
             
+            # Колонки та індекси, яких create_all не додає в існуючі таблиці
+            from schema_migrations import apply_schema_migrations
+            apply_schema_migrations()
+            
             # Create default admin user if it doesn't exist
             try:
                 from werkzeug.security import generate_password_hash
@@ -104,8 +109,10 @@ def initialize_app():
         logging.error(f"Error initializing app: {e}")
         # Don't crash the app, let it start even with database issues
 
-# Initialize the app
-initialize_app()
+# Initialize the app (not when multiprocessing re-imports the main module as __mp_main__
+# in spawn/forkserver processes: pdf_render workers need neither the schema nor the admin user)
+if '__mp_main__' not in sys.modules:
+    initialize_app()
 
 # Register API blueprints
 try:
@@ -0,0 +1,14 @@
+"""
+Мікробенчмарки гарячих шляхів: імпорт, актуалізація, рейтинг, експорт.
+
+datagen.py генерує детерміновані (seed) синтетичні файли з реальними
+заголовками першого файлу (російські/українські варіанти, колонки доходу і
+прибутку з пробілами в кінці), файлу актуалізації і _processed.csv на
+10K/160K/1M рядків. run.py проганяє етапи проти окремої локальної бази
+PostgreSQL і пише час кожного етапу в JSON; compare.py порівнює результат з
+збереженою базовою лінією.
+
+    BENCHMARK_DATABASE_URL=postgresql://localhost/benchmark \\
+        python -m benchmarks.run --size 160k --output results.json --baseline baseline.json
+    python -m benchmarks.compare results.json baseline.json
+"""
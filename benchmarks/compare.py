@@ -0,0 +1,84 @@
+"""
+Порівняння результатів бенчмарку з базовою лінією.
+
+Етап вважається повільнішим, якщо його час перевищує базовий більше ніж на
+threshold (частка) і різниця більша за MIN_DELTA_SECONDS - коливання
+швидких етапів у мілісекундах не є регресією. Результати різних розмірів
+чи seed не порівнюються.
+
+    python -m benchmarks.compare results.json baseline.json [--threshold 0.1]
+
+Код виходу 1, якщо є регресії.
+"""
+
+import argparse
+import json
+import sys
+
+THRESHOLD = 0.10
+MIN_DELTA_SECONDS = 0.05
+
+# Поля meta, які мають збігатися, щоб час був порівнюваним
+COMPARABLE_META = ('rows', 'seed', 'headers', 'format')
+
+
+def compare_results(current, baseline, threshold=THRESHOLD):
+    """
+    {'stages': [{stage, baseline, current, change, status}], 'regressions': [...],
+    'mismatch': {поле: (поточне, базове)}}; status - slower/faster/same/new/missing
+    """
+    mismatch = {key: (current['meta'].get(key), baseline['meta'].get(key)) for key in COMPARABLE_META
+                if current['meta'].get(key) != baseline['meta'].get(key)}
+    if mismatch:
+        raise ValueError(f"Results are not comparable: {mismatch}")
+
+    stages = []
+    for stage in list(current['stages']) + [name for name in baseline['stages'] if name not in current['stages']]:
+        now = current['stages'].get(stage, {}).get('seconds')
+        before = baseline['stages'].get(stage, {}).get('seconds')
+        if before is None or now is None:
+            stages.append({'stage': stage, 'baseline': before, 'current': now, 'change': None,
+                           'status': 'new' if before is None else 'missing'})
+            continue
+        change = (now - before) / before if before > 0 else 0.0
+        if abs(now - before) < MIN_DELTA_SECONDS or abs(change) <= threshold:
+            status = 'same'
+        else:
+            status = 'slower' if change > 0 else 'faster'
+        stages.append({'stage': stage, 'baseline': before, 'current': now, 'change': round(change, 4),
+                       'status': status})
+    return {
+        'stages': stages,
+        'regressions': [row['stage'] for row in stages if row['status'] == 'slower'],
+        'mismatch': mismatch,
+    }
+
+
+def format_comparison(comparison):
+    """Таблиця порівняння для консолі"""
+    lines = [f"{'stage':<11} {'baseline':>10} {'current':>10} {'change':>8}  status"]
+    for row in comparison['stages']:
+        baseline = f"{row['baseline']:.3f}" if row['baseline'] is not None else '-'
+        current = f"{row['current']:.3f}" if row['current'] is not None else '-'
+        change = f"{row['change'] * 100:+.1f}%" if row['change'] is not None else '-'
+        lines.append(f"{row['stage']:<11} {baseline:>10} {current:>10} {change:>8}  {row['status']}")
+    if comparison['regressions']:
+        lines.append(f"Regressions: {', '.join(comparison['regressions'])}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare benchmark results with a baseline')
+    parser.add_argument('current')
+    parser.add_argument('baseline')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args(argv)
+
+    with open(args.current, encoding='utf-8') as current_file, open(args.baseline, encoding='utf-8') as baseline_file:
+        comparison = compare_results(json.load(current_file), json.load(baseline_file), args.threshold)
+    print(format_comparison(comparison))
+    return 1 if comparison['regressions'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,338 @@
+"""
+Детермінований генератор синтетичних файлів для бенчмарків.
+
+Той самий seed дає ті самі файли на будь-якій машині (numpy Generator).
+Файли повторюють реальні вхідні дані:
+- перший файл компаній: заголовки 'ru' - як у файлах, з якими працюють
+  process_large_csv.py і data_processor_full.py (російська назва колонок,
+  'Tелефон' з латинською T, доходи і прибутки з пробілами в кінці назви),
+  'uk' - українські варіанти з COLUMN_VARIANTS ingestion_pipeline; суми в
+  різних форматах ('1 234 567', '1,234,567.00', '...грн'), порожні значення,
+  невалідні ЄДРПОУ, ЄДРПОУ з Excel ('12345678.0') і дублікати;
+- файл актуалізації: варіанти заголовків actualization_engine, частина
+  ЄДРПОУ відсутня в базі;
+- _processed.csv для import_engine з показниками за додаткові роки.
+
+    python -m benchmarks.datagen --size 160k [--data-dir DIR] [--seed N] [--format xlsx]
+"""
+
+import argparse
+import csv
+import os
+import tempfile
+
+import numpy as np
+
+SIZES = {
+    '10k': 10_000,
+    '160k': 160_000,
+    '1m': 1_000_000,
+}
+DEFAULT_SIZE = '10k'
+DEFAULT_SEED = 20190
+DATA_DIR = os.environ.get('BENCHMARK_DATA_DIR', os.path.join(tempfile.gettempdir(), 'benchmark_data'))
+
+FIRST_EDRPOU = 20_000_000
+DIRTY_RATE = 0.002
+DUPLICATE_RATE = 0.005
+EMPTY_AMOUNT_RATE = 0.03
+ACTUALIZED_FRACTION = 0.5
+UNKNOWN_ACTUALIZATION_RATE = 0.05
+EXTRA_YEARS = (2023,)
+WRITE_CHUNK_SIZE = 50_000
+
+FIELDS = [
+    'edrpou', 'name', 'kved_code', 'kved_description', 'region_name', 'phone', 'address',
+    'company_size_name', 'personnel_2019', 'revenue_2019', 'profit_2019',
+]
+
+# Заголовки першого файлу за полем companies
+HEADERS = {
+    'ru': {
+        'edrpou': 'Код ЄДРПОУ',
+        'name': 'Название компании',
+        'kved_code': 'КВЕД',
+        'kved_description': 'Основний вид діяльності (КВЕД)',
+        'region_name': 'Область',
+        'phone': 'Tелефон',
+        'address': 'Адреса реєстрації',
+        'company_size_name': 'Размер',
+        'personnel_2019': 'Персонал (2019 р.)',
+        'revenue_2019': 'Чистий дохід від реалізації продукції' + ' ' * 4,
+        'profit_2019': 'Чистий фінансовий результат: прибуток' + ' ' * 43,
+    },
+    'uk': {
+        'edrpou': 'ЄДРПОУ',
+        'name': 'Назва компанії',
+        'kved_code': 'Код КВЕД',
+        'kved_description': 'Основний вид діяльності',
+        'region_name': 'Регіон',
+        'phone': 'Телефон',
+        'address': 'Адреса',
+        'company_size_name': 'Розмір компанії',
+        'personnel_2019': 'Персонал (осіб)',
+        'revenue_2019': 'Чистий дохід від реалізації продукції (товарів, робіт, послуг) ',
+        'profit_2019': 'Чистий фінансовий результат (прибуток) ',
+    },
+}
+# Індекс варіанта заголовка у списках actualization_engine: 0 - українська, 1 - російська
+ACTUALIZATION_VARIANT = {'uk': 0, 'ru': 1}
+
+REGIONS = [
+    'Вінницька', 'Волинська', 'Дніпропетровська', 'Донецька', 'Житомирська', 'Закарпатська',
+    'Запорізька', 'Івано-Франківська', 'Київська', 'Кіровоградська', 'Луганська', 'Львівська',
+    'Миколаївська', 'Одеська', 'Полтавська', 'Рівненська', 'Сумська', 'Тернопільська',
+    'Харківська', 'Херсонська', 'Хмельницька', 'Черкаська', 'Чернівецька', 'Чернігівська', 'м. Київ',
+]
+REGION_WEIGHTS = [3, 1, 8, 4, 2, 1, 4, 2, 6, 1, 2, 7, 2, 7, 3, 1, 2, 1, 8, 2, 2, 2, 1, 1, 25]
+SIZES_NAMES = ['Мікро', 'Мале', 'Середнє', 'Велике']
+SIZE_WEIGHTS = [70, 22, 7, 1]
+LEGAL_FORMS = ['ТОВ', 'ТзОВ', 'ПП', 'ПрАТ', 'ПАТ', 'ФОП', 'ДП', 'Товариство з обмеженою відповідальністю']
+LEGAL_FORM_WEIGHTS = [60, 5, 15, 5, 2, 8, 3, 2]
+SYLLABLES = ['агро', 'буд', 'тех', 'сервіс', 'торг', 'інвест', 'маш', 'енерго', 'фарм', 'транс',
+             'пром', 'газ', 'мет', 'хім', 'строй', 'лайн', 'груп', 'еко', 'нова', 'світ']
+KVED_COUNT = 300
+
+
+def size_rows(size):
+    """Кількість рядків за назвою розміру ('10k', '160k', '1m') або числом"""
+    if str(size).lower() in SIZES:
+        return SIZES[str(size).lower()]
+    rows = int(size) if str(size).isdigit() else 0
+    if rows <= 0:
+        raise ValueError(f"Некоректний розмір: {size} (10k, 160k, 1m або кількість рядків)")
+    return rows
+
+
+def _weights(values):
+    values = np.asarray(values, dtype=np.float64)
+    return values / values.sum()
+
+
+def kved_catalog(seed=DEFAULT_SEED):
+    """Коди КВЕД з описами і ймовірностями (розподіл з довгим хвостом, як у реальних базах)"""
+    rng = np.random.default_rng(seed + 1)
+    sections = rng.choice(np.arange(1, 100), size=KVED_COUNT)
+    classes = rng.integers(10, 100, size=KVED_COUNT)
+    codes = sorted({f'{section:02d}.{group:02d}' for section, group in zip(sections, classes)})
+    descriptions = [f'Вид діяльності {code}' for code in codes]
+    probabilities = _weights(1.0 / np.arange(1, len(codes) + 1) ** 1.1)
+    return codes, descriptions, probabilities[rng.permutation(len(codes))]
+
+
+def _format_amounts(rng, values):
+    """Суми в різних форматах реальних файлів; частина порожня"""
+    styles = rng.integers(0, 4, size=len(values))
+    result = []
+    for value, style in zip(values.tolist(), styles.tolist()):
+        if style == 0:
+            result.append(f'{value:.0f}')
+        elif style == 1:
+            result.append(f'{value:,.0f}'.replace(',', ' '))
+        elif style == 2:
+            result.append(f'{value:,.2f}')
+        else:
+            result.append(f'{value:.0f} грн')
+    for index in np.flatnonzero(rng.random(len(values)) < EMPTY_AMOUNT_RATE).tolist():
+        result[index] = ''
+    return result
+
+
+def company_data(rows, seed=DEFAULT_SEED):
+    """
+    Синтетичні компанії: словник поле → масив значень. Числа - float/int,
+    ЄДРПОУ - чисті 8-значні рядки (забруднення додає company_rows)
+    """
+    rng = np.random.default_rng(seed)
+    codes, descriptions, probabilities = kved_catalog(seed)
+    edrpou = (FIRST_EDRPOU + rng.permutation(rows)).astype(str)
+    kved_index = rng.choice(len(codes), size=rows, p=probabilities)
+    region_index = rng.choice(len(REGIONS), size=rows, p=_weights(REGION_WEIGHTS))
+    size_index = rng.choice(len(SIZES_NAMES), size=rows, p=_weights(SIZE_WEIGHTS))
+    form_index = rng.choice(len(LEGAL_FORMS), size=rows, p=_weights(LEGAL_FORM_WEIGHTS))
+    first, second = rng.integers(0, len(SYLLABLES), size=(2, rows))
+    personnel = np.maximum(rng.lognormal(2.0, 1.4, size=rows), 1).astype(np.int64)
+    revenue = np.round(rng.lognormal(14.0, 2.2, size=rows))
+    profit = np.round(revenue * rng.normal(0.04, 0.12, size=rows))
+
+    regions = np.array(REGIONS, dtype=object)[region_index]
+    return {
+        'edrpou': edrpou,
+        'name': [f'{LEGAL_FORMS[form]} "{SYLLABLES[a].capitalize()}{SYLLABLES[b]} {n}"'
+                 for n, (form, a, b) in enumerate(zip(form_index.tolist(), first.tolist(), second.tolist()), 1)],
+        'kved_code': np.array(codes, dtype=object)[kved_index],
+        'kved_description': np.array(descriptions, dtype=object)[kved_index],
+        'region_name': regions,
+        'phone': [f'+380 {code} {number:07d}' for code, number in
+                  zip(rng.integers(31, 99, size=rows).tolist(), rng.integers(0, 10 ** 7, size=rows).tolist())],
+        'address': [f'{region} обл., вул. {SYLLABLES[street].capitalize()}на, {house}' for region, street, house in
+                    zip(regions.tolist(), first.tolist(), rng.integers(1, 200, size=rows).tolist())],
+        'company_size_name': np.array(SIZES_NAMES, dtype=object)[size_index],
+        'personnel_2019': personnel,
+        'revenue_2019': revenue,
+        'profit_2019': profit,
+    }
+
+
+def company_rows(rows, seed=DEFAULT_SEED):
+    """Рядки першого файлу (значення - рядки як у CSV) з брудними ЄДРПОУ, сумами і дублікатами"""
+    data = company_data(rows, seed)
+    rng = np.random.default_rng(seed + 2)
+    edrpou = data['edrpou'].astype(object)
+
+    dirty = rng.choice(rows, size=int(rows * DIRTY_RATE), replace=False)
+    for kind, index in enumerate(dirty.tolist()):
+        edrpou[index] = ('', 'н/д', f'{edrpou[index]}.0')[kind % 3]
+    duplicates = rng.choice(rows, size=int(rows * DUPLICATE_RATE), replace=False)
+    edrpou[duplicates] = edrpou[rng.choice(rows, size=len(duplicates))]
+
+    columns = [edrpou.tolist()]
+    for field in FIELDS[1:]:
+        values = data[field]
+        if field in ('revenue_2019', 'profit_2019'):
+            columns.append(_format_amounts(rng, values))
+        elif field == 'personnel_2019':
+            columns.append([str(value) for value in values.tolist()])
+        else:
+            columns.append(list(values))
+    return zip(*columns)
+
+
+def processed_rows(rows, seed=DEFAULT_SEED, years=EXTRA_YEARS):
+    """Рядки _processed.csv (канонічні колонки import_engine + показники за years)"""
+    data = company_data(rows, seed)
+    rng = np.random.default_rng(seed + 3)
+    columns = [data[field].tolist() if hasattr(data[field], 'tolist') else data[field] for field in FIELDS]
+    for year in years:
+        growth = rng.normal(1.05, 0.2, size=rows)
+        columns.append(np.round(data['revenue_2019'] * growth).tolist())
+        columns.append(np.round(data['profit_2019'] * growth).tolist())
+        columns.append(np.maximum(data['personnel_2019'] * growth, 1).astype(np.int64).tolist())
+    return zip(*columns)
+
+
+def processed_header(years=EXTRA_YEARS):
+    return FIELDS + [f'{metric}_{year}' for year in years for metric in ('revenue', 'profit', 'personnel')]
+
+
+def actualization_header(headers='uk'):
+    from actualization_engine import (GOVERNMENT_PURCHASES_VARIANTS, TENDER_COUNT_VARIANTS,
+                                      TEXT_FIELD_VARIANTS)
+
+    variant = ACTUALIZATION_VARIANT[headers]
+    return ([HEADERS[headers]['edrpou']] + [names[variant] for names in TEXT_FIELD_VARIANTS.values()]
+            + [GOVERNMENT_PURCHASES_VARIANTS[variant], TENDER_COUNT_VARIANTS[variant]])
+
+
+def actualization_rows(rows, seed=DEFAULT_SEED, fraction=ACTUALIZED_FRACTION):
+    """Рядки файлу актуалізації для частки fraction компаній; частина ЄДРПОУ відсутня в базі"""
+    data = company_data(rows, seed)
+    rng = np.random.default_rng(seed + 4)
+    count = max(1, int(rows * fraction))
+    edrpou = data['edrpou'][rng.choice(rows, size=count, replace=False)].astype(object)
+    unknown = np.flatnonzero(rng.random(count) < UNKNOWN_ACTUALIZATION_RATE)
+    edrpou[unknown] = (FIRST_EDRPOU + rows + unknown).astype(str)
+
+    first, middle, last = rng.integers(0, len(SYLLABLES), size=(3, count)).tolist()
+    statuses = ['зареєстровано', 'в стані припинення', 'припинено']
+    status_index = rng.choice(len(statuses), size=count, p=[0.9, 0.07, 0.03]).tolist()
+    purchases = _format_amounts(rng, np.round(rng.lognormal(11.0, 2.0, size=count)))
+    tenders = rng.integers(0, 50, size=count).tolist()
+    for index, code in enumerate(edrpou.tolist()):
+        first_name = SYLLABLES[first[index]].capitalize() + 'ій'
+        middle_name = SYLLABLES[middle[index]].capitalize() + 'ович'
+        last_name = SYLLABLES[last[index]].capitalize() + 'енко'
+        yield (code, first_name, middle_name, last_name, f'+380 44 {index % 10 ** 7:07d}',
+               f'www.{SYLLABLES[first[index]]}{index}.ua', f'office{index}@{SYLLABLES[last[index]]}.ua',
+               statuses[status_index[index]], f'{last_name} {first_name} {middle_name}',
+               f'{last_name} {first_name[0]}. {middle_name[0]}.', purchases[index], str(tenders[index]))
+
+
+def write_csv(path, header, rows):
+    """Записати рядки в CSV (UTF-8) частинами; повертає кількість рядків"""
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(header)
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= WRITE_CHUNK_SIZE:
+                writer.writerows(chunk)
+                written += len(chunk)
+                chunk = []
+        writer.writerows(chunk)
+        written += len(chunk)
+    return written
+
+
+def write_xlsx(path, header, rows):
+    """Записати рядки в XLSX (openpyxl write-only); повертає кількість рядків"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Компанії')
+    sheet.append(list(header))
+    written = 0
+    for row in rows:
+        sheet.append(list(row))
+        written += 1
+    workbook.save(path)
+    return written
+
+
+def benchmark_files(size=DEFAULT_SIZE, data_dir=DATA_DIR, seed=DEFAULT_SEED, headers='ru', file_format='csv'):
+    """
+    Шляхи до файлів бенчмарку {'companies', 'processed', 'actualization'},
+    відсутні файли генеруються (той самий size/seed/headers - той самий файл)
+    """
+    rows = size_rows(size)
+    os.makedirs(data_dir, exist_ok=True)
+    stem = f'{rows}_{seed}_{headers}'
+    files = {
+        'companies': os.path.join(data_dir, f'companies_{stem}.{file_format}'),
+        'processed': os.path.join(data_dir, f'companies_{rows}_{seed}_processed.csv'),
+        'actualization': os.path.join(data_dir, f'actualization_{stem}.{file_format}'),
+    }
+    writer = write_xlsx if file_format == 'xlsx' else write_csv
+    generators = {
+        'companies': lambda path: writer(path, list(HEADERS[headers].values()), company_rows(rows, seed)),
+        'processed': lambda path: write_csv(path, processed_header(), processed_rows(rows, seed)),
+        'actualization': lambda path: writer(path, actualization_header(headers), actualization_rows(rows, seed)),
+    }
+    for name, path in files.items():
+        if not os.path.exists(path):
+            # Тимчасова назва: перерваний запуск не залишить обрізаний файл під кінцевою назвою
+            temp_path = f'{path}.tmp.{file_format}' if name != 'processed' else f'{path}.tmp.csv'
+            generators[name](temp_path)
+            os.replace(temp_path, path)
+    return files
+
+
+def check_headers():
+    """Заголовки генератора розпізнаються ColumnResolver і actualization_engine"""
+    from actualization_engine import TEXT_FIELD_VARIANTS
+    from ingestion_pipeline import ColumnResolver
+
+    for style, headers in HEADERS.items():
+        mapping = ColumnResolver().resolve(list(headers.values()))
+        missing = set(headers) - set(mapping.values())
+        assert not missing, f"{style}: unresolved fields {missing}"
+        assert all(mapping[header] == field for field, header in headers.items()), f"{style}: {mapping}"
+        header = actualization_header(style)
+        assert len(header) == len(TEXT_FIELD_VARIANTS) + 3, header
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic benchmark files')
+    parser.add_argument('--size', default=DEFAULT_SIZE, help=f"{', '.join(SIZES)} or a row count")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--headers', choices=sorted(HEADERS), default='ru')
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    args = parser.parse_args()
+
+    check_headers()
+    for name, path in benchmark_files(args.size, args.data_dir, args.seed, args.headers, args.format).items():
+        print(f"{name}: {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
@@ -0,0 +1,326 @@
+"""
+Прогін бенчмарків проти окремої локальної бази PostgreSQL.
+
+База задається BENCHMARK_DATABASE_URL (або --database-url) і на початку
+кожного прогону очищується (RESET_TABLES), тому збіг з DATABASE_URL
+додатку заборонено без --allow-app-database. Схема створюється тим самим
+initialize_app (create_all + schema_migrations), індекси - ensure_indexes.
+
+Етапи виконуються тим самим кодом, що й задачі та маршрути додатку:
+- parse, clean, write - ingest_file (ingestion_pipeline) першого файлу:
+  читання і розпізнавання колонок, очищення і валідація, COPY + upsert;
+- import - stream_import_processed_csv (import_engine) _processed.csv з
+  показниками за додатковий рік;
+- actualize - actualize_file (actualization_engine), як задача actualize;
+- select - база відбору з materialize_selection, як POST /filter;
+- rank - Ranking + create_ranking + ranking_preview, як POST /ranking;
+- export_csv - потоковий CSV рейтингу (export_stream);
+- export_pdf - create_pdf_export (pdf_export).
+
+Результат - JSON з метаданими і {етап: seconds, rows, rows_per_second};
+з --repeat N - медіана N прогонів. --baseline порівнює з базовою лінією
+(compare.py), --save-baseline записує результат як нову базову лінію.
+
+    BENCHMARK_DATABASE_URL=postgresql://localhost/benchmark \\
+        python -m benchmarks.run --size 10k [--stages parse,clean,write,rank] [--repeat 3]
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.compare import THRESHOLD, compare_results, format_comparison
+from benchmarks.datagen import DATA_DIR, DEFAULT_SEED, DEFAULT_SIZE, HEADERS, benchmark_files, size_rows
+
+STAGES = ['parse', 'clean', 'write', 'import', 'actualize', 'select', 'rank', 'export_csv', 'export_pdf']
+
+# Таблиці, які бенчмарк заповнює; очищуються перед кожним прогоном
+RESET_TABLES = ['company_ranking_history', 'ranking_companies', 'rankings', 'selection_companies',
+                'selection_bases', 'company_financials', 'companies']
+
+BENCHMARK_SOURCE = 'benchmark'
+# Частка компаній у базі відбору (межа доходу - відповідний квантиль)
+SELECTION_FRACTION = 0.05
+PREVIEW_LIMIT = 1000
+
+
+def init_app(database_url, allow_app_database=False):
+    """Додаток, привʼязаний до бази бенчмарку (DATABASE_URL підміняється до імпорту app)"""
+    if not database_url:
+        raise SystemExit("BENCHMARK_DATABASE_URL is not set (dedicated database, it is truncated on every run)")
+    if database_url == os.environ.get('DATABASE_URL') and not allow_app_database:
+        raise SystemExit("BENCHMARK_DATABASE_URL is the application database; use --allow-app-database to truncate it")
+    if 'app' in sys.modules:
+        raise RuntimeError("app is already imported with another DATABASE_URL")
+    os.environ['DATABASE_URL'] = database_url
+
+    from app import app
+    return app
+
+
+def reset_database():
+    """Очистити таблиці бенчмарку і побудувати керовані індекси"""
+    from sqlalchemy import text
+
+    from app import db
+    from db_indexes import ensure_indexes
+
+    db.session.execute(text(f"TRUNCATE {', '.join(RESET_TABLES)} RESTART IDENTITY"))
+    db.session.commit()
+    ensure_indexes()
+
+
+def _stage(seconds, rows, **extra):
+    return dict({'seconds': round(seconds, 4), 'rows': rows,
+                 'rows_per_second': round(rows / seconds) if seconds > 0 else None}, **extra)
+
+
+def _timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def run_ingest(files):
+    """parse/clean/write з одного прогону конвеєра (статистика кроків IngestionPipeline)"""
+    from ingestion_pipeline import ingest_file
+
+    stats = ingest_file(files['companies'], source=BENCHMARK_SOURCE)
+    steps = stats['steps']
+    return {
+        'parse': _stage(steps['read']['seconds'] + steps['resolve']['seconds'], steps['read']['rows']),
+        'clean': _stage(steps['clean']['seconds'] + steps['validate']['seconds'], steps['clean']['rows'],
+                        rejected=stats['rows_rejected']),
+        'write': _stage(steps['write']['seconds'], steps['write']['rows']),
+    }
+
+
+def run_import(files):
+    from import_engine import stream_import_processed_csv
+
+    seconds, totals = _timed(stream_import_processed_csv, files['processed'])
+    return {'import': _stage(seconds, totals['processed'], inserted=totals['inserted'],
+                             updated=totals['updated'], financials=totals['financials'])}
+
+
+def run_actualize(files):
+    from actualization_engine import actualize_file
+    from app import db
+
+    connection = db.engine.raw_connection()
+    try:
+        seconds, stats = _timed(actualize_file, connection, files['actualization'])
+    finally:
+        connection.close()
+    return {'actualize': _stage(seconds, stats['rows_read'], matched=stats['matched'],
+                                unmatched=stats['unmatched'])}
+
+
+def run_select():
+    """База відбору з межею доходу на квантилі 1 - SELECTION_FRACTION. Повертає (результат, selection_base)"""
+    from sqlalchemy import text
+
+    from app import db
+    from models_full import SelectionBase
+    from ranking_engine import selection_conditions
+    from selection_snapshot import materialize_selection
+
+    min_revenue = db.session.execute(text(
+        "SELECT percentile_disc(:quantile) WITHIN GROUP (ORDER BY revenue_2019) FROM companies"
+    ), {'quantile': 1 - SELECTION_FRACTION}).scalar() or 0
+
+    def select():
+        selection_base = SelectionBase(name='Benchmark selection', companies_count=0, min_employees=1,
+                                       min_revenue=min_revenue, is_active=True)
+        db.session.add(selection_base)
+        db.session.flush()
+        where, params = selection_conditions(selection_base)
+        count = materialize_selection(selection_base, where, params)
+        db.session.commit()
+        return selection_base, count
+
+    seconds, (selection_base, count) = _timed(select)
+    return {'select': _stage(seconds, count, min_revenue=float(min_revenue))}, selection_base
+
+
+def run_rank(selection_base, criteria='revenue'):
+    """Рейтинг бази відбору як POST /ranking. Повертає (результат, ranking_id)"""
+    from app import db
+    from models_full import Ranking
+    from ranking_engine import CRITERIA_NAMES, DEFAULT_RANK_METHOD, create_ranking, ranking_preview, selection_conditions
+
+    def rank():
+        ranking = Ranking(name='Benchmark ranking', selection_base_id=selection_base.id, sort_criteria=criteria,
+                          sort_order='desc', rank_method=DEFAULT_RANK_METHOD, companies_count=0, is_active=True)
+        db.session.add(ranking)
+        db.session.flush()
+        where, params = selection_conditions(selection_base)
+        stats = create_ranking(ranking.id, where, params, criteria, ranking.name,
+                               CRITERIA_NAMES[criteria], f'Україна {datetime.now().year}')
+        ranking.companies_count = stats['positions']
+        ranking_preview(ranking.id, PREVIEW_LIMIT)
+        db.session.commit()
+        return ranking.id, stats
+
+    seconds, (ranking_id, stats) = _timed(rank)
+    return {'rank': _stage(seconds, stats['positions'], companies_changed=stats['companies_changed'])}, ranking_id
+
+
+def run_export_csv(ranking_id):
+    from export_stream import csv_chunks, ranking_batches
+
+    def export():
+        return sum(len(chunk) for chunk in csv_chunks(ranking_batches(ranking_id)))
+
+    seconds, size = _timed(export)
+    return {'export_csv': _stage(seconds, _ranking_size(ranking_id), bytes=size)}
+
+
+def run_export_pdf(ranking_id):
+    from pdf_export import create_pdf_export
+
+    handle, path = tempfile.mkstemp(suffix='.pdf')
+    os.close(handle)
+    try:
+        seconds, (success, message) = _timed(create_pdf_export, ranking_id, path)
+        if not success:
+            raise RuntimeError(message)
+        return {'export_pdf': _stage(seconds, _ranking_size(ranking_id), bytes=os.path.getsize(path))}
+    finally:
+        os.remove(path)
+
+
+def _ranking_size(ranking_id):
+    from app import db
+    from models_full import Ranking
+    return db.session.get(Ranking, ranking_id).companies_count
+
+
+def run_once(files, stages):
+    """Один прогін: очищення бази і етапи по черзі. Повертає {етап: результат} для stages"""
+    reset_database()
+    results = {}
+    # Завантаження першого файлу потрібне всім наступним етапам, тому виконується завжди
+    results.update(run_ingest(files))
+    if 'import' in stages:
+        results.update(run_import(files))
+    if 'actualize' in stages:
+        results.update(run_actualize(files))
+    if {'select', 'rank', 'export_csv', 'export_pdf'} & set(stages):
+        selected, selection_base = run_select()
+        results.update(selected)
+        if {'rank', 'export_csv', 'export_pdf'} & set(stages):
+            ranked, ranking_id = run_rank(selection_base)
+            results.update(ranked)
+            if 'export_csv' in stages:
+                results.update(run_export_csv(ranking_id))
+            if 'export_pdf' in stages:
+                results.update(run_export_pdf(ranking_id))
+    return {stage: result for stage, result in results.items() if stage in stages}
+
+
+def summarize(runs):
+    """Медіана часу кожного етапу по прогонах; решта полів - з першого прогону"""
+    summary = {}
+    for stage in runs[0]:
+        seconds = [run[stage]['seconds'] for run in runs]
+        summary[stage] = dict(runs[0][stage], seconds=round(statistics.median(seconds), 4), runs=seconds)
+        rows = summary[stage]['rows']
+        summary[stage]['rows_per_second'] = round(rows / summary[stage]['seconds']) if summary[stage]['seconds'] else None
+    return summary
+
+
+def metadata(args, rows):
+    from sqlalchemy import text
+
+    from app import db
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'size': args.size,
+        'rows': rows,
+        'seed': args.seed,
+        'headers': args.headers,
+        'format': args.format,
+        'repeat': args.repeat,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'postgres': db.session.execute(text("SHOW server_version")).scalar(),
+    }
+
+
+def run_benchmarks(args):
+    try:
+        rows = size_rows(args.size)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    stages = [stage for stage in args.stages.split(',') if stage] if args.stages else STAGES
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        raise SystemExit(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    files = benchmark_files(args.size, args.data_dir, args.seed, args.headers, args.format)
+    app = init_app(args.database_url, args.allow_app_database)
+    with app.app_context():
+        runs = []
+        for number in range(args.repeat):
+            logging.info(f"Benchmark run {number + 1}/{args.repeat}: {rows} rows, stages {stages}")
+            runs.append(run_once(files, stages))
+        return {'meta': metadata(args, rows), 'stages': summarize(runs)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark ingestion, actualization, ranking and export')
+    parser.add_argument('--size', default=DEFAULT_SIZE, help='10k, 160k, 1m or a row count')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--headers', choices=sorted(HEADERS), default='ru')
+    parser.add_argument('--format', choices=['csv', 'xlsx'], default='csv')
+    parser.add_argument('--stages', help=f"comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--database-url', default=os.environ.get('BENCHMARK_DATABASE_URL'))
+    parser.add_argument('--allow-app-database', action='store_true')
+    parser.add_argument('--output', help='results JSON (default: <data-dir>/results_<rows>_<time>.json)')
+    parser.add_argument('--baseline', help='baseline JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--save-baseline', help='also write the results to this baseline path')
+    args = parser.parse_args(argv)
+    args.repeat = max(1, args.repeat)
+
+    logging.basicConfig(level=logging.INFO)
+    results = run_benchmarks(args)
+
+    output = args.output or os.path.join(
+        args.data_dir, f"results_{results['meta']['rows']}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    for path in filter(None, [output, args.save_baseline]):
+        with open(path, 'w', encoding='utf-8') as result_file:
+            json.dump(results, result_file, ensure_ascii=False, indent=2)
+    print(f"Results: {output}")
+    for stage, result in results['stages'].items():
+        print(f"  {stage:<11} {result['seconds']:>9.3f} s  {result['rows']:>9} rows  "
+              f"{result['rows_per_second'] or 0:>9} rows/s")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            comparison = compare_results(results, json.load(baseline_file), args.threshold)
+        print(format_comparison(comparison))
+        if comparison['regressions']:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
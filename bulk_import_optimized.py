@@ -5,6 +5,7 @@
 
 import csv
 import io
+from datetime import datetime
 from app import app, db
 import logging
 
@@ -16,6 +17,7 @@ def bulk_import_csv(file_path):
         try:
             # Підготовка даних для bulk insert
             data_buffer = io.StringIO()
+            actualized_at = datetime.utcnow().isoformat(sep=' ')
             
             # Читаємо CSV та конвертуємо у формат для COPY
             with open(file_path, 'r', encoding='utf-8') as csvfile:
@@ -40,7 +42,9 @@ def bulk_import_csv(file_path):
                         row.get('revenue_2019', '') or '0',
                         row.get('profit_2019', '') or '0',
                         'bulk_import',
-                        'так'
+                        'так',
+                        'true',
+                        actualized_at
                     ]
                     
                     # Екранування спеціальних символів для COPY
@@ -64,7 +68,8 @@ def bulk_import_csv(file_path):
                     columns=[
                         'edrpou', 'name', 'kved_code', 'kved_description', 'region_name',
                         'phone', 'address', 'company_size_name', 'personnel_2019',
-                        'revenue_2019', 'profit_2019', 'source', 'actualized'
+                        'revenue_2019', 'profit_2019', 'source', 'actualized',
+                        'is_actualized', 'actualized_at'
                     ],
                     sep='\t'
                 )
@@ -112,12 +117,12 @@ def prepare_temp_table_import(file_path):
                 INSERT INTO companies (
                     edrpou, name, kved_code, kved_description, region_name,
                     phone, address, company_size_name, personnel_2019,
-                    revenue_2019, profit_2019, source, actualized, created_at
+                    revenue_2019, profit_2019, source, actualized, is_actualized, actualized_at, created_at
                 )
                 SELECT 
                     edrpou, name, kved_code, kved_description, region_name,
                     phone, address, company_size_name, personnel_2019,
-                    revenue_2019, profit_2019, 'bulk_temp', 'так', CURRENT_TIMESTAMP
+                    revenue_2019, profit_2019, 'bulk_temp', 'так', true, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
                 FROM temp_companies
                 ON CONFLICT (edrpou) DO UPDATE SET
                     name = EXCLUDED.name,
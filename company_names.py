@@ -0,0 +1,57 @@
+"""
+Нормалізація назв компаній для пошуку (company_search.py).
+
+SEARCH_NAME_SQL - вираз згенерованої колонки companies.search_name,
+normalize_name - те саме перетворення в Python для рядка запиту: лапки і
+апострофи прибрані, нижній регістр, пробіли схлопнуті, організаційно-правова
+форма на початку відкинута. Модуль не залежить від app, тож його імпортують
+schema_migrations і company_search без циклічних імпортів.
+"""
+
+import re
+
+UPPER_LETTERS = 'АБВГҐДЕЄЖЗИІЇЙКЛМНОПРСТУФХЦЧШЩЬЮЯЁЪЫЭ'
+LOWER_LETTERS = UPPER_LETTERS.lower()
+QUOTE_CHARS = '"«»“”„\'’ʼ`'
+
+# Від довших до коротших: «тов» не має відрізати початок «товариство ...»
+LEGAL_FORMS = (
+    'товариство з обмеженою відповідальністю',
+    'товариство з додатковою відповідальністю',
+    'приватне акціонерне товариство',
+    'публічне акціонерне товариство',
+    'відкрите акціонерне товариство',
+    'закрите акціонерне товариство',
+    'акціонерне товариство',
+    'приватне підприємство',
+    'дочірнє підприємство',
+    'державне підприємство',
+    'комунальне підприємство',
+    'фізична особа-підприємець',
+    'тзов', 'тов', 'тдв', 'прат', 'пат', 'ват', 'зат', 'ат', 'пп', 'дп', 'кп', 'фоп',
+)
+LEGAL_FORM_REGEX = r'^\s*(%s)\s+' % '|'.join(LEGAL_FORMS)
+
+
+def _sql_literal(value):
+    return "'%s'" % value.replace("'", "''")
+
+
+# Вираз згенерованої колонки companies.search_name (schema_migrations).
+# translate замість lower для кирилиці: lower() в COLLATE "C" змінює тільки ASCII
+SEARCH_NAME_SQL = (
+    "btrim(regexp_replace(regexp_replace(lower(translate(translate(name, {quotes}, ''), {upper}, {lower})),"
+    " '\\s+', ' ', 'g'), {legal_forms}, ''))"
+).format(quotes=_sql_literal(QUOTE_CHARS), upper=_sql_literal(UPPER_LETTERS),
+         lower=_sql_literal(LOWER_LETTERS), legal_forms=_sql_literal(LEGAL_FORM_REGEX))
+
+_QUOTES_TABLE = str.maketrans('', '', QUOTE_CHARS)
+_LETTERS_TABLE = str.maketrans(UPPER_LETTERS, LOWER_LETTERS)
+_LEGAL_FORM = re.compile(LEGAL_FORM_REGEX)
+
+
+def normalize_name(value):
+    """Назва як у companies.search_name: без лапок і правової форми, нижній регістр"""
+    value = str(value or '').translate(_QUOTES_TABLE).translate(_LETTERS_TABLE).lower()
+    value = re.sub(r'\s+', ' ', value)
+    return _LEGAL_FORM.sub('', value, count=1).strip()
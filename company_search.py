@@ -0,0 +1,217 @@
+"""
+Пошук компаній за ЄДРПОУ і назвою з автодоповненням.
+
+Назва шукається по companies.search_name - згенерованій (STORED) колонці з
+нормалізованою назвою: лапки і апострофи прибрані, кирилиця і латиниця в
+нижньому регістрі, пробіли схлопнуті, організаційно-правова форма на
+початку (ТОВ, ПАТ, ПрАТ, «Товариство з обмеженою відповідальністю», ...)
+відкинута. Колонку підтримує сама PostgreSQL, тож імпорти і актуалізація
+нічого не знають про пошук; вираз колонки і те саме перетворення в Python
+для рядка запиту - company_names.py.
+
+Запит виконується у два кроки:
+- префікс: цифри - ЄДРПОУ, що починається з введеного; інакше - назва, що
+  починається з введеного. Індекси з COLLATE "C" (db_indexes.py) дають
+  LIKE 'abc%' і ORDER BY одним проходом по індексу;
+- входження: якщо префіксних збігів менше за limit і встановлено pg_trgm,
+  доповнення збігами всередині рядка через GIN-індекси gin_trgm_ops,
+  назви - за схожістю (similarity). Без pg_trgm (розширення недоступне на
+  сервері) пошук лишається префіксним і не сканує таблицю.
+
+Колонка search_name не входить у модель Company: в заповнену базу вона
+додається разовою міграцією (python schema_migrations.py search_name), а до
+неї назва шукається як раніше - ILIKE '%...%' по name, без індексу.
+
+    python company_search.py <запит> [limit]
+"""
+
+import logging
+
+from sqlalchemy import Text, literal_column, text
+
+from app import db
+from company_names import normalize_name
+from facets import TTLCache
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+# Коротший рядок дає надто мало триграм - GIN-індекс не звужує вибірку
+MIN_TRIGRAM_LENGTH = 3
+
+COLUMNS = "id, edrpou, name, region_name, kved_code"
+
+EDRPOU_PREFIX_SQL = f"""
+    SELECT {COLUMNS} FROM companies
+    WHERE edrpou COLLATE "C" LIKE :prefix
+    ORDER BY edrpou COLLATE "C"
+    LIMIT :limit
+"""
+
+EDRPOU_CONTAINS_SQL = f"""
+    SELECT {COLUMNS} FROM companies
+    WHERE edrpou LIKE :contains AND edrpou COLLATE "C" NOT LIKE :prefix
+    ORDER BY edrpou COLLATE "C"
+    LIMIT :limit
+"""
+
+NAME_PREFIX_SQL = f"""
+    SELECT {COLUMNS} FROM companies
+    WHERE search_name COLLATE "C" LIKE :prefix
+    ORDER BY search_name COLLATE "C", id
+    LIMIT :limit
+"""
+
+NAME_CONTAINS_SQL = f"""
+    SELECT {COLUMNS} FROM companies
+    WHERE search_name LIKE :contains AND search_name COLLATE "C" NOT LIKE :prefix
+    ORDER BY similarity(search_name, :query) DESC, id
+    LIMIT :limit
+"""
+
+# Пошук за назвою до міграції search_name
+NAME_FALLBACK_SQL = f"""
+    SELECT {COLUMNS} FROM companies
+    WHERE name ILIKE :raw_contains
+    ORDER BY name, id
+    LIMIT :limit
+"""
+
+SEARCH_NAME_COLUMN_SQL = """
+    SELECT EXISTS (SELECT 1 FROM pg_attribute
+                   WHERE attrelid = 'companies'::regclass AND attname = 'search_name' AND NOT attisdropped)
+"""
+
+# pg_trgm встановлено і обидва GIN-індекси вже побудовані (db_indexes)
+TRIGRAM_SQL = """
+    SELECT COUNT(*) = 2 FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE c.relname IN ('idx_companies_edrpou_trgm', 'idx_companies_search_name_trgm') AND i.indisvalid
+"""
+
+_trigram_cache = TTLCache(maxsize=2, ttl=300)
+
+
+def like_escape(value):
+    """Екранувати % і _ для LIKE (ESCAPE за замовчуванням - зворотна коса)"""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def trigram_available():
+    """Чи доступний пошук входження триграмами (кешується на 5 хвилин)"""
+    available = _trigram_cache.get('pg_trgm')
+    if available is None:
+        available = bool(db.session.execute(text(TRIGRAM_SQL)).scalar())
+        _trigram_cache.set('pg_trgm', available)
+    return available
+
+
+def search_name_available():
+    """Чи додано колонку search_name (кешується на 5 хвилин)"""
+    available = _trigram_cache.get('search_name')
+    if available is None:
+        available = bool(db.session.execute(text(SEARCH_NAME_COLUMN_SQL)).scalar())
+        _trigram_cache.set('search_name', available)
+    return available
+
+
+def search_terms(query):
+    """
+    Розбір запиту: ('edrpou', цифри) або ('name', нормалізована назва);
+    None для порожнього запиту
+    """
+    query = (query or '').strip()
+    if not query:
+        return None
+    if query.isdigit():
+        return 'edrpou', query
+    name = normalize_name(query)
+    return ('name', name) if name else None
+
+
+def search_condition(query):
+    """
+    Умова SQLAlchemy для сторінки /companies: ЄДРПОУ або назва, що починається
+    з запиту або (з pg_trgm) містить його. None - умови немає
+    """
+    from models_full import Company
+
+    terms = search_terms(query)
+    if terms is None:
+        return None
+    kind, value = terms
+    if kind == 'name' and not search_name_available():
+        return Company.name.ilike(f'%{like_escape(query.strip())}%')
+    # search_name не входить у модель Company: колонка може бути ще не додана міграцією
+    column = Company.edrpou if kind == 'edrpou' else literal_column('companies.search_name', Text)
+    escaped = like_escape(value)
+    if len(value) >= MIN_TRIGRAM_LENGTH and trigram_available():
+        return column.like(f'%{escaped}%')
+    return column.collate('C').like(f'{escaped}%')
+
+
+def _search_params(query, value, limit):
+    escaped = like_escape(value)
+    return {'prefix': f'{escaped}%', 'contains': f'%{escaped}%', 'query': value, 'limit': limit,
+            'raw_contains': f'%{like_escape(query.strip())}%'}
+
+
+def suggest_companies(query, limit=DEFAULT_LIMIT):
+    """
+    До limit компаній для автодоповнення: спершу префіксні збіги, далі
+    (з pg_trgm) входження. Кожен результат - словник з полем match
+    ('prefix' або 'contains')
+    """
+    terms = search_terms(query)
+    if terms is None:
+        return []
+    kind, value = terms
+    limit = max(1, min(int(limit), MAX_LIMIT))
+    params = _search_params(query, value, limit)
+
+    if kind == 'name' and not search_name_available():
+        rows = [(row, 'contains') for row in db.session.execute(text(NAME_FALLBACK_SQL), params)]
+    else:
+        prefix_sql, contains_sql = ((EDRPOU_PREFIX_SQL, EDRPOU_CONTAINS_SQL) if kind == 'edrpou'
+                                    else (NAME_PREFIX_SQL, NAME_CONTAINS_SQL))
+        rows = [(row, 'prefix') for row in db.session.execute(text(prefix_sql), params)]
+        if len(rows) < limit and len(value) >= MIN_TRIGRAM_LENGTH and trigram_available():
+            params['limit'] = limit - len(rows)
+            rows += [(row, 'contains') for row in db.session.execute(text(contains_sql), params)]
+
+    return [{
+        'id': row[0],
+        'edrpou': row[1],
+        'name': row[2],
+        'region_name': row[3],
+        'kved_code': row[4],
+        'match': match,
+    } for row, match in rows]
+
+
+def search_queries(query):
+    """(назва, sql, params) запитів suggest_companies для EXPLAIN перевірки (db_indexes)"""
+    kind, value = search_terms(query)
+    params = _search_params(query, value, DEFAULT_LIMIT)
+    if kind == 'name' and not search_name_available():
+        return [('suggest_name_fallback', NAME_FALLBACK_SQL, params)]
+    queries = [(f'suggest_{kind}_prefix', EDRPOU_PREFIX_SQL if kind == 'edrpou' else NAME_PREFIX_SQL, params)]
+    if len(value) >= MIN_TRIGRAM_LENGTH and trigram_available():
+        queries.append((f'suggest_{kind}_contains',
+                        EDRPOU_CONTAINS_SQL if kind == 'edrpou' else NAME_CONTAINS_SQL, params))
+    return queries
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        started = time.perf_counter()
+        results = suggest_companies(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_LIMIT)
+        elapsed = (time.perf_counter() - started) * 1000
+        for company in results:
+            print(f"{company['edrpou']}  {company['name']}  ({company['match']})")
+        print(f"{len(results)} results in {elapsed:.1f} ms, pg_trgm: {trigram_available()}")
@@ -0,0 +1,332 @@
+"""
+Колонковий знімок companies у памʼяті процесу для швидкої фільтрації.
+
+Числові поля (дохід, прибуток, персонал) зберігаються масивами NumPy
+float64 (NULL - NaN), категорійні (КВЕД, область, розмір, актуалізація) -
+словниковими кодами int32 (NULL - -1). Фільтри по межах і списках значень
+рахуються векторними масками, кількість - сумою маски, top-k - через
+argpartition без повного сортування. Семантика та сама, що в SQL умовах
+відбору (ranking_engine.selection_conditions): NULL не проходить межу,
+у top-k порожнє значення критерію - 0, рівні значення - за ЄДРПОУ.
+
+Знімок незмінний; після імпорту покоління даних (generations.py)
+змінюється, і наступний запит будує новий знімок, поки інші потоки
+читають попередній. Покоління перевіряється не частіше ніж раз на
+GENERATION_CHECK_INTERVAL секунд, тож живий лічильник на сторінці фільтра
+не звертається до БД на кожне натискання клавіші. SNAPSHOT_MAX_AGE -
+запасний варіант для записів в обхід задач. COMPANY_SNAPSHOT=0 вимикає
+знімок, тоді виклики повертаються до SQL.
+
+Перевірка відповідності SQL: python company_snapshot.py
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+from sqlalchemy import text
+
+from app import db
+from generations import current_generation
+
+SNAPSHOT_ENABLED = os.environ.get('COMPANY_SNAPSHOT', '1') != '0'
+GENERATION_CHECK_INTERVAL = 2
+SNAPSHOT_MAX_AGE = 300
+SNAPSHOT_BATCH_SIZE = 20000
+MAX_TOP_K = 1000
+
+NUMERIC_COLUMNS = ('revenue_2019', 'profit_2019', 'personnel_2019')
+CATEGORICAL_COLUMNS = ('kved_code', 'region_name', 'company_size_name', 'actualized')
+
+# Критерій рейтингу → числова колонка знімку (як RANKING_CRITERIA у ranking_engine)
+CRITERIA_COLUMNS = {
+    'revenue': 'revenue_2019',
+    'profit': 'profit_2019',
+    'personnel': 'personnel_2019',
+}
+
+SNAPSHOT_SQL = f"""
+    SELECT id, edrpou, name,
+           {', '.join(f'CAST({column} AS double precision)' for column in NUMERIC_COLUMNS)},
+           {', '.join(CATEGORICAL_COLUMNS)}
+    FROM companies
+    ORDER BY id
+"""
+
+# Критерії відбору; атрибути збігаються з SelectionBase, тож фільтри можна
+# передати в selection_conditions для перевірки тим самим SQL
+SelectionFilters = namedtuple(
+    'SelectionFilters',
+    'min_employees min_revenue min_profit kved_codes regions sizes',
+    defaults=(None, None, None, (), (), ()),
+)
+
+
+def _number(value, cast):
+    if value is None or not str(value).strip():
+        return None
+    try:
+        return cast(value)
+    except ValueError:
+        return None
+
+
+def parse_filters(args):
+    """
+    SelectionFilters з параметрів форми фільтра (request.args або request.form).
+    Як у filter_companies_route: нульові мінімуми працівників і доходу не
+    фільтрують, прибуток - якщо заданий.
+    """
+    min_employees = _number(args.get('min_employees'), int)
+    min_revenue = _number(args.get('min_revenue'), float)
+    return SelectionFilters(
+        min_employees=min_employees if min_employees else None,
+        min_revenue=min_revenue if min_revenue else None,
+        min_profit=_number(args.get('min_profit'), float),
+        kved_codes=tuple(value for value in args.getlist('kved_filter') if value),
+        regions=tuple(value for value in args.getlist('region_filter') if value),
+        sizes=tuple(value for value in args.getlist('size_filter') if value),
+    )
+
+
+class CompanySnapshot:
+    """Незмінний колонковий знімок companies для покоління generation"""
+
+    def __init__(self, generation, ids, edrpou, names, numeric, categorical):
+        self.generation = generation
+        self.built_at = time.monotonic()
+        self.ids = ids
+        self.edrpou = edrpou
+        self.names = names
+        # {колонка: float64 масив}
+        self.numeric = numeric
+        # {колонка: (int32 коди, {значення: код})}
+        self.categorical = categorical
+        # Порядковий номер ЄДРПОУ - цілочисловий tiebreak для lexsort
+        self.edrpou_order = np.argsort(np.argsort(edrpou, kind='stable'), kind='stable')
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        arrays = [self.ids, self.edrpou_order, *self.numeric.values()]
+        arrays += [codes for codes, _ in self.categorical.values()]
+        return sum(array.nbytes for array in arrays)
+
+    @classmethod
+    def load(cls, generation=None):
+        """Зчитати companies курсором на сервері пачками по SNAPSHOT_BATCH_SIZE"""
+        if generation is None:
+            generation = current_generation()
+        started = time.perf_counter()
+        ids, edrpou, names = [], [], []
+        numeric = {column: [] for column in NUMERIC_COLUMNS}
+        lookups = {column: {} for column in CATEGORICAL_COLUMNS}
+        codes = {column: [] for column in CATEGORICAL_COLUMNS}
+        numeric_slots = list(enumerate(NUMERIC_COLUMNS, start=3))
+        categorical_slots = list(enumerate(CATEGORICAL_COLUMNS, start=3 + len(NUMERIC_COLUMNS)))
+
+        with db.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(text(SNAPSHOT_SQL))
+            for partition in result.partitions(SNAPSHOT_BATCH_SIZE):
+                for row in partition:
+                    ids.append(row[0])
+                    edrpou.append(row[1] or '')
+                    names.append(row[2])
+                    for index, column in numeric_slots:
+                        numeric[column].append(row[index])
+                    for index, column in categorical_slots:
+                        value = row[index]
+                        if value is None:
+                            codes[column].append(-1)
+                        else:
+                            lookup = lookups[column]
+                            codes[column].append(lookup.setdefault(value, len(lookup)))
+
+        snapshot = cls(
+            generation,
+            np.array(ids, dtype=np.int64),
+            np.array(edrpou, dtype=object),
+            names,
+            {column: np.array(values, dtype=np.float64) for column, values in numeric.items()},
+            {column: (np.array(codes[column], dtype=np.int32), lookups[column]) for column in CATEGORICAL_COLUMNS},
+        )
+        logging.info(f"Company snapshot g{generation}: {len(snapshot)} rows, "
+                     f"{snapshot.nbytes / 1024 / 1024:.1f} MB in {time.perf_counter() - started:.2f}s")
+        return snapshot
+
+    def _in(self, column, values):
+        codes, lookup = self.categorical[column]
+        wanted = [lookup[value] for value in values if value in lookup]
+        if not wanted:
+            return np.zeros(len(codes), dtype=bool)
+        if len(wanted) == 1:
+            return codes == wanted[0]
+        return np.isin(codes, wanted)
+
+    def mask(self, filters=None):
+        """Булева маска компаній, що проходять filters (SelectionFilters)"""
+        mask = np.ones(len(self), dtype=bool)
+        if filters is None:
+            return mask
+        # NaN >= x - False, як NULL >= x у SQL
+        for column, bound in (('personnel_2019', filters.min_employees),
+                              ('revenue_2019', filters.min_revenue),
+                              ('profit_2019', filters.min_profit)):
+            if bound is not None:
+                mask &= self.numeric[column] >= bound
+        for column, values in (('kved_code', filters.kved_codes),
+                               ('region_name', filters.regions),
+                               ('company_size_name', filters.sizes)):
+            if values:
+                mask &= self._in(column, values)
+        return mask
+
+    def count(self, filters=None):
+        return int(np.count_nonzero(self.mask(filters)))
+
+    def top_k(self, criteria='revenue', k=10, sort_order='desc', filters=None):
+        """
+        Індекси k перших компаній за критерієм серед відібраних, у порядку
+        рейтингу ROW_NUMBER: COALESCE(значення, 0), рівні - за ЄДРПОУ.
+        """
+        column = CRITERIA_COLUMNS.get(criteria, CRITERIA_COLUMNS['revenue'])
+        selected = np.flatnonzero(self.mask(filters))
+        k = max(0, min(k, MAX_TOP_K, len(selected)))
+        if not k:
+            return selected[:0]
+        values = np.nan_to_num(self.numeric[column][selected], nan=0.0)
+        if sort_order != 'asc':
+            values = -values
+        if k < len(selected):
+            # Межа k-го значення; рівні їй значення беруться всі, щоб tiebreak був точним
+            bound = np.partition(values, k - 1)[k - 1]
+            keep = np.flatnonzero(values <= bound)
+            selected, values = selected[keep], values[keep]
+        order = np.lexsort((self.edrpou_order[selected], values))[:k]
+        return selected[order]
+
+    def companies(self, indices, criteria='revenue'):
+        """Короткі записи компаній за індексами знімку"""
+        column = CRITERIA_COLUMNS.get(criteria, CRITERIA_COLUMNS['revenue'])
+        values = self.numeric[column]
+        return [{
+            'id': int(self.ids[index]),
+            'edrpou': self.edrpou[index],
+            'name': self.names[index],
+            'value': None if np.isnan(values[index]) else float(values[index]),
+        } for index in indices]
+
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0.0
+
+
+def get_snapshot():
+    """
+    Актуальний знімок або None, якщо знімок вимкнено. Поки один потік
+    будує знімок нового покоління, інші отримують попередній.
+    """
+    global _snapshot, _checked_at
+    if not SNAPSHOT_ENABLED:
+        return None
+    snapshot = _snapshot
+    now = time.monotonic()
+    if snapshot is not None and now - _checked_at < GENERATION_CHECK_INTERVAL:
+        return snapshot
+    if not _lock.acquire(blocking=snapshot is None):
+        return snapshot
+    try:
+        snapshot = _snapshot
+        generation = current_generation()
+        _checked_at = time.monotonic()
+        if (snapshot is None or snapshot.generation != generation
+                or _checked_at - snapshot.built_at > SNAPSHOT_MAX_AGE):
+            snapshot = CompanySnapshot.load(generation)
+            _snapshot = snapshot
+        return snapshot
+    finally:
+        _lock.release()
+
+
+def reset_snapshot():
+    global _snapshot, _checked_at
+    with _lock:
+        _snapshot = None
+        _checked_at = 0.0
+
+
+def sql_count(filters):
+    """Кількість компаній за filters запитом до БД (запасний шлях і еталон)"""
+    from ranking_engine import selection_conditions
+
+    where, params = selection_conditions(filters, filters.kved_codes, filters.regions, filters.sizes)
+    return db.session.execute(text(f"SELECT COUNT(*) FROM companies WHERE {where}"), params).scalar() or 0
+
+
+def count_companies(filters):
+    """(кількість, engine): зі знімку, якщо він увімкнений, інакше з БД"""
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return sql_count(filters), 'sql'
+    return snapshot.count(filters), 'snapshot'
+
+
+def check_snapshot(samples=20, seed=0):
+    """
+    Порівняти знімок з SQL: кількості для випадкових комбінацій фільтрів і
+    top-k з вибіркою рейтингу ROW_NUMBER. Повертає словник з часом і
+    кількістю розбіжностей.
+    """
+    from ranking_engine import selection_conditions, window_order
+
+    rng = np.random.default_rng(seed)
+    snapshot = CompanySnapshot.load()
+    pick = lambda column, n: tuple(rng.choice(sorted(snapshot.categorical[column][1]), size=n, replace=False)) \
+        if len(snapshot.categorical[column][1]) >= n else ()
+    mismatches = []
+    snapshot_time = 0.0
+    for sample in range(samples):
+        filters = SelectionFilters(
+            min_employees=int(rng.choice([0, 5, 50])) or None,
+            min_revenue=float(rng.choice([0, 1000, 100000])) or None,
+            min_profit=float(rng.choice([-1000, 0, 500])) if sample % 2 else None,
+            kved_codes=pick('kved_code', int(rng.integers(0, 4))),
+            regions=pick('region_name', int(rng.integers(0, 3))),
+            sizes=pick('company_size_name', int(rng.integers(0, 2))),
+        )
+        started = time.perf_counter()
+        count = snapshot.count(filters)
+        criteria = ('revenue', 'profit', 'personnel')[sample % 3]
+        sort_order = 'asc' if sample % 4 == 3 else 'desc'
+        top = snapshot.top_k(criteria, 10, sort_order, filters)
+        snapshot_time += time.perf_counter() - started
+
+        expected = sql_count(filters)
+        where, params = selection_conditions(filters, filters.kved_codes, filters.regions, filters.sizes)
+        expected_top = [row[0] for row in db.session.execute(text(
+            f"SELECT id FROM companies WHERE {where} "
+            f"ORDER BY {window_order(criteria, sort_order, 'row_number')} LIMIT 10"
+        ), params)]
+        if count != expected or [int(snapshot.ids[index]) for index in top] != expected_top:
+            mismatches.append({'filters': filters._asdict(), 'count': count, 'expected': expected})
+    return {
+        'rows': len(snapshot),
+        'megabytes': round(snapshot.nbytes / 1024 / 1024, 1),
+        'samples': samples,
+        'avg_ms': round(snapshot_time / samples * 1000, 3),
+        'mismatches': mismatches,
+    }
+
+
+if __name__ == '__main__':
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        print(check_snapshot())
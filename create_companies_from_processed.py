@@ -113,8 +113,8 @@ def process_csv_to_database(file_path):
                         INSERT INTO companies (
                             edrpou, name, kved_code, kved_description, region_name,
                             phone, address, company_size_name, personnel_2019,
-                            revenue_2019, profit_2019, source, actualized, created_at
-                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+                            revenue_2019, profit_2019, source, actualized, is_actualized, actualized_at, created_at
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, true, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
                         """
                         cur.execute(insert_sql, (
                             company_data['edrpou'],
@@ -0,0 +1,306 @@
+"""
+Зведена статистика дашборду.
+
+Агрегати по companies (кількість компаній, областей, КВЕД, актуалізованих
+(is_actualized),
+проранжованих, в активному відборі) зберігаються в dashboard_kved_stats,
+dashboard_region_stats і dashboard_state. Головна сторінка, /api/stats і
+/api/database-stats читають O(#КВЕД) рядків замість сканування companies.
+
+Оновлення інкрементальне: після імпорту, актуалізації чи рейтингу
+перераховуються тільки групи КВЕД/областей компаній, змінених після
+водяного знаку (updated_at/created_at). Якщо суми груп розходяться з
+COUNT(*) companies (видалення, зміна КВЕД/області), статистика
+перебудовується повністю. Якщо статистику давно не оновлювали (запис в обхід
+задач), get_dashboard_stats оновлює її сам.
+"""
+
+import json
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app import db
+
+STATE_ID = 1
+TOP_KVED_LIMIT = 10
+RECENT_COMPANIES_LIMIT = 5
+STATS_MAX_AGE = timedelta(minutes=10)
+
+LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('dashboard_stats'))"
+
+# Групи, що містять компанії, змінені після водяного знаку
+DIRTY_GROUPS_SQL = """
+    SELECT
+        COALESCE(array_agg(DISTINCT COALESCE(kved_code, '')), '{}'),
+        COALESCE(array_agg(DISTINCT COALESCE(region_name, '')), '{}')
+    FROM companies
+    WHERE updated_at >= :since OR created_at >= :since
+"""
+
+RESET_KVED_SQL = "UPDATE dashboard_kved_stats SET total_count = 0, actualized_count = 0 WHERE {where}"
+RESET_REGION_SQL = "UPDATE dashboard_region_stats SET total_count = 0 WHERE {where}"
+
+# Актуалізовані рахуються окремо по частковому індексу idx_companies_actualized
+# (is_actualized, actualization_flag.py) - index-only scan замість перевірки тексту в кожному рядку
+KVED_GROUPS_SQL = """
+    INSERT INTO dashboard_kved_stats
+        (kved_code, kved_description, total_count, actualized_count, selection_count, updated_at)
+    SELECT t.kved_code, t.kved_description, t.total_count, COALESCE(a.actualized_count, 0), 0, :now
+    FROM (
+        SELECT COALESCE(kved_code, '') AS kved_code, MIN(kved_description) AS kved_description,
+               COUNT(*) AS total_count
+        FROM companies
+        WHERE {where}
+        GROUP BY COALESCE(kved_code, '')
+    ) t
+    LEFT JOIN (
+        SELECT COALESCE(kved_code, '') AS kved_code, COUNT(*) AS actualized_count
+        FROM companies
+        WHERE is_actualized AND {where}
+        GROUP BY COALESCE(kved_code, '')
+    ) a USING (kved_code)
+    ON CONFLICT (kved_code) DO UPDATE SET
+        kved_description = EXCLUDED.kved_description,
+        total_count = EXCLUDED.total_count,
+        actualized_count = EXCLUDED.actualized_count,
+        updated_at = EXCLUDED.updated_at
+"""
+
+REGION_GROUPS_SQL = """
+    INSERT INTO dashboard_region_stats (region_name, total_count, updated_at)
+    SELECT COALESCE(region_name, ''), COUNT(*), :now
+    FROM companies
+    WHERE {where}
+    GROUP BY COALESCE(region_name, '')
+    ON CONFLICT (region_name) DO UPDATE SET
+        total_count = EXCLUDED.total_count,
+        updated_at = EXCLUDED.updated_at
+"""
+
+CONSISTENCY_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM companies),
+        (SELECT COALESCE(SUM(total_count), 0) FROM dashboard_kved_stats),
+        (SELECT COALESCE(SUM(total_count), 0) FROM dashboard_region_stats)
+"""
+
+RECENT_COMPANIES_SQL = """
+    SELECT edrpou, name, region_name, kved_code, created_at
+    FROM companies
+    ORDER BY created_at DESC NULLS LAST
+    LIMIT :limit
+"""
+
+SELECTION_COUNTS_SQL = """
+    UPDATE dashboard_kved_stats k SET selection_count = s.selection_count
+    FROM (
+        SELECT COALESCE(c.kved_code, '') AS kved_code, COUNT(DISTINCT c.id) AS selection_count
+        FROM selection_companies sc
+        JOIN companies c ON c.id = sc.company_id
+        WHERE sc.selection_base_id = :selection_base_id
+        GROUP BY COALESCE(c.kved_code, '')
+    ) s
+    WHERE k.kved_code = s.kved_code
+"""
+
+# Ті самі лічильники з перетину бітмапів (selection_bitmap.selection_kved_counts)
+SELECTION_COUNTS_FROM_ARRAYS_SQL = """
+    UPDATE dashboard_kved_stats k SET selection_count = s.selection_count
+    FROM unnest(CAST(:codes AS text[]), CAST(:counts AS integer[])) AS s(kved_code, selection_count)
+    WHERE k.kved_code = s.kved_code
+"""
+
+
+def checkpoint():
+    """Час БД до початку запису; передається в refresh_dashboard_stats(since=...)"""
+    with db.engine.connect() as connection:
+        return connection.execute(text("SELECT LOCALTIMESTAMP")).scalar()
+
+
+def _get_state():
+    from models_full import DashboardState
+    return db.session.get(DashboardState, STATE_ID)
+
+
+def _active_selection_id():
+    return db.session.execute(text(
+        "SELECT id FROM selection_bases WHERE is_active = true ORDER BY id DESC LIMIT 1"
+    )).scalar()
+
+
+def _refresh_groups(now, kved_codes=None, regions=None):
+    """Перерахувати групи КВЕД/областей (None - всі групи)"""
+    if kved_codes is None:
+        where, params = 'true', {}
+    else:
+        where, params = "COALESCE(kved_code, '') = ANY(:codes)", {'codes': list(kved_codes)}
+    db.session.execute(text(RESET_KVED_SQL.format(where=where)), params)
+    db.session.execute(text(KVED_GROUPS_SQL.format(where=where)), dict(params, now=now))
+
+    if regions is None:
+        where, params = 'true', {}
+    else:
+        where, params = "COALESCE(region_name, '') = ANY(:regions)", {'regions': list(regions)}
+    db.session.execute(text(RESET_REGION_SQL.format(where=where)), params)
+    db.session.execute(text(REGION_GROUPS_SQL.format(where=where)), dict(params, now=now))
+
+    db.session.execute(text("DELETE FROM dashboard_kved_stats WHERE total_count = 0"))
+    db.session.execute(text("DELETE FROM dashboard_region_stats WHERE total_count = 0"))
+
+
+def _refresh_selection(state, selection_base_id):
+    db.session.execute(text("UPDATE dashboard_kved_stats SET selection_count = 0 WHERE selection_count <> 0"))
+    if selection_base_id:
+        from selection_bitmap import selection_kved_counts
+        counts = selection_kved_counts(selection_base_id)
+        if counts is None:
+            db.session.execute(text(SELECTION_COUNTS_SQL), {'selection_base_id': selection_base_id})
+        elif counts:
+            db.session.execute(text(SELECTION_COUNTS_FROM_ARRAYS_SQL),
+                               {'codes': list(counts), 'counts': list(counts.values())})
+    state.selection_base_id = selection_base_id
+
+
+def _refresh_ranking(state):
+    state.companies_with_ranking = db.session.execute(
+        text("SELECT COUNT(*) FROM companies WHERE ranking IS NOT NULL")
+    ).scalar() or 0
+
+
+def _refresh_recent(state):
+    rows = db.session.execute(text(RECENT_COMPANIES_SQL), {'limit': RECENT_COMPANIES_LIMIT}).fetchall()
+    state.recent_companies = json.dumps([{
+        'edrpou': row[0],
+        'name': row[1],
+        'region_name': row[2],
+        'kved_code': row[3],
+        'created_at': row[4].isoformat() if row[4] else None
+    } for row in rows])
+
+
+def refresh_dashboard_stats(since=None, full=False):
+    """
+    Оновити статистику після запису в companies.
+
+    since - checkpoint() перед записом: групи перераховуються для компаній,
+    змінених після min(since, водяний знак). full=True або відсутність
+    статистики - повна перебудова. Повертає кількість перерахованих груп КВЕД
+    (None при повній перебудові).
+    """
+    from models_full import DashboardState
+
+    db.session.execute(text(LOCK_SQL))
+    now = db.session.execute(text("SELECT clock_timestamp()::timestamp")).scalar()
+    state = _get_state()
+    if state is None:
+        state = DashboardState(id=STATE_ID)
+        db.session.add(state)
+        full = True
+
+    refreshed = None
+    if not full:
+        watermark = state.refreshed_at
+        if since is not None and (watermark is None or since < watermark):
+            watermark = since
+        if watermark is None:
+            full = True
+        else:
+            kved_codes, regions = db.session.execute(text(DIRTY_GROUPS_SQL), {'since': watermark}).fetchone()
+            if kved_codes or regions:
+                _refresh_groups(now, kved_codes, regions)
+            total, kved_total, region_total = db.session.execute(text(CONSISTENCY_SQL)).fetchone()
+            # Зміна КВЕД/області або видалення компаній залишає старі групи завищеними
+            full = not (total == kved_total == region_total)
+            if full:
+                logging.info("Dashboard stats drifted from companies, rebuilding")
+            refreshed = len(kved_codes)
+
+    if full:
+        _refresh_groups(now)
+        refreshed = None
+
+    _refresh_selection(state, _active_selection_id())
+    _refresh_ranking(state)
+    _refresh_recent(state)
+    state.refreshed_at = now
+    db.session.commit()
+    logging.info(f"Dashboard stats refreshed ({'full' if full else f'{refreshed} KVED groups'})")
+    return refreshed
+
+
+def refresh_selection_stats(selection_base_id=None):
+    """Оновити кількість компаній в активному (або заданому) відборі по КВЕД"""
+    db.session.execute(text(LOCK_SQL))
+    state = _get_state()
+    if state is None:
+        db.session.rollback()
+        return refresh_dashboard_stats(full=True)
+    _refresh_selection(state, selection_base_id or _active_selection_id())
+    db.session.commit()
+
+
+def refresh_ranking_stats():
+    """Оновити кількість проранжованих компаній після створення рейтингу"""
+    db.session.execute(text(LOCK_SQL))
+    state = _get_state()
+    if state is None:
+        db.session.rollback()
+        return refresh_dashboard_stats(full=True)
+    _refresh_ranking(state)
+    db.session.commit()
+
+
+def get_dashboard_stats(top_kved=TOP_KVED_LIMIT):
+    """
+    Статистика для дашборду з зведених таблиць: total_companies, total_regions,
+    total_kved, companies_with_ranking, recent_companies, kved_statistics
+    (топ КВЕД за кількістю компаній), selection_base_id, refreshed_at.
+    """
+    state = _get_state()
+    if state is None:
+        refresh_dashboard_stats(full=True)
+    elif state.refreshed_at is None or checkpoint() - state.refreshed_at > STATS_MAX_AGE:
+        refresh_dashboard_stats()
+    else:
+        active_selection = _active_selection_id()
+        if active_selection != state.selection_base_id:
+            refresh_selection_stats(active_selection)
+    state = _get_state()
+
+    total_companies, total_kved = db.session.execute(text(
+        "SELECT COALESCE(SUM(total_count), 0), COUNT(*) FILTER (WHERE kved_code <> '') FROM dashboard_kved_stats"
+    )).fetchone()
+    total_regions = db.session.execute(text(
+        "SELECT COUNT(*) FROM dashboard_region_stats WHERE region_name <> ''"
+    )).scalar()
+    kved_rows = db.session.execute(text("""
+        SELECT kved_code, kved_description, total_count, selection_count, actualized_count
+        FROM dashboard_kved_stats
+        WHERE kved_code <> ''
+        ORDER BY total_count DESC, kved_code
+        LIMIT :limit
+    """), {'limit': top_kved}).fetchall()
+
+    recent_companies = json.loads(state.recent_companies or '[]')
+    for company in recent_companies:
+        if company['created_at']:
+            company['created_at'] = datetime.fromisoformat(company['created_at'])
+
+    return {
+        'total_companies': int(total_companies),
+        'total_regions': total_regions,
+        'total_kved': total_kved,
+        'companies_with_ranking': state.companies_with_ranking or 0,
+        'recent_companies': recent_companies,
+        'kved_statistics': [{
+            'code': row[0],
+            'description': row[1],
+            'total_count': row[2],
+            'after_selection': row[3],
+            'actualized_count': row[4]
+        } for row in kved_rows],
+        'selection_base_id': state.selection_base_id,
+        'refreshed_at': state.refreshed_at
+    }
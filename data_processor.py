@@ -1,42 +1,10 @@
 import pandas as pd
 import logging
-import unicodedata
-import re
+from datetime import datetime
 from sqlalchemy import desc, select
 from models import Company, Region, Kved, CompanySize, Financial
 from app import db
-
-def clean_text_value(value):
-    """Clean text values to avoid UTF-8 encoding issues"""
-    if pd.isna(value) or value is None:
-        return None
-    
-    try:
-        text = str(value).strip()
-        # Normalize unicode characters
-        text = unicodedata.normalize('NFKC', text)
-        # Remove problematic characters that cause encoding issues
-        text = re.sub(r'[^\x00-\x7F\u0400-\u04FF]', '', text)  # Keep ASCII and Cyrillic
-        return text if text else None
-    except Exception:
-        return None
-
-def clean_numeric_value(value):
-    """Clean and convert numeric values from Excel"""
-    if pd.isna(value) or value == '' or value is None:
-        return None
-    
-    if isinstance(value, str):
-        # Remove spaces, commas, and other non-numeric characters except decimal points
-        value = value.replace(' ', '').replace(',', '').replace('₴', '').replace('грн', '')
-        # Handle different decimal separators
-        if ',' in value and '.' not in value:
-            value = value.replace(',', '.')
-    
-    try:
-        return float(value)
-    except (ValueError, TypeError):
-        return None
+from vectorized_cleaning import normalize_text_value as clean_text_value, parse_amount_value as clean_numeric_value
 
 def get_or_create_region(region_name):
     """Get or create a region"""
@@ -477,6 +445,8 @@ def filter_and_rank_companies(min_employees=0, min_revenue=0, min_profit=None,
             company.top_count = secondary_count  # Total companies in this ranking
             company.total_count = secondary_count  # General count by category
             company.actualized = "так"  # Mark as actualized during ranking
+            company.is_actualized = True
+            company.actualized_at = datetime.utcnow()
             
             ranking_updated += 1
         
@@ -3,45 +3,16 @@ import logging
 import psycopg2
 import os
 from decimal import Decimal
+from vectorized_cleaning import clean_text_for_sql, clean_numeric_for_sql
 
 def get_db_connection():
     """Get direct PostgreSQL connection"""
     return psycopg2.connect(os.environ.get("DATABASE_URL"))
 
-def clean_text_for_sql(value):
-    """Clean text value for SQL insertion"""
-    if pd.isna(value) or value is None or str(value).lower() == 'nan':
-        return None
-    
-    text = str(value).strip()
-    
-    # Remove NULL bytes and other problematic characters
-    text = text.replace('\x00', '').replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
-    text = text.replace('\t', ' ').replace('\\', '/').replace("'", "''")  # Escape single quotes
-    
-    # Limit length
-    if len(text) > 500:
-        text = text[:500]
-    
-    return text if text and text.lower() != 'nan' else None
-
-def clean_numeric_for_sql(value):
-    """Clean numeric value for SQL insertion"""
-    if pd.isna(value) or value is None or value == '':
-        return None
-    
-    try:
-        str_value = str(value).strip()
-        str_value = str_value.replace(',', '').replace(' ', '').replace('₴', '').replace('грн', '')
-        
-        numeric_value = float(str_value)
-        
-        if numeric_value < 0 or numeric_value > 1000000000000:
-            return None
-            
-        return numeric_value
-    except (ValueError, TypeError):
-        return None
+def _companies_written():
+    """Нове покоління даних (generations.py): фасети і знімки перебудовуються після запису"""
+    from generations import companies_written
+    companies_written()
 
 def process_first_file(df):
     """Process first file with basic company data (11 columns)"""
@@ -133,6 +104,7 @@ def process_first_file(df):
         conn.close()
     
     logging.info(f"First file processing complete: {success_count} success, {error_count} errors")
+    _companies_written()
     return success_count, error_count
 
 def process_second_file(df):
@@ -277,6 +249,8 @@ def process_second_file(df):
                 # Mark as actualized regardless of whether additional data was found
                 update_fields.append('actualized = %s')
                 update_values.append('так')
+                update_fields.append('is_actualized = true')
+                update_fields.append('actualized_at = CURRENT_TIMESTAMP')
                 
                 update_fields.append('source = %s')
                 update_values.append('файл_2_актуалізація')
@@ -314,6 +288,7 @@ def process_second_file(df):
         cursor.close()
         conn.close()
     
+    _companies_written()
     return success_count, error_count
     
     # If has additional data, process normally
@@ -359,7 +334,8 @@ def process_second_file(df):
                         work_phone = %s, corporate_site = %s, work_email = %s,
                         company_status = %s, director = %s, government_purchases = %s,
                         tender_count = %s, initials = %s,
-                        actualized = 'так', updated_at = CURRENT_TIMESTAMP
+                        actualized = 'так', is_actualized = true, actualized_at = CURRENT_TIMESTAMP,
+                        updated_at = CURRENT_TIMESTAMP
                     WHERE edrpou = %s
                 """, (first_name, middle_name, last_name, work_phone, corporate_site,
                       work_email, company_status, director, government_purchases, 
@@ -1,5 +1,6 @@
 import pandas as pd
 import logging
+from datetime import datetime
 from app import db
 from models_simple import Company
 
@@ -91,6 +92,8 @@ def process_companies_minimal(df):
                 # Update existing
                 company = existing
                 company.actualized = 'так'
+                company.is_actualized = True
+                company.actualized_at = datetime.utcnow()
             else:
                 # Create new
                 company = Company()
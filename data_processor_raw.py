@@ -90,7 +90,8 @@ def process_companies_raw_sql(df):
                             name = %s, phone = %s, address = %s, personnel_2019 = %s,
                             region_name = %s, kved_code = %s, kved_description = %s, 
                             company_size_name = %s, revenue_2019 = %s, profit_2019 = %s,
-                            actualized = 'так', updated_at = CURRENT_TIMESTAMP
+                            actualized = 'так', is_actualized = true, actualized_at = CURRENT_TIMESTAMP,
+                            updated_at = CURRENT_TIMESTAMP
                         WHERE id = %s
                     """, (name, phone, address, personnel, region_name, kved_code, 
                           kved_description, company_size_name, revenue, profit, company_id))
@@ -0,0 +1,384 @@
+"""
+Керований набір індексів для запитів фільтрації, сортування і рейтингу.
+
+Індекси описані в MANAGED_INDEXES і будуються CREATE INDEX CONCURRENTLY
+(без блокування запису в таблицю) при старті додатку у фоновому потоці
+(ensure_indexes_async). Процес ідемпотентний:
+- відсутній індекс будується;
+- індекс, що лишився INVALID після перерваної побудови, або індекс зі
+  зміненим визначенням (хеш визначення зберігається в COMMENT ON INDEX)
+  видаляється DROP INDEX CONCURRENTLY і будується знову;
+- одноколонкові індекси старого optimize_database.py, які покриваються
+  складеними, видаляються (RETIRED_INDEXES).
+Кілька процесів (воркери gunicorn) не будують одночасно: працює той, хто
+отримав advisory lock, решта пропускають крок.
+
+Що покривається:
+- відбір і фільтри (selection_conditions, /companies, /api/companies):
+  (kved_code | region_name, revenue_2019, id) з INCLUDE решти колонок
+  умов - рівність по КВЕД/області і діапазон доходу одним index-only scan;
+- сортування з keyset пагінацією (pagination.py): (колонка, id) для
+  доходу, прибутку, персоналу і назви. Порядок за замовчуванням PostgreSQL
+  (DESC - NULLS FIRST), тому індекс зростаючий і читається в обидва боки;
+- поточний рейтинг companies.ranking - частковий індекс по ranked рядках;
+- лічильники актуалізованих компаній (is_actualized) - частковий індекс;
+- пошук (company_search): префіксні індекси ЄДРПОУ і search_name, GIN
+  триграм, якщо pg_trgm можна встановити (інакше вони пропускаються).
+- змінені компанії для оновлення рейтингів (updated_at), показники року
+  в company_financials (year, metric, value) і позиції ranking_companies
+  за рейтингом, компанією та значенням критерію; унікальний склад знімку
+  бази відбору (selection_companies) - після видалення дублікатів.
+
+check_index_usage() виконує EXPLAIN головних запитів з параметрами з
+реальних даних і перевіряє, що companies читається індексом, а не
+послідовним скануванням:
+
+    python db_indexes.py            # побудувати/оновити індекси
+    python db_indexes.py --check    # EXPLAIN перевірка
+"""
+
+import hashlib
+import json
+import logging
+import threading
+from collections import namedtuple
+
+from sqlalchemy import text
+
+from app import db
+
+# extension - розширення PostgreSQL, без якого індекс не будується (пропускається);
+# column - колонка, що додається разовою міграцією (schema_migrations.MANUAL_MIGRATIONS):
+# поки її немає, індекс теж пропускається; unique - UNIQUE індекс, dedupe - SQL, що
+# видаляє дублікати ключа перед побудовою (інакше побудова падала б на кожному старті)
+ManagedIndex = namedtuple('ManagedIndex', 'name table definition extension column unique dedupe',
+                          defaults=(None, None, False, None))
+
+# Колонки умов відбору, що не входять у ключ індексу
+_SELECTION_INCLUDE = "personnel_2019, profit_2019, company_size_name"
+
+MANAGED_INDEXES = [
+    # Відбір/фільтр за КВЕД з межею доходу і сортуванням за доходом у межах КВЕД
+    # (edrpou - tiebreak вікна рейтингу, щоб рейтинг вибірки теж читався тільки з індексу)
+    ManagedIndex('idx_companies_kved_revenue', 'companies',
+                 f"(kved_code, revenue_2019, id) INCLUDE (region_name, {_SELECTION_INCLUDE}, edrpou)"),
+    ManagedIndex('idx_companies_region_revenue', 'companies',
+                 f"(region_name, revenue_2019, id) INCLUDE (kved_code, {_SELECTION_INCLUDE}, edrpou)"),
+    # Сортування всієї таблиці і межа доходу без фільтра за КВЕД/областю
+    ManagedIndex('idx_companies_revenue', 'companies',
+                 f"(revenue_2019, id) INCLUDE (kved_code, region_name, {_SELECTION_INCLUDE})"),
+    ManagedIndex('idx_companies_profit', 'companies', "(profit_2019, id)"),
+    ManagedIndex('idx_companies_personnel', 'companies', "(personnel_2019, id)"),
+    ManagedIndex('idx_companies_name_id', 'companies', "(name, id)"),
+    # Компанії поточного рейтингу (експорт, синхронізація companies.ranking)
+    ManagedIndex('idx_companies_ranked', 'companies', "(ranking, id) WHERE ranking IS NOT NULL"),
+    # Лічильники «Актуалізовано» по КВЕД (dashboard_stats) - тільки актуалізовані рядки
+    ManagedIndex('idx_companies_actualized', 'companies', "(kved_code) WHERE is_actualized"),
+    # Пошук і автодоповнення (company_search): префікс ЄДРПОУ/назви в порядку "C" незалежно від
+    # collation бази, входження - триграмами pg_trgm
+    ManagedIndex('idx_companies_edrpou_prefix', 'companies', '(edrpou COLLATE "C")'),
+    ManagedIndex('idx_companies_search_name', 'companies', '(search_name COLLATE "C", id)', column='search_name'),
+    ManagedIndex('idx_companies_edrpou_trgm', 'companies', "USING gin (edrpou gin_trgm_ops)", 'pg_trgm'),
+    ManagedIndex('idx_companies_search_name_trgm', 'companies', "USING gin (search_name gin_trgm_ops)", 'pg_trgm',
+                 'search_name'),
+    # Компанії, змінені після останнього оновлення рейтингу (ranking_refresh)
+    ManagedIndex('idx_companies_updated_at', 'companies', "(updated_at)"),
+    # Показники року (financials.py): вибірка року і показника без звернення до таблиці
+    ManagedIndex('idx_company_financials_year_metric', 'company_financials',
+                 "(year, metric, value) INCLUDE (company_id, edrpou)"),
+    # Склад знімку бази відбору (selection_snapshot): одна компанія - один раз
+    ManagedIndex('idx_selection_companies_base', 'selection_companies', "(selection_base_id, company_id)",
+                 unique=True, dedupe="""
+                     DELETE FROM selection_companies a USING selection_companies b
+                     WHERE a.selection_base_id = b.selection_base_id AND a.company_id = b.company_id
+                       AND a.id > b.id"""),
+    # Позиції рейтингу читаються (сторінки, превʼю, експорт) і пишуться по ranking_id
+    ManagedIndex('idx_ranking_companies_ranking', 'ranking_companies', "(ranking_id, position)"),
+    # Інкрементальне оновлення рейтингів (ranking_refresh): позиції компанії і межі значень критерію
+    ManagedIndex('idx_ranking_companies_company', 'ranking_companies', "(ranking_id, company_id)"),
+    ManagedIndex('idx_ranking_companies_sort', 'ranking_companies',
+                 "(ranking_id, group_label, sort_value, position)"),
+]
+
+# Індекси optimize_database.py, покриті складеними (або унікальним ix_companies_edrpou)
+RETIRED_INDEXES = ['idx_companies_edrpou', 'idx_companies_name', 'idx_companies_kved', 'idx_companies_region']
+
+LOCK_KEY = 'managed_indexes'
+COMMENT_PREFIX = 'managed:'
+
+EXISTING_SQL = """
+    SELECT c.relname, i.indisvalid, obj_description(c.oid, 'pg_class')
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE c.relname = ANY(:names)
+"""
+
+
+def definition_hash(index):
+    unique = ' UNIQUE' if index.unique else ''
+    return hashlib.md5(f"{index.table} {index.definition}{unique}".encode('utf-8')).hexdigest()[:12]
+
+
+def _create_sql(index):
+    unique = 'UNIQUE ' if index.unique else ''
+    return f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {index.table} {index.definition}"
+
+
+def _missing_extensions(connection, build):
+    """Розширення індексів, яких немає в базі (build - спершу спробувати встановити)"""
+    missing = set()
+    for extension in sorted({index.extension for index in MANAGED_INDEXES if index.extension}):
+        if build:
+            try:
+                connection.execute(text(f"CREATE EXTENSION IF NOT EXISTS {extension}"))
+                continue
+            except Exception as e:
+                logging.warning(f"Extension {extension} is not available, its indexes are skipped: {e}")
+        elif connection.execute(text("SELECT 1 FROM pg_extension WHERE extname = :name"),
+                                {'name': extension}).scalar():
+            continue
+        missing.add(extension)
+    return missing
+
+
+COLUMNS_SQL = """
+    SELECT c.relname, a.attname FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    WHERE c.relname = ANY(:tables) AND a.attname = ANY(:columns) AND NOT a.attisdropped
+"""
+
+
+def _missing_columns(connection):
+    """(таблиця, колонка) індексів з column, яких ще немає в базі"""
+    required = {(index.table, index.column) for index in MANAGED_INDEXES if index.column}
+    if not required:
+        return set()
+    existing = set(connection.execute(text(COLUMNS_SQL), {
+        'tables': sorted({table for table, _ in required}),
+        'columns': sorted({column for _, column in required}),
+    }).fetchall())
+    return required - {tuple(row) for row in existing}
+
+
+def ensure_indexes(build=True):
+    """
+    Привести індекси до MANAGED_INDEXES. build=False - тільки показати план.
+    Повертає {'created': [...], 'rebuilt': [...], 'dropped': [...],
+    'unavailable': [...], 'skipped': bool}; unavailable - індекси, чиє
+    розширення не встановлено і не може бути встановлене або чия колонка
+    ще не додана міграцією.
+    """
+    result = {'created': [], 'rebuilt': [], 'dropped': [], 'unavailable': [], 'skipped': False}
+    # CONCURRENTLY не працює в транзакції - окреме зʼєднання в autocommit
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if not connection.execute(text("SELECT pg_try_advisory_lock(hashtext(:key))"), {'key': LOCK_KEY}).scalar():
+            logging.info("Managed indexes: another process holds the lock, skipping")
+            result['skipped'] = True
+            return result
+        try:
+            names = [index.name for index in MANAGED_INDEXES] + RETIRED_INDEXES
+            existing = {row[0]: (row[1], row[2]) for row in connection.execute(text(EXISTING_SQL), {'names': names})}
+
+            for name in RETIRED_INDEXES:
+                if name in existing:
+                    result['dropped'].append(name)
+                    if build:
+                        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+            missing = _missing_extensions(connection, build)
+            missing_columns = _missing_columns(connection)
+            for index in MANAGED_INDEXES:
+                if index.extension in missing or (index.table, index.column) in missing_columns:
+                    result['unavailable'].append(index.name)
+                    continue
+                comment = COMMENT_PREFIX + definition_hash(index)
+                if index.name in existing:
+                    valid, current = existing[index.name]
+                    if valid and current == comment:
+                        continue
+                    result['rebuilt'].append(index.name)
+                    if build:
+                        connection.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+                else:
+                    result['created'].append(index.name)
+                if build:
+                    if index.dedupe:
+                        removed = connection.execute(text(index.dedupe)).rowcount
+                        if removed:
+                            logging.warning(f"Removed {removed} duplicate rows from {index.table} "
+                                            f"before building {index.name}")
+                    logging.info(f"Building index {index.name}")
+                    connection.execute(text(_create_sql(index)))
+                    connection.execute(text(f"COMMENT ON INDEX {index.name} IS '{comment}'"))
+
+            changed = set(result['created'] + result['rebuilt'])
+            if build and changed:
+                for table in sorted({index.table for index in MANAGED_INDEXES if index.name in changed}):
+                    connection.execute(text(f"ANALYZE {table}"))
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(hashtext(:key))"), {'key': LOCK_KEY})
+    logging.info(f"Managed indexes: {result}")
+    return result
+
+
+def ensure_indexes_async(app):
+    """Побудувати індекси у фоновому потоці при старті, не затримуючи запуск додатку"""
+
+    def run():
+        with app.app_context():
+            try:
+                ensure_indexes()
+            except Exception as e:
+                logging.error(f"Managed index build failed: {e}")
+
+    thread = threading.Thread(target=run, name='managed-indexes', daemon=True)
+    thread.start()
+    return thread
+
+
+# ===== EXPLAIN перевірка =====
+
+SEQ_SCAN = 'Seq Scan'
+INDEX_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+def explain(sql, params=None):
+    """План запиту (EXPLAIN FORMAT JSON) як дерево словників"""
+    raw = db.session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"), params or {}).scalar()
+    if isinstance(raw, str):
+        raw = json.loads(raw)
+    return raw[0]['Plan']
+
+
+def _companies_scans(plan):
+    """Типи вузлів, що читають companies, і використані індекси"""
+    scans, indexes = [], []
+    for node in _plan_nodes(plan):
+        if node.get('Relation Name') == 'companies' or node.get('Index Name', '').startswith('idx_companies'):
+            scans.append(node['Node Type'])
+            if node.get('Index Name'):
+                indexes.append(node['Index Name'])
+    return scans, indexes
+
+
+def _sample_parameters():
+    """Параметри запитів з даних: КВЕД і область середнього розміру, верхній дециль доходу"""
+    kved = db.session.execute(text("""
+        SELECT kved_code FROM companies WHERE kved_code IS NOT NULL
+        GROUP BY kved_code ORDER BY COUNT(*) DESC OFFSET (
+            SELECT COUNT(DISTINCT kved_code) / 2 FROM companies) LIMIT 1
+    """)).scalar()
+    region = db.session.execute(text("""
+        SELECT region_name FROM companies WHERE region_name IS NOT NULL
+        GROUP BY region_name ORDER BY COUNT(*) DESC OFFSET (
+            SELECT COUNT(DISTINCT region_name) / 2 FROM companies) LIMIT 1
+    """)).scalar()
+    revenue = db.session.execute(text(
+        "SELECT percentile_disc(0.99) WITHIN GROUP (ORDER BY revenue_2019) FROM companies"
+    )).scalar()
+    ranking_id = db.session.execute(text("SELECT MAX(id) FROM rankings")).scalar()
+    from company_search import search_name_available
+    name_column = 'search_name' if search_name_available() else 'name'
+    edrpou, name = db.session.execute(text(
+        f"SELECT edrpou, {name_column} FROM companies WHERE {name_column} <> '' ORDER BY id LIMIT 1"
+    )).fetchone() or ('0', 'a')
+    return {'kved': kved, 'region': region, 'revenue': revenue or 0, 'ranking_id': ranking_id or 0,
+            'edrpou': edrpou[:3], 'name': name.split(' ')[0][:4]}
+
+
+# Вибірка рейтингу без запису (частина RANK_SELECTION_SQL після INSERT)
+RANK_WINDOW_SQL = """
+    SELECT id, {rank_function} OVER ({partition}ORDER BY {window_order}), {sort_value}
+    FROM {source}
+    WHERE {where}
+"""
+
+
+def workload_queries():
+    """(назва, sql, params) головних запитів відбору, рейтингу і /companies"""
+    from company_search import search_queries
+    from company_snapshot import SelectionFilters
+    from ranking_engine import PREVIEW_SQL, selection_conditions, window_parts
+
+    sample = _sample_parameters()
+    # Умови відбору тим самим кодом, що й filter_companies_route / create_ranking
+    kved_where, kved_params = selection_conditions(SelectionFilters(min_employees=1), kved_codes=[sample['kved']])
+    revenue_where, revenue_params = selection_conditions(
+        SelectionFilters(min_employees=1, min_revenue=sample['revenue']))
+    return [
+        # /companies і /api/companies: keyset сторінки (pagination.py) без фільтра і з фільтром
+        ('companies_page_revenue',
+         "SELECT * FROM companies ORDER BY revenue_2019 DESC, id DESC LIMIT 51", {}),
+        ('companies_page_revenue_after',
+         "SELECT * FROM companies WHERE (revenue_2019, id) < (:revenue, 0) "
+         "ORDER BY revenue_2019 DESC, id DESC LIMIT 51", {'revenue': sample['revenue']}),
+        ('companies_page_kved',
+         "SELECT * FROM companies WHERE kved_code = :kved ORDER BY revenue_2019 DESC, id DESC LIMIT 51",
+         {'kved': sample['kved']}),
+        ('companies_page_region',
+         "SELECT * FROM companies WHERE region_name = :region ORDER BY revenue_2019 ASC, id ASC LIMIT 51",
+         {'region': sample['region']}),
+        ('companies_page_name', "SELECT * FROM companies ORDER BY name ASC, id ASC LIMIT 51", {}),
+        # Відбір (selection_snapshot.MATERIALIZE_SQL): КВЕД з межею персоналу, межа доходу
+        ('selection_kved', f"SELECT id FROM companies WHERE {kved_where}", kved_params),
+        ('selection_revenue', f"SELECT id FROM companies WHERE {revenue_where}", revenue_params),
+        # Рейтинг вибірки КВЕД віконною функцією і превʼю збереженого рейтингу
+        ('ranking_window_kved', RANK_WINDOW_SQL.format(**window_parts(kved_where, 'revenue')), kved_params),
+        ('ranking_preview', PREVIEW_SQL.format(columns='c.edrpou, c.name, c.revenue_2019'),
+         {'ranking_id': sample['ranking_id'], 'limit': 100}),
+        # Експорт поточного рейтингу (export_stream.CURRENT_RANKING_ROWS_SQL), перша пачка
+        ('current_ranking',
+         "SELECT id, ranking FROM companies WHERE ranking IS NOT NULL ORDER BY ranking, id LIMIT 2000", {}),
+        # Актуалізовані по КВЕД для дашборду (dashboard_stats.KVED_GROUPS_SQL)
+        ('dashboard_actualized',
+         "SELECT COALESCE(kved_code, ''), COUNT(*) FROM companies WHERE is_actualized AND true "
+         "GROUP BY COALESCE(kved_code, '')", {}),
+        # Автодоповнення /api/companies/suggest: ЄДРПОУ і назва
+        *search_queries(sample['edrpou']),
+        *search_queries(sample['name']),
+    ]
+
+
+def check_index_usage(analyze=True):
+    """
+    EXPLAIN головних запитів: companies має читатися індексом. analyze -
+    спершу VACUUM ANALYZE companies. Повертає
+    {'rows', 'queries': {назва: {'scans', 'indexes'}}}; якщо якийсь запит
+    сканує companies послідовно - AssertionError зі списком.
+    """
+    if analyze:
+        # Статистика і карта видимості (index-only scan), як після autovacuum
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text("VACUUM ANALYZE companies"))
+    rows = db.session.execute(text("SELECT COUNT(*) FROM companies")).scalar()
+    report, failures = {}, []
+    for name, sql, params in workload_queries():
+        scans, indexes = _companies_scans(explain(sql, params))
+        report[name] = {'scans': scans, 'indexes': indexes}
+        if SEQ_SCAN in scans or not any(scan in INDEX_SCANS for scan in scans):
+            failures.append(name)
+    db.session.rollback()
+    assert not failures, f"Sequential scans of companies ({rows} rows): {failures}: {report}"
+    return {'rows': rows, 'queries': report}
+
+
+if __name__ == '__main__':
+    import sys
+
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        if '--check' in sys.argv:
+            result = check_index_usage()
+            print(f"{result['rows']} companies")
+            for name, usage in result['queries'].items():
+                print(f"  {name}: {', '.join(usage['indexes']) or usage['scans']}")
+        else:
+            print(ensure_indexes(build='--dry-run' not in sys.argv))
@@ -0,0 +1,217 @@
+"""
+Потоковий експорт рейтингів у CSV/XLSX.
+
+Рядки читаються курсором на сервері (stream_results + yield_per, для
+psycopg2 - іменований курсор) пачками по EXPORT_BATCH_SIZE і одразу
+віддаються клієнту через потокову відповідь Flask. У памʼяті процесу
+одночасно лише одна пачка, тож споживання памʼяті не залежить від розміру
+рейтингу.
+
+CSV пишеться частинами по пачках (опційно з UTF-8 BOM для Excel). XLSX
+будується openpyxl у режимі write-only: рядки скидаються у тимчасовий файл
+на диску, після завершення книги файл віддається частинами і видаляється.
+
+Макет - 33 колонки, як у /api/export_ranking: перша "Місце в рейтингу",
+остання "Источник".
+"""
+
+import csv
+import io
+import logging
+import os
+import tempfile
+from datetime import datetime
+
+from flask import Response
+from sqlalchemy import text
+
+from app import db
+
+EXPORT_BATCH_SIZE = 2000
+FILE_CHUNK_SIZE = 64 * 1024
+UTF8_BOM = '\ufeff'
+
+CSV_MIMETYPE = 'text/csv; charset=utf-8'
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+FORMATS = ('csv', 'xlsx')
+
+# (заголовок, колонка companies або None - поля немає в моделі)
+COMPANY_COLUMNS = [
+    ('ЄДРПОУ', 'edrpou'),
+    ('Назва компанії', 'name'),
+    ('КВЕД код', 'kved_code'),
+    ('КВЕД опис', 'kved_description'),
+    ('Регіон', 'region_name'),
+    ('Дохід 2019 (тис. грн)', 'revenue_2019'),
+    ('Прибуток 2019 (тис. грн)', 'profit_2019'),
+    ('Персонал 2019', 'personnel_2019'),
+    ('Статус актуалізації', 'actualized'),
+    ('Розмір компанії', 'company_size_name'),
+    ('Адреса', 'address'),
+    ('Телефон', 'phone'),
+    ('Email', 'work_email'),
+    ('Веб-сайт', 'corporate_site'),
+    ('Рік заснування', None),
+    ('Форма власності', None),
+    ('ПДВ номер', None),
+    ('Банк', None),
+    ('МФО', None),
+    ('Рахунок', None),
+    ('Директор', 'director'),
+    ('Бухгалтер', None),
+    ('Основний вид діяльності', None),
+    ('Додаткові види діяльності', None),
+    ('Ліцензії', None),
+    ('Сертифікати', None),
+    ('Експорт', None),
+    ('Імпорт', None),
+    ('Примітки', None),
+    ('Дата створення запису', 'created_at'),
+    ('Дата оновлення запису', 'updated_at'),
+]
+POSITION_HEADER = 'Місце в рейтингу'
+SOURCE_HEADER = 'Источник'
+HEADERS = [POSITION_HEADER] + [header for header, _ in COMPANY_COLUMNS] + [SOURCE_HEADER]
+
+# Порожні значення - як у попередньому експорті
+ZERO_DEFAULTS = {'revenue_2019', 'profit_2019', 'personnel_2019'}
+DATE_COLUMNS = {'created_at', 'updated_at'}
+DEFAULT_ACTUALIZED = 'ні'
+
+_SELECTED = [column for _, column in COMPANY_COLUMNS if column]
+# Останнім - власне джерело компанії (companies.source) для колонки "Источник"
+_SELECT_LIST = ', '.join(f'c.{column}' for column in _SELECTED + ['source'])
+
+RANKING_ROWS_SQL = f"""
+    SELECT rc.position, {_SELECT_LIST}
+    FROM ranking_companies rc
+    JOIN companies c ON c.id = rc.company_id
+    WHERE rc.ranking_id = :ranking_id
+    ORDER BY rc.position, rc.id
+"""
+
+# Поточний рейтинг (companies.ranking), як у /api/export_ranking
+CURRENT_RANKING_ROWS_SQL = f"""
+    SELECT c.ranking, {_SELECT_LIST}
+    FROM companies c
+    WHERE c.ranking IS NOT NULL
+    ORDER BY c.ranking, c.id
+"""
+
+
+def default_source():
+    return f"Україна {datetime.now().year}"
+
+
+def _format_row(row, source):
+    values = dict(zip(_SELECTED, row[1:-1]))
+    output = [row[0]]
+    for _, column in COMPANY_COLUMNS:
+        if column is None:
+            output.append('')
+            continue
+        value = values[column]
+        if column in DATE_COLUMNS:
+            value = value.strftime('%d.%m.%Y') if value else ''
+        elif column in ZERO_DEFAULTS:
+            value = value or 0
+        elif column == 'actualized':
+            value = value or DEFAULT_ACTUALIZED
+        else:
+            value = value or ''
+        output.append(value)
+    output.append(row[-1] or source)
+    return output
+
+
+def ranking_batches(ranking_id=None, source=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Генератор пачок відформатованих рядків рейтингу ranking_id (None -
+    поточний рейтинг companies.ranking). Engine береться при виклику, тому
+    генератор можна віддавати у відповідь після завершення запиту.
+    """
+    engine = db.engine
+    source = source or default_source()
+    if ranking_id is None:
+        sql, params = CURRENT_RANKING_ROWS_SQL, {}
+    else:
+        sql, params = RANKING_ROWS_SQL, {'ranking_id': ranking_id}
+
+    def batches():
+        with engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(
+                text(sql), params
+            )
+            for partition in result.partitions(batch_size):
+                yield [_format_row(row, source) for row in partition]
+
+    return batches()
+
+
+def csv_chunks(batches, bom=False):
+    """Байтові частини CSV: заголовок, потім одна частина на пачку рядків"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if bom:
+        buffer.write(UTF8_BOM)
+    writer.writerow(HEADERS)
+    rows = 0
+    for batch in batches:
+        writer.writerows(batch)
+        rows += len(batch)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+    logging.info(f"CSV export streamed {rows} rows")
+
+
+def write_xlsx(batches, path):
+    """Записати пачки у файл XLSX у режимі write-only (памʼять не залежить від кількості рядків)"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Рейтинг')
+    sheet.append(HEADERS)
+    rows = 0
+    for batch in batches:
+        for row in batch:
+            sheet.append(row)
+        rows += len(batch)
+    workbook.save(path)
+    return rows
+
+
+def xlsx_chunks(batches):
+    """Байтові частини XLSX: книга пишеться у тимчасовий файл, потім віддається і видаляється"""
+    handle, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(handle)
+    try:
+        rows = write_xlsx(batches, path)
+        logging.info(f"XLSX export wrote {rows} rows")
+        with open(path, 'rb') as workbook_file:
+            while True:
+                chunk = workbook_file.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+
+def ranking_export_response(ranking_id=None, export_format='csv', bom=False, source=None, filename=None):
+    """Потокова відповідь Flask з експортом рейтингу у форматі csv або xlsx"""
+    if export_format not in FORMATS:
+        raise ValueError(f"Невідомий формат експорту: {export_format}")
+    batches = ranking_batches(ranking_id, source)
+    filename = filename or f"ranking_{ranking_id if ranking_id is not None else 'current'}.{export_format}"
+    if export_format == 'xlsx':
+        body, mimetype = xlsx_chunks(batches), XLSX_MIMETYPE
+    else:
+        body, mimetype = csv_chunks(batches, bom), CSV_MIMETYPE
+    return Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename={filename}',
+        # Проксі не повинен буферизувати відповідь цілком
+        'X-Accel-Buffering': 'no',
+    })
@@ -0,0 +1,135 @@
+"""
+Фасети фільтрів: області, КВЕД і розміри компаній з кількістю компаній.
+
+Значення рахуються одним GROUP BY на фасет і зберігаються в кеші процесу
+(TTL + LRU) з ключем (фасет, версія даних). Версія - покоління даних
+(generations.py), яке збільшують імпорт і актуалізація, і остання мітка
+companies.updated_at (індекс idx_companies_updated_at) для записів, що не
+збільшують покоління. Тож кеш інвалідується без сканування companies при
+кожному відкритті сторінки. Відповіді API мають ETag з версією: браузер
+повторно запитує список з If-None-Match і отримує 304, поки дані не змінились.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, request
+from sqlalchemy import text
+
+from app import db
+from generations import current_generation
+
+FACET_TTL = 300
+FACET_CACHE_SIZE = 32
+
+FACET_QUERIES = {
+    'regions': """
+        SELECT region_name, COUNT(*)
+        FROM companies
+        WHERE region_name IS NOT NULL
+        GROUP BY region_name
+        ORDER BY region_name
+    """,
+    'kved': """
+        SELECT kved_code, MIN(kved_description), COUNT(*)
+        FROM companies
+        WHERE kved_code IS NOT NULL
+        GROUP BY kved_code
+        ORDER BY kved_code
+    """,
+    'sizes': """
+        SELECT company_size_name, COUNT(*)
+        FROM companies
+        WHERE company_size_name IS NOT NULL
+        GROUP BY company_size_name
+        ORDER BY company_size_name
+    """,
+    # Роки фінансових показників (financials.py)
+    'financial_years': """
+        SELECT year, COUNT(DISTINCT company_id)
+        FROM company_financials
+        GROUP BY year
+        ORDER BY year DESC
+    """,
+}
+
+
+class TTLCache:
+    """Потокобезпечний LRU кеш з часом життя записів"""
+
+    def __init__(self, maxsize=FACET_CACHE_SIZE, ttl=FACET_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_cache = TTLCache()
+
+WATERMARK_SQL = "SELECT MAX(updated_at) FROM companies"
+
+
+def data_version():
+    """Версія даних для кешу і ETag: покоління і остання зміна companies"""
+    watermark = db.session.execute(text(WATERMARK_SQL)).scalar()
+    return f"g{current_generation()}-{watermark.strftime('%Y%m%d%H%M%S%f') if watermark else 0}"
+
+
+def get_facet(name, version=None):
+    """Рядки фасету (tuple з значенням, [описом,] кількістю) для версії даних version"""
+    if version is None:
+        version = data_version()
+    key = (name, version)
+    rows = _cache.get(key)
+    if rows is None:
+        rows = [tuple(row) for row in db.session.execute(text(FACET_QUERIES[name])).fetchall()]
+        _cache.set(key, rows)
+    return rows
+
+
+def facet_values(name, version=None):
+    """Тільки значення фасету (для списків у шаблонах)"""
+    return [row[0] for row in get_facet(name, version)]
+
+
+def facet_response(name, build):
+    """
+    JSON відповідь з фасету з ETag за версією даних (data_version).
+
+    build(rows) → словник відповіді. Якщо If-None-Match збігається з ETag,
+    повертається 304 без звернення до кешу.
+    """
+    version = data_version()
+    etag = f'{name}-{version}'
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build(get_facet(name, version)))
+    response.set_etag(etag)
+    # Браузер зберігає відповідь, але перевіряє її актуальність при кожному запиті
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
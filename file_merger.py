@@ -6,6 +6,7 @@ import pandas as pd
 import logging
 from datetime import datetime
 from typing import Tuple, Dict, List
+from ingestion_pipeline import read_frame
 
 class ExcelFileMerger:
     """Клас для злиття двох Excel файлів за кодом ЄДРПОУ"""
@@ -25,8 +26,7 @@ class ExcelFileMerger:
     def load_main_file(self, file_path: str) -> bool:
         """Завантажує основний файл (11 колонок)"""
         try:
-            df = pd.read_excel(file_path)
-            df = self._normalize_columns(df)
+            df = read_frame(file_path, transform=self._normalize_columns)
             
             # Перевірка наявності ЄДРПОУ
             if 'edrpou' not in df.columns:
@@ -48,8 +48,7 @@ class ExcelFileMerger:
     def load_additional_file(self, file_path: str) -> bool:
         """Завантажує додатковий файл (17 додаткових колонок)"""
         try:
-            df = pd.read_excel(file_path)
-            df = self._normalize_columns(df)
+            df = read_frame(file_path, transform=self._normalize_columns)
             
             # Перевірка наявності ЄДРПОУ
             if 'edrpou' not in df.columns:
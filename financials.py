@@ -0,0 +1,221 @@
+"""
+Фінансові показники компаній по роках.
+
+company_financials - фактова таблиця (company_id, year, metric) → value з
+ЄДРПОУ компанії: кожен рік звітності додає рядки, а не колонки до
+33-колонкової companies. Індекс (year, metric, value) INCLUDE
+(company_id, edrpou) дає вибірку показника за рік одним index-only scan.
+Імпорт (import_engine) дописує факти з колонок CSV виду revenue_2023,
+profit_2023, personnel_2023; колонки *_2019 переносяться разовою міграцією
+(python schema_migrations.py financials_2019).
+
+Рейтинг за роком читає показник з фактів через похідну таблицю з тим самим
+імʼям companies (year_source), тож умови відбору і вікно рейтингу не
+змінюються. Для LEGACY_YEAR лишаються колонки companies.*_2019 - їх
+оновлюють і актуалізація, і старі імпорти. Рейтинг за зростанням
+(base_year → year) впорядковує за приростом показника у відсотках.
+
+Зростання рік до року для аналітики рахується векторно NumPy по матриці
+компанія × рік (growth_matrix, yoy_growth).
+
+    python financials.py [company_id]
+"""
+
+import logging
+import re
+
+import numpy as np
+from sqlalchemy import text
+
+from app import db
+
+# Показник → код у company_financials.metric; ключі збігаються з критеріями рейтингу
+METRICS = {
+    'revenue': 1,
+    'profit': 2,
+    'personnel': 3,
+}
+
+# Рік, показники якого зберігаються також у колонках companies.*_2019
+LEGACY_YEAR = 2019
+MIN_YEAR = 1990
+MAX_YEAR = 2100
+
+# Колонки CSV з показником за рік: revenue_2023, profit_2023, personnel_2023
+FINANCIAL_FIELD = re.compile(r'^(revenue|profit|personnel)_(\d{4})$')
+
+YEARS_SQL = """
+    SELECT year, COUNT(DISTINCT company_id) FROM company_financials
+    GROUP BY year
+    ORDER BY year
+"""
+
+# Похідна таблиця замість companies: показник року (і року порівняння) поруч з колонками компанії.
+# Та сама назва companies - умови відбору і вирази вікна лишаються без змін
+YEAR_SOURCE = """(
+        SELECT companies.*, cur.value AS year_value{base_column}
+        FROM companies
+        LEFT JOIN company_financials cur
+               ON cur.company_id = companies.id AND cur.year = {year} AND cur.metric = {metric}{base_join}
+    ) companies"""
+BASE_COLUMN = ", base.value AS base_value"
+BASE_JOIN = """
+        LEFT JOIN company_financials base
+               ON base.company_id = companies.id AND base.year = {year} AND base.metric = {metric}"""
+
+# Зростання у відсотках; без базового значення чи при нулі - NULL (у рейтингу - 0).
+# Обмежене діапазоном NUMERIC(15,2) ranking_companies.sort_value
+MAX_GROWTH = 9999999999999
+GROWTH_EXPRESSION = (
+    "LEAST(GREATEST(ROUND(({prefix}year_value - {prefix}base_value) * 100.0"
+    " / NULLIF(ABS({prefix}base_value), 0), 2), -%(limit)s), %(limit)s)" % {'limit': MAX_GROWTH}
+)
+
+GROWTH_ROWS_SQL = """
+    SELECT company_id, year, value FROM company_financials
+    WHERE metric = :metric AND year = ANY(:years)
+    {company_filter}
+    ORDER BY company_id
+"""
+
+COMPANY_FINANCIALS_SQL = """
+    SELECT year, metric, value FROM company_financials
+    WHERE company_id = :company_id
+    ORDER BY year, metric
+"""
+
+
+def validate_year(year):
+    """Рік як int або None; ValueError для нечислового чи неможливого року"""
+    if year in (None, ''):
+        return None
+    try:
+        year = int(year)
+    except (TypeError, ValueError):
+        raise ValueError(f"Некоректний рік: {year}")
+    if not MIN_YEAR <= year <= MAX_YEAR:
+        raise ValueError(f"Некоректний рік: {year}")
+    return year
+
+
+def financial_fields(fieldnames):
+    """Колонки CSV з показниками за рік: [(колонка, рік, код показника)]"""
+    fields = []
+    for name in fieldnames or []:
+        match = FINANCIAL_FIELD.match((name or '').strip())
+        if match:
+            fields.append((name, int(match.group(2)), METRICS[match.group(1)]))
+    return fields
+
+
+def available_years():
+    """Роки з фактами: [(рік, кількість компаній)]"""
+    return [(row[0], row[1]) for row in db.session.execute(text(YEARS_SQL))]
+
+
+def uses_facts(year=None, base_year=None):
+    """Чи читає рейтинг показник з company_financials (інакше - колонки *_2019)"""
+    return base_year is not None or (year is not None and year != LEGACY_YEAR)
+
+
+def year_source(criteria, year, base_year=None):
+    """SQL похідної таблиці companies з year_value (і base_value) показника criteria"""
+    metric = METRICS.get(criteria, METRICS['revenue'])
+    base_column, base_join = '', ''
+    if base_year is not None:
+        base_column = BASE_COLUMN
+        base_join = BASE_JOIN.format(year=int(base_year), metric=metric)
+    return YEAR_SOURCE.format(year=int(year if year is not None else LEGACY_YEAR), metric=metric,
+                              base_column=base_column, base_join=base_join)
+
+
+def year_value_expression(base_year=None, prefix=''):
+    """Значення критерію з year_source: показник року або зростання від base_year, %"""
+    if base_year is not None:
+        return GROWTH_EXPRESSION.format(prefix=prefix)
+    return f"{prefix}year_value"
+
+
+def criteria_label(name, year=None, base_year=None):
+    """Назва критерію з роком: 'Чистий дохід 2023', 'Чистий дохід: зростання 2019→2023, %'"""
+    if base_year is not None:
+        return f"{name}: зростання {base_year}→{year or LEGACY_YEAR}, %"
+    if year is not None and year != LEGACY_YEAR:
+        return f"{name} {year}"
+    return name
+
+
+def yoy_growth(values):
+    """
+    Зростання рік до року по матриці компанія × рік (float, NaN - немає даних):
+    (v[t] - v[t-1]) / |v[t-1]|. Без попереднього значення чи при нулі - NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    previous, current = values[:, :-1], values[:, 1:]
+    base = np.abs(previous)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = (current - previous) / base
+    growth[~(base > 0)] = np.nan
+    return growth
+
+
+def growth_matrix(criteria, years, company_ids=None):
+    """
+    Матриця показника criteria компанія × рік з фактів і зростання рік до року.
+    Повертає (company_ids, years, values, growth): values - [n, len(years)],
+    growth - [n, len(years) - 1] (частки, NaN - немає бази).
+    """
+    years = sorted({int(year) for year in years})
+    params = {'metric': METRICS.get(criteria, METRICS['revenue']), 'years': years}
+    company_filter = ''
+    if company_ids is not None:
+        company_filter = 'AND company_id = ANY(:company_ids)'
+        params['company_ids'] = list(company_ids)
+    rows = db.session.execute(text(GROWTH_ROWS_SQL.format(company_filter=company_filter)), params).fetchall()
+
+    if not rows:
+        empty = np.empty((0, len(years)))
+        return np.empty(0, dtype=np.int64), years, empty, yoy_growth(empty)
+    data = np.array([(row[0], row[1], float(row[2])) for row in rows], dtype=np.float64)
+    ids, row_index = np.unique(data[:, 0].astype(np.int64), return_inverse=True)
+    column_index = np.searchsorted(years, data[:, 1].astype(np.int64))
+    values = np.full((len(ids), len(years)), np.nan)
+    values[row_index, column_index] = data[:, 2]
+    return ids, years, values, yoy_growth(values)
+
+
+def company_financials(company_id):
+    """
+    Показники компанії по роках з зростанням до попереднього року:
+    {'years': [..], 'metrics': {'revenue': {'values': [..], 'growth': [None, ..]}, ..}}
+    """
+    rows = db.session.execute(text(COMPANY_FINANCIALS_SQL), {'company_id': company_id}).fetchall()
+    years = sorted({row[0] for row in rows})
+    values = np.full((len(METRICS), len(years)), np.nan)
+    for year, metric, value in rows:
+        values[metric - 1, years.index(year)] = float(value)
+    growth = yoy_growth(values)
+
+    def listed(array):
+        return [None if np.isnan(value) else round(float(value), 4) for value in array]
+
+    return {
+        'company_id': company_id,
+        'years': years,
+        'metrics': {
+            name: {'values': listed(values[code - 1]), 'growth': [None] + listed(growth[code - 1])}
+            for name, code in METRICS.items()
+        },
+    }
+
+
+if __name__ == '__main__':
+    import sys
+
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        print(available_years())
+        if len(sys.argv) > 1:
+            print(company_financials(int(sys.argv[1])))
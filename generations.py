@@ -0,0 +1,52 @@
+"""
+Лічильник поколінь даних (ingestion generation).
+
+Після кожного імпорту чи актуалізації companies (задачі jobs.py і записи
+поза ними - companies_written) лічильник збільшується в таблиці
+data_generations, тож усі процеси бачать зміну. Кеші, побудовані
+з companies (фасети фільтрів, знімки), зберігають покоління, для якого
+пораховані, і перебудовуються, коли воно змінилось.
+"""
+
+import logging
+
+from sqlalchemy import text
+
+from app import db
+
+COMPANIES = 'companies'
+
+BUMP_SQL = """
+    INSERT INTO data_generations (name, generation, updated_at)
+    VALUES (:name, 1, CURRENT_TIMESTAMP)
+    ON CONFLICT (name) DO UPDATE SET
+        generation = data_generations.generation + 1,
+        updated_at = CURRENT_TIMESTAMP
+    RETURNING generation
+"""
+
+
+def current_generation(name=COMPANIES):
+    """Поточне покоління набору даних (0, якщо ще не змінювався)"""
+    with db.engine.connect() as connection:
+        return connection.execute(
+            text("SELECT generation FROM data_generations WHERE name = :name"), {'name': name}
+        ).scalar() or 0
+
+
+def bump_generation(name=COMPANIES):
+    """Збільшити покоління після запису (окрема транзакція, видно одразу)"""
+    with db.engine.begin() as connection:
+        return connection.execute(text(BUMP_SQL), {'name': name}).scalar()
+
+
+def companies_written():
+    """
+    Нове покоління після запису в companies поза фоновими задачами (маршрути,
+    data_processor_*). Помилка лише логується - запис уже закомічено.
+    """
+    try:
+        return bump_generation()
+    except Exception as e:
+        logging.error(f"Generation bump failed: {e}")
+        return None
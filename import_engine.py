@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Потоковий імпорт оброблених CSV (_processed.csv) в таблицю companies.
+
+Файл читається частинами фіксованого розміру, кожна частина завантажується
+в тимчасову staging-таблицю через COPY FROM STDIN і зливається з companies
+одним INSERT ... ON CONFLICT (edrpou) DO UPDATE з тією ж COALESCE-семантикою,
+що й у попередньому построковому імпорті.
+
+Фінансові показники з колонок виду revenue_2023 / profit_2023 /
+personnel_2023 (включно з *_2019) дописуються в company_financials
+(financials.py) тією ж частиною: COPY у staging_financials і один
+INSERT ... ON CONFLICT (company_id, year, metric), що пише тільки змінені
+значення. Новий рік звітності - нові рядки, без нових колонок companies.
+"""
+
+import csv
+import io
+import logging
+import math
+
+from actualization_flag import is_actualized_value
+
+# Колонки _processed.csv (див. process_large_csv.py) і їх обмеження довжини
+TEXT_COLUMNS = [
+    ('name', 500),
+    ('kved_code', 20),
+    ('kved_description', 500),
+    ('region_name', 100),
+    ('phone', 50),
+    ('address', 500),
+    ('company_size_name', 50),
+]
+NUMERIC_COLUMNS = ['personnel_2019', 'revenue_2019', 'profit_2019']
+STAGING_COLUMNS = ['row_num', 'edrpou'] + [name for name, _ in TEXT_COLUMNS] + NUMERIC_COLUMNS
+
+DEFAULT_CHUNK_SIZE = 5000
+
+# Межі значень staging-колонок: INTEGER і NUMERIC(15,2)
+MAX_PERSONNEL = 2 ** 31 - 1
+MAX_AMOUNT = 10 ** 13 - 1
+
+FINANCIAL_STAGING_COLUMNS = ['row_num', 'edrpou', 'year', 'metric', 'value']
+
+# Значення технічних колонок для нових компаній з _processed.csv
+IMPORT_SOURCE = 'імпорт'
+IMPORT_ACTUALIZED = 'так'
+
+STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS staging_companies (
+        row_num INTEGER,
+        edrpou TEXT,
+        name TEXT,
+        kved_code TEXT,
+        kved_description TEXT,
+        region_name TEXT,
+        phone TEXT,
+        address TEXT,
+        company_size_name TEXT,
+        personnel_2019 INTEGER,
+        revenue_2019 NUMERIC(15,2),
+        profit_2019 NUMERIC(15,2)
+    ) ON COMMIT DELETE ROWS
+"""
+
+FINANCIAL_STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS staging_financials (
+        row_num INTEGER,
+        edrpou TEXT,
+        year SMALLINT,
+        metric SMALLINT,
+        value NUMERIC(15,2)
+    ) ON COMMIT DELETE ROWS
+"""
+
+# Після злиття частини з companies: компанія вже існує, береться останній рядок файлу
+MERGE_FINANCIALS_SQL = """
+    INSERT INTO company_financials (company_id, year, metric, edrpou, value)
+    SELECT DISTINCT ON (c.id, s.year, s.metric) c.id, s.year, s.metric, c.edrpou, s.value
+    FROM staging_financials s
+    JOIN companies c ON c.edrpou = s.edrpou
+    ORDER BY c.id, s.year, s.metric, s.row_num DESC
+    ON CONFLICT (company_id, year, metric) DO UPDATE SET value = EXCLUDED.value
+    WHERE company_financials.value IS DISTINCT FROM EXCLUDED.value
+"""
+
+# Кілька рядків з одним ЄДРПОУ в межах частини зводяться до одного (ON CONFLICT
+# не може оновити той самий рядок двічі за одну команду): для кожного поля
+# береться останнє непорожнє значення - так само, як послідовні построкові
+# UPDATE з COALESCE (див. LATEST_VALUES_SQL в actualization_engine.py).
+LATEST_VALUES_SQL = ',\n'.join(
+    f"            (array_agg({field} ORDER BY row_num DESC) FILTER (WHERE {field} IS NOT NULL))[1] AS {field}"
+    for field in STAGING_COLUMNS[2:]
+)
+
+# xmax = 0 означає, що рядок щойно вставлено, а не оновлено.
+MERGE_SQL = f"""
+    WITH latest AS (
+        SELECT edrpou,
+{LATEST_VALUES_SQL}
+        FROM staging_companies
+        GROUP BY edrpou
+    ), upserted AS (
+        INSERT INTO companies (
+            edrpou, name, kved_code, kved_description, region_name,
+            phone, address, company_size_name, personnel_2019,
+            revenue_2019, profit_2019, source, actualized, is_actualized, actualized_at, created_at, updated_at
+        )
+        SELECT
+            edrpou, COALESCE(name, ''), kved_code, kved_description, region_name,
+            phone, address, company_size_name, personnel_2019,
+            revenue_2019, profit_2019, %(source)s, %(actualized)s,
+            %(is_actualized)s, CASE WHEN %(is_actualized)s THEN CURRENT_TIMESTAMP END,
+            CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM latest
+        ON CONFLICT (edrpou) DO UPDATE SET
+            name = COALESCE(NULLIF(EXCLUDED.name, ''), companies.name),
+            kved_code = COALESCE(EXCLUDED.kved_code, companies.kved_code),
+            kved_description = COALESCE(EXCLUDED.kved_description, companies.kved_description),
+            region_name = COALESCE(EXCLUDED.region_name, companies.region_name),
+            phone = COALESCE(EXCLUDED.phone, companies.phone),
+            address = COALESCE(EXCLUDED.address, companies.address),
+            company_size_name = COALESCE(EXCLUDED.company_size_name, companies.company_size_name),
+            personnel_2019 = COALESCE(EXCLUDED.personnel_2019, companies.personnel_2019),
+            revenue_2019 = COALESCE(EXCLUDED.revenue_2019, companies.revenue_2019),
+            profit_2019 = COALESCE(EXCLUDED.profit_2019, companies.profit_2019),
+            updated_at = CURRENT_TIMESTAMP
+        RETURNING (xmax = 0) AS inserted
+    )
+    SELECT
+        COUNT(*) FILTER (WHERE inserted) AS inserted_count,
+        COUNT(*) FILTER (WHERE NOT inserted) AS updated_count
+    FROM upserted
+"""
+
+
+def copy_escape(value):
+    """Екранування значення для текстового формату COPY"""
+    if value is None:
+        return '\\N'
+    return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def prepare_row(row):
+    """
+    Перетворити рядок _processed.csv у значення для staging-таблиці.
+    Повертає None для рядків без ЄДРПОУ; ValueError для некоректних чисел.
+    """
+    edrpou = (row.get('edrpou') or '').strip()
+    if not edrpou:
+        return None
+
+    values = [edrpou]
+    for column, max_length in TEXT_COLUMNS:
+        raw = row.get(column)
+        values.append(raw[:max_length] if raw else None)
+
+    personnel = row.get('personnel_2019')
+    revenue = row.get('revenue_2019')
+    profit = row.get('profit_2019')
+    values.append(int(parse_number(personnel, MAX_PERSONNEL)) if personnel else None)
+    values.append(parse_number(revenue) if revenue else None)
+    values.append(parse_number(profit) if profit else None)
+    return values
+
+
+def parse_number(raw, limit=MAX_AMOUNT):
+    """
+    Число з CSV; ValueError для inf/nan і значень, що не вмістяться в колонку -
+    інакше COPY перервав би імпорт усієї частини замість пропуску рядка
+    """
+    value = float(raw)
+    if not math.isfinite(value) or abs(value) > limit:
+        raise ValueError(f"Value out of range: {raw}")
+    return value
+
+
+def prepare_financials(row, fields):
+    """Непорожні показники рядка: [(рік, код показника, значення)]; ValueError для некоректних чисел"""
+    facts = []
+    for column, year, metric in fields:
+        raw = row.get(column)
+        if raw:
+            facts.append((year, metric, parse_number(raw)))
+    return facts
+
+
+def staged_financials(rows):
+    """Рядки staging_financials з колонок *_2019 рядків staging_companies (інші джерела імпорту)"""
+    from financials import LEGACY_YEAR, METRICS
+
+    columns = [(STAGING_COLUMNS.index(f'{name}_{LEGACY_YEAR}'), code) for name, code in METRICS.items()]
+    return [[row[0], row[1], LEGACY_YEAR, metric, row[index]]
+            for row in rows for index, metric in columns if row[index] is not None]
+
+
+def iter_chunks(file_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Читати CSV частинами: yield (rows, financials, skipped_count) для кожної
+    частини; financials - рядки staging_financials.
+    """
+    from financials import financial_fields
+
+    with open(file_path, 'r', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        fields = financial_fields(reader.fieldnames)
+        rows = []
+        financials = []
+        skipped = 0
+        for row_num, row in enumerate(reader, 1):
+            try:
+                values = prepare_row(row)
+                facts = prepare_financials(row, fields) if values is not None else []
+            except (ValueError, TypeError) as e:
+                logging.error(f"Error processing row {row_num}: {e}")
+                values = None
+            if values is None:
+                skipped += 1
+            else:
+                rows.append([row_num] + values)
+                edrpou = values[0]
+                financials.extend([row_num, edrpou, year, metric, value] for year, metric, value in facts)
+
+            if row_num % chunk_size == 0:
+                yield rows, financials, skipped
+                rows = []
+                financials = []
+                skipped = 0
+
+        if rows or skipped:
+            yield rows, financials, skipped
+
+
+def copy_chunk(cursor, rows, table='staging_companies', columns=STAGING_COLUMNS):
+    """Завантажити частину рядків у staging-таблицю через COPY FROM STDIN"""
+    buffer = io.StringIO()
+    for values in rows:
+        buffer.write('\t'.join(copy_escape(v) for v in values))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN",
+        buffer
+    )
+
+
+def merge_chunk(cursor, rows, source, actualized):
+    """Завантажити частину в staging і злити з companies. Повертає (inserted, updated)"""
+    cursor.execute(STAGING_DDL)
+    copy_chunk(cursor, rows)
+    cursor.execute(MERGE_SQL, {'source': source, 'actualized': actualized,
+                               'is_actualized': is_actualized_value(actualized)})
+    inserted, updated = cursor.fetchone()
+    # ON COMMIT DELETE ROWS очищає staging лише при commit, тому очищаємо явно
+    cursor.execute("TRUNCATE staging_companies")
+    return inserted, updated
+
+
+def merge_financials(cursor, financials):
+    """Дописати показники частини в company_financials. Повертає кількість записаних значень"""
+    cursor.execute(FINANCIAL_STAGING_DDL)
+    copy_chunk(cursor, financials, 'staging_financials', FINANCIAL_STAGING_COLUMNS)
+    cursor.execute(MERGE_FINANCIALS_SQL)
+    written = cursor.rowcount
+    cursor.execute("TRUNCATE staging_financials")
+    return written
+
+
+def count_data_lines(file_path):
+    """Кількість рядків даних у CSV (без заголовка)"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return max(sum(1 for _ in f) - 1, 0)
+
+
+def stream_import_processed_csv(file_path, progress=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Імпортувати _processed.csv в companies частинами через COPY + upsert.
+
+    progress(lines_read, total_lines, totals) - необов'язковий callback,
+    викликається після кожної закоміченої частини (див. jobs.py).
+    Повертає словник з processed/inserted/updated/financials/errors.
+    """
+    from app import db
+
+    totals = {'processed': 0, 'inserted': 0, 'updated': 0, 'financials': 0, 'errors': 0}
+    total_lines = count_data_lines(file_path)
+    if progress:
+        progress(0, total_lines, dict(totals))
+
+    connection = db.session.connection().connection
+    cursor = connection.cursor()
+    try:
+        try:
+            cursor.execute("SET synchronous_commit = off")
+        except Exception:
+            # Ігноруємо помилки з недоступними параметрами в production
+            connection.rollback()
+
+        lines_read = 0
+        for rows, financials, skipped in iter_chunks(file_path, chunk_size):
+            lines_read += len(rows) + skipped
+            totals['errors'] += skipped
+
+            if rows:
+                inserted, updated = merge_chunk(cursor, rows, IMPORT_SOURCE, IMPORT_ACTUALIZED)
+                if financials:
+                    totals['financials'] += merge_financials(cursor, financials)
+                connection.commit()
+
+                totals['inserted'] += inserted
+                totals['updated'] += updated
+                totals['processed'] += len(rows)
+
+            logging.info(f"Import chunk done: {lines_read}/{total_lines} rows, "
+                         f"inserted={totals['inserted']}, updated={totals['updated']}")
+            if progress:
+                progress(lines_read, total_lines, dict(totals))
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        # З'єднання повертається в пул - параметр сесії не має діяти на наступні запити
+        try:
+            cursor.execute("RESET synchronous_commit")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+        cursor.close()
+
+    return totals
+
+
+if __name__ == '__main__':
+    import sys
+    from app import app
+
+    if len(sys.argv) < 2:
+        print("Використання: python import_engine.py <file_processed.csv>")
+        sys.exit(1)
+
+    with app.app_context():
+        result = stream_import_processed_csv(sys.argv[1])
+    print(f"✓ Імпорт завершено: {result}")
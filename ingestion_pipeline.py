@@ -0,0 +1,490 @@
+"""
+Єдиний конвеєр завантаження файлів компаній.
+
+Кроки: reader → column resolver → cleaner → validator → sink.
+Кожен крок замінний (pandas/openpyxl/csv читачі; SQLAlchemy або psycopg2 COPY
+запис), а конвеєр збирає час і кількість рядків для кожного кроку.
+"""
+
+import csv
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from actualization_flag import is_actualized_value
+from import_engine import MAX_AMOUNT, MAX_PERSONNEL
+from vectorized_cleaning import clean_text_column, parse_amount_value
+
+DEFAULT_BATCH_SIZE = 5000
+
+# Канонічні поля companies з першого файлу та варіанти заголовків
+# (заголовки порівнюються у нижньому регістрі з нормалізованими пробілами)
+COLUMN_VARIANTS = {
+    'edrpou': ['код єдрпоу', 'єдрпоу', 'код едрпоу', 'edrpou'],
+    'name': ['название компании', 'назва компанії', 'назва', 'найменування', 'компанія', 'name'],
+    'kved_code': ['квед', 'код квед', 'kved', 'kved_code'],
+    'kved_description': ['основний вид діяльності (квед)', 'основний вид діяльності', 'квед опис',
+                         'діяльність', 'kved_description'],
+    'personnel_2019': ['персонал (2019 р.)', 'персонал (осіб)', 'кількість працівників', 'персонал',
+                       'personnel', 'personnel_2019'],
+    'region_name': ['область', 'регіон', 'region', 'region_name'],
+    'phone': ['tелефон', 'телефон', 'phone'],
+    'address': ['адреса реєстрації', 'адреса', 'address'],
+    'revenue_2019': ['чистий дохід від реалізації продукції',
+                     'чистий дохід від реалізації продукції (товарів, робіт, послуг)',
+                     'чистий дохід (виручка) від реалізації продукції',
+                     'чистий дохід (тис. грн)', 'дохід від реалізації', 'дохід', 'виручка',
+                     'revenue', 'revenue_2019'],
+    'profit_2019': ['чистий фінансовий результат: прибуток', 'чистий фінансовий результат (прибуток)',
+                    'чистий прибуток (збиток)', 'прибуток (збиток)', 'чистий прибуток', 'прибуток',
+                    'profit', 'profit_2019'],
+    'company_size_name': ['размер', 'розмір', 'розмір компанії', 'size', 'company_size_name'],
+}
+
+# Обмеження довжини текстових полів (як у run_database_import)
+TEXT_FIELD_LIMITS = {
+    'edrpou': 20,
+    'name': 500,
+    'kved_code': 20,
+    'kved_description': 500,
+    'region_name': 100,
+    'phone': 50,
+    'address': 500,
+    'company_size_name': 50,
+}
+INTEGER_FIELDS = ['personnel_2019']
+DECIMAL_FIELDS = ['revenue_2019', 'profit_2019']
+COMPANY_FIELDS = list(TEXT_FIELD_LIMITS) + INTEGER_FIELDS + DECIMAL_FIELDS
+
+# Найбільше за модулем значення, що вміщується в колонку (INTEGER, NUMERIC(15,2)) -
+# ті самі межі, що й у COPY-імпорті (import_engine.parse_number)
+AMOUNT_LIMITS = {
+    'personnel_2019': MAX_PERSONNEL,
+    'revenue_2019': MAX_AMOUNT,
+    'profit_2019': MAX_AMOUNT,
+}
+
+# ЄДРПОУ - тільки ASCII-цифри (str.isdigit пропускає й інші цифри Unicode: '١٢', '１２')
+EDRPOU_PATTERN = r'[0-9]+'
+
+
+def normalize_header(header):
+    """Нормалізувати заголовок: нижній регістр, один пробіл між словами"""
+    return ' '.join(str(header).lower().split())
+
+
+# ===== Readers: yield DataFrame з оригінальними заголовками =====
+
+def unique_headers(header):
+    """Повторні заголовки отримують суфікси .1, .2 (як у pandas.read_excel)"""
+    seen = {}
+    result = []
+    for name in header:
+        name = '' if name is None else str(name)
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        result.append(name)
+    return result
+
+
+class CsvReader:
+    """Читання CSV стандартним модулем csv (без залежності від pandas парсера)"""
+
+    def __init__(self, file_path, batch_size=DEFAULT_BATCH_SIZE, encoding='utf-8'):
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self.encoding = encoding
+
+    def __iter__(self):
+        with open(self.file_path, 'r', encoding=self.encoding, newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader, None)
+            if header is None:
+                return
+            header = unique_headers(header)
+            rows = []
+            for row in reader:
+                rows.append(row)
+                if len(rows) >= self.batch_size:
+                    yield pd.DataFrame(rows, columns=header, dtype=object)
+                    rows = []
+            if rows:
+                yield pd.DataFrame(rows, columns=header, dtype=object)
+
+
+class PandasReader:
+    """Читання через pandas: CSV частинами (chunksize), Excel - цілим аркушем"""
+
+    def __init__(self, file_path, batch_size=DEFAULT_BATCH_SIZE, encoding='utf-8'):
+        self.file_path = file_path
+        self.batch_size = batch_size
+        self.encoding = encoding
+
+    def __iter__(self):
+        if self.file_path.endswith('.csv'):
+            yield from pd.read_csv(self.file_path, encoding=self.encoding, dtype=str,
+                                   chunksize=self.batch_size)
+            return
+        df = pd.read_excel(self.file_path, dtype=object)
+        for start in range(0, len(df), self.batch_size):
+            yield df.iloc[start:start + self.batch_size]
+
+
+class OpenpyxlReader:
+    """
+    Потокове читання xlsx через openpyxl у режимі read_only.
+
+    Аркуш не завантажується в пам'ять і не конвертується в CSV: рядки
+    читаються генератором з типізованими значеннями клітинок (int/float/str/
+    datetime) і віддаються батчами по batch_size, тому запис у базу
+    починається після першого батчу. Порожні рядки перед заголовком і в
+    даних пропускаються.
+    """
+
+    def __init__(self, file_path, batch_size=DEFAULT_BATCH_SIZE):
+        self.file_path = file_path
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        import openpyxl
+        wb = openpyxl.load_workbook(self.file_path, read_only=True, data_only=True)
+        try:
+            ws = wb.active
+            # Деякі генератори xlsx записують хибний розмір аркуша (напр. A1:A1)
+            ws.reset_dimensions()
+            rows_iter = (row for row in ws.iter_rows(values_only=True)
+                         if any(cell is not None for cell in row))
+            header = next(rows_iter, None)
+            if header is None:
+                return
+            header = unique_headers(header)
+            width = len(header)
+            padding = (None,) * width
+            rows = []
+            for row in rows_iter:
+                rows.append(row[:width] if len(row) >= width else row + padding[len(row):])
+                if len(rows) >= self.batch_size:
+                    yield pd.DataFrame(rows, columns=header, dtype=object)
+                    rows = []
+            if rows:
+                yield pd.DataFrame(rows, columns=header, dtype=object)
+        finally:
+            wb.close()
+
+
+# ===== Column resolver =====
+
+class ColumnResolver:
+    """Перейменування колонок файлу в канонічні поля companies"""
+
+    def __init__(self, variants=None):
+        self.variants = variants or COLUMN_VARIANTS
+        self._mapping = None
+
+    def resolve(self, columns):
+        """Побудувати відображення оригінальний заголовок → канонічне поле"""
+        normalized = {}
+        for column in columns:
+            normalized.setdefault(normalize_header(column), column)
+
+        mapping = {}
+        for field, variants in self.variants.items():
+            for variant in variants:
+                if variant in normalized and normalized[variant] not in mapping:
+                    mapping[normalized[variant]] = field
+                    break
+        return mapping
+
+    def __call__(self, df):
+        if self._mapping is None:
+            self._mapping = self.resolve(df.columns)
+            logging.info(f"Column mapping: {self._mapping}")
+            if 'edrpou' not in self._mapping.values():
+                raise ValueError("Відсутня обов'язкова колонка ЄДРПОУ")
+        df = df[list(self._mapping)].rename(columns=self._mapping)
+        for field in COMPANY_FIELDS:
+            if field not in df.columns:
+                df[field] = None
+        return df[COMPANY_FIELDS]
+
+
+# ===== Cleaner =====
+
+class VectorizedCleaner:
+    """
+    Очищення цілих колонок операціями pandas замість виклику функції на клітинку.
+    Рядки з сумами inf/nan-подібними або поза AMOUNT_LIMITS відкидаються (як
+    пропуск рядка з помилкою в run_database_import) - інакше COPY перервав би
+    весь батч.
+    """
+
+    def __call__(self, df):
+        df = df.copy()
+        for field, limit in TEXT_FIELD_LIMITS.items():
+            df[field] = clean_text_column(df[field], limit)
+        # ЄДРПОУ з Excel приходить як число: 12345678.0 → 12345678
+        df['edrpou'] = df['edrpou'].str.replace(r'\.0$', '', regex=True)
+        invalid = np.zeros(len(df), dtype=bool)
+        for field in INTEGER_FIELDS + DECIMAL_FIELDS:
+            # parse_amount_column впирається у float() і не швидша за map (див. бенчмарк
+            # vectorized_cleaning), тому суми розбираються скалярною функцією
+            values = df[field].map(parse_amount_value).astype(float)
+            out_of_range = ~(np.isfinite(values) & (values.abs() <= AMOUNT_LIMITS[field])) & values.notna()
+            invalid |= out_of_range.to_numpy()
+            df[field] = values.mask(out_of_range)
+        for field in INTEGER_FIELDS:
+            df[field] = df[field].round().astype('Int64')
+        if invalid.any():
+            logging.warning(f"{int(invalid.sum())} rows rejected: amount is not finite or out of range")
+            df = df[~invalid]
+        return df
+
+
+# ===== Validator =====
+
+class CompanyValidator:
+    """Відкидає рядки без валідного ЄДРПОУ (EDRPOU_PATTERN) або без назви"""
+
+    def __init__(self, require_name=False):
+        self.require_name = require_name
+
+    def __call__(self, df):
+        valid = df['edrpou'].notna() & df['edrpou'].astype('string').str.fullmatch(EDRPOU_PATTERN).fillna(False)
+        if self.require_name:
+            valid &= df['name'].notna()
+        return df[valid.astype(bool)]
+
+
+# ===== Sinks =====
+
+SQLALCHEMY_UPSERT_SQL = """
+    INSERT INTO companies (
+        edrpou, name, kved_code, kved_description, region_name,
+        phone, address, company_size_name, personnel_2019,
+        revenue_2019, profit_2019, source, actualized, is_actualized, actualized_at, created_at, updated_at
+    ) VALUES (
+        :edrpou, COALESCE(:name, ''), :kved_code, :kved_description, :region_name,
+        :phone, :address, :company_size_name, :personnel_2019,
+        :revenue_2019, :profit_2019, :source, :actualized,
+        :is_actualized, CASE WHEN :is_actualized THEN CURRENT_TIMESTAMP END, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+    )
+    ON CONFLICT (edrpou) DO UPDATE SET
+        name = COALESCE(NULLIF(EXCLUDED.name, ''), companies.name),
+        kved_code = COALESCE(EXCLUDED.kved_code, companies.kved_code),
+        kved_description = COALESCE(EXCLUDED.kved_description, companies.kved_description),
+        region_name = COALESCE(EXCLUDED.region_name, companies.region_name),
+        phone = COALESCE(EXCLUDED.phone, companies.phone),
+        address = COALESCE(EXCLUDED.address, companies.address),
+        company_size_name = COALESCE(EXCLUDED.company_size_name, companies.company_size_name),
+        personnel_2019 = COALESCE(EXCLUDED.personnel_2019, companies.personnel_2019),
+        revenue_2019 = COALESCE(EXCLUDED.revenue_2019, companies.revenue_2019),
+        profit_2019 = COALESCE(EXCLUDED.profit_2019, companies.profit_2019),
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+# Показники *_2019 у фактову таблицю company_financials (financials.py)
+SQLALCHEMY_FINANCIALS_SQL = """
+    INSERT INTO company_financials (company_id, year, metric, edrpou, value)
+    SELECT id, :year, :metric, edrpou, :value FROM companies WHERE edrpou = :edrpou
+    ON CONFLICT (company_id, year, metric) DO UPDATE SET value = EXCLUDED.value
+    WHERE company_financials.value IS DISTINCT FROM EXCLUDED.value
+"""
+
+
+def dataframe_records(df):
+    """DataFrame → список кортежів з None замість NaN/<NA>"""
+    df = df.astype(object).where(df.notna(), None)
+    return list(df.itertuples(index=False, name=None))
+
+
+class SqlAlchemySink:
+    """Запис батчами через db.session (executemany), працює з будь-яким драйвером"""
+
+    def __init__(self, source='основний', actualized='ні'):
+        self.source = source
+        self.actualized = actualized
+        self.counters = {'written': 0}
+
+    def write(self, df):
+        from app import db
+        from financials import LEGACY_YEAR, METRICS
+        # Дублікати ЄДРПОУ: для кожного поля останнє непорожнє значення (як MERGE_SQL import_engine)
+        deduped = df.groupby('edrpou', sort=False, as_index=False).last()[COMPANY_FIELDS]
+        params = [dict(zip(COMPANY_FIELDS, record), source=self.source, actualized=self.actualized,
+                       is_actualized=is_actualized_value(self.actualized))
+                  for record in dataframe_records(deduped)]
+        if params:
+            db.session.execute(db.text(SQLALCHEMY_UPSERT_SQL), params)
+            columns = [(f'{name}_{LEGACY_YEAR}', metric) for name, metric in METRICS.items()]
+            financials = [{'edrpou': row['edrpou'], 'year': LEGACY_YEAR, 'metric': metric, 'value': row[column]}
+                          for row in params for column, metric in columns if row[column] is not None]
+            if financials:
+                db.session.execute(db.text(SQLALCHEMY_FINANCIALS_SQL), financials)
+            db.session.commit()
+        self.counters['written'] += len(params)
+        return len(params)
+
+    def close(self):
+        pass
+
+
+class CopySink:
+    """Запис через psycopg2 COPY FROM STDIN у staging-таблицю і один upsert на батч"""
+
+    def __init__(self, source='основний', actualized='ні'):
+        self.source = source
+        self.actualized = actualized
+        self.counters = {'written': 0, 'inserted': 0, 'updated': 0}
+        self._connection = None
+        self._cursor = None
+        self._row_num = 0
+
+    def _ensure_cursor(self):
+        if self._cursor is None:
+            from app import db
+            self._connection = db.session.connection().connection
+            self._cursor = self._connection.cursor()
+        return self._cursor
+
+    def write(self, df):
+        from import_engine import merge_chunk, merge_financials, staged_financials
+        cursor = self._ensure_cursor()
+        rows = []
+        for record in dataframe_records(df):
+            self._row_num += 1
+            rows.append([self._row_num] + list(record))
+        if not rows:
+            return 0
+        try:
+            inserted, updated = merge_chunk(cursor, rows, self.source, self.actualized)
+            financials = staged_financials(rows)
+            if financials:
+                merge_financials(cursor, financials)
+            self._connection.commit()
+        except Exception:
+            self._connection.rollback()
+            raise
+        self.counters['inserted'] += inserted
+        self.counters['updated'] += updated
+        self.counters['written'] += inserted + updated
+        return inserted + updated
+
+    def close(self):
+        if self._cursor is not None:
+            self._cursor.close()
+            self._cursor = None
+
+
+# ===== Pipeline =====
+
+class IngestionPipeline:
+    """Послідовне виконання кроків з обліком часу і кількості рядків"""
+
+    STEPS = ['read', 'resolve', 'clean', 'validate', 'write']
+
+    def __init__(self, reader, sink, resolver=None, cleaner=None, validator=None):
+        self.reader = reader
+        self.resolver = resolver or ColumnResolver()
+        self.cleaner = cleaner or VectorizedCleaner()
+        self.validator = validator or CompanyValidator()
+        self.sink = sink
+        self.stats = {step: {'seconds': 0.0, 'rows': 0} for step in self.STEPS}
+
+    def _timed(self, step, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        self.stats[step]['seconds'] += time.perf_counter() - started
+        return result
+
+    def run(self, progress=None):
+        """
+        Виконати конвеєр. progress(rows_read, rows_written) викликається після кожного батчу.
+        Повертає словник статистики (кроки + лічильники sink).
+        """
+        total_started = time.perf_counter()
+        batches = iter(self.reader)
+        rows_read = 0
+        rows_rejected = 0
+        try:
+            while True:
+                batch = self._timed('read', next, batches, None)
+                if batch is None:
+                    break
+                rows_read += len(batch)
+                self.stats['read']['rows'] += len(batch)
+
+                batch = self._timed('resolve', self.resolver, batch)
+                self.stats['resolve']['rows'] += len(batch)
+
+                resolved = len(batch)
+                batch = self._timed('clean', self.cleaner, batch)
+                self.stats['clean']['rows'] += len(batch)
+
+                valid = self._timed('validate', self.validator, batch)
+                self.stats['validate']['rows'] += len(valid)
+                # Відкинуті очищенням (некоректні суми) і валідацією
+                rows_rejected += resolved - len(valid)
+
+                written = self._timed('write', self.sink.write, valid)
+                self.stats['write']['rows'] += written
+
+                if progress:
+                    progress(rows_read, self.stats['write']['rows'])
+        finally:
+            self.sink.close()
+
+        result = {
+            'steps': self.stats,
+            'rows_read': rows_read,
+            'rows_rejected': rows_rejected,
+            'total_seconds': time.perf_counter() - total_started,
+        }
+        result.update(self.sink.counters)
+        logging.info(f"Ingestion finished: {result}")
+        return result
+
+
+def default_reader(file_path, batch_size=DEFAULT_BATCH_SIZE):
+    """Найшвидший коректний читач для типу файлу"""
+    if file_path.endswith('.xlsx'):
+        return OpenpyxlReader(file_path, batch_size)
+    if file_path.endswith('.xls'):
+        return PandasReader(file_path, batch_size)
+    return CsvReader(file_path, batch_size)
+
+
+def read_frame(file_path, batch_size=DEFAULT_BATCH_SIZE, transform=None):
+    """
+    Зібрати файл у один DataFrame з потокових батчів default_reader.
+    transform(batch) застосовується до кожного батчу до об'єднання (напр. щоб
+    залишити тільки потрібні колонки), типи колонок визначаються після.
+    """
+    frames = []
+    for batch in default_reader(file_path, batch_size):
+        frames.append(transform(batch) if transform else batch)
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True).infer_objects()
+
+
+def default_sink(source='основний', actualized='ні'):
+    """COPY для psycopg2, інакше executemany через SQLAlchemy"""
+    from app import db
+    if db.engine.dialect.driver == 'psycopg2':
+        return CopySink(source, actualized)
+    return SqlAlchemySink(source, actualized)
+
+
+def build_pipeline(file_path, source='основний', actualized='ні', batch_size=DEFAULT_BATCH_SIZE):
+    """Конвеєр з типовими кроками для файлу"""
+    return IngestionPipeline(default_reader(file_path, batch_size), default_sink(source, actualized))
+
+
+def ingest_file(file_path, source='основний', actualized='ні', progress=None):
+    """Завантажити файл компаній у базу. Повертає статистику конвеєра"""
+    return build_pipeline(file_path, source, actualized).run(progress)
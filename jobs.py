@@ -0,0 +1,518 @@
+"""
+Фонові задачі всередині процесу веб-додатку.
+
+Стан задач зберігається в таблиці background_jobs, тому прогрес, скасування
+і повтор доступні з будь-якого worker-процесу gunicorn. Кожен процес запускає
+обмежений пул потоків (JOB_WORKERS), які забирають задачі зі статусом queued
+через SELECT ... FOR UPDATE SKIP LOCKED, тож одна задача ніколи не
+виконується двічі. Задача, процес якої зупинився, позначається failed після
+STALE_AFTER без heartbeat і може бути повторена.
+
+Обробник задачі реєструється декоратором @job_handler(kind) і отримує
+JobContext: ctx.progress(done, total, message, details) записує прогрес
+(не частіше ніж раз на PROGRESS_INTERVAL) і кидає JobCancelled, якщо
+задачу скасовано.
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app import db
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+POLL_INTERVAL = 5
+HEARTBEAT_INTERVAL = 30
+PROGRESS_INTERVAL = 1.0
+STALE_AFTER = timedelta(minutes=10)
+UPLOADS_DIR = 'uploads'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+COMPLETED = 'completed'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+JOB_HANDLERS = {}
+
+CLAIM_SQL = """
+    UPDATE background_jobs SET
+        status = 'running',
+        attempts = attempts + 1,
+        worker = :worker,
+        started_at = :now,
+        heartbeat_at = :now,
+        finished_at = NULL
+    WHERE id = (
+        SELECT id FROM background_jobs
+        WHERE status = 'queued'
+        ORDER BY id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, kind, params
+"""
+
+PROGRESS_SQL = """
+    UPDATE background_jobs SET
+        rows_done = :done,
+        rows_total = COALESCE(:total, rows_total),
+        message = COALESCE(:message, message),
+        result = COALESCE(:details, result),
+        heartbeat_at = :now
+    WHERE id = :id
+    RETURNING cancel_requested
+"""
+
+FINISH_SQL = """
+    UPDATE background_jobs SET
+        status = :status,
+        message = COALESCE(:message, message),
+        result = COALESCE(:result, result),
+        error = :error,
+        finished_at = :now,
+        heartbeat_at = :now
+    WHERE id = :id
+"""
+
+HEARTBEAT_SQL = "UPDATE background_jobs SET heartbeat_at = :now WHERE id = ANY(:ids)"
+
+STALE_SQL = """
+    UPDATE background_jobs SET
+        status = 'failed',
+        error = 'Процес, що виконував задачу, зупинився',
+        finished_at = :now
+    WHERE status = 'running' AND heartbeat_at < :cutoff
+"""
+
+
+class JobCancelled(Exception):
+    """Задачу скасовано користувачем"""
+
+
+def job_handler(kind):
+    """Зареєструвати обробник задачі типу kind"""
+    def register(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return register
+
+
+class JobContext:
+    """Прогрес і скасування для обробника задачі"""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.cancelled = False
+        self._last_write = 0.0
+
+    def progress(self, done, total=None, message=None, details=None, force=False):
+        """Записати прогрес (throttled). Кидає JobCancelled, якщо задачу скасовано"""
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_INTERVAL:
+            return
+        self._last_write = now
+
+        # Окреме з'єднання: прогрес видно одразу, незалежно від транзакції обробника
+        with db.engine.begin() as connection:
+            cancel_requested = connection.execute(text(PROGRESS_SQL), {
+                'id': self.job_id,
+                'done': done,
+                'total': total,
+                'message': message,
+                'details': json.dumps(details, default=str) if details is not None else None,
+                'now': datetime.utcnow(),
+            }).scalar()
+        if cancel_requested:
+            self.cancelled = True
+            raise JobCancelled()
+
+
+class JobRunner:
+    """Пул потоків процесу, що виконує задачі з таблиці background_jobs"""
+
+    def __init__(self, app, workers=JOB_WORKERS):
+        self.app = app
+        self.workers = workers
+        self.pid = os.getpid()
+        self.worker_name = f'{socket.gethostname()}:{self.pid}'
+        self._wake = threading.Event()
+        self._active = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        for number in range(self.workers):
+            threading.Thread(target=self._work_loop, name=f'job-worker-{number}', daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True).start()
+        logging.info(f"Job runner started: {self.workers} workers in {self.worker_name}")
+
+    def wake(self):
+        self._wake.set()
+
+    def _work_loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    claimed = self._claim()
+                    if claimed:
+                        self._run(*claimed)
+                        continue
+            except Exception as e:
+                logging.error(f"Job runner error: {e}")
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    def _claim(self):
+        with db.engine.begin() as connection:
+            row = connection.execute(text(CLAIM_SQL), {
+                'worker': self.worker_name, 'now': datetime.utcnow()
+            }).fetchone()
+        return tuple(row) if row else None
+
+    def _run(self, job_id, kind, params):
+        context = JobContext(job_id)
+        with self._lock:
+            self._active.add(job_id)
+        logging.info(f"Job {job_id} ({kind}) started")
+        try:
+            handler = JOB_HANDLERS.get(kind)
+            if handler is None:
+                raise ValueError(f"Невідомий тип задачі: {kind}")
+            result = handler(context, **json.loads(params or '{}'))
+            _finish(job_id, COMPLETED, message='Завершено', result=result)
+        except Exception as e:
+            db.session.rollback()
+            # Скасування всередині COPY/драйвера приходить як помилка драйвера
+            if isinstance(e, JobCancelled) or context.cancelled:
+                _finish(job_id, CANCELLED, message='Скасовано')
+            else:
+                logging.exception(f"Job {job_id} ({kind}) failed")
+                _finish(job_id, FAILED, error=str(e))
+        finally:
+            with self._lock:
+                self._active.discard(job_id)
+            db.session.remove()
+        logging.info(f"Job {job_id} ({kind}) finished")
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            try:
+                with self.app.app_context(), db.engine.begin() as connection:
+                    now = datetime.utcnow()
+                    with self._lock:
+                        active = list(self._active)
+                    if active:
+                        connection.execute(text(HEARTBEAT_SQL), {'ids': active, 'now': now})
+                    connection.execute(text(STALE_SQL), {'now': now, 'cutoff': now - STALE_AFTER})
+            except Exception as e:
+                logging.error(f"Job heartbeat error: {e}")
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def ensure_job_runner(app=None):
+    """Запустити пул задач у поточному процесі (повторно - після fork)"""
+    global _runner
+    with _runner_lock:
+        if _runner is None or _runner.pid != os.getpid():
+            if app is None:
+                from app import app
+            _runner = JobRunner(app)
+            _runner.start()
+    return _runner
+
+
+def _finish(job_id, status, message=None, result=None, error=None):
+    with db.engine.begin() as connection:
+        connection.execute(text(FINISH_SQL), {
+            'id': job_id,
+            'status': status,
+            'message': message,
+            'result': json.dumps(result, default=str) if result is not None else None,
+            'error': error,
+            'now': datetime.utcnow(),
+        })
+
+
+# ===== API задач =====
+
+def submit_job(kind, params=None, target=None, user_id=None):
+    """Поставити задачу в чергу. Повертає BackgroundJob"""
+    from models_full import BackgroundJob
+
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Невідомий тип задачі: {kind}")
+    job = BackgroundJob(
+        kind=kind,
+        params=json.dumps(params or {}),
+        target=target,
+        status=QUEUED,
+        rows_done=0,
+        attempts=0,
+        cancel_requested=False,
+        created_by=user_id,
+    )
+    db.session.add(job)
+    db.session.commit()
+    ensure_job_runner().wake()
+    return job
+
+
+def get_job(job_id):
+    from models_full import BackgroundJob
+    return db.session.get(BackgroundJob, job_id)
+
+
+def latest_job(kind, target):
+    """Остання задача типу kind для target (напр. імені файлу) або None"""
+    from models_full import BackgroundJob
+    return db.session.execute(
+        db.select(BackgroundJob)
+        .where(BackgroundJob.kind == kind, BackgroundJob.target == target)
+        .order_by(BackgroundJob.id.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def list_jobs(limit=50, status=None, kind=None):
+    from models_full import BackgroundJob
+    query = db.select(BackgroundJob).order_by(BackgroundJob.id.desc()).limit(limit)
+    if status:
+        query = query.where(BackgroundJob.status == status)
+    if kind:
+        query = query.where(BackgroundJob.kind == kind)
+    return db.session.execute(query).scalars().all()
+
+
+def cancel_job(job_id):
+    """Скасувати задачу: queued - одразу, running - на наступному ctx.progress"""
+    job = get_job(job_id)
+    if job is None or job.status not in ACTIVE_STATUSES:
+        return job
+    if job.status == QUEUED:
+        job.status = CANCELLED
+        job.message = 'Скасовано'
+        job.finished_at = datetime.utcnow()
+    job.cancel_requested = True
+    db.session.commit()
+    return job
+
+
+def retry_job(job_id):
+    """Повторно поставити в чергу задачу, що завершилась помилкою або скасована"""
+    job = get_job(job_id)
+    if job is None or job.status not in (FAILED, CANCELLED):
+        return job
+    job.status = QUEUED
+    job.rows_done = 0
+    job.message = None
+    job.result = None
+    job.error = None
+    job.cancel_requested = False
+    job.finished_at = None
+    db.session.commit()
+    ensure_job_runner().wake()
+    return job
+
+
+def job_to_dict(job):
+    """Стан задачі з пропускною здатністю (рядків/с) і оцінкою часу до завершення"""
+    elapsed = None
+    throughput = None
+    eta_seconds = None
+    if job.started_at:
+        elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+        if elapsed > 0 and job.rows_done:
+            throughput = job.rows_done / elapsed
+        if job.status == RUNNING and throughput and job.rows_total:
+            eta_seconds = max(job.rows_total - job.rows_done, 0) / throughput
+
+    return {
+        'id': job.id,
+        'kind': job.kind,
+        'target': job.target,
+        'params': json.loads(job.params or '{}'),
+        'status': job.status,
+        'rows_done': job.rows_done or 0,
+        'rows_total': job.rows_total,
+        'percent': round(100.0 * job.rows_done / job.rows_total, 1) if job.rows_total else None,
+        'throughput': round(throughput, 1) if throughput else None,
+        'elapsed_seconds': round(elapsed, 1) if elapsed is not None else None,
+        'eta_seconds': round(eta_seconds) if eta_seconds is not None else None,
+        'message': job.message,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'attempts': job.attempts,
+        'cancel_requested': job.cancel_requested,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def upload_path(filename):
+    """Шлях до файлу в uploads (тільки ім'я файлу, без каталогів)"""
+    return os.path.join(UPLOADS_DIR, os.path.basename(filename))
+
+
+# ===== Обробники задач =====
+
+def _companies_changed(since):
+    """
+    Після запису в companies: нове покоління даних (інвалідує фасети) і
+    оновлення статистики дашборду. Помилка тут не валить задачу.
+    """
+    from dashboard_stats import refresh_dashboard_stats
+    from generations import bump_generation
+    try:
+        bump_generation()
+        refresh_dashboard_stats(since)
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Post-write refresh failed: {e}")
+
+
+@job_handler('import_processed_csv')
+def run_import_processed_csv(ctx, filename):
+    """Імпорт _processed.csv через COPY + upsert (import_engine)"""
+    from import_engine import stream_import_processed_csv
+    from dashboard_stats import checkpoint
+
+    def progress(done, total, totals):
+        ctx.progress(done, total, f'Оброблено {done}/{total}', details=totals)
+
+    since = checkpoint()
+    result = stream_import_processed_csv(upload_path(filename), progress=progress)
+    _companies_changed(since)
+    return result
+
+
+@job_handler('ingest_file')
+def run_ingest_file(ctx, filename, source='основний', actualized='ні', remove_file=False):
+    """Завантаження xlsx/xls/csv через конвеєр ingestion_pipeline"""
+    from ingestion_pipeline import ingest_file
+    from dashboard_stats import checkpoint
+
+    file_path = upload_path(filename)
+    since = checkpoint()
+    result = ingest_file(file_path, source, actualized,
+                         progress=lambda read, written: ctx.progress(
+                             read, message=f'Прочитано {read}, записано {written}',
+                             details={'rows_read': read, 'written': written}))
+    _companies_changed(since)
+    if remove_file and os.path.exists(file_path):
+        os.remove(file_path)
+    return result
+
+
+@job_handler('actualize')
+def run_actualize(ctx, filename):
+    """Актуалізація одним COPY у staging і UPDATE ... FROM (actualization_engine)"""
+    from actualization_engine import actualize_file
+    from import_engine import count_data_lines
+    from dashboard_stats import checkpoint
+
+    file_path = upload_path(filename)
+    total = count_data_lines(file_path) if file_path.endswith('.csv') else None
+    result_path = os.path.splitext(file_path)[0] + '_actualized.csv'
+
+    since = checkpoint()
+    connection = db.engine.raw_connection()
+    try:
+        stats = actualize_file(connection, file_path, result_path,
+                               progress=lambda read: ctx.progress(read, total, f'Прочитано {read} рядків'))
+    finally:
+        connection.close()
+    _companies_changed(since)
+    stats['result_file'] = os.path.basename(result_path)
+    return stats
+
+
+@job_handler('process_csv')
+def run_process_csv(ctx, filename):
+    """Перевірка і підготовка CSV у _processed.csv (process_large_csv)"""
+    from process_large_csv import process_csv_file
+
+    return process_csv_file(upload_path(filename),
+                            progress=lambda done, valid, errors: ctx.progress(
+                                done, message=f'Оброблено {done}, валідних {valid}, помилок {errors}'))
+
+
+@job_handler('merge')
+def run_merge(ctx, main_file, additional_file):
+    """Злиття основного і додаткового файлів за ЄДРПОУ (ExcelFileMerger) у merged_*.csv"""
+    from file_merger import ExcelFileMerger
+
+    merger = ExcelFileMerger()
+    ctx.progress(0, message='Завантаження основного файлу', force=True)
+    if not merger.load_main_file(upload_path(main_file)):
+        raise ValueError('Не вдалося завантажити основний файл')
+    ctx.progress(0, message='Завантаження додаткового файлу', force=True)
+    if not merger.load_additional_file(upload_path(additional_file)):
+        raise ValueError('Не вдалося завантажити додатковий файл')
+    merged = merger.merge_files()
+    if merged is None:
+        raise ValueError("Помилка об'єднання файлів")
+
+    output_name = f"merged_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    ctx.progress(len(merged), len(merged), 'Запис результату', force=True)
+    if not merger.export_to_csv(upload_path(output_name)):
+        raise ValueError('Помилка експорту CSV')
+    stats = {key: int(value) for key, value in merger.get_merge_statistics().items()}
+    stats['result_file'] = output_name
+    return stats
+
+
+@job_handler('export_ranking_pdf')
+def run_export_ranking_pdf(ctx, ranking_id):
+    """PDF експорт рейтингу у static/exports"""
+    from pdf_export import export_ranking_to_pdf
+
+    success, filename, message = export_ranking_to_pdf(ranking_id)
+    if not success:
+        raise ValueError(message)
+    return {'filename': filename, 'message': message}
+
+
+@job_handler('export_rankings_pdf_bundle')
+def run_export_rankings_pdf_bundle(ctx, ranking_ids=None, workers=None):
+    """PDF кількох рейтингів (None - всі активні) одним ZIP у static/exports"""
+    from pdf_export import BUNDLE_WORKERS, export_rankings_bundle
+
+    def progress(done, total, message):
+        ctx.progress(done, total, message, force=done == total)
+
+    return export_rankings_bundle(ranking_ids, workers or BUNDLE_WORKERS, progress)
+
+
+@job_handler('refresh_rankings')
+def run_refresh_rankings(ctx, ranking_ids=None, full=False):
+    """Інкрементальне оновлення рейтингів (None - всі активні зі збереженим визначенням)"""
+    from ranking_refresh import refresh_ranking, refreshable_ranking_ids
+
+    ranking_ids = ranking_ids or refreshable_ranking_ids()
+    results = []
+    for index, ranking_id in enumerate(ranking_ids):
+        ctx.progress(index, len(ranking_ids), f'Рейтинг {ranking_id}')
+        try:
+            stats = refresh_ranking(ranking_id, full=full)
+        except ValueError as e:
+            # Рейтинг без визначення чи знімку бази відбору - пропускається, решта оновлюються
+            db.session.rollback()
+            logging.warning(f"Ranking {ranking_id} is not refreshed: {e}")
+            results.append({'ranking_id': ranking_id, 'error': str(e)})
+            continue
+        db.session.commit()
+        results.append({key: stats.get(key) for key in ('ranking_id', 'mode', 'positions_changed', 'companies_count')})
+    ctx.progress(len(ranking_ids), len(ranking_ids), 'Рейтинги оновлено', force=True)
+    return {'rankings': results}
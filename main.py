@@ -1,3 +1,5 @@
+import sys
+
 from app import app
 
 # Register blueprints after app is fully initialized
@@ -9,6 +11,17 @@ app.register_blueprint(main)
 app.register_blueprint(auth, url_prefix='/auth')
 app.register_blueprint(api, url_prefix='/api')
 
+# Процеси пулу рендерингу PDF (spawn/forkserver) імпортують головний модуль заново
+# як __mp_main__ - фонові служби запускаються тільки в основному процесі
+if '__mp_main__' not in sys.modules:
+    # Фонові задачі (імпорт, актуалізація, злиття, експорт) виконуються пулом потоків процесу
+    from jobs import ensure_job_runner
+    ensure_job_runner(app)
+
+    # Керовані індекси (db_indexes.py) будуються CONCURRENTLY у фоні при деплої
+    from db_indexes import ensure_indexes_async
+    ensure_indexes_async(app)
+
 # Startup fix видалений - автоматичне виправлення даних тепер в app.py
 
 if __name__ == '__main__':
@@ -64,6 +64,8 @@ class Company(db.Model):
     top_count = db.Column(db.Integer)
     total_count = db.Column(db.Integer)
     actualized = db.Column(db.Text, default='ні')
+    is_actualized = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    actualized_at = db.Column(db.DateTime)
     
     def __repr__(self):
         return f'<Company {self.edrpou}>'
@@ -162,5 +164,4 @@ class CompanyRankingHistory(db.Model):
     # Relationship
     company = db.relationship('Company')
     
-    # Unique constraint for preventing duplicate history entries
-    __table_args__ = (db.UniqueConstraint('company_id', 'ranking_name', 'ranking_criteria', name='unique_company_ranking_history'),)
+    # Історія лише доповнюється (як models_full): повторний рейтинг з тією ж назвою додає нові записи
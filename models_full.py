@@ -57,7 +57,10 @@ class Company(db.Model):
     # Technical fields (5 технічних колонок)
     source = db.Column(db.Text, default='основний')  # Джерело завантаження
     actualized = db.Column(db.Text, default='ні')  # Чи актуалізовано з другого файлу
+    is_actualized = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # Стан актуалізації (actualization_flag)
+    actualized_at = db.Column(db.DateTime)  # Час останньої актуалізації
     ranking = db.Column(db.Integer)  # Позиція в рейтингу
+    ranking_criteria = db.Column(db.Text)  # Критерій поточного рейтингу
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
@@ -73,6 +76,8 @@ class SelectionBase(db.Model):
     companies_count = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)
+    materialized_at = db.Column(db.DateTime)  # Час запису знімку в selection_companies, NULL - відбір за критеріями
+    company_bitmap = db.deferred(db.Column(db.LargeBinary))  # Стиснутий бітмап id компаній знімку (selection_bitmap.py)
 
 class SelectionCompany(db.Model):
     __tablename__ = 'selection_companies'
@@ -91,9 +96,17 @@ class Ranking(db.Model):
     region_filter = db.Column(db.Text)
     kved_filter = db.Column(db.Text)
     size_filter = db.Column(db.Text)
-    year_filter = db.Column(db.Integer)
+    year_filter = db.Column(db.Integer)  # Фінансовий рік критерію (financials.py), NULL - колонки *_2019
+    base_year = db.Column(db.Integer)  # Рік порівняння: позиція за зростанням base_year → year_filter, %
+    partition_by = db.Column(db.Text)  # Колонки розрізу через кому, NULL - загальний рейтинг
+    # Визначення рейтингу для оновлення (ranking_refresh.py); NULL - рейтинг не оновлюється
+    sort_criteria = db.Column(db.Text)  # revenue, profit, personnel
+    sort_order = db.Column(db.Text)  # desc, asc
+    rank_method = db.Column(db.Text)  # row_number, rank, dense_rank
+    regional_kved_filter = db.Column(db.Boolean, default=False)
     companies_count = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    refreshed_at = db.Column(db.DateTime)  # Час БД, до якого враховані зміни companies
     is_active = db.Column(db.Boolean, default=True)
 
 class RankingCompany(db.Model):
@@ -103,4 +116,83 @@ class RankingCompany(db.Model):
     ranking_id = db.Column(db.Integer, nullable=False)
     company_id = db.Column(db.Integer, nullable=False)
     position = db.Column(db.Integer)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    group_label = db.Column(db.Text)  # Група рейтингу в розрізі (КВЕД/область/розмір), NULL - загальний
+    sort_value = db.Column(db.Numeric(15, 2))  # Значення критерію, за яким рахувалась позиція
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CompanyFinancial(db.Model):
+    __tablename__ = 'company_financials'
+    
+    # Факт фінансової звітності: значення показника компанії за рік (financials.py)
+    company_id = db.Column(db.Integer, primary_key=True)
+    year = db.Column(db.SmallInteger, primary_key=True)
+    metric = db.Column(db.SmallInteger, primary_key=True)  # financials.METRICS: 1 дохід, 2 прибуток, 3 персонал
+    edrpou = db.Column(db.Text, nullable=False)
+    value = db.Column(db.Numeric(15,2), nullable=False)
+
+class CompanyRankingHistory(db.Model):
+    __tablename__ = 'company_ranking_history'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, nullable=False, index=True)
+    ranking_name = db.Column(db.Text, nullable=False)
+    ranking_position = db.Column(db.Integer, nullable=False)
+    ranking_criteria = db.Column(db.Text, nullable=False)  # Критерій сортування
+    source_name = db.Column(db.Text, nullable=False)  # Источник
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class BackgroundJob(db.Model):
+    __tablename__ = 'background_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.Text, nullable=False)  # Тип задачі (import, actualize, merge, export...)
+    target = db.Column(db.Text, index=True)  # Об'єкт задачі (ім'я файлу, ID рейтингу) для пошуку статусу
+    params = db.Column(db.Text)  # Параметри задачі (JSON)
+    status = db.Column(db.Text, default='queued', index=True)  # queued/running/completed/failed/cancelled
+    rows_done = db.Column(db.BigInteger, default=0)
+    rows_total = db.Column(db.BigInteger)
+    message = db.Column(db.Text)
+    result = db.Column(db.Text)  # Результат задачі (JSON)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    worker = db.Column(db.Text)  # host:pid процесу, що виконує задачу
+    created_by = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)
+
+# Зведена статистика дашборду (dashboard_stats.py), оновлюється після імпорту/актуалізації/рейтингу
+class KvedStat(db.Model):
+    __tablename__ = 'dashboard_kved_stats'
+    
+    kved_code = db.Column(db.Text, primary_key=True)  # '' - компанії без КВЕД
+    kved_description = db.Column(db.Text)
+    total_count = db.Column(db.Integer, default=0)
+    actualized_count = db.Column(db.Integer, default=0)
+    selection_count = db.Column(db.Integer, default=0)  # Компаній КВЕД в активному відборі
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class RegionStat(db.Model):
+    __tablename__ = 'dashboard_region_stats'
+    
+    region_name = db.Column(db.Text, primary_key=True)  # '' - компанії без області
+    total_count = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DashboardState(db.Model):
+    __tablename__ = 'dashboard_state'
+    
+    id = db.Column(db.Integer, primary_key=True)  # Один рядок з id = 1
+    companies_with_ranking = db.Column(db.Integer, default=0)
+    selection_base_id = db.Column(db.Integer)  # Відбір, для якого пораховано selection_count
+    recent_companies = db.Column(db.Text)  # Останні додані компанії (JSON)
+    refreshed_at = db.Column(db.DateTime)  # Водяний знак інкрементального оновлення
+
+class DataGeneration(db.Model):
+    __tablename__ = 'data_generations'
+    
+    name = db.Column(db.Text, primary_key=True)  # Набір даних ('companies')
+    generation = db.Column(db.BigInteger, default=0)  # Збільшується після кожного імпорту/актуалізації
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -45,6 +45,8 @@ class Company(db.Model):
     top_count = db.Column(db.Integer)
     total_count = db.Column(db.Integer)
     actualized = db.Column(db.String(10), default='ні')
+    is_actualized = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    actualized_at = db.Column(db.DateTime)
     ranking = db.Column(db.Integer)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -7,46 +7,16 @@ from app import app, db
 import logging
 
 def optimize_database():
-    """Create indexes and optimize database for faster imports"""
+    """Create/update managed indexes (db_indexes.py) for filter, sort and ranking queries"""
     with app.app_context():
         try:
-            # Створюємо індекс на ЄДРПОУ для швидшого пошуку
-            db.session.execute(db.text("""
-                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_companies_edrpou 
-                ON companies(edrpou);
-            """))
-            
-            # Індекс на назву компанії для швидшого пошуку
-            db.session.execute(db.text("""
-                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_companies_name 
-                ON companies(name);
-            """))
-            
-            # Індекс на КВЕД код
-            db.session.execute(db.text("""
-                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_companies_kved 
-                ON companies(kved_code);
-            """))
-            
-            # Індекс на регіон
-            db.session.execute(db.text("""
-                CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_companies_region 
-                ON companies(region_name);
-            """))
-            
-            # Оптимізуємо налаштування PostgreSQL (тільки дозволені в production)
-            try:
-                db.session.execute(db.text("SET synchronous_commit = off;"))
-                print("✓ Synchronous commit відключено")
-            except Exception as e:
-                print(f"! Не вдалося змінити synchronous_commit: {e}")
-            
-            # Інші параметри недоступні в managed PostgreSQL
-            print("! Деякі оптимізації недоступні в production режимі")
-            
-            db.session.commit()
-            print("✓ Індекси створено успішно")
-            print("✓ Налаштування оптимізації застосовано")
+            from db_indexes import ensure_indexes
+            result = ensure_indexes()
+            if result['skipped']:
+                print("! Індекси зараз будує інший процес")
+            else:
+                print(f"✓ Індекси створено: {result['created'] or 'немає нових'}")
+                print(f"✓ Перебудовано: {result['rebuilt'] or 'немає'}; видалено застарілі: {result['dropped'] or 'немає'}")
             
         except Exception as e:
             print(f"Помилка оптимізації: {e}")
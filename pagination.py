@@ -0,0 +1,179 @@
+"""
+Keyset (seek) пагінація і дешеві підрахунки для переглядача компаній.
+
+Замість OFFSET наступна сторінка вибирається умовою (sort_key, id) > (v, id)
+за курсором з останнього рядка попередньої сторінки, тому час відповіді не
+залежить від номера сторінки. id - стабільний tiebreak для однакових значень.
+NULL значення йдуть як у PostgreSQL за замовчуванням: в кінці при ASC і на
+початку при DESC.
+
+Загальна кількість без фільтрів береться з оцінки pg_class.reltuples (для
+великих таблиць), з фільтрами - SELECT count(*) без завантаження ORM об'єктів.
+"""
+
+import base64
+import json
+from decimal import Decimal
+
+from sqlalchemy import Numeric, and_, func, or_, select, text, tuple_
+
+from app import db
+from models_full import Company
+
+# Ключ сортування (UI та API) → колонка companies
+SORT_COLUMNS = {
+    'name': Company.name,
+    'revenue': Company.revenue_2019,
+    'revenue_2019': Company.revenue_2019,
+    'profit': Company.profit_2019,
+    'profit_2019': Company.profit_2019,
+    'personnel': Company.personnel_2019,
+    'personnel_2019': Company.personnel_2019,
+    'ranking': Company.ranking,
+}
+DEFAULT_SORT = 'name'
+
+# Нижче цього розміру таблиці точний count(*) дешевший за неточність оцінки
+ESTIMATE_THRESHOLD = 50000
+
+RELTUPLES_SQL = "SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"
+
+
+class KeysetPage:
+    """Сторінка результатів з курсорами на сусідні сторінки"""
+
+    def __init__(self, items, has_next, has_prev, next_cursor, prev_cursor):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def sort_column(sort_by):
+    """Колонка сортування для ключа (невідомий ключ → name)"""
+    return SORT_COLUMNS.get(sort_by, SORT_COLUMNS[DEFAULT_SORT])
+
+
+def encode_cursor(sort_by, sort_order, value, row_id):
+    """Непрозорий курсор (base64url JSON) на рядок (value, id)"""
+    if isinstance(value, Decimal):
+        value = str(value)
+    payload = json.dumps([sort_by, sort_order, value, row_id], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_by, sort_order, column):
+    """(value, id) з курсору або None, якщо курсор некоректний чи для іншого сортування"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key, order, value, row_id = json.loads(base64.urlsafe_b64decode(padded).decode('utf-8'))
+    except (ValueError, TypeError):
+        return None
+    if key != sort_by or order != sort_order or not isinstance(row_id, int):
+        return None
+    if value is not None and isinstance(column.type, Numeric):
+        value = Decimal(value)
+    return value, row_id
+
+
+def _seek_condition(column, id_column, value, row_id, descending):
+    """Рядки після (value, row_id) в порядку column ASC NULLS LAST / DESC NULLS FIRST, id"""
+    if not descending:
+        if value is None:
+            return and_(column.is_(None), id_column > row_id)
+        return or_(tuple_(column, id_column) > tuple_(value, row_id), column.is_(None))
+    if value is None:
+        return or_(and_(column.is_(None), id_column < row_id), column.isnot(None))
+    return tuple_(column, id_column) < tuple_(value, row_id)
+
+
+def _ordering(column, id_column, descending):
+    if descending:
+        return column.desc(), id_column.desc()
+    return column.asc(), id_column.asc()
+
+
+def keyset_page(query, sort_by, sort_order, per_page, after=None, before=None, id_column=Company.id):
+    """
+    Сторінка query (select без ORDER BY) після курсору after або перед курсором before.
+
+    Вибирається per_page + 1 рядок, щоб визначити наявність наступної сторінки
+    без підрахунку. Повертає KeysetPage.
+    """
+    column = sort_column(sort_by)
+    descending = sort_order == 'desc'
+
+    position = decode_cursor(before, sort_by, sort_order, column)
+    backward = position is not None
+    if not backward:
+        position = decode_cursor(after, sort_by, sort_order, column)
+
+    # Попередня сторінка: той самий пошук у зворотному порядку, потім розворот
+    scan_descending = descending != backward
+    if position is not None:
+        query = query.where(_seek_condition(column, id_column, position[0], position[1], scan_descending))
+    query = query.order_by(*_ordering(column, id_column, scan_descending)).limit(per_page + 1)
+
+    items = db.session.execute(query).scalars().all()
+    has_more = len(items) > per_page
+    items = items[:per_page]
+    if backward:
+        items.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, position is not None
+
+    def cursor_for(item):
+        return encode_cursor(sort_by, sort_order, getattr(item, column.key), getattr(item, id_column.key))
+
+    return KeysetPage(
+        items,
+        has_next=has_next,
+        has_prev=has_prev,
+        next_cursor=cursor_for(items[-1]) if items and has_next else None,
+        prev_cursor=cursor_for(items[0]) if items and has_prev else None,
+    )
+
+
+def offset_page(query, sort_by, sort_order, page, per_page, id_column=Company.id):
+    """Сторінка за номером (OFFSET) - для прямих посилань ?page=N без курсору"""
+    column = sort_column(sort_by)
+    query = query.order_by(*_ordering(column, id_column, sort_order == 'desc'))
+    items = db.session.execute(query.offset((page - 1) * per_page).limit(per_page + 1)).scalars().all()
+    has_next = len(items) > per_page
+    items = items[:per_page]
+
+    def cursor_for(item):
+        return encode_cursor(sort_by, sort_order, getattr(item, column.key), getattr(item, id_column.key))
+
+    return KeysetPage(
+        items,
+        has_next=has_next,
+        has_prev=page > 1,
+        next_cursor=cursor_for(items[-1]) if items and has_next else None,
+        prev_cursor=cursor_for(items[0]) if items and page > 1 else None,
+    )
+
+
+def estimated_row_count(table):
+    """Оцінка кількості рядків з pg_class.reltuples (None, якщо таблицю ще не аналізували)"""
+    estimate = db.session.execute(text(RELTUPLES_SQL), {'table': table}).scalar()
+    return estimate if estimate is not None and estimate >= 0 else None
+
+
+def count_rows(conditions=(), model=Company):
+    """
+    Кількість рядків model з умовами conditions. Повертає (count, estimated).
+    Без умов для великої таблиці - оцінка pg_class.reltuples.
+    """
+    if not conditions:
+        estimate = estimated_row_count(model.__tablename__)
+        if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+            return estimate, True
+    query = select(func.count()).select_from(model)
+    if conditions:
+        query = query.where(*conditions)
+    return db.session.execute(query).scalar() or 0, False
@@ -1,220 +1,360 @@
 #!/usr/bin/env python3
 """
 Експорт рейтингів компаній в PDF з фірмовим бланком
+
+Шрифти і стилі реєструються один раз на процес. Таблиця рейтингу ділиться
+на частини по одній сторінці (LongTable з повтором шапки, висота рядків
+рахується заздалегідь), тож ReportLab не розбиває одну величезну таблицю.
+Короткий текст пишеться рядком, Paragraph - тільки для тексту, що не
+вміщується в колонку.
+
+Файли адресуються вмістом: імʼя містить хеш версії рейтингу (назва, склад і
+позиції, покоління даних companies, версія макету). Незмінений рейтинг
+віддається з диска без рендерингу. Каталог експорту обмежений
+PDF_CACHE_MAX_BYTES: найдавніше використані файли видаляються (LRU за mtime).
+
+Пакетний експорт (export_rankings_bundle) бере рядки всіх рейтингів одним
+потоковим запитом і рендерить змінені рейтинги в пулі процесів (верстка
+ReportLab навантажує CPU і тримає GIL), результат - один ZIP з manifest.json.
+Процеси пулу запускаються через forkserver/spawn і рендерять функціями
+pdf_render (без app і БД): fork з потоками задач міг успадкувати захоплені
+блокування logging чи пулу зʼєднань. Головний модуль, який вони імпортують
+заново, не запускає в них initialize_app і фонові служби. У роботі одночасно не більше
+workers * BUNDLE_WINDOW рейтингів, тож у памʼяті лише їхні рядки.
+
+    python pdf_export.py 12
+    python pdf_export.py 12 15 18 --workers 4
+    python pdf_export.py --all-active --workers 4
 """
 
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import cm
-from reportlab.lib.enums import TA_CENTER
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from app import app, db
+import hashlib
+import json
+import logging
+import multiprocessing
 import os
+import time
+import zipfile
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime
+from itertools import groupby
+
+from app import app, db
+from pdf_render import PdfRow, _render_ranking_file, _temp_path, render_pdf
+
+EXPORT_DIR = os.environ.get('PDF_EXPORT_DIR', 'static/exports')
+PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+# Збільшується при зміні вигляду PDF, щоб не віддавати старі файли з кешу
+PDF_LAYOUT_VERSION = 2
+
+BUNDLE_WORKERS = int(os.environ.get('PDF_BUNDLE_WORKERS', os.cpu_count() or 1))
+MANIFEST_NAME = 'manifest.json'
+# Рейтингів у роботі пулу на один процес (обмежує рядки в памʼяті)
+BUNDLE_WINDOW = 2
+
+VERSION_SQL = """
+    SELECT r.id, r.name, r.created_at, COUNT(rc.id) AS company_count,
+           md5(string_agg(rc.company_id || ':' || rc.position, ',' ORDER BY rc.position, rc.id)) AS content_hash
+    FROM rankings r
+    LEFT JOIN ranking_companies rc ON r.id = rc.ranking_id
+    WHERE r.id = ANY(:ranking_ids)
+    GROUP BY r.id, r.name, r.created_at
+"""
+
+ROWS_SQL = """
+    SELECT c.edrpou, c.name, c.kved_code, c.kved_description,
+           rc.position as rank_position
+    FROM ranking_companies rc
+    JOIN companies c ON rc.company_id = c.id
+    WHERE rc.ranking_id = :ranking_id
+    ORDER BY rc.position ASC, rc.id
+"""
+
+# Рядки кількох рейтингів одним запитом, згруповані за рейтингом
+BUNDLE_ROWS_SQL = """
+    SELECT rc.ranking_id, c.edrpou, c.name, c.kved_code, c.kved_description,
+           rc.position as rank_position
+    FROM ranking_companies rc
+    JOIN companies c ON rc.company_id = c.id
+    WHERE rc.ranking_id = ANY(:ranking_ids)
+    ORDER BY rc.ranking_id, rc.position ASC, rc.id
+"""
+
+ACTIVE_RANKINGS_SQL = "SELECT id FROM rankings WHERE is_active = true ORDER BY id"
+
+def ranking_versions(ranking_ids):
+    """
+    Версії рейтингів для кешу: {ranking_id: (ranking, version)}. Версія - хеш
+    назви, дати, складу і позицій, версії даних companies (facets.data_version:
+    назви й описи КВЕД, змінені і поза задачами) і версії макету. Рейтингів,
+    яких немає, у результаті немає.
+    """
+    from facets import data_version
+
+    companies_version = data_version()
+    versions = {}
+    for ranking in db.session.execute(db.text(VERSION_SQL), {'ranking_ids': list(ranking_ids)}):
+        key = '|'.join(str(part) for part in (
+            PDF_LAYOUT_VERSION, ranking.id, ranking.name, ranking.created_at,
+            ranking.company_count, ranking.content_hash, companies_version
+        ))
+        versions[ranking.id] = (ranking, hashlib.sha256(key.encode('utf-8')).hexdigest()[:20])
+    return versions
+
+
+def ranking_version(ranking_id):
+    """(ranking, version) одного рейтингу; (None, None), якщо рейтингу немає"""
+    return ranking_versions([ranking_id]).get(ranking_id, (None, None))
+
+
+def cached_filename(ranking_id, version):
+    return f'ranking_{ranking_id}_{version}.pdf'
+
+
+def prune_exports(keep=None, max_bytes=None):
+    """
+    Видалити найдавніше використані PDF і ZIP, поки каталог не вміститься в
+    max_bytes. keep - файл, який не видаляється. Повертає кількість видалених.
+    """
+    max_bytes = PDF_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    files = []
+    for entry in os.scandir(EXPORT_DIR):
+        if entry.is_file() and entry.name.endswith(('.pdf', '.zip')):
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path, entry.name))
+    total = sum(size for _, size, _, _ in files)
+    removed = 0
+    for _, size, path, name in sorted(files):
+        if total <= max_bytes:
+            break
+        if name == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        removed += 1
+    if removed:
+        logging.info(f"PDF exports pruned: {removed} files, {total} bytes left")
+    return removed
 
-def register_fonts():
-    """Register fonts for Ukrainian text"""
-    try:
-        # Use system fonts that support Cyrillic
-        pdfmetrics.registerFont(TTFont('DejaVu', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'))
-        pdfmetrics.registerFont(TTFont('DejaVu-Bold', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'))
-        return True
-    except:
-        return False
 
 def create_pdf_export(ranking_id, output_path):
     """
     Створює PDF експорт рейтингу з фірмовим бланком
     """
     with app.app_context():
-        # Отримуємо дані рейтингу
-        ranking = db.session.execute(db.text("""
-            SELECT r.id, r.name, r.created_at, 
-                   COUNT(rc.id) as company_count
-            FROM rankings r
-            LEFT JOIN ranking_companies rc ON r.id = rc.ranking_id
-            WHERE r.id = :ranking_id
-            GROUP BY r.id, r.name, r.created_at
-        """), {'ranking_id': ranking_id}).fetchone()
-        
+        ranking = db.session.execute(db.text(VERSION_SQL), {'ranking_ids': [ranking_id]}).fetchone()
         if not ranking:
             return False, "Рейтинг не знайдено"
-        
-        # Отримуємо компанії рейтингу з потрібними полями
-        companies = db.session.execute(db.text("""
-            SELECT c.edrpou, c.name, c.kved_code, c.kved_description,
-                   rc.position as rank_position
-            FROM ranking_companies rc
-            JOIN companies c ON rc.company_id = c.id
-            WHERE rc.ranking_id = :ranking_id
-            ORDER BY rc.position ASC
-        """), {'ranking_id': ranking_id}).fetchall()
-        
+
+        companies = db.session.execute(db.text(ROWS_SQL), {'ranking_id': ranking_id}).fetchall()
         if not companies:
             return False, "Компанії в рейтингу не знайдено"
-        
-        # Створюємо PDF документ
-        doc = SimpleDocTemplate(
-            output_path,
-            pagesize=A4,
-            rightMargin=1*cm,
-            leftMargin=1*cm,
-            topMargin=1*cm,
-            bottomMargin=1*cm
-        )
-        
-        story = []
-        styles = getSampleStyleSheet()
-        
-        # Реєструємо шрифти
-        font_registered = register_fonts()
-        
-        # Створюємо стилі для українського тексту
-        if font_registered:
-            title_style = ParagraphStyle(
-                'CustomTitle',
-                parent=styles['Title'],
-                fontName='DejaVu-Bold',
-                fontSize=16,
-                alignment=1,  # Center
-                spaceAfter=20,
-                textColor=colors.HexColor('#1f4e79')
-            )
-            
-            normal_style = ParagraphStyle(
-                'CustomNormal',
-                parent=styles['Normal'],
-                fontName='DejaVu',
-                fontSize=10
-            )
-        else:
-            title_style = styles['Title']
-            normal_style = styles['Normal']
-        
-        # Додаємо тільки фірмовий логотип
-        logo_path = 'attached_assets/shapka_liga_1756405895606.png'
-        if os.path.exists(logo_path):
-            try:
-                logo = Image(logo_path, width=18*cm, height=3*cm, hAlign='CENTER')
-                story.append(logo)
-                story.append(Spacer(1, 15))
-            except:
-                pass
-        
-        # Створюємо стиль для заголовків з переносом
-        header_style = ParagraphStyle(
-            'HeaderText',
-            fontName='DejaVu-Bold' if font_registered else 'Helvetica-Bold',
-            fontSize=9,
-            alignment=TA_CENTER,
-            wordWrap='CJK'
-        )
-        
-        # Створюємо таблицю компаній з 5 колонками у вказаному порядку
-        table_data = [
-            ['Код ЄДРПОУ', 'Назва компанії', Paragraph('Місце в рейтингу', header_style), 'Код КВЕД', 'Галузь']
-        ]
-        
-        # Компактний стиль для переносу слів
-        wrap_style = ParagraphStyle(
-            'WrapText',
-            fontName='DejaVu' if font_registered else 'Helvetica',
-            fontSize=8,
-            alignment=TA_CENTER,
-            wordWrap='CJK'  # Перенос по словам
-        )
-        
-        for company in companies:
-            # Обгортаємо назву компанії та KVED в Paragraph
-            company_name = Paragraph(company.name if company.name else '', wrap_style)
-            kved_description = Paragraph(company.kved_description if company.kved_description else '', wrap_style)
-            
-            table_data.append([
-                str(company.edrpou) if company.edrpou else '',
-                company_name,  # Paragraph для переносу
-                str(company.rank_position),
-                company.kved_code if company.kved_code else '',
-                kved_description  # Paragraph для переносу
-            ])
-        
-        # Створюємо таблицю з 5 колонками
-        table = Table(table_data, colWidths=[2.5*cm, 5*cm, 2.5*cm, 2*cm, 6*cm])
-        
-        table_style = [
-            # Зелена шапка таблиці
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#228B22')),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-            
-            # Синя підсвітка колонки "Місце в рейтингу" (3-тя колонка, індекс 2)
-            ('BACKGROUND', (2, 1), (2, -1), colors.HexColor('#87CEEB')),
-            
-            # Весь текст по центру
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            
-            # Перенос слів вже обробляється Paragraph об'єктами
-            
-            # Шрифти
-            ('FONTNAME', (0, 0), (-1, 0), 'DejaVu-Bold' if font_registered else 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 9),
-            ('FONTNAME', (0, 1), (-1, -1), 'DejaVu' if font_registered else 'Helvetica'),
-            ('FONTSIZE', (0, 1), (-1, -1), 8),
-            
-            # Паддинги
-            ('TOPPADDING', (0, 0), (-1, -1), 6),
-            ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-            ('LEFTPADDING', (0, 0), (-1, -1), 3),
-            ('RIGHTPADDING', (0, 0), (-1, -1), 3),
-            
-            # Сітка таблиці
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            
-            # Білий фон для даних
-            ('BACKGROUND', (0, 1), (1, -1), colors.white),
-            ('BACKGROUND', (3, 1), (-1, -1), colors.white)
-        ]
-        
-        table.setStyle(TableStyle(table_style))
-        story.append(table)
-        
+
         try:
-            doc.build(story)
+            render_pdf(companies, output_path)
             return True, f"PDF створено: {output_path}"
         except Exception as e:
             return False, f"Помилка створення PDF: {str(e)}"
 
+
 def export_ranking_to_pdf(ranking_id):
     """
-    Експортує рейтинг в PDF файл
+    Експортує рейтинг в PDF файл (з кешу, якщо рейтинг не змінився)
     """
-    # Створюємо директорію для експорту
-    export_dir = 'static/exports'
-    if not os.path.exists(export_dir):
-        os.makedirs(export_dir)
-    
-    # Генеруємо ім'я файлу
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f'ranking_{ranking_id}_{timestamp}.pdf'
-    output_path = os.path.join(export_dir, filename)
-    
-    success, message = create_pdf_export(ranking_id, output_path)
-    
-    if success:
-        return True, filename, message
-    else:
-        return False, None, message
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+
+    with app.app_context():
+        ranking, version = ranking_version(ranking_id)
+    if not ranking:
+        return False, None, "Рейтинг не знайдено"
+
+    filename = cached_filename(ranking_id, version)
+    output_path = os.path.join(EXPORT_DIR, filename)
+    if os.path.exists(output_path):
+        # Позначаємо використання для LRU
+        os.utime(output_path)
+        return True, filename, f"PDF з кешу: {output_path}"
+
+    # Рендеримо в тимчасовий файл і атомарно перейменовуємо: паралельний запит не побачить частковий PDF
+    with _temp_path(output_path) as temp_path:
+        success, message = create_pdf_export(ranking_id, temp_path)
+        if not success:
+            return False, None, message
+        os.replace(temp_path, output_path)
+
+    prune_exports(keep=filename)
+    return True, filename, f"PDF створено: {output_path}"
+
+
+def _bundle_rows(ranking_ids):
+    """(ranking_id, [PdfRow]) для рейтингів одним потоковим запитом"""
+    result = db.session.execute(
+        db.text(BUNDLE_ROWS_SQL).execution_options(stream_results=True),
+        {'ranking_ids': list(ranking_ids)}
+    )
+    for ranking_id, rows in groupby(result, key=lambda row: row[0]):
+        yield ranking_id, [PdfRow(*row[1:]) for row in rows]
+
+
+def export_rankings_bundle(ranking_ids=None, workers=BUNDLE_WORKERS, progress=None):
+    """
+    PDF кількох рейтингів (None - всі активні) одним ZIP з manifest.json.
+
+    Незмінені рейтинги беруться з кешу, решта рендериться в пулі з workers
+    процесів (1 - у поточному процесі). progress(done, total, message)
+    викликається після кожного рейтингу. Повертає словник з імʼям ZIP у
+    EXPORT_DIR і підсумками.
+    """
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    started = time.monotonic()
+
+    with app.app_context():
+        if ranking_ids is None:
+            ranking_ids = [row[0] for row in db.session.execute(db.text(ACTIVE_RANKINGS_SQL))]
+        ranking_ids = list(dict.fromkeys(ranking_ids))
+        versions = ranking_versions(ranking_ids)
+
+    entries = {}
+    pending = []
+    for ranking_id in ranking_ids:
+        if ranking_id not in versions:
+            entries[ranking_id] = {'ranking_id': ranking_id, 'status': 'not_found'}
+            continue
+        ranking, version = versions[ranking_id]
+        filename = cached_filename(ranking_id, version)
+        entries[ranking_id] = {
+            'ranking_id': ranking_id,
+            'name': ranking.name,
+            'companies_count': ranking.company_count,
+            'version': version,
+            'file': filename,
+        }
+        if not ranking.company_count:
+            entries[ranking_id]['status'] = 'empty'
+        elif os.path.exists(os.path.join(EXPORT_DIR, filename)):
+            os.utime(os.path.join(EXPORT_DIR, filename))
+            entries[ranking_id]['status'] = 'cached'
+        else:
+            pending.append(ranking_id)
+
+    total = len(ranking_ids)
+    done = total - len(pending)
+    if progress:
+        progress(done, total, f'З кешу: {done}, до рендерингу: {len(pending)}')
+
+    def finished(ranking_id, status, size=None, seconds=None, error=None):
+        nonlocal done
+        done += 1
+        entries[ranking_id].update(status=status)
+        if size is not None:
+            entries[ranking_id].update(size=size, seconds=round(seconds, 2))
+        if error:
+            entries[ranking_id]['error'] = error
+        if progress:
+            progress(done, total, f'Рейтинг {ranking_id}: {status}')
+
+    if pending:
+        workers = max(1, min(workers or 1, len(pending)))
+        with app.app_context():
+            batches = _bundle_rows(pending)
+            if workers == 1:
+                for ranking_id, rows in batches:
+                    try:
+                        _, size, seconds = _render_ranking_file(
+                            ranking_id, rows, os.path.join(EXPORT_DIR, entries[ranking_id]['file']))
+                        finished(ranking_id, 'rendered', size, seconds)
+                    except Exception as e:
+                        finished(ranking_id, 'error', error=str(e))
+            else:
+                # Без fork: процес пулу імпортує тільки pdf_render, а не успадковує потоки,
+                # блокування і зʼєднання батьківського процесу
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    context = multiprocessing.get_context('forkserver')
+                    # Сервер fork-ів завантажує reportlab один раз замість головного модуля
+                    context.set_forkserver_preload(['pdf_render'])
+                else:
+                    context = multiprocessing.get_context('spawn')
+                pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+                futures = {}
+
+                def collect(return_when):
+                    completed, _ = wait(futures, return_when=return_when)
+                    for future in completed:
+                        ranking_id = futures.pop(future)
+                        try:
+                            _, size, seconds = future.result()
+                            finished(ranking_id, 'rendered', size, seconds)
+                        except Exception as e:
+                            finished(ranking_id, 'error', error=str(e))
+
+                try:
+                    # Наступний рейтинг читається з потоку, тільки коли звільнилось місце у вікні
+                    for ranking_id, rows in batches:
+                        if len(futures) >= workers * BUNDLE_WINDOW:
+                            collect(FIRST_COMPLETED)
+                        future = pool.submit(_render_ranking_file, ranking_id, rows,
+                                             os.path.join(EXPORT_DIR, entries[ranking_id]['file']))
+                        futures[future] = ranking_id
+                    collect(ALL_COMPLETED)
+                finally:
+                    pool.shutdown(wait=True, cancel_futures=True)
+
+    manifest = {
+        'generated_at': datetime.now().isoformat(timespec='seconds'),
+        'rankings': [entries[ranking_id] for ranking_id in ranking_ids],
+    }
+    files = [entry['file'] for entry in manifest['rankings']
+             if entry.get('status') in ('cached', 'rendered')]
+    bundle_key = '|'.join(files)
+    bundle_name = f"rankings_{hashlib.sha256(bundle_key.encode('utf-8')).hexdigest()[:20]}.zip"
+    bundle_path = os.path.join(EXPORT_DIR, bundle_name)
+
+    with _temp_path(bundle_path) as temp_path:
+        # PDF вже стиснуті - зберігаємо без повторного стиснення
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_STORED) as bundle:
+            for filename in files:
+                bundle.write(os.path.join(EXPORT_DIR, filename), filename)
+            bundle.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+        os.replace(temp_path, bundle_path)
+    prune_exports(keep=bundle_name)
+
+    counts = {}
+    for entry in manifest['rankings']:
+        counts[entry['status']] = counts.get(entry['status'], 0) + 1
+    summary = {
+        'filename': bundle_name,
+        'rankings': total,
+        'statuses': counts,
+        'workers': workers if pending else 0,
+        'seconds': round(time.monotonic() - started, 2),
+    }
+    logging.info(f"PDF bundle {bundle_name}: {summary}")
+    return summary
+
 
 if __name__ == '__main__':
-    import sys
-    if len(sys.argv) > 1:
-        ranking_id = int(sys.argv[1])
-        success, filename, message = export_ranking_to_pdf(ranking_id)
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Експорт рейтингів в PDF')
+    parser.add_argument('ranking_ids', nargs='*', type=int, help='id рейтингів')
+    parser.add_argument('--all-active', action='store_true', help='всі активні рейтинги одним ZIP')
+    parser.add_argument('--workers', type=int, default=BUNDLE_WORKERS, help='процесів рендерингу')
+    args = parser.parse_args()
+
+    if len(args.ranking_ids) == 1 and not args.all_active:
+        success, filename, message = export_ranking_to_pdf(args.ranking_ids[0])
         print(f"Статус: {'Успіх' if success else 'Помилка'}")
         print(f"Повідомлення: {message}")
         if success:
             print(f"Файл: {filename}")
+    elif args.ranking_ids or args.all_active:
+        def report(done, total, message):
+            print(f"[{done}/{total}] {message}", flush=True)
+
+        summary = export_rankings_bundle(None if args.all_active else args.ranking_ids, args.workers, report)
+        print(f"Файл: {os.path.join(EXPORT_DIR, summary['filename'])}")
+        print(f"Підсумок: {summary['statuses']}, {summary['seconds']} с, процесів: {summary['workers']}")
     else:
-        print("Використання: python pdf_export.py <ranking_id>")
\ No newline at end of file
+        parser.print_usage()
@@ -0,0 +1,251 @@
+"""
+Рендеринг PDF рейтингу ReportLab без звернень до БД.
+
+Окремий модуль без імпорту застосунку: процеси пулу пакетного експорту
+(pdf_export.export_rankings_bundle) запускаються через spawn/forkserver і
+імпортують тільки його, а не app з підключенням до БД і міграціями.
+Шрифти і стилі реєструються один раз на процес.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, LongTable, Table, TableStyle, Paragraph, Spacer, Image, PageBreak
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import cm
+from reportlab.lib.enums import TA_CENTER
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+FONT_PATH = '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+BOLD_FONT_PATH = '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'
+LOGO_PATH = 'attached_assets/shapka_liga_1756405895606.png'
+LOGO_WIDTH, LOGO_HEIGHT = 18*cm, 3*cm
+LOGO_SPACING = 15
+
+HEADERS = ['Код ЄДРПОУ', 'Назва компанії', 'Місце в рейтингу', 'Код КВЕД', 'Галузь']
+COLUMN_WIDTHS = [2.5*cm, 5*cm, 2.5*cm, 2*cm, 6*cm]
+HEADER_FONT_SIZE = 9
+BODY_FONT_SIZE = 8
+CELL_PADDING = 3
+ROW_PADDING = 6
+# Запас висоти сторінки на похибку розрахунку висоти рядків
+PAGE_FILL = 0.97
+
+# Рядок таблиці PDF (передається в процеси пулу)
+PdfRow = namedtuple('PdfRow', 'edrpou name kved_code kved_description rank_position')
+
+
+_fonts_lock = threading.Lock()
+_fonts_registered = None
+_styles = None
+
+
+def register_fonts():
+    """Register fonts for Ukrainian text (once per process)"""
+    global _fonts_registered
+    if _fonts_registered is None:
+        with _fonts_lock:
+            if _fonts_registered is None:
+                try:
+                    # Use system fonts that support Cyrillic
+                    pdfmetrics.registerFont(TTFont('DejaVu', FONT_PATH))
+                    pdfmetrics.registerFont(TTFont('DejaVu-Bold', BOLD_FONT_PATH))
+                    _fonts_registered = True
+                except Exception as e:
+                    logging.warning(f"DejaVu fonts not available, using Helvetica: {e}")
+                    _fonts_registered = False
+    return _fonts_registered
+
+
+def pdf_styles():
+    """Шрифти, стилі абзаців і стиль таблиці - будуються один раз на процес"""
+    global _styles
+    if _styles is None:
+        font_registered = register_fonts()
+        font = 'DejaVu' if font_registered else 'Helvetica'
+        bold_font = 'DejaVu-Bold' if font_registered else 'Helvetica-Bold'
+
+        # Стиль для заголовків з переносом
+        header_style = ParagraphStyle(
+            'HeaderText',
+            fontName=bold_font,
+            fontSize=HEADER_FONT_SIZE,
+            alignment=TA_CENTER,
+            wordWrap='CJK'
+        )
+        # Компактний стиль для переносу слів
+        wrap_style = ParagraphStyle(
+            'WrapText',
+            fontName=font,
+            fontSize=BODY_FONT_SIZE,
+            alignment=TA_CENTER,
+            wordWrap='CJK'
+        )
+        table_style = TableStyle([
+            # Зелена шапка таблиці
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#228B22')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+
+            # Синя підсвітка колонки "Місце в рейтингу" (3-тя колонка, індекс 2)
+            ('BACKGROUND', (2, 1), (2, -1), colors.HexColor('#87CEEB')),
+
+            # Весь текст по центру
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+
+            # Шрифти
+            ('FONTNAME', (0, 0), (-1, 0), bold_font),
+            ('FONTSIZE', (0, 0), (-1, 0), HEADER_FONT_SIZE),
+            ('FONTNAME', (0, 1), (-1, -1), font),
+            ('FONTSIZE', (0, 1), (-1, -1), BODY_FONT_SIZE),
+            # Інтерліньяж рядків як у Paragraph, щоб висота не залежала від типу клітинки
+            ('LEADING', (0, 1), (-1, -1), BODY_FONT_SIZE * 1.2),
+
+            # Паддинги
+            ('TOPPADDING', (0, 0), (-1, -1), ROW_PADDING),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), ROW_PADDING),
+            ('LEFTPADDING', (0, 0), (-1, -1), CELL_PADDING),
+            ('RIGHTPADDING', (0, 0), (-1, -1), CELL_PADDING),
+
+            # Сітка таблиці
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+
+            # Білий фон для даних
+            ('BACKGROUND', (0, 1), (1, -1), colors.white),
+            ('BACKGROUND', (3, 1), (-1, -1), colors.white)
+        ])
+        header_row = [HEADERS[0], HEADERS[1], Paragraph(HEADERS[2], header_style), HEADERS[3], HEADERS[4]]
+
+        # Висоти шапки і однорядкового рядка даних - вимірюються один раз
+        header_height = _measure_rows([header_row], table_style)
+        plain_height = _measure_rows([header_row, ['0'] * len(HEADERS)], table_style) - header_height
+
+        _styles = {
+            'font': font,
+            'wrap_style': wrap_style,
+            'table_style': table_style,
+            'header_row': header_row,
+            'header_height': header_height,
+            'plain_height': plain_height,
+        }
+    return _styles
+
+
+def _measure_rows(rows, table_style):
+    table = Table(rows, colWidths=COLUMN_WIDTHS)
+    table.setStyle(table_style)
+    return table.wrap(sum(COLUMN_WIDTHS), A4[1])[1]
+
+
+def _cell(text, column, styles):
+    """Рядок, якщо текст вміщується в колонку, інакше Paragraph з переносом. Повертає (клітинка, висота)"""
+    text = str(text) if text else ''
+    width = COLUMN_WIDTHS[column] - 2 * CELL_PADDING
+    if pdfmetrics.stringWidth(text, styles['font'], BODY_FONT_SIZE) <= width:
+        return text, 0
+    paragraph = Paragraph(text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'),
+                          styles['wrap_style'])
+    return paragraph, paragraph.wrap(width, A4[1])[1] + 2 * ROW_PADDING
+
+
+def table_pages(companies, first_page_height, page_height):
+    """
+    Таблиці по одній сторінці: рядки набираються, поки вміщуються у висоту
+    сторінки (перша - нижча через бланк). Кожна - LongTable з шапкою і
+    repeatRows=1 на випадок, якщо розрахунок висоти помилився.
+    """
+    styles = pdf_styles()
+    tables = []
+    rows = []
+    available = first_page_height * PAGE_FILL - styles['header_height']
+    used = 0
+    for company in companies:
+        name, name_height = _cell(company.name, 1, styles)
+        kved_description, kved_height = _cell(company.kved_description, 4, styles)
+        height = max(styles['plain_height'], name_height, kved_height)
+        if rows and used + height > available:
+            tables.append(_table(rows, styles))
+            rows, used = [], 0
+            available = page_height * PAGE_FILL - styles['header_height']
+        rows.append([
+            str(company.edrpou) if company.edrpou else '',
+            name,
+            str(company.rank_position),
+            company.kved_code if company.kved_code else '',
+            kved_description
+        ])
+        used += height
+    if rows:
+        tables.append(_table(rows, styles))
+    return tables
+
+
+def _table(rows, styles):
+    table = LongTable([styles['header_row']] + rows, colWidths=COLUMN_WIDTHS, repeatRows=1)
+    table.setStyle(styles['table_style'])
+    return table
+
+
+def render_pdf(companies, output_path):
+    """Зібрати PDF рейтингу з рядків companies (edrpou, name, kved_code, kved_description, rank_position)"""
+    doc = SimpleDocTemplate(
+        output_path,
+        pagesize=A4,
+        rightMargin=1*cm,
+        leftMargin=1*cm,
+        topMargin=1*cm,
+        bottomMargin=1*cm
+    )
+
+    story = []
+    # Висота рамки сторінки без внутрішніх відступів Frame (по 6 пт)
+    page_height = doc.height - 12
+    first_page_height = page_height
+
+    # Додаємо тільки фірмовий логотип
+    if os.path.exists(LOGO_PATH):
+        try:
+            story.append(Image(LOGO_PATH, width=LOGO_WIDTH, height=LOGO_HEIGHT, hAlign='CENTER'))
+            story.append(Spacer(1, LOGO_SPACING))
+            first_page_height -= LOGO_HEIGHT + LOGO_SPACING
+        except Exception:
+            pass
+
+    for index, table in enumerate(table_pages(companies, first_page_height, page_height)):
+        if index:
+            story.append(PageBreak())
+        story.append(table)
+
+    doc.build(story)
+
+
+class _temp_path:
+    """Тимчасовий файл поруч з path; видаляється, якщо не був перейменований"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        handle, self.temp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(self.path) or '.')
+        os.close(handle)
+        return self.temp
+
+    def __exit__(self, *exc):
+        if os.path.exists(self.temp):
+            os.remove(self.temp)
+
+
+def _render_ranking_file(ranking_id, companies, output_path):
+    """Робота процесу пулу: PDF одного рейтингу в output_path. Повертає (ranking_id, розмір, секунди)"""
+    started = time.monotonic()
+    with _temp_path(output_path) as temp_path:
+        render_pdf(companies, temp_path)
+        os.replace(temp_path, output_path)
+    return ranking_id, os.path.getsize(output_path), time.monotonic() - started
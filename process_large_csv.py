@@ -9,11 +9,15 @@ import sys
 import os
 from datetime import datetime
 
-def process_csv_file(file_path):
-    """Обробити CSV файл і вивести статистику"""
+def process_csv_file(file_path, progress=None):
+    """
+    Обробити CSV файл і вивести статистику.
+
+    progress(rows, valid, errors) - необов'язковий callback кожні 1000 рядків
+    (фонова задача process_csv у jobs.py). Повертає словник зі статистикою.
+    """
     if not os.path.exists(file_path):
-        print(f"Файл {file_path} не знайдено")
-        return
+        raise FileNotFoundError(f"Файл {file_path} не знайдено")
     
     print(f"Початок обробки файлу: {file_path}")
     print(f"Час початку: {datetime.now()}")
@@ -23,6 +27,7 @@ def process_csv_file(file_path):
     total_lines = 0
     
     valid_companies = []
+    output_file = None
     
     try:
         with open(file_path, 'r', encoding='utf-8') as csvfile:
@@ -30,6 +35,9 @@ def process_csv_file(file_path):
             
             for row_num, row in enumerate(reader, 1):
                 total_lines += 1
+                # Поза try рядка: виняток callback (скасування задачі) не є помилкою рядка
+                if progress and row_num % 1000 == 0:
+                    progress(row_num, success_count, error_count)
                 
                 try:
                     # Перевірка ЄДРПОУ
@@ -118,6 +126,14 @@ def process_csv_file(file_path):
     
     except Exception as e:
         print(f"Критична помилка: {e}")
+        raise
+    
+    return {
+        'total': total_lines,
+        'valid': success_count,
+        'errors': error_count,
+        'result_file': os.path.basename(output_file) if output_file else None
+    }
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
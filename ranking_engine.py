@@ -0,0 +1,398 @@
+"""
+Побудова і запис рейтингів набором операцій у PostgreSQL.
+
+Позиції рахуються віконною функцією (ROW_NUMBER/RANK/DENSE_RANK) по всій
+відфільтрованій вибірці і пишуться в ranking_companies одним
+INSERT ... SELECT, без вибірки компаній у веб-процес. Для відповіді
+сторінці читається тільки top-N (превʼю). Рейтинг у розрізі КВЕД/області/
+розміру (PARTITION BY) рахує позиції всіх груп тим самим одним запитом і
+зберігає їх під одним Ranking з міткою групи в ranking_companies.group_label.
+Готовий впорядкований список
+(експорт) вставляється одним INSERT ... SELECT з unnest масивів.
+
+Історія в company_ranking_history - одним INSERT ... SELECT
+з ranking_companies. companies.ranking оновлюється одним UPDATE ... FROM,
+що зачіпає тільки рядки, позиція чи критерій яких змінились (включно зі
+скиданням у NULL компаній, що випали з рейтингу), без повного
+UPDATE companies SET ranking = NULL.
+
+Рейтинг за фінансовим роком (year) чи за зростанням між роками (base_year →
+year) бере значення критерію з company_financials через похідну таблицю
+financials.year_source замість companies.
+"""
+
+import logging
+
+from sqlalchemy import text
+
+from app import db
+from financials import uses_facts, year_source, year_value_expression
+
+# Критерій сортування → колонка companies
+RANKING_CRITERIA = {
+    'revenue': 'revenue_2019',
+    'profit': 'profit_2019',
+    'personnel': 'personnel_2019',
+}
+DEFAULT_CRITERIA = 'revenue'
+
+# Назва критерію в історії рейтингів (company_ranking_history.ranking_criteria)
+CRITERIA_NAMES = {
+    'revenue': 'Чистий дохід від реалізації',
+    'profit': 'Чистий фінансовий результат',
+    'personnel': 'Кількість працівників',
+}
+
+RANK_FUNCTIONS = {
+    'row_number': 'ROW_NUMBER()',  # 1, 2, 3, 4 - унікальні позиції
+    'rank': 'RANK()',  # 1, 2, 2, 4 - однакові значення ділять позицію
+    'dense_rank': 'DENSE_RANK()',  # 1, 2, 2, 3
+}
+DEFAULT_RANK_METHOD = 'row_number'
+SORT_ORDERS = ('desc', 'asc')
+
+# Ключ розрізу рейтингу → колонка companies
+PARTITION_COLUMNS = {
+    'kved_code': 'kved_code',
+    'kved': 'kved_code',
+    'region_name': 'region_name',
+    'region': 'region_name',
+    'company_size_name': 'company_size_name',
+    'size': 'company_size_name',
+}
+GROUP_LABEL_SEPARATOR = ' | '
+
+# Регіональний фільтр КВЕД (data_processor.filter_and_rank_companies):
+# у групах КВЕД, менших за цей розмір, лишаються тільки компанії з областю
+SMALL_KVED_GROUP = 100
+REGIONAL_KVED_CONDITION = f"(kved_code IS NULL OR kved_group_size >= {SMALL_KVED_GROUP} OR region_name IS NOT NULL)"
+
+PREVIEW_LIMIT = 1000
+MAX_PREVIEW_LIMIT = 10000
+
+# Колонки превʼю рейтингу (формат JSON відповіді /ranking)
+PREVIEW_COLUMNS = [
+    'edrpou', 'name', 'kved_code', 'kved_description', 'personnel_2019', 'region_name', 'phone',
+    'address', 'revenue_2019', 'profit_2019', 'company_size_name', 'first_name', 'middle_name',
+    'last_name', 'work_phone', 'corporate_site', 'work_email', 'company_status', 'director',
+    'government_purchases', 'tender_count', 'initials', 'actualized',
+]
+NUMERIC_PREVIEW_COLUMNS = {'revenue_2019', 'profit_2019', 'government_purchases'}
+INTEGER_PREVIEW_COLUMNS = {'personnel_2019', 'tender_count'}
+
+# Порожнє значення критерію рахується як 0 (як у попередньому сортуванні в Python).
+# sort_value - значення критерію для інкрементального оновлення (ranking_refresh.py)
+RANK_SELECTION_SQL = """
+    INSERT INTO ranking_companies (ranking_id, company_id, position, group_label, sort_value, created_at)
+    SELECT :ranking_id, id, {rank_function} OVER ({partition}ORDER BY {window_order}), {group_label},
+           {sort_value}, CURRENT_TIMESTAMP
+    FROM {source}
+    WHERE {where}
+"""
+
+# Розмір групи КВЕД рахується вікном по вже відфільтрованій вибірці
+KVED_GROUP_SIZE_SOURCE = """(
+        SELECT companies.*, COUNT(*) OVER (PARTITION BY kved_code) AS kved_group_size
+        FROM {companies}
+        WHERE {where}
+    ) s"""
+
+PREVIEW_SQL = """
+    SELECT rc.position, rc.group_label, rc.sort_value, {columns}
+    FROM ranking_companies rc
+    JOIN companies c ON c.id = rc.company_id
+    WHERE rc.ranking_id = :ranking_id
+    ORDER BY rc.group_label NULLS FIRST, rc.position, c.edrpou
+    LIMIT :limit
+"""
+
+GROUPS_SQL = """
+    SELECT group_label, COUNT(*)
+    FROM ranking_companies
+    WHERE ranking_id = :ranking_id
+    GROUP BY group_label
+    ORDER BY group_label
+"""
+
+INSERT_POSITIONS_SQL = """
+    INSERT INTO ranking_companies (ranking_id, company_id, position, created_at)
+    SELECT :ranking_id, t.company_id, t.position, CURRENT_TIMESTAMP
+    FROM unnest(CAST(:company_ids AS integer[]), CAST(:positions AS integer[])) AS t(company_id, position)
+"""
+
+# Для рейтингу в розрізі назва в історії включає мітку групи
+HISTORY_NAME = "CASE WHEN group_label IS NULL THEN :ranking_name ELSE :ranking_name || ' — ' || group_label END"
+
+# Історія лише доповнюється: повторний рейтинг з тією ж назвою і критерієм додає нові записи
+INSERT_HISTORY_SQL = f"""
+    INSERT INTO company_ranking_history
+        (company_id, ranking_name, ranking_position, ranking_criteria, source_name, created_at)
+    SELECT company_id, {HISTORY_NAME}, position, :criteria, :source_name, CURRENT_TIMESTAMP
+    FROM ranking_companies
+    WHERE ranking_id = :ranking_id
+"""
+
+# {source} - підзапит (company_id, position) нового поточного рейтингу
+SYNC_COMPANIES_SQL = """
+    UPDATE companies c SET
+        ranking = n.position,
+        ranking_criteria = CASE WHEN n.position IS NULL THEN NULL ELSE :criteria END
+    FROM (
+        SELECT COALESCE(t.company_id, r.id) AS id, t.position
+        FROM ({source}) t
+        FULL JOIN (SELECT id FROM companies WHERE ranking IS NOT NULL) r ON r.id = t.company_id
+    ) n
+    WHERE c.id = n.id
+      AND (c.ranking IS DISTINCT FROM n.position
+           OR c.ranking_criteria IS DISTINCT FROM CASE WHEN n.position IS NULL THEN NULL ELSE :criteria END)
+"""
+
+# Час БД, до якого враховані зміни companies: початок найстаршої відкритої
+# транзакції, щоб не пропустити зміни, закомічені після обчислення рейтингу
+WATERMARK_SQL = """
+    SELECT LEAST(LOCALTIMESTAMP, (
+        SELECT MIN(xact_start)::timestamp FROM pg_stat_activity
+        WHERE datname = current_database() AND xact_start IS NOT NULL
+    ))
+"""
+MARK_REFRESHED_SQL = f"UPDATE rankings SET refreshed_at = ({WATERMARK_SQL}) WHERE id = :ranking_id"
+
+RANKING_SOURCE = "SELECT company_id, position FROM ranking_companies WHERE ranking_id = :ranking_id"
+ARRAY_SOURCE = ("SELECT company_id, position FROM unnest(CAST(:company_ids AS integer[]), "
+                "CAST(:positions AS integer[])) AS u(company_id, position)")
+
+
+def insert_ranking_positions(ranking_id, company_ids):
+    """Вставити позиції 1..N для company_ids (у порядку рейтингу) одним запитом"""
+    company_ids = list(company_ids)
+    db.session.execute(text(INSERT_POSITIONS_SQL), {
+        'ranking_id': ranking_id,
+        'company_ids': company_ids,
+        'positions': list(range(1, len(company_ids) + 1)),
+    })
+    return len(company_ids)
+
+
+def record_ranking_history(ranking_id, ranking_name, criteria, source_name):
+    """Дописати позиції рейтингу в company_ranking_history"""
+    params = {'ranking_id': ranking_id, 'ranking_name': ranking_name,
+              'criteria': criteria, 'source_name': source_name}
+    return db.session.execute(text(INSERT_HISTORY_SQL), params).rowcount
+
+
+def sync_company_rankings(criteria, ranking_id=None, company_ids=None):
+    """
+    Зробити рейтинг поточним у companies.ranking: з ranking_companies
+    (ranking_id) або з впорядкованого списку company_ids. Оновлюються тільки
+    змінені рядки; повертає їх кількість.
+    """
+    if ranking_id is not None:
+        source, params = RANKING_SOURCE, {'ranking_id': ranking_id}
+    else:
+        company_ids = list(company_ids)
+        source, params = ARRAY_SOURCE, {'company_ids': company_ids,
+                                        'positions': list(range(1, len(company_ids) + 1))}
+    params['criteria'] = criteria
+    return db.session.execute(text(SYNC_COMPANIES_SQL.format(source=source)), params).rowcount
+
+
+def save_ranking(ranking_id, company_ids, ranking_name, criteria, source_name):
+    """
+    Зберегти рейтинг: позиції, історію і поточний рейтинг компаній.
+    Транзакцію комітить викликач. Повертає статистику запису.
+    """
+    stats = {'positions': insert_ranking_positions(ranking_id, company_ids)}
+    stats['history'] = record_ranking_history(ranking_id, ranking_name, criteria, source_name)
+    stats['companies_changed'] = sync_company_rankings(criteria, ranking_id=ranking_id)
+    logging.info(f"Ranking {ranking_id} saved: {stats}")
+    return stats
+
+
+def selection_conditions(selection_base=None, kved_codes=None, regions=None, sizes=None):
+    """
+    WHERE для вибірки рейтингу: склад бази відбору + фільтри етапу рейтингу.
+    База зі знімком (selection_snapshot) обмежує вибірку своїми компаніями,
+    без знімку - своїми критеріями. Повертає (where_sql, params).
+    """
+    from selection_snapshot import is_materialized, membership_condition
+
+    conditions = []
+    params = {}
+    if is_materialized(selection_base):
+        condition, params = membership_condition(selection_base.id)
+        conditions.append(condition)
+    elif selection_base is not None:
+        if selection_base.min_employees is not None:
+            conditions.append("personnel_2019 >= :min_employees")
+            params['min_employees'] = selection_base.min_employees
+        if selection_base.min_revenue is not None:
+            conditions.append("revenue_2019 >= :min_revenue")
+            params['min_revenue'] = selection_base.min_revenue
+        if selection_base.min_profit is not None:
+            conditions.append("profit_2019 >= :min_profit")
+            params['min_profit'] = selection_base.min_profit
+
+    for column, values, name in (('kved_code', kved_codes, 'kved_codes'),
+                                 ('region_name', regions, 'regions'),
+                                 ('company_size_name', sizes, 'sizes')):
+        values = [value for value in (values or []) if value]
+        if values:
+            conditions.append(f"{column} = ANY(:{name})")
+            params[name] = values
+
+    return " AND ".join(conditions) if conditions else "true", params
+
+
+def sort_value_expression(criteria, prefix='', year=None, base_year=None):
+    """
+    Значення критерію, за яким рахується позиція (порожнє - 0). Для року з
+    фактів чи зростання - колонка похідної таблиці financials.year_source.
+    """
+    if uses_facts(year, base_year):
+        return f"COALESCE({year_value_expression(base_year, prefix)}, 0)"
+    column = RANKING_CRITERIA.get(criteria, RANKING_CRITERIA[DEFAULT_CRITERIA])
+    return f"COALESCE({prefix}{column}, 0)"
+
+
+def window_order(criteria, sort_order='desc', method=DEFAULT_RANK_METHOD, prefix='', year=None, base_year=None):
+    """
+    ORDER BY для вікна рейтингу. Для ROW_NUMBER додається ЄДРПОУ як
+    детермінований tiebreak; для RANK/DENSE_RANK рівні значення ділять позицію.
+    """
+    direction = 'ASC' if sort_order == 'asc' else 'DESC'
+    order = f"{sort_value_expression(criteria, prefix, year, base_year)} {direction}"
+    if method == 'row_number':
+        order += f", {prefix}edrpou"
+    return order
+
+
+def partition_columns(partition_by):
+    """
+    Колонки розрізу з ключа: 'kved_code', 'region,size', ['kved', 'region'].
+    Невідомий ключ - ValueError; порожній - [] (рейтинг без розрізу).
+    """
+    if not partition_by:
+        return []
+    if isinstance(partition_by, str):
+        partition_by = partition_by.split(',')
+    columns = []
+    for key in partition_by:
+        key = key.strip()
+        if not key:
+            continue
+        if key not in PARTITION_COLUMNS:
+            raise ValueError(f"Невідомий розріз рейтингу: {key}")
+        column = PARTITION_COLUMNS[key]
+        if column not in columns:
+            columns.append(column)
+    return columns
+
+
+def ranking_order(sort_order, method):
+    """
+    Напрям і метод рейтингу з форми: порожні - за замовчуванням,
+    невідомі - ValueError. Повертає (sort_order, method).
+    """
+    sort_order = (sort_order or SORT_ORDERS[0]).strip().lower()
+    method = (method or DEFAULT_RANK_METHOD).strip().lower()
+    if sort_order not in SORT_ORDERS:
+        raise ValueError(f"Невідомий напрям сортування: {sort_order}")
+    if method not in RANK_FUNCTIONS:
+        raise ValueError(f"Невідомий метод рейтингу: {method}")
+    return sort_order, method
+
+
+def group_label_expression(columns):
+    """Мітка групи: значення колонок розрізу через GROUP_LABEL_SEPARATOR"""
+    if not columns:
+        return 'NULL'
+    values = ', '.join(f"COALESCE({column}, '')" for column in columns)
+    return f"concat_ws('{GROUP_LABEL_SEPARATOR}', {values})"
+
+
+def window_parts(where, criteria, sort_order='desc', method=DEFAULT_RANK_METHOD,
+                 partition_by=None, regional_kved_filter=False, year=None, base_year=None):
+    """
+    Частини запиту рейтингу для RANK_SELECTION_SQL і подібних: функція, вікно,
+    джерело, умова. year/base_year - критерій з фактів company_financials.
+    """
+    if method not in RANK_FUNCTIONS:
+        method = DEFAULT_RANK_METHOD
+    columns = partition_columns(partition_by)
+    source = year_source(criteria, year, base_year) if uses_facts(year, base_year) else 'companies'
+    if regional_kved_filter:
+        source, where = KVED_GROUP_SIZE_SOURCE.format(companies=source, where=where), REGIONAL_KVED_CONDITION
+    return {
+        'rank_function': RANK_FUNCTIONS[method],
+        'partition': f"PARTITION BY {', '.join(columns)} " if columns else '',
+        'window_order': window_order(criteria, sort_order, method, year=year, base_year=base_year),
+        'group_label': group_label_expression(columns),
+        'sort_value': sort_value_expression(criteria, year=year, base_year=base_year),
+        'source': source,
+        'where': where,
+    }
+
+
+def rank_selection(ranking_id, where, params, criteria, sort_order='desc', method=DEFAULT_RANK_METHOD,
+                   partition_by=None, regional_kved_filter=False, year=None, base_year=None):
+    """
+    Порахувати позиції всієї вибірки віконною функцією і вставити в ranking_companies.
+
+    partition_by - колонки розрізу (partition_columns): позиції рахуються
+    окремо в кожній групі. regional_kved_filter - прибрати компанії без
+    області з груп КВЕД, менших за SMALL_KVED_GROUP. year - фінансовий рік
+    критерію, base_year - рік порівняння (позиція за зростанням, %).
+    """
+    sql = RANK_SELECTION_SQL.format(**window_parts(where, criteria, sort_order, method,
+                                                   partition_by, regional_kved_filter, year, base_year))
+    return db.session.execute(text(sql), dict(params, ranking_id=ranking_id)).rowcount
+
+
+def ranking_groups(ranking_id):
+    """Групи рейтингу в розрізі: [(мітка, кількість компаній)]"""
+    rows = db.session.execute(text(GROUPS_SQL), {'ranking_id': ranking_id}).fetchall()
+    return [(row[0], row[1]) for row in rows if row[0] is not None]
+
+
+def ranking_preview(ranking_id, limit=PREVIEW_LIMIT):
+    """Перші limit позицій рейтингу як словники (порожні значення → '' / 0)"""
+    limit = max(0, min(int(limit), MAX_PREVIEW_LIMIT))
+    sql = PREVIEW_SQL.format(columns=', '.join(f'c.{column}' for column in PREVIEW_COLUMNS))
+    rows = db.session.execute(text(sql), {'ranking_id': ranking_id, 'limit': limit}).fetchall()
+
+    preview = []
+    for row in rows:
+        company = {'ranking': row[0], 'sort_value': float(row[2]) if row[2] is not None else None}
+        if row[1] is not None:
+            company['group_label'] = row[1]
+        for column, value in zip(PREVIEW_COLUMNS, row[3:]):
+            if column in NUMERIC_PREVIEW_COLUMNS:
+                value = float(value) if value else 0
+            elif column in INTEGER_PREVIEW_COLUMNS:
+                value = int(value) if value else 0
+            else:
+                value = value or ''
+            company[column] = value
+        preview.append(company)
+    return preview
+
+
+def create_ranking(ranking_id, where, params, criteria, ranking_name, criteria_display, source_name,
+                   sort_order='desc', method=DEFAULT_RANK_METHOD, partition_by=None, regional_kved_filter=False,
+                   year=None, base_year=None):
+    """
+    Рейтинг повністю в SQL: позиції вікном, історія і поточний рейтинг компаній.
+    Рейтинг у розрізі не змінює companies.ranking (позиції в групах не є
+    загальним рейтингом). Транзакцію комітить викликач. Повертає статистику запису.
+    """
+    stats = {'positions': rank_selection(ranking_id, where, params, criteria, sort_order, method,
+                                         partition_by, regional_kved_filter, year, base_year)}
+    stats['history'] = record_ranking_history(ranking_id, ranking_name, criteria_display, source_name)
+    if partition_columns(partition_by):
+        stats['companies_changed'] = 0
+    else:
+        stats['companies_changed'] = sync_company_rankings(criteria_display, ranking_id=ranking_id)
+    # Зміни companies до цього моменту враховані - точка відліку для ranking_refresh
+    db.session.execute(text(MARK_REFRESHED_SQL), {'ranking_id': ranking_id})
+    logging.info(f"Ranking {ranking_id} created in SQL: {stats}")
+    return stats
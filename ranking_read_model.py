@@ -0,0 +1,200 @@
+"""
+Модель читання рейтингів для сторінок списку і перегляду.
+
+Список рейтингів - один запит: рейтинг, база відбору (LEFT JOIN), лідер
+(LEFT JOIN LATERAL з першою позицією), кількість рейтингів і активних
+(віконні агрегати). Перегляд - два запити незалежно від розміру рейтингу:
+заголовок (рейтинг, база відбору, лідер, кількість позицій) і сторінка
+ranking_companies JOIN companies з LIMIT/OFFSET по індексу
+(ranking_id, position).
+
+Кількість запитів перевіряє check_query_budget (python ranking_read_model.py)
+і tests/test_ranking_read_model.py (потрібна TEST_DATABASE_URL).
+"""
+
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import event, func, select, true
+
+from app import db
+from models_full import Company, Ranking, RankingCompany, SelectionBase
+
+RANKINGS_PER_PAGE = 50
+COMPANIES_PER_PAGE = 100
+MAX_PER_PAGE = 1000
+
+# Верхні межі кількості SQL запитів для сторінок (регресійна перевірка N+1)
+LIST_QUERY_BUDGET = 1
+VIEW_QUERY_BUDGET = 2
+
+
+class RankingPage:
+    """Сторінка позицій рейтингу: items - [(RankingCompany, Company)]"""
+
+    def __init__(self, items, page, per_page, total):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.pages = max(1, -(-total // per_page)) if per_page else 1
+        self.has_prev = page > 1
+        self.has_next = page < self.pages
+        self.prev_num = page - 1 if self.has_prev else None
+        self.next_num = page + 1 if self.has_next else None
+
+
+def _leader():
+    """LATERAL підзапит: компанія на першій позиції рейтингу Ranking"""
+    return (
+        select(Company.name.label('leader_name'), Company.edrpou.label('leader_edrpou'))
+        .select_from(RankingCompany)
+        .join(Company, Company.id == RankingCompany.company_id)
+        .where(RankingCompany.ranking_id == Ranking.id)
+        .order_by(RankingCompany.position, RankingCompany.id)
+        .limit(1)
+        .lateral('leader')
+    )
+
+
+def _positions_count():
+    """Кількість позицій: збережена в рейтингу або порахована для старих рейтингів"""
+    counted = (
+        select(func.count())
+        .select_from(RankingCompany)
+        .where(RankingCompany.ranking_id == Ranking.id)
+        .scalar_subquery()
+    )
+    return func.coalesce(Ranking.companies_count, counted)
+
+
+def list_rankings(page=1, per_page=RANKINGS_PER_PAGE):
+    """
+    Сторінка списку рейтингів одним запитом. Повертає (items, totals):
+    items - [{'ranking', 'selection_base', 'first_company_name', 'companies_count'}],
+    totals - {'total', 'active'} по всіх рейтингах.
+    """
+    page = max(1, page)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    leader = _leader()
+    query = (
+        select(
+            Ranking,
+            SelectionBase,
+            leader.c.leader_name,
+            _positions_count().label('positions'),
+            func.count().over().label('total'),
+            func.count().filter(Ranking.is_active == True).over().label('active'),
+        )
+        .outerjoin(SelectionBase, SelectionBase.id == Ranking.selection_base_id)
+        .outerjoin(leader, true())
+        .order_by(Ranking.created_at.desc(), Ranking.id.desc())
+        .offset((page - 1) * per_page)
+        .limit(per_page)
+    )
+    rows = db.session.execute(query).all()
+
+    items = [{
+        'ranking': row[0],
+        'selection_base': row[1],
+        'first_company_name': row[2] or "Немає компаній",
+        'companies_count': row[3] or 0,
+    } for row in rows]
+    totals = {'total': rows[0][4] if rows else 0, 'active': rows[0][5] if rows else 0}
+    return items, totals
+
+
+def ranking_header(ranking_id):
+    """
+    Рейтинг з базою відбору, лідером і кількістю позицій одним запитом.
+    Повертає словник або None, якщо рейтингу немає.
+    """
+    leader = _leader()
+    row = db.session.execute(
+        select(Ranking, SelectionBase, leader.c.leader_name, leader.c.leader_edrpou,
+               _positions_count().label('positions'))
+        .outerjoin(SelectionBase, SelectionBase.id == Ranking.selection_base_id)
+        .outerjoin(leader, true())
+        .where(Ranking.id == ranking_id)
+    ).first()
+    if row is None:
+        return None
+    return {
+        'ranking': row[0],
+        'selection_base': row[1],
+        'leader_name': row[2],
+        'leader_edrpou': row[3],
+        'companies_count': row[4] or 0,
+    }
+
+
+def ranking_companies_page(ranking_id, page=1, per_page=COMPANIES_PER_PAGE, total=None):
+    """
+    Сторінка позицій рейтингу одним запитом ranking_companies JOIN companies.
+    total - відома кількість позицій (з ranking_header), щоб не рахувати її знову.
+    """
+    page = max(1, page)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    rows = db.session.execute(
+        select(RankingCompany, Company)
+        .join(Company, Company.id == RankingCompany.company_id)
+        .where(RankingCompany.ranking_id == ranking_id)
+        .order_by(RankingCompany.position, RankingCompany.id)
+        .offset((page - 1) * per_page)
+        .limit(per_page)
+    ).all()
+    if total is None:
+        total = db.session.execute(
+            select(func.count()).select_from(RankingCompany).where(RankingCompany.ranking_id == ranking_id)
+        ).scalar() or 0
+    return RankingPage([(row[0], row[1]) for row in rows], page, per_page, total)
+
+
+@contextmanager
+def count_queries():
+    """Лічильник SQL інструкцій, виконаних через db.engine всередині блоку: with count_queries() as queries"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def check_query_budget(ranking_id=None):
+    """
+    Регресійна перевірка N+1: список і перегляд рейтингу мають виконувати
+    не більше LIST_QUERY_BUDGET / VIEW_QUERY_BUDGET запитів незалежно від
+    кількості рейтингів і позицій. Повертає словник з кількістю запитів;
+    при перевищенні - AssertionError.
+    """
+    db.session.rollback()
+    with count_queries() as statements:
+        items, _ = list_rankings()
+    result = {'list_queries': len(statements), 'rankings': len(items)}
+    assert len(statements) <= LIST_QUERY_BUDGET, f"rankings list ran {len(statements)} queries: {statements}"
+
+    if ranking_id is None and items:
+        ranking_id = items[0]['ranking'].id
+    if ranking_id is not None:
+        db.session.rollback()
+        with count_queries() as statements:
+            header = ranking_header(ranking_id)
+            page = ranking_companies_page(ranking_id, total=header['companies_count'] if header else 0)
+        result.update(view_queries=len(statements), positions=len(page.items))
+        assert len(statements) <= VIEW_QUERY_BUDGET, f"ranking view ran {len(statements)} queries: {statements}"
+    return result
+
+
+if __name__ == '__main__':
+    import sys
+
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    with app.app_context():
+        print(check_query_budget(int(sys.argv[1]) if len(sys.argv) > 1 else None))
@@ -0,0 +1,427 @@
+"""
+Інкрементальне оновлення збережених рейтингів після актуалізації чи імпорту.
+
+Змінені компанії - ті, у яких companies.updated_at пізніше за
+rankings.refreshed_at. Серед них рухаються тільки ті, у яких змінилось
+членство у вибірці, значення критерію (порівнюється з
+ranking_companies.sort_value) або група розрізу. Для кожної такої компанії
+індексом (ranking_id, group_label, sort_value, position) знаходиться межа
+в старому порядку, а нові позиції рахуються в памʼяті по відсортованих
+ключах змінених компаній (bisect). Решта позицій зсувається діапазонними
+UPDATE тільки там, де зсув ненульовий, тож записуються лише рядки, позиція
+яких змінилась, і робота пропорційна кількості змін, а не розміру рейтингу.
+
+DENSE_RANK, регіональний фільтр КВЕД (членство залежить від розміру групи)
+і велика частка змін (> INCREMENTAL_MAX_SHARE) перераховуються вікном
+повністю, але теж з записом тільки змінених рядків (FULL_REFRESH_SQL).
+
+Склад вибірки читається тільки зі знімку бази відбору (selection_snapshot):
+SelectionBase без знімку зберігає лише пороги min_*, і перерахунок за ними
+розширив би вибірку, тож такі рейтинги не оновлюються (ValueError).
+
+    python ranking_refresh.py [ranking_id ...] [--check]
+"""
+
+import logging
+from bisect import bisect_left
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app import db
+from models_full import Ranking, SelectionBase
+from ranking_engine import (CRITERIA_NAMES, DEFAULT_RANK_METHOD, HISTORY_NAME, RANK_FUNCTIONS, WATERMARK_SQL,
+                            selection_conditions, window_parts)
+from selection_snapshot import is_materialized
+
+# Частка змінених компаній, після якої рейтинг перераховується повністю
+INCREMENTAL_MAX_SHARE = 0.2
+INCREMENTAL_METHODS = ('row_number', 'rank')
+
+# Компанії, змінені після since, чия позиція в рейтингу може змінитись
+CHANGED_SQL = """
+    WITH touched AS (
+        SELECT id, edrpou, {sort_value} AS sort_value, {group_label} AS group_label,
+               COALESCE(({where}), false) AS is_member
+        FROM {source}
+        WHERE updated_at > :since
+    )
+    SELECT t.id, t.edrpou, t.is_member, t.sort_value, t.group_label,
+           rc.position AS old_position, rc.sort_value AS old_sort_value, rc.group_label AS old_group_label
+    FROM touched t
+    LEFT JOIN ranking_companies rc ON rc.ranking_id = :ranking_id AND rc.company_id = t.id
+    WHERE (t.is_member AND rc.id IS NULL)
+       OR (NOT t.is_member AND rc.id IS NOT NULL)
+       OR (t.is_member AND (rc.sort_value IS DISTINCT FROM t.sort_value
+                            OR rc.group_label IS DISTINCT FROM t.group_label))
+"""
+
+# Перша позиція старого порядку групи з ключем не раніше за новий ключ компанії:
+# серед рівних значень критерію - за ЄДРПОУ (для ROW_NUMBER), інакше - перша
+# позиція найближчого наступного значення. Обидва пошуки йдуть індексом
+# (ranking_id, group_label, sort_value, position)
+BOUNDARY_SQL = """
+    SELECT k.ord, LEAST(
+        (SELECT MIN(rc.position) FROM ranking_companies rc JOIN companies c ON c.id = rc.company_id
+         WHERE rc.ranking_id = :ranking_id AND {group_condition}
+           AND rc.sort_value = k.sort_value AND {tie_condition}),
+        (SELECT MIN(rc.position) FROM ranking_companies rc
+         WHERE rc.ranking_id = :ranking_id AND {group_condition}
+           AND rc.sort_value = (SELECT {next_value}(n.sort_value) FROM ranking_companies n
+                                WHERE n.ranking_id = :ranking_id AND {next_group_condition}
+                                  AND n.sort_value {after} k.sort_value))
+    ) AS boundary
+    FROM unnest(CAST(:group_labels AS text[]), CAST(:sort_values AS numeric[]), CAST(:edrpous AS text[]))
+         WITH ORDINALITY AS k(group_label, sort_value, edrpou, ord)
+"""
+
+# Рейтинг без розрізу має одну групу NULL
+UNGROUPED_CONDITION = "{alias}.group_label IS NULL"
+GROUPED_CONDITION = "{alias}.group_label = {label}"
+
+GROUP_SIZES_SQL = """
+    SELECT group_label, COUNT(*) FROM ranking_companies
+    WHERE ranking_id = :ranking_id AND group_label = ANY(:group_labels)
+    GROUP BY group_label
+"""
+
+# Зсув незмінених рядків групи: відрізки (low, high] старих позицій з їх зсувом, одним UPDATE
+SHIFT_SQL = """
+    UPDATE ranking_companies rc SET position = rc.position + s.delta
+    FROM unnest(CAST(:lows AS integer[]), CAST(:highs AS integer[]), CAST(:deltas AS integer[]))
+         AS s(low, high, delta)
+    WHERE rc.ranking_id = :ranking_id AND {group_condition}
+      AND rc.position > s.low AND (s.high IS NULL OR rc.position <= s.high)
+    RETURNING rc.company_id
+"""
+
+DELETE_MOVED_SQL = """
+    DELETE FROM ranking_companies WHERE ranking_id = :ranking_id AND company_id = ANY(:company_ids)
+"""
+
+INSERT_MOVED_SQL = """
+    INSERT INTO ranking_companies (ranking_id, company_id, position, group_label, sort_value, created_at)
+    SELECT :ranking_id, t.company_id, t.position, t.group_label, t.sort_value, CURRENT_TIMESTAMP
+    FROM unnest(CAST(:company_ids AS integer[]), CAST(:positions AS integer[]),
+                CAST(:group_labels AS text[]), CAST(:sort_values AS numeric[]))
+         AS t(company_id, position, group_label, sort_value)
+"""
+
+# Повний перерахунок вікном із записом тільки змінених рядків; повертає id змінених компаній
+FULL_REFRESH_SQL = """
+    WITH fresh AS (
+        SELECT id AS company_id, {rank_function} OVER ({partition}ORDER BY {window_order}) AS position,
+               {group_label} AS group_label, {sort_value} AS sort_value
+        FROM {source}
+        WHERE {where}
+    ), updated AS (
+        UPDATE ranking_companies rc SET position = f.position, group_label = f.group_label, sort_value = f.sort_value
+        FROM fresh f
+        WHERE rc.ranking_id = :ranking_id AND rc.company_id = f.company_id
+          AND (rc.position IS DISTINCT FROM f.position OR rc.group_label IS DISTINCT FROM f.group_label
+               OR rc.sort_value IS DISTINCT FROM f.sort_value)
+        RETURNING rc.company_id
+    ), deleted AS (
+        DELETE FROM ranking_companies rc
+        WHERE rc.ranking_id = :ranking_id
+          AND NOT EXISTS (SELECT 1 FROM fresh f WHERE f.company_id = rc.company_id)
+        RETURNING rc.company_id
+    ), inserted AS (
+        INSERT INTO ranking_companies (ranking_id, company_id, position, group_label, sort_value, created_at)
+        SELECT :ranking_id, f.company_id, f.position, f.group_label, f.sort_value, CURRENT_TIMESTAMP
+        FROM fresh f
+        WHERE NOT EXISTS (SELECT 1 FROM ranking_companies rc
+                          WHERE rc.ranking_id = :ranking_id AND rc.company_id = f.company_id)
+        RETURNING company_id
+    )
+    SELECT company_id FROM updated
+    UNION ALL SELECT company_id FROM deleted
+    UNION ALL SELECT company_id FROM inserted
+"""
+
+# Нові записи історії (лише доповнюється) тільки для компаній, позиція яких змінилась
+INSERT_CHANGED_HISTORY_SQL = f"""
+    INSERT INTO company_ranking_history
+        (company_id, ranking_name, ranking_position, ranking_criteria, source_name, created_at)
+    SELECT company_id, {HISTORY_NAME}, position, :criteria, :source_name, CURRENT_TIMESTAMP
+    FROM ranking_companies
+    WHERE ranking_id = :ranking_id AND company_id = ANY(:company_ids)
+"""
+
+# companies.ranking тільки для змінених компаній поточного рейтингу
+SYNC_CHANGED_SQL = """
+    UPDATE companies c SET
+        ranking = rc.position,
+        ranking_criteria = CASE WHEN rc.position IS NULL THEN NULL ELSE :criteria END
+    FROM unnest(CAST(:company_ids AS integer[])) AS t(id)
+    LEFT JOIN ranking_companies rc ON rc.ranking_id = :ranking_id AND rc.company_id = t.id
+    WHERE c.id = t.id AND c.ranking IS DISTINCT FROM rc.position
+"""
+
+# Активні рейтинги зі збереженим визначенням; materialized - чи є знімок бази відбору
+REFRESHABLE_SQL = """
+    SELECT r.id, sb.materialized_at IS NOT NULL AS materialized
+    FROM rankings r
+    LEFT JOIN selection_bases sb ON sb.id = r.selection_base_id
+    WHERE r.is_active = true AND r.sort_criteria IS NOT NULL
+    ORDER BY r.id
+"""
+
+# Поточний рейтинг companies.ranking - останній рейтинг без розрізу
+CURRENT_RANKING_SQL = "SELECT MAX(id) FROM rankings WHERE partition_by IS NULL"
+
+COUNT_SQL = "SELECT COUNT(*) FROM ranking_companies WHERE ranking_id = :ranking_id"
+
+
+def _split(value):
+    return [item for item in (value or '').split(',') if item]
+
+
+def ranking_definition(ranking):
+    """
+    (where, params, window) для вибірки рейтингу за збереженим визначенням.
+    ValueError, якщо рейтинг створено без визначення (до оновлень), бази відбору
+    немає або її знімок не збережено.
+    """
+    if not ranking.sort_criteria:
+        raise ValueError(f"Рейтинг {ranking.id} створено без збереженого визначення - створіть його заново")
+    selection_base = db.session.get(SelectionBase, ranking.selection_base_id)
+    if selection_base is None:
+        raise ValueError(f"База відбору {ranking.selection_base_id} рейтингу {ranking.id} не існує")
+    if not is_materialized(selection_base):
+        raise ValueError(f"База відбору {selection_base.id} рейтингу {ranking.id} не має знімку складу - "
+                         f"перерахунок за критеріями змінив би вибірку, створіть рейтинг заново")
+    where, params = selection_conditions(selection_base, _split(ranking.kved_filter),
+                                         _split(ranking.region_filter), _split(ranking.size_filter))
+    window = window_parts(where, ranking.sort_criteria, ranking.sort_order or 'desc',
+                          ranking.rank_method or DEFAULT_RANK_METHOD, ranking.partition_by,
+                          bool(ranking.regional_kved_filter), ranking.year_filter, ranking.base_year)
+    return where, params, window
+
+
+def _sort_key(sort_value, edrpou, descending, with_edrpou):
+    """Ключ порядку рейтингу: менший ключ - вища позиція"""
+    value = -sort_value if descending else sort_value
+    return (value, edrpou) if with_edrpou else (value,)
+
+
+def _group_condition(partitioned, alias='rc', label='k.group_label'):
+    return (GROUPED_CONDITION if partitioned else UNGROUPED_CONDITION).format(alias=alias, label=label)
+
+
+def _boundaries(ranking_id, entries, partitioned, descending, with_edrpou, equal_after):
+    """
+    Для кожного (group_label, sort_value, edrpou) - перша позиція старого порядку
+    групи, що йде не раніше нового ключа (None - після кінця групи).
+    equal_after=False - рівні значення критерію рахуються як такі, що йдуть
+    раніше (межа зсуву для RANK, де рівні значення ділять позицію).
+    """
+    if not entries:
+        return []
+    if with_edrpou:
+        tie_condition = 'c.edrpou >= k.edrpou'
+    else:
+        tie_condition = 'true' if equal_after else 'false'
+    sql = BOUNDARY_SQL.format(
+        group_condition=_group_condition(partitioned),
+        next_group_condition=_group_condition(partitioned, alias='n'),
+        tie_condition=tie_condition,
+        next_value='MAX' if descending else 'MIN',
+        after='<' if descending else '>',
+    )
+    rows = db.session.execute(text(sql), {
+        'ranking_id': ranking_id,
+        'group_labels': [entry[0] for entry in entries],
+        'sort_values': [entry[1] for entry in entries],
+        'edrpous': [entry[2] for entry in entries],
+    }).fetchall()
+    boundaries = {row[0]: row[1] for row in rows}
+    return [boundaries[index + 1] for index in range(len(entries))]
+
+
+def _refresh_incremental(ranking, changed, descending, method):
+    """
+    Застосувати зміни changed (рядки CHANGED_SQL) до позицій рейтингу.
+    Повертає (id компаній, позиція чи членство яких змінились; нова кількість позицій).
+    """
+    with_edrpou = method == 'row_number'
+    partitioned = bool(ranking.partition_by)
+    old = [row for row in changed if row.old_position is not None]
+    new = [row for row in changed if row.is_member]
+    groups = {row.old_group_label for row in old} | {row.group_label for row in new}
+
+    # Розмір групи - межа для ключів, що йдуть після всіх рядків групи
+    if partitioned:
+        sizes = dict(db.session.execute(text(GROUP_SIZES_SQL), {
+            'ranking_id': ranking.id, 'group_labels': list(groups)
+        }).fetchall())
+    else:
+        sizes = {None: ranking.companies_count or 0}
+
+    entries = [(row.group_label, row.sort_value, row.edrpou) for row in new]
+    # Скільки старих рядків строго перед новим ключем
+    before = _boundaries(ranking.id, entries, partitioned, descending, with_edrpou, equal_after=True)
+    # Межа зсуву: для RANK рядки з рівним значенням ділять позицію і не зсуваються
+    after = before if with_edrpou else _boundaries(ranking.id, entries, partitioned, descending, with_edrpou,
+                                                   equal_after=False)
+
+    changed_ids = set()
+    moved_ids = [row.id for row in old]
+    if moved_ids:
+        db.session.execute(text(DELETE_MOVED_SQL), {'ranking_id': ranking.id, 'company_ids': moved_ids})
+        changed_ids.update(moved_ids)
+
+    inserts = []
+    shift_sql = SHIFT_SQL.format(group_condition=_group_condition(partitioned, label=':group_label'))
+    for group in groups:
+        size = sizes.get(group, 0)
+        group_old = [row for row in old if row.old_group_label == group]
+        group_new = [(index, row) for index, row in enumerate(new) if row.group_label == group]
+
+        old_keys = sorted(_sort_key(row.old_sort_value, row.edrpou, descending, with_edrpou) for row in group_old)
+        new_keys = sorted(_sort_key(row.sort_value, row.edrpou, descending, with_edrpou) for _, row in group_new)
+
+        # Зсув незмінених рядків: -1 після кожного вилученого, +1 після межі кожного доданого
+        events = [(row.old_position, -1) for row in group_old]
+        for index, row in group_new:
+            key = _sort_key(row.sort_value, row.edrpou, descending, with_edrpou)
+            old_rows_before = (before[index] - 1) if before[index] is not None else size
+            unchanged_before = old_rows_before - bisect_left(old_keys, key)
+            position = unchanged_before + bisect_left(new_keys, key) + 1
+            inserts.append((row.id, position, group, row.sort_value))
+            events.append(((after[index] - 1) if after[index] is not None else size, 1))
+
+        # Відрізки старих позицій (low, high] з ненульовим сумарним зсувом
+        events.sort()
+        lows, highs, deltas = [], [], []
+        delta = 0
+        for index, (threshold, change) in enumerate(events):
+            delta += change
+            next_threshold = events[index + 1][0] if index + 1 < len(events) else None
+            if delta and next_threshold != threshold:
+                lows.append(threshold)
+                highs.append(next_threshold)
+                deltas.append(delta)
+        if deltas:
+            shifted = db.session.execute(text(shift_sql), {
+                'ranking_id': ranking.id, 'group_label': group,
+                'lows': lows, 'highs': highs, 'deltas': deltas,
+            }).fetchall()
+            changed_ids.update(row[0] for row in shifted)
+
+    if inserts:
+        db.session.execute(text(INSERT_MOVED_SQL), {
+            'ranking_id': ranking.id,
+            'company_ids': [item[0] for item in inserts],
+            'positions': [item[1] for item in inserts],
+            'group_labels': [item[2] for item in inserts],
+            'sort_values': [item[3] for item in inserts],
+        })
+        changed_ids.update(item[0] for item in inserts)
+    return changed_ids, (ranking.companies_count or 0) - len(old) + len(inserts)
+
+
+def _refresh_full(ranking, params, window):
+    sql = FULL_REFRESH_SQL.format(**window)
+    rows = db.session.execute(text(sql), dict(params, ranking_id=ranking.id)).fetchall()
+    return {row[0] for row in rows}
+
+
+def _record_changes(ranking, changed_ids):
+    """Історія і companies.ranking тільки для компаній зі зміненою позицією"""
+    criteria = CRITERIA_NAMES.get(ranking.sort_criteria, ranking.sort_criteria)
+    company_ids = list(changed_ids)
+    params = {'ranking_id': ranking.id, 'ranking_name': ranking.name, 'criteria': criteria,
+              'company_ids': company_ids, 'source_name': f"Україна {datetime.now().year}"}
+    history = db.session.execute(text(INSERT_CHANGED_HISTORY_SQL), params).rowcount
+
+    companies_changed = 0
+    if not ranking.partition_by and db.session.execute(text(CURRENT_RANKING_SQL)).scalar() == ranking.id:
+        companies_changed = db.session.execute(text(SYNC_CHANGED_SQL), params).rowcount
+    return history, companies_changed
+
+
+def refresh_ranking(ranking_id, full=False):
+    """
+    Оновити позиції рейтингу після змін companies з моменту refreshed_at
+    (для старих рейтингів - created_at). full - перерахувати вікном повністю.
+    Транзакцію комітить викликач. Повертає статистику оновлення.
+    """
+    ranking = db.session.get(Ranking, ranking_id)
+    if ranking is None:
+        raise ValueError(f"Рейтинг {ranking_id} не знайдено")
+    where, params, window = ranking_definition(ranking)
+    watermark = db.session.execute(text(WATERMARK_SQL)).scalar()
+    since = ranking.refreshed_at or ranking.created_at
+
+    method = ranking.rank_method if ranking.rank_method in RANK_FUNCTIONS else DEFAULT_RANK_METHOD
+    descending = (ranking.sort_order or 'desc') != 'asc'
+    stats = {'ranking_id': ranking.id, 'since': since, 'mode': 'full'}
+
+    if not full and method in INCREMENTAL_METHODS and not ranking.regional_kved_filter:
+        sql = CHANGED_SQL.format(sort_value=window['sort_value'], group_label=window['group_label'],
+                                 source=window['source'], where=where)
+        changed = db.session.execute(text(sql), dict(params, ranking_id=ranking.id, since=since)).fetchall()
+        stats['changed_companies'] = len(changed)
+        if len(changed) <= INCREMENTAL_MAX_SHARE * max(ranking.companies_count or 0, 1):
+            stats['mode'] = 'incremental'
+            changed_ids, companies_count = _refresh_incremental(ranking, changed, descending, method)
+    if stats['mode'] == 'full':
+        changed_ids = _refresh_full(ranking, params, window)
+        companies_count = db.session.execute(text(COUNT_SQL), {'ranking_id': ranking.id}).scalar()
+
+    stats['positions_changed'] = len(changed_ids)
+    if changed_ids:
+        stats['history'], stats['companies_changed'] = _record_changes(ranking, changed_ids)
+    ranking.companies_count = companies_count
+    ranking.refreshed_at = watermark
+    stats['companies_count'] = ranking.companies_count
+    logging.info(f"Ranking {ranking.id} refreshed: {stats}")
+    return stats
+
+
+def refreshable_ranking_ids():
+    """Активні рейтинги зі збереженим визначенням і знімком бази відбору"""
+    rows = db.session.execute(text(REFRESHABLE_SQL)).fetchall()
+    skipped = [row.id for row in rows if not row.materialized]
+    if skipped:
+        logging.warning(f"Rankings without a selection snapshot are not refreshed: {skipped}")
+    return [row.id for row in rows if row.materialized]
+
+
+def check_refresh(ranking_id):
+    """
+    Перевірка: позиції рейтингу збігаються з повним перерахунком вікном.
+    Повертає кількість розбіжностей (0 - збігаються); нічого не змінює.
+    """
+    ranking = db.session.get(Ranking, ranking_id)
+    where, params, window = ranking_definition(ranking)
+    sql = f"""
+        WITH fresh AS (
+            SELECT id AS company_id, {window['rank_function']} OVER ({window['partition']}ORDER BY {window['window_order']}) AS position,
+                   {window['group_label']} AS group_label
+            FROM {window['source']}
+            WHERE {window['where']}
+        )
+        SELECT COUNT(*) FROM fresh f
+        FULL JOIN (SELECT company_id, position, group_label FROM ranking_companies WHERE ranking_id = :ranking_id) rc
+            ON rc.company_id = f.company_id
+        WHERE rc.company_id IS NULL OR f.company_id IS NULL
+           OR rc.position IS DISTINCT FROM f.position OR rc.group_label IS DISTINCT FROM f.group_label
+    """
+    return db.session.execute(text(sql), dict(params, ranking_id=ranking_id)).scalar()
+
+
+if __name__ == '__main__':
+    import sys
+
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+    with app.app_context():
+        for ranking_id in [int(argument) for argument in arguments] or refreshable_ranking_ids():
+            print(refresh_ranking(ranking_id, full='--full' in sys.argv))
+            db.session.commit()
+            if '--check' in sys.argv:
+                print(f"Ranking {ranking_id}: {check_refresh(ranking_id)} mismatches")
@@ -1,5 +1,4 @@
 import os
-import csv
 import logging
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify, send_file
 from flask_login import login_required, current_user
@@ -7,6 +6,7 @@ from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash
 from models_full import Company, SelectionBase, SelectionCompany, Ranking, RankingCompany, User
 from app import db
+from actualization_flag import is_actualized_value
 from permissions import admin_required, manager_or_admin_required, upload_required, actualize_required, export_required, require_role
 from sqlalchemy import desc, asc, text
 from datetime import datetime
@@ -20,336 +20,30 @@ ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
 def is_company_actualized(actualized_value):
     """
     Універсальна функція для визначення чи актуалізована компанія
-    Працює однаково в development і production
+    Працює однаково в development і production (actualization_flag)
     """
-    if not actualized_value:
-        return False
-    
-    # Очищаємо значення 
-    clean_value = str(actualized_value).strip().lower()
-    
-    # Список значень що означають "актуалізовано"
-    actualized_values = ['так', 'yes', 'true', '1', 'актуалізовано', 'updated', 'ok']
-    
-    return clean_value in actualized_values
+    return is_actualized_value(actualized_value)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def clean_text_value(value):
-    """Clean text value for safe database storage"""
-    if value is None or str(value).lower() in ['nan', 'none']:
-        return None
-    
-    text = str(value).strip()
-    if text.lower() == 'nan' or text == '':
-        return None
-    
-    # Remove problematic characters
-    text = text.replace('\x00', '').replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
-    text = text.replace('\t', ' ')
-    
-    # Limit length to prevent database errors
-    if len(text) > 500:
-        text = text[:500]
-    
-    return text
-
-def clean_numeric_value(value):
-    """Clean numeric value for safe database storage"""
-    if value is None or str(value).lower() in ['nan', 'none']:
-        return None
-    
-    try:
-        text = str(value).strip().replace(',', '').replace(' ', '').replace('-', '0')
-        if text == '' or text.lower() == 'nan':
-            return None
-        return float(text)
-    except:
-        return None
+def is_actualization_file(filename):
+    """Файл актуалізації: actualization_*.csv або Excel (рушій актуалізації читає його напряму)"""
+    return filename.startswith('actualization_') and filename.endswith(('.csv', '.xlsx', '.xls'))
 
 def process_excel_data_optimized(file_path, file_type='basic'):
-    """Optimized processing for large files up to 160K rows"""
-    success_count = 0
-    error_count = 0
-    
-    # Convert Excel to CSV first if needed
-    csv_file_path = file_path.replace('.xlsx', '.csv').replace('.xls', '.csv')
-    
-    if file_path.endswith(('.xlsx', '.xls')):
-        try:
-            # Use openpyxl only for conversion to CSV
-            import openpyxl
-            wb = openpyxl.load_workbook(file_path, read_only=True)
-            ws = wb.active
-            
-            with open(csv_file_path, 'w', newline='', encoding='utf-8') as csvfile:
-                writer = csv.writer(csvfile)
-                for row in ws.iter_rows(values_only=True):
-                    cleaned_row = []
-                    for cell in row:
-                        if cell is not None:
-                            cleaned_row.append(str(cell))
-                        else:
-                            cleaned_row.append('')
-                    writer.writerow(cleaned_row)
-            wb.close()
-            
-        except Exception as e:
-            logging.error(f"Error converting Excel to CSV: {e}")
-            return 0, 1
-    else:
-        csv_file_path = file_path
-    
-    # Process CSV file
-    try:
-        with open(csv_file_path, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            
-            companies_to_create = []
-            row_count = 0
-            
-            for row in reader:
-                row_count += 1
-                try:
-                    # Get EDRPOU
-                    edrpou = None
-                    for key in ['ЄДРПОУ', 'Код ЄДРПОУ', 'edrpou']:
-                        if key in row and row[key]:
-                            edrpou = str(row[key]).strip()
-                            break
-                    
-                    if not edrpou or edrpou == 'nan':
-                        error_count += 1
-                        continue
-                    
-                    # Collect company data
-                    company_data = {
-                        'edrpou': edrpou,
-                        'name': (row.get('Назва', '') or row.get('Название компании', '') or row.get('Назва компанії', ''))[:500],
-                        'kved_code': (row.get('КВЕД', '') or row.get('Код КВЕД', ''))[:20],
-                        'region': (row.get('Регіон', '') or row.get('Область', ''))[:100]
-                    }
-                    
-                    # Parse numeric fields safely
-                    try:
-                        personnel_str = row.get('Кількість працівників', '') or row.get('Персонал (2019 р.)', '') or row.get('Персонал (осіб)', '')
-                        if personnel_str and personnel_str != 'nan':
-                            company_data['personnel'] = int(float(personnel_str))
-                    except:
-                        company_data['personnel'] = None
-                    
-                    try:
-                        revenue_str = row.get('Дохід', '') or row.get('Чистий дохід (тис. грн)', '')
-                        if revenue_str and revenue_str != 'nan':
-                            company_data['revenue'] = float(revenue_str)
-                    except:
-                        company_data['revenue'] = None
-                    
-                    companies_to_create.append(company_data)
-                    
-                    # Process in batches of 200 for large file efficiency
-                    if len(companies_to_create) >= 200:
-                        batch_success = process_simple_batch(companies_to_create)
-                        success_count += batch_success
-                        error_count += (len(companies_to_create) - batch_success)
-                        companies_to_create = []
-                        
-                        if row_count % 2000 == 0:
-                            logging.info(f"Processed {row_count} rows: {success_count} success, {error_count} errors")
-                
-                except Exception as e:
-                    logging.error(f"Error processing row {row_count}: {e}")
-                    error_count += 1
-                    continue
-            
-            # Process remaining companies
-            if companies_to_create:
-                batch_success = process_simple_batch(companies_to_create)
-                success_count += batch_success
-                error_count += (len(companies_to_create) - batch_success)
-        
-        # Clean up CSV file if it was converted
-        if csv_file_path != file_path:
-            os.remove(csv_file_path)
-            
-    except Exception as e:
-        logging.error(f"Error processing CSV: {e}")
-        error_count += 100
-    
-    return success_count, error_count
-
-def process_simple_batch(companies_data):
-    """Efficient batch processing with bulk operations"""
-    success_count = 0
-    
-    try:
-        # Get all existing EDRPOU codes in this batch for efficient lookup
-        edrpou_list = [data['edrpou'] for data in companies_data]
-        existing_companies = {
-            company.edrpou: company for company in 
-            db.session.query(Company).filter(Company.edrpou.in_(edrpou_list)).all()
-        }
-        
-        # Process companies
-        for data in companies_data:
-            try:
-                edrpou = data['edrpou']
-                
-                if edrpou in existing_companies:
-                    # Update existing company
-                    company = existing_companies[edrpou]
-                    if data['name']:
-                        company.name = data['name']
-                    if data['kved_code']:
-                        company.kved_code = data['kved_code']
-                    if data['region']:
-                        company.region_name = data['region']
-                    if data.get('personnel'):
-                        company.personnel_2019 = data['personnel']
-                    if data.get('revenue'):
-                        company.revenue_2019 = data['revenue']
-                else:
-                    # Create new company
-                    company = Company(
-                        edrpou=edrpou,
-                        name=data['name'][:500] if data['name'] else None,
-                        kved_code=data['kved_code'][:20] if data['kved_code'] else None,
-                        region_name=data['region'][:100] if data['region'] else None,
-                        personnel_2019=data.get('personnel'),
-                        revenue_2019=data.get('revenue'),
-                        source='основний',
-                        actualized='ні'
-                    )
-                    db.session.add(company)
-                
-                success_count += 1
-                
-            except Exception as e:
-                logging.error(f"Error processing company {data['edrpou']}: {e}")
-                continue
-        
-        # Single commit for entire batch
-        db.session.commit()
-        
-    except Exception as e:
-        logging.error(f"Error in batch processing: {e}")
-        db.session.rollback()
-        success_count = 0
-    
-    return success_count
-
-def process_batch_to_database(batch_data):
-    """Process a batch of companies using PostgreSQL UPSERT for maximum performance"""
-    success_count = 0
-    error_count = 0
-    
-    # Prepare values list for bulk upsert
-    values_list = []
-    
-    for data in batch_data:
-        try:
-            edrpou = data['edrpou']
-            name = data['name'] if data['name'] else None
-            kved_code = data['kved_code'] if data['kved_code'] else None
-            region = data['region'] if data['region'] else None
-            
-            personnel_val = None
-            revenue_val = None
-            
-            if data['personnel']:
-                try:
-                    personnel_val = int(float(data['personnel']))
-                except:
-                    pass
-            
-            if data['revenue']:
-                try:
-                    revenue_val = float(data['revenue'])
-                except:
-                    pass
-            
-            values_list.append((edrpou, name, kved_code, personnel_val, revenue_val, region))
-            
-        except Exception as e:
-            logging.error(f"Error preparing data for {data.get('edrpou', 'unknown')}: {e}")
-            error_count += 1
-            continue
-    
-    if not values_list:
-        return 0, error_count
+    """Optimized processing for large files up to 160K rows via the ingestion pipeline"""
+    from ingestion_pipeline import ingest_file
+    from generations import companies_written
     
     try:
-        # Use PostgreSQL UPSERT for bulk insert/update
-        upsert_sql = """
-            INSERT INTO companies (edrpou, name, kved_code, personnel_2019, revenue_2019, region_name, source, actualized, created_at, updated_at)
-            VALUES %s
-            ON CONFLICT (edrpou) 
-            DO UPDATE SET 
-                name = EXCLUDED.name,
-                kved_code = EXCLUDED.kved_code,
-                personnel_2019 = EXCLUDED.personnel_2019,
-                revenue_2019 = EXCLUDED.revenue_2019,
-                region_name = EXCLUDED.region_name,
-                updated_at = CURRENT_TIMESTAMP
-        """
-        
-        # Create VALUES clause
-        values_str = ','.join([
-            f"('{edrpou}', " +
-            (f"'{name}'" if name else 'NULL') + ", " +
-            (f"'{kved_code}'" if kved_code else 'NULL') + ", " +
-            f"{personnel if personnel else 'NULL'}, {revenue if revenue else 'NULL'}, " +
-            (f"'{region}'" if region else 'NULL') + ", 'основний', 'ні', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)"
-            for edrpou, name, kved_code, personnel, revenue, region in values_list
-        ])
-        
-        final_sql = upsert_sql.replace('%s', values_str)
-        
-        # Execute the bulk upsert
-        db.session.execute(text(final_sql))
-        db.session.commit()
-        
-        success_count = len(values_list)
-        
+        result = ingest_file(file_path)
+        logging.info(f"Pipeline timings for {file_path}: {result['steps']}")
+        companies_written()  # Фасети і знімки перебудовуються для нових даних
+        return result['written'], result['rows_rejected']
     except Exception as e:
-        logging.error(f"Error in bulk upsert: {e}")
-        db.session.rollback()
-        
-        # Fallback: process one by one
-        for edrpou, name, kved_code, personnel, revenue, region in values_list:
-            try:
-                simple_upsert = text("""
-                    INSERT INTO companies (edrpou, name, kved_code, personnel_2019, revenue_2019, region_name, source, actualized, created_at, updated_at)
-                    VALUES (:edrpou, :name, :kved_code, :personnel, :revenue, :region, 'основний', 'ні', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-                    ON CONFLICT (edrpou) 
-                    DO UPDATE SET 
-                        name = EXCLUDED.name,
-                        kved_code = EXCLUDED.kved_code,
-                        personnel_2019 = EXCLUDED.personnel_2019,
-                        revenue_2019 = EXCLUDED.revenue_2019,
-                        region_name = EXCLUDED.region_name,
-                        updated_at = CURRENT_TIMESTAMP
-                """)
-                
-                db.session.execute(simple_upsert, {
-                    'edrpou': edrpou,
-                    'name': name,
-                    'kved_code': kved_code,
-                    'personnel': personnel,
-                    'revenue': revenue,
-                    'region': region
-                })
-                db.session.commit()
-                success_count += 1
-                
-            except Exception as e2:
-                logging.error(f"Error in fallback upsert for {edrpou}: {e2}")
-                db.session.rollback()
-                error_count += 1
-                continue
-    
-    return success_count, error_count
+        logging.error(f"Error processing file {file_path}: {e}")
+        return 0, 1
 
 @main.route('/debug-stats')
 @login_required 
@@ -378,113 +72,36 @@ def debug_stats():
 def index():
     if current_user.is_authenticated:
         try:
-            # Use only Raw SQL queries - they work perfectly on production!
-            total_companies = db.session.execute(db.text("SELECT COUNT(*) FROM companies")).scalar() or 0
-            
-            region_count_query = db.session.execute(
-                db.text("SELECT COUNT(DISTINCT region_name) FROM companies WHERE region_name IS NOT NULL AND region_name != ''")
-            ).scalar() or 0
-            
-            kved_count_query = db.session.execute(
-                db.text("SELECT COUNT(DISTINCT kved_code) FROM companies WHERE kved_code IS NOT NULL AND kved_code != ''")
-            ).scalar() or 0
-            
-            logging.info(f"Stats loaded: companies={total_companies}, regions={region_count_query}, kved={kved_count_query}")
+            # Зведені таблиці dashboard_stats: O(#КВЕД) рядків замість сканування companies
+            from dashboard_stats import get_dashboard_stats
+            dashboard = get_dashboard_stats()
             
-            # Recent companies using working Raw SQL pattern
-            recent_companies = []
-            try:
-                recent_rows = db.session.execute(
-                    db.text("SELECT edrpou, name, region_name, kved_code, created_at FROM companies ORDER BY created_at DESC NULLS LAST LIMIT 5")
-                ).fetchall()
-                
-                for row in recent_rows:
-                    recent_companies.append(type('Company', (), {
-                        'edrpou': row[0], 
-                        'name': row[1], 
-                        'region_name': row[2], 
-                        'kved_code': row[3],
-                        'created_at': row[4] if row[4] else type('datetime', (), {'strftime': lambda x: 'Невідомо'})()
-                    })())
-                    
-                logging.info(f"Recent companies loaded: {len(recent_companies)}")
-            except Exception as e:
-                logging.error(f"Error getting recent companies: {e}")
-            
-            # KVED statistics - правильна логіка для відбору та актуалізації
             kved_stats = []
-            try:
-                # Перевіряємо чи є активні відбори
-                active_selection = db.session.execute(
-                    db.text("SELECT id FROM selection_bases WHERE is_active = true LIMIT 1")
-                ).scalar()
-                
-                if active_selection:
-                    # Якщо є активний відбір - рахуємо компанії в відборі + актуалізовані
-                    kved_query = db.session.execute(
-                        db.text("""
-                            SELECT 
-                                c.kved_code,
-                                c.kved_description,
-                                COUNT(*) as total_count,
-                                COUNT(CASE WHEN sc.company_id IS NOT NULL THEN 1 END) as after_selection_count,
-                                COUNT(CASE WHEN LOWER(TRIM(c.actualized)) IN ('так', 'yes', 'true', '1', 'актуалізовано', 'updated', 'ok') THEN 1 END) as really_actualized_count
-                            FROM companies c
-                            LEFT JOIN selection_companies sc ON c.id = sc.company_id 
-                            WHERE c.kved_code IS NOT NULL AND c.kved_code != ''
-                            GROUP BY c.kved_code, c.kved_description 
-                            ORDER BY total_count DESC 
-                            LIMIT 10
-                        """)
-                    ).fetchall()
-                else:
-                    # Якщо немає активного відбору - рахуємо тільки загальну кількість + актуалізовані
-                    kved_query = db.session.execute(
-                        db.text("""
-                            SELECT 
-                                kved_code,
-                                kved_description,
-                                COUNT(*) as total_count,
-                                0 as after_selection_count,
-                                COUNT(CASE WHEN LOWER(TRIM(actualized)) IN ('так', 'yes', 'true', '1', 'актуалізовано', 'updated', 'ok') THEN 1 END) as really_actualized_count
-                            FROM companies 
-                            WHERE kved_code IS NOT NULL AND kved_code != ''
-                            GROUP BY kved_code, kved_description 
-                            ORDER BY total_count DESC 
-                            LIMIT 10
-                        """)
-                    ).fetchall()
-                
-                for row in kved_query:
-                    after_selection_text = "Відбір не створений" if row[3] == 0 else str(row[3])
-                    actualized_text = f"{row[4]}" if row[4] > 0 else "0"
-                    
-                    kved_stats.append({
-                        'code': row[0],
-                        'description': row[1][:50] + '...' if row[1] and len(str(row[1])) > 50 else (row[1] or 'Не вказано'),
-                        'total_count': row[2],
-                        'after_selection': row[3],  # Кількість після відбору (0 якщо відбору немає)
-                        'selection_criteria': actualized_text  # Кількість реально актуалізованих
-                    })
-                    
-                logging.info(f"KVED stats loaded: {len(kved_stats)} entries")
-            except Exception as e:
-                logging.error(f"Error getting KVED statistics: {e}")
-
+            for row in dashboard['kved_statistics']:
+                description = row['description']
+                kved_stats.append({
+                    'code': row['code'],
+                    'description': description[:50] + '...' if description and len(str(description)) > 50 else (description or 'Не вказано'),
+                    'total_count': row['total_count'],
+                    'after_selection': row['after_selection'],  # Кількість після відбору (0 якщо відбору немає)
+                    'selection_criteria': str(row['actualized_count'])  # Кількість реально актуалізованих
+                })
+            
             stats = {
-                'total_companies': total_companies,
-                'total_regions': region_count_query,
-                'total_kved': kved_count_query,
-                'recent_companies': recent_companies,
+                'total_companies': dashboard['total_companies'],
+                'total_regions': dashboard['total_regions'],
+                'total_kved': dashboard['total_kved'],
+                'recent_companies': dashboard['recent_companies'],
                 'kved_statistics': kved_stats
             }
             
-            # Debug logging
-            logging.info(f"Dashboard stats: companies={total_companies}, regions={region_count_query}, kved={kved_count_query}, recent={len(recent_companies)}, kved_stats={len(kved_stats)}")
+            logging.info(f"Dashboard stats: companies={stats['total_companies']}, regions={stats['total_regions']}, "
+                         f"kved={stats['total_kved']}, refreshed_at={dashboard['refreshed_at']}")
             
             return render_template('index.html', stats=stats)
         except Exception as e:
             logging.error(f"Error in index route: {e}")
+            db.session.rollback()
             # Return basic template without stats
             return render_template('index.html', stats={
                 'total_companies': 0,
@@ -527,30 +144,15 @@ def upload():
                 logging.info(f"Processing file: {filename}")
                 
                 if action == 'upload':
-                    # Конвертація в CSV для подальшої обробки
+                    # Excel читається потоково і пишеться в базу батчами, без проміжного CSV
                     if filename.endswith(('.xlsx', '.xls')):
-                        csv_filename = filename.replace('.xlsx', '.csv').replace('.xls', '.csv')
-                        csv_path = os.path.join('uploads', f"converted_{csv_filename}")
-                        
-                        import openpyxl
-                        wb = openpyxl.load_workbook(file_path, read_only=True)
-                        ws = wb.active
-                        
-                        with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-                            writer = csv.writer(csvfile)
-                            row_count = 0
-                            for row in ws.iter_rows(values_only=True):
-                                cleaned_row = []
-                                for cell in row:
-                                    if cell is not None:
-                                        cleaned_row.append(str(cell))
-                                    else:
-                                        cleaned_row.append('')
-                                writer.writerow(cleaned_row)
-                                row_count += 1
-                        
-                        wb.close()
-                        flash(f'Excel файл {filename} конвертовано в CSV. Знайдено {row_count} рядків. Файл збережено як {csv_filename} для подальшої обробки.', 'success')
+                        # Завантаження виконується фоновою задачею, файл видаляє сама задача
+                        from jobs import submit_job
+                        job = submit_job('ingest_file', {'filename': filename, 'remove_file': True},
+                                         target=filename, user_id=current_user.id)
+                        flash(f'Excel файл {filename} поставлено в чергу завантаження (задача #{job.id}). '
+                              f'Прогрес: /api/jobs/{job.id}', 'success')
+                        return redirect(url_for('main.upload'))
                         
                     elif filename.endswith('.csv'):
                         # Скопіювати CSV файл
@@ -563,30 +165,14 @@ def upload():
                         flash(f'CSV файл {filename} імпортовано. Знайдено {row_count} рядків. Готово для подальшої обробки.', 'success')
                         
                 elif action == 'actualize':
-                    # Конвертація файлу актуалізації в CSV для подальшої обробки (як у кроці 1)
+                    # Excel зберігається як є: actualization_engine читає його напряму
+                    # (OpenpyxlReader), без проміжного CSV
                     if filename.endswith(('.xlsx', '.xls')):
-                        csv_filename = filename.replace('.xlsx', '.csv').replace('.xls', '.csv')
-                        csv_path = os.path.join('uploads', f"actualization_{csv_filename}")
-                        
-                        import openpyxl
-                        wb = openpyxl.load_workbook(file_path, read_only=True)
-                        ws = wb.active
-                        
-                        with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-                            writer = csv.writer(csvfile)
-                            row_count = 0
-                            for row in ws.iter_rows(values_only=True):
-                                cleaned_row = []
-                                for cell in row:
-                                    if cell is not None:
-                                        cleaned_row.append(str(cell))
-                                    else:
-                                        cleaned_row.append('')
-                                writer.writerow(cleaned_row)
-                                row_count += 1
+                        excel_path = os.path.join('uploads', f"actualization_{filename}")
+                        import shutil
+                        shutil.copy2(file_path, excel_path)
                         
-                        wb.close()
-                        flash(f'📁 Excel файл {filename} конвертовано для актуалізації. Знайдено {row_count} рядків. Файл збережено як actualization_{csv_filename} для подальшої обробки.', 'success')
+                        flash(f'📁 Excel файл {filename} підготовлено для актуалізації. Файл збережено як actualization_{filename}.', 'success')
                         
                     elif filename.endswith('.csv'):
                         # Скопіювати CSV файл для актуалізації
@@ -640,31 +226,20 @@ def file_manager():
             return redirect(url_for('main.process_file', filename=filename))
             
         elif action == 'process_external' and filename:
-            # Process with external script
+            # Перевірка і підготовка CSV фоновою задачею (замість зовнішнього скрипта)
             file_path = os.path.join(uploads_dir, filename)
             if os.path.exists(file_path) and filename.endswith('.csv'):
-                try:
-                    import subprocess
-                    result = subprocess.run([
-                        'python', 'process_large_csv.py', file_path
-                    ], capture_output=True, text=True, timeout=300)
-                    
-                    if result.returncode == 0:
-                        flash(f'Файл {filename} успішно оброблено зовнішнім скриптом. Перевірте консоль для деталей.', 'success')
-                    else:
-                        flash(f'Помилка обробки файлу {filename}: {result.stderr}', 'error')
-                        
-                except subprocess.TimeoutExpired:
-                    flash(f'Обробка файлу {filename} перервана через таймаут (5 хвилин)', 'warning')
-                except Exception as e:
-                    flash(f'Помилка запуску зовнішнього скрипта: {str(e)}', 'error')
+                from jobs import submit_job
+                job = submit_job('process_csv', {'filename': filename}, target=filename, user_id=current_user.id)
+                flash(f'Обробку файлу {filename} поставлено в чергу (задача #{job.id}). '
+                      f'Результат з\'явиться як {filename.replace(".csv", "_processed.csv")}.', 'success')
             else:
                 flash(f'Файл {filename} не знайдено або це не CSV файл.', 'error')
                 
         elif action == 'actualize_external' and filename:
             # Перенаправити на сторінку прогресу актуалізації
             file_path = os.path.join(uploads_dir, filename)
-            if os.path.exists(file_path) and filename.startswith('actualization_') and filename.endswith('.csv'):
+            if os.path.exists(file_path) and is_actualization_file(filename):
                 return redirect(url_for('main.actualize_progress', filename=filename))
             else:
                 flash(f'Файл {filename} не знайдено або це не файл актуалізації.', 'error')
@@ -688,24 +263,13 @@ def file_manager():
                 flash(f'Файл результату актуалізації {filename} не знайдено.', 'error')
             
         elif action == 'bulk_import' and filename:
-            # Швидке масове завантаження через COPY FROM
+            # Швидке масове завантаження через COPY FROM у staging + upsert у фоновій задачі
             file_path = os.path.join(uploads_dir, filename)
             if os.path.exists(file_path) and filename.endswith('_processed.csv'):
-                try:
-                    import subprocess
-                    result = subprocess.run([
-                        'python', 'bulk_import_optimized.py', file_path
-                    ], capture_output=True, text=True, timeout=1800)  # 30 хвилин таймаут
-                    
-                    if result.returncode == 0:
-                        flash(f'Масове завантаження {filename} завершено успішно за рекордний час!', 'success')
-                    else:
-                        flash(f'Помилка масового завантаження: {result.stderr}', 'error')
-                        
-                except subprocess.TimeoutExpired:
-                    flash(f'Масове завантаження перервано через таймаут', 'warning')
-                except Exception as e:
-                    flash(f'Помилка запуску масового завантаження: {str(e)}', 'error')
+                from jobs import submit_job
+                job = submit_job('import_processed_csv', {'filename': filename},
+                                 target=filename, user_id=current_user.id)
+                flash(f'Масове завантаження {filename} поставлено в чергу (задача #{job.id}).', 'success')
             else:
                 flash(f'Файл {filename} не знайдено або це не оброблений CSV файл.', 'error')
         
@@ -788,12 +352,13 @@ def actualize_csv(filename):
     if not os.path.exists(file_path):
         return jsonify({'error': 'File not found'}), 404
     
-    if not filename.startswith('actualization_') or not filename.endswith('.csv'):
+    if not is_actualization_file(filename):
         return jsonify({'error': 'Invalid actualization file format'}), 400
     
     try:
-        # Read actualization CSV file  
-        df = pd.read_csv(file_path, encoding='utf-8')
+        # Read actualization file (CSV або Excel)
+        from ingestion_pipeline import read_frame
+        df = read_frame(file_path)
         
         if df is None or df.empty:
             return jsonify({'error': 'Не вдалося прочитати файл актуалізації'}), 500
@@ -853,56 +418,19 @@ def actualize_start(filename):
     if not os.path.exists(file_path):
         return jsonify({'error': 'File not found'}), 404
     
-    if not filename.startswith('actualization_') or not filename.endswith('.csv'):
+    if not is_actualization_file(filename):
         return jsonify({'error': 'Invalid actualization file format'}), 400
     
     try:
-        import subprocess
-        import threading
+        from jobs import submit_job, latest_job, ACTIVE_STATUSES
         
-        # Створити файл статусу
-        status_file = file_path.replace('.csv', '_status.txt')
-        with open(status_file, 'w', encoding='utf-8') as f:
-            f.write('processing')
-        
-        def run_actualization():
-            try:
-                # Запустити зовнішній скрипт
-                result = subprocess.run([
-                    'python', 'process_actualization.py', file_path
-                ], capture_output=True, text=True, timeout=900)
-                
-                if result.returncode == 0:
-                    # Перевірити результат
-                    result_filename = file_path.replace('.csv', '_actualized.csv')
-                    if os.path.exists(result_filename):
-                        with open(result_filename, 'r', encoding='utf-8') as f:
-                            updated_count = sum(1 for _ in f) - 1
-                        
-                        # Записати успішний статус
-                        with open(status_file, 'w', encoding='utf-8') as f:
-                            f.write(f'completed:{updated_count}:{os.path.basename(result_filename)}')
-                    else:
-                        with open(status_file, 'w', encoding='utf-8') as f:
-                            f.write('error:Результуючий файл не створено')
-                else:
-                    with open(status_file, 'w', encoding='utf-8') as f:
-                        f.write(f'error:{result.stderr}')
-                        
-            except subprocess.TimeoutExpired:
-                with open(status_file, 'w', encoding='utf-8') as f:
-                    f.write('error:Таймаут 15 хвилин')
-            except Exception as e:
-                with open(status_file, 'w', encoding='utf-8') as f:
-                    f.write(f'error:{str(e)}')
-        
-        # Запустити в окремому потоці
-        thread = threading.Thread(target=run_actualization)
-        thread.daemon = True
-        thread.start()
+        job = latest_job('actualize', filename)
+        if job is None or job.status not in ACTIVE_STATUSES:
+            job = submit_job('actualize', {'filename': filename}, target=filename, user_id=current_user.id)
         
         return jsonify({
             'status': 'started',
+            'job_id': job.id,
             'message': 'Обробка актуалізації запущена у фоновому режимі'
         })
         
@@ -917,55 +445,39 @@ def actualize_start(filename):
 @login_required
 @admin_required
 def actualize_status(filename):
-    """Check actualization processing status"""
-    
-    uploads_dir = 'uploads'
-    status_file = os.path.join(uploads_dir, filename.replace('.csv', '_status.txt'))
+    """Check actualization processing status (стан останньої задачі actualize для файлу)"""
+    from jobs import latest_job, job_to_dict, COMPLETED, FAILED, CANCELLED
     
-    if not os.path.exists(status_file):
+    job = latest_job('actualize', filename)
+    if job is None:
         return jsonify({
             'status': 'not_started',
             'message': 'Обробка не запущена'
         })
     
-    try:
-        with open(status_file, 'r', encoding='utf-8') as f:
-            status_content = f.read().strip()
-        
-        if status_content == 'processing':
-            return jsonify({
-                'status': 'processing',
-                'message': 'Обробка триває...'
-            })
-        elif status_content.startswith('completed:'):
-            parts = status_content.split(':')
-            updated_count = int(parts[1]) if len(parts) > 1 else 0
-            result_file = parts[2] if len(parts) > 2 else 'unknown'
-            
-            return jsonify({
-                'status': 'completed',
-                'message': f'Актуалізація завершена! Оновлено {updated_count} компаній.',
-                'updated_count': updated_count,
-                'result_file': result_file
-            })
-        elif status_content.startswith('error:'):
-            error_msg = status_content[6:]  # Видалити 'error:'
-            return jsonify({
-                'status': 'error',
-                'error': error_msg
-            })
-        else:
-            return jsonify({
-                'status': 'unknown',
-                'message': 'Невідомий статус обробки'
-            })
-            
-    except Exception as e:
-        logging.error(f"Error checking status: {str(e)}")
+    state = job_to_dict(job)
+    if job.status == COMPLETED:
+        result = state['result'] or {}
+        updated_count = result.get('matched', 0)
+        return jsonify({
+            'status': 'completed',
+            'message': f'Актуалізація завершена! Оновлено {updated_count} компаній.',
+            'updated_count': updated_count,
+            'result_file': result.get('result_file', 'unknown'),
+            'job': state
+        })
+    elif job.status in (FAILED, CANCELLED):
         return jsonify({
             'status': 'error',
-            'error': f'Помилка перевірки статусу: {str(e)}'
+            'error': job.error or 'Обробку скасовано',
+            'job': state
         })
+    
+    return jsonify({
+        'status': 'processing',
+        'message': job.message or 'Обробка триває...',
+        'job': state
+    })
 
 @main.route('/api/process-csv-simple/<filename>')
 @login_required
@@ -981,71 +493,50 @@ def process_csv_simple(filename):
         return jsonify({'error': 'File not found'}), 404
     
     try:
-        # Read file based on type (Excel or CSV)
-        df = None
+        from ingestion_pipeline import default_reader
         
-        if filename.endswith('.xlsx') or filename.endswith('.xls'):
-            # Handle Excel files with encoding issues
-            for engine in ['openpyxl', 'xlrd', None]:
-                try:
-                    logging.info(f"API: Trying to read Excel with engine: {engine}")
-                    if engine:
-                        df = pd.read_excel(file_path, engine=engine)
-                    else:
-                        df = pd.read_excel(file_path)
-                    
-                    if df is not None and not df.empty:
-                        logging.info(f"API: Successfully read Excel file with {len(df)} rows using engine: {engine}")
-                        break
-                        
-                except UnicodeDecodeError as ude:
-                    logging.warning(f"API: Unicode decode error with engine {engine}: {str(ude)}")
-                    continue
-                except Exception as ee:
-                    logging.warning(f"API: Error reading with engine {engine}: {str(ee)}")
-                    continue
-        else:
-            # Handle CSV files
-            df = pd.read_csv(file_path, encoding='utf-8')
-        
-        if df is None or df.empty:
-            return jsonify({'error': 'Не вдалося прочитати файл. Перевірте кодування або формат.'}), 500
-        
-        total_lines = len(df)
+        total_lines = 0
         success_count = 0
         error_count = 0
         sample_data = []
         
-        # Debug: показати назви колонок
-        logging.info(f"API: Колонки в файлі: {list(df.columns)}")
-        
-        # Process DataFrame instead of CSV reader
-        for i, (index, row) in enumerate(df.iterrows()):
-            # Знайти колонку з ЄДРПОУ (гнучкий пошук)
-            edrpou = ''
-            for col_name in df.columns:
-                if any(keyword in col_name.upper() for keyword in ['ЄДРПОУ', 'EDRPOU']):
+        # Файл читається потоково батчами (xlsx - openpyxl read_only), без DataFrame на весь аркуш
+        for batch in default_reader(file_path):
+            if total_lines == 0:
+                # Debug: показати назви колонок
+                logging.info(f"API: Колонки в файлі: {list(batch.columns)}")
+                # Знайти колонку з ЄДРПОУ (гнучкий пошук)
+                edrpou_columns = [col_name for col_name in batch.columns
+                                  if any(keyword in str(col_name).upper() for keyword in ['ЄДРПОУ', 'EDRPOU'])]
+            
+            for _, row in batch.iterrows():
+                edrpou = ''
+                for col_name in edrpou_columns:
                     if not pd.isna(row[col_name]):
                         edrpou = str(row[col_name]).strip()
                         break
-            
-            # Debug: показати кілька прикладів ЄДРПОУ
-            if i < 5:
-                logging.info(f"API: Рядок {i}: ЄДРПОУ = '{edrpou}'")
-            
-            if edrpou and edrpou != 'nan' and len(edrpou) >= 6 and edrpou.isdigit():
-                success_count += 1
-                if len(sample_data) < 5:
-                    sample_data.append({
-                        'edrpou': edrpou,
-                        'name': str(row.get('Название компании', '') or row.get('Назва', '') or '')[:50],
-                        'kved': str(row.get('КВЕД', '') or row.get('KVED', '') or ''),
-                        'region': str(row.get('Область', '') or row.get('Region', '') or ''),
-                        'revenue': str(row.get('Чистий дохід від реалізації продукції    ', '') or row.get('Revenue', '') or ''),
-                        'profit': str(row.get('Чистий фінансовий результат: прибуток                                           ', '') or row.get('Profit', '') or '')
-                    })
-            else:
-                error_count += 1
+                
+                # Debug: показати кілька прикладів ЄДРПОУ
+                if total_lines < 5:
+                    logging.info(f"API: Рядок {total_lines}: ЄДРПОУ = '{edrpou}'")
+                total_lines += 1
+                
+                if edrpou and edrpou != 'nan' and len(edrpou) >= 6 and edrpou.isdigit():
+                    success_count += 1
+                    if len(sample_data) < 5:
+                        sample_data.append({
+                            'edrpou': edrpou,
+                            'name': str(row.get('Название компании', '') or row.get('Назва', '') or '')[:50],
+                            'kved': str(row.get('КВЕД', '') or row.get('KVED', '') or ''),
+                            'region': str(row.get('Область', '') or row.get('Region', '') or ''),
+                            'revenue': str(row.get('Чистий дохід від реалізації продукції    ', '') or row.get('Revenue', '') or ''),
+                            'profit': str(row.get('Чистий фінансовий результат: прибуток                                           ', '') or row.get('Profit', '') or '')
+                        })
+                else:
+                    error_count += 1
+        
+        if total_lines == 0:
+            return jsonify({'error': 'Не вдалося прочитати файл. Перевірте кодування або формат.'}), 500
         
         return jsonify({
             'success': True,
@@ -1076,9 +567,6 @@ def database_import(filename):
     
     return render_template('database_import_progress.html', filename=filename)
 
-# Global variable to track import status
-import_status = {}
-
 @main.route('/api/start-database-import/<filename>', methods=['POST'])
 @login_required
 @admin_required
@@ -1092,25 +580,14 @@ def start_database_import(filename):
         return jsonify({'error': 'File not found'}), 404
     
     try:
-        # Initialize status
-        import_status[filename] = {
-            'running': True,
-            'processed': 0,
-            'total': 0,
-            'updated': 0,
-            'inserted': 0,
-            'errors': 0,
-            'success': False,
-            'message': 'Підготовка...'
-        }
+        from jobs import submit_job, latest_job, ACTIVE_STATUSES
         
-        # Start background process
-        import threading
-        thread = threading.Thread(target=run_database_import, args=(filename, file_path))
-        thread.daemon = True
-        thread.start()
+        job = latest_job('import_processed_csv', filename)
+        if job is None or job.status not in ACTIVE_STATUSES:
+            job = submit_job('import_processed_csv', {'filename': filename},
+                             target=filename, user_id=current_user.id)
         
-        return jsonify({'success': True, 'message': 'Import started'})
+        return jsonify({'success': True, 'job_id': job.id, 'message': 'Import started'})
         
     except Exception as e:
         logging.error(f"Error starting import: {e}")
@@ -1119,321 +596,49 @@ def start_database_import(filename):
 @main.route('/api/database-import-status/<filename>')
 @login_required
 def database_import_status(filename):
-    """Get database import status"""
-    status = import_status.get(filename, {
-        'running': False,
-        'processed': 0,
-        'total': 0,
-        'updated': 0,
-        'inserted': 0,
-        'errors': 0,
-        'success': False,
-        'message': 'Не знайдено'
-    })
+    """Get database import status (стан останньої задачі import_processed_csv для файлу)"""
+    from jobs import latest_job, job_to_dict, ACTIVE_STATUSES, COMPLETED
     
-    return jsonify(status)
-
-def run_database_import(filename, file_path):
-    """Run database import in background thread with optimizations"""
-    from app import app, db
-    import csv
+    job = latest_job('import_processed_csv', filename)
+    if job is None:
+        return jsonify({
+            'running': False,
+            'processed': 0,
+            'total': 0,
+            'updated': 0,
+            'inserted': 0,
+            'errors': 0,
+            'success': False,
+            'message': 'Не знайдено'
+        })
     
-    with app.app_context():
-        try:
-            # Оптимізація PostgreSQL для швидшого завантаження (тільки дозволені параметри)
-            try:
-                db.session.execute(db.text("SET synchronous_commit = off;"))
-                db.session.commit()
-            except Exception:
-                # Ігноруємо помилки з недоступними параметрами в production
-                pass
-            
-            # Count total lines
-            with open(file_path, 'r', encoding='utf-8') as f:
-                total_lines = sum(1 for _ in f) - 1  # exclude header
-            
-            import_status[filename]['total'] = total_lines
-            import_status[filename]['message'] = f'Початок обробки {total_lines} записів'
-            
-            success_count = 0
-            update_count = 0
-            insert_count = 0
-            error_count = 0
-            
-            # Process CSV file
-            with open(file_path, 'r', encoding='utf-8') as csvfile:
-                reader = csv.DictReader(csvfile)
-                
-                for row_num, row in enumerate(reader, 1):
-                    try:
-                        edrpou = row.get('edrpou', '').strip()
-                        if not edrpou:
-                            error_count += 1
-                            continue
-                        
-                        # Check if company exists (optimized query)
-                        existing = db.session.execute(
-                            db.text("SELECT 1 FROM companies WHERE edrpou = :edrpou LIMIT 1"), 
-                            {'edrpou': edrpou}
-                        ).fetchone()
-                        
-                        if existing:
-                            # Update existing company
-                            db.session.execute(db.text("""
-                                UPDATE companies SET 
-                                    name = COALESCE(:name, name),
-                                    kved_code = COALESCE(:kved_code, kved_code),
-                                    kved_description = COALESCE(:kved_description, kved_description),
-                                    region_name = COALESCE(:region_name, region_name),
-                                    phone = COALESCE(:phone, phone),
-                                    address = COALESCE(:address, address),
-                                    company_size_name = COALESCE(:company_size_name, company_size_name),
-                                    personnel_2019 = COALESCE(:personnel_2019, personnel_2019),
-                                    revenue_2019 = COALESCE(:revenue_2019, revenue_2019),
-                                    profit_2019 = COALESCE(:profit_2019, profit_2019),
-                                    updated_at = CURRENT_TIMESTAMP
-                                WHERE edrpou = :edrpou
-                            """), {
-                                'name': row.get('name', '')[:500] if row.get('name') else None,
-                                'kved_code': row.get('kved_code', '')[:20] if row.get('kved_code') else None,
-                                'kved_description': row.get('kved_description', '')[:500] if row.get('kved_description') else None,
-                                'region_name': row.get('region_name', '')[:100] if row.get('region_name') else None,
-                                'phone': row.get('phone', '')[:50] if row.get('phone') else None,
-                                'address': row.get('address', '')[:500] if row.get('address') else None,
-                                'company_size_name': row.get('company_size_name', '')[:50] if row.get('company_size_name') else None,
-                                'personnel_2019': int(float(row.get('personnel_2019', 0))) if row.get('personnel_2019') else None,
-                                'revenue_2019': float(row.get('revenue_2019', 0)) if row.get('revenue_2019') else None,
-                                'profit_2019': float(row.get('profit_2019', 0)) if row.get('profit_2019') else None,
-                                'edrpou': edrpou
-                            })
-                            update_count += 1
-                        else:
-                            # Insert new company
-                            db.session.execute(db.text("""
-                                INSERT INTO companies (
-                                    edrpou, name, kved_code, kved_description, region_name,
-                                    phone, address, company_size_name, personnel_2019,
-                                    revenue_2019, profit_2019, source, actualized, created_at
-                                ) VALUES (:edrpou, :name, :kved_code, :kved_description, :region_name, 
-                                         :phone, :address, :company_size_name, :personnel_2019,
-                                         :revenue_2019, :profit_2019, :source, :actualized, CURRENT_TIMESTAMP)
-                            """), {
-                                'edrpou': edrpou,
-                                'name': row.get('name', '')[:500] if row.get('name') else None,
-                                'kved_code': row.get('kved_code', '')[:20] if row.get('kved_code') else None,
-                                'kved_description': row.get('kved_description', '')[:500] if row.get('kved_description') else None,
-                                'region_name': row.get('region_name', '')[:100] if row.get('region_name') else None,
-                                'phone': row.get('phone', '')[:50] if row.get('phone') else None,
-                                'address': row.get('address', '')[:500] if row.get('address') else None,
-                                'company_size_name': row.get('company_size_name', '')[:50] if row.get('company_size_name') else None,
-                                'personnel_2019': int(float(row.get('personnel_2019', 0))) if row.get('personnel_2019') else None,
-                                'revenue_2019': float(row.get('revenue_2019', 0)) if row.get('revenue_2019') else None,
-                                'profit_2019': float(row.get('profit_2019', 0)) if row.get('profit_2019') else None,
-                                'source': 'імпорт',
-                                'actualized': 'так'
-                            })
-                            insert_count += 1
-                        
-                        success_count += 1
-                        
-                        # Update status every 500 records and commit in batches
-                        if row_num % 500 == 0:
-                            db.session.commit()
-                            import_status[filename].update({
-                                'processed': row_num,
-                                'updated': update_count,
-                                'inserted': insert_count,
-                                'errors': error_count,
-                                'message': f'Оброблено {row_num}/{total_lines}'
-                            })
-                    
-                    except Exception as e:
-                        error_count += 1
-                        logging.error(f"Error processing row {row_num}: {e}")
-                        continue
-            
-            # Final commit
-            db.session.commit()
-            
-            # Повернути стандартні налаштування PostgreSQL
-            try:
-                db.session.execute(db.text("SET synchronous_commit = on;"))
-                db.session.commit()
-            except Exception:
-                # Ігноруємо помилки з недоступними параметрами в production
-                pass
-            
-            # Update final status
-            import_status[filename].update({
-                'running': False,
-                'processed': success_count,
-                'updated': update_count,
-                'inserted': insert_count,
-                'errors': error_count,
-                'success': True,
-                'message': f'Завершено: {success_count} записів'
-            })
-            
-        except Exception as e:
-            logging.error(f"Critical error in database import: {e}")
-            import_status[filename].update({
-                'running': False,
-                'success': False,
-                'error': str(e),
-                'message': f'Критична помилка: {e}'
-            })
+    state = job_to_dict(job)
+    totals = state['result'] or {}
+    status = {
+        'running': job.status in ACTIVE_STATUSES,
+        'processed': state['rows_done'],
+        'total': state['rows_total'] or 0,
+        'updated': totals.get('updated', 0),
+        'inserted': totals.get('inserted', 0),
+        'errors': totals.get('errors', 0),
+        'success': job.status == COMPLETED,
+        'message': job.message or 'Підготовка...',
+        'throughput': state['throughput'],
+        'eta_seconds': state['eta_seconds'],
+        'job_id': job.id
+    }
+    if job.status == COMPLETED:
+        status['processed'] = totals.get('processed', status['processed'])
+        status['message'] = f"Завершено: {status['processed']} записів"
+    elif job.error:
+        status['error'] = job.error
+        status['message'] = f'Критична помилка: {job.error}'
+    
+    return jsonify(status)
 
 def process_csv_to_database(file_path):
     """Process CSV file to database with proper field mapping"""
-    success_count = 0
-    error_count = 0
-    
-    try:
-        with open(file_path, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            
-            batch_data = []
-            row_count = 0
-            
-            for row in reader:
-                row_count += 1
-                try:
-                    # Map CSV columns to database fields
-                    edrpou = str(row.get('Код ЄДРПОУ', '') or row.get('ЄДРПОУ', '')).strip()
-                    if not edrpou or edrpou == 'nan':
-                        error_count += 1
-                        continue
-                    
-                    # Extract all fields from CSV
-                    company_data = {
-                        'edrpou': edrpou,
-                        'name': (row.get('Название компании', '') or row.get('Назва', '') or row.get('Назва компанії', ''))[:500],
-                        'kved_code': str(row.get('КВЕД', '') or '').strip()[:20],
-                        'kved_description': (row.get('Основний вид діяльності (КВЕД)', '') or row.get('КВЕД опис', ''))[:500],
-                        'region_name': (row.get('Область', '') or row.get('Регіон', ''))[:100],
-                        'phone': str(row.get('Tелефон', '') or row.get('Телефон', ''))[:50],
-                        'address': (row.get('Адреса реєстрації', '') or row.get('Адреса', ''))[:500],
-                        'company_size_name': (row.get('Размер', '') or row.get('Розмір компанії', ''))[:50]
-                    }
-                    
-                    # Parse numeric fields safely
-                    try:
-                        personnel_str = str(row.get('Персонал (2019 р.)', '') or row.get('Кількість працівників', '') or row.get('Персонал (осіб)', ''))
-                        if personnel_str and personnel_str.replace('.', '').replace(',', '').isdigit():
-                            company_data['personnel_2019'] = int(float(personnel_str))
-                    except:
-                        company_data['personnel_2019'] = None
-                    
-                    try:
-                        revenue_str = str(row.get('Чистий дохід від реалізації продукції    ', '') or row.get('Дохід', '') or row.get('Чистий дохід (тис. грн)', ''))
-                        if revenue_str and revenue_str.replace(',', '.').replace(' ', ''):
-                            company_data['revenue_2019'] = float(revenue_str.replace(',', '.'))
-                    except:
-                        company_data['revenue_2019'] = None
-                    
-                    try:
-                        profit_str = str(row.get('Чистий фінансовий результат: прибуток                                           ', '') or row.get('Прибуток', '') or row.get('Прибуток (збиток)', ''))
-                        if profit_str and profit_str.replace(',', '.').replace(' ', ''):
-                            company_data['profit_2019'] = float(profit_str.replace(',', '.'))
-                    except:
-                        company_data['profit_2019'] = None
-                    
-                    batch_data.append(company_data)
-                    
-                    # Process in batches of 100
-                    if len(batch_data) >= 100:
-                        batch_success = process_csv_batch_to_db(batch_data)
-                        success_count += batch_success
-                        error_count += (len(batch_data) - batch_success)
-                        batch_data = []
-                        
-                        if row_count % 1000 == 0:
-                            logging.info(f"Processed {row_count} rows: {success_count} success, {error_count} errors")
-                            
-                except Exception as e:
-                    logging.error(f"Error processing row {row_count}: {e}")
-                    error_count += 1
-                    continue
-            
-            # Process remaining batch
-            if batch_data:
-                batch_success = process_csv_batch_to_db(batch_data)
-                success_count += batch_success
-                error_count += (len(batch_data) - batch_success)
-    
-    except Exception as e:
-        logging.error(f"Error processing CSV file: {e}")
-        error_count += 100
-    
-    return success_count, error_count
-
-def process_csv_batch_to_db(companies_data):
-    """Process batch of companies with all fields to database"""
-    success_count = 0
-    
-    try:
-        # Get existing companies for this batch
-        edrpou_list = [data['edrpou'] for data in companies_data]
-        existing_companies = {
-            company.edrpou: company for company in 
-            db.session.query(Company).filter(Company.edrpou.in_(edrpou_list)).all()
-        }
-        
-        for data in companies_data:
-            try:
-                edrpou = data['edrpou']
-                
-                if edrpou in existing_companies:
-                    # Update existing company with ALL fields
-                    company = existing_companies[edrpou]
-                    company.name = data['name'] if data['name'] else company.name
-                    company.kved_code = data['kved_code'] if data['kved_code'] else company.kved_code
-                    company.kved_description = data['kved_description'] if data['kved_description'] else company.kved_description
-                    company.region_name = data['region_name'] if data['region_name'] else company.region_name
-                    company.phone = data['phone'] if data['phone'] else company.phone
-                    company.address = data['address'] if data['address'] else company.address
-                    company.company_size_name = data['company_size_name'] if data['company_size_name'] else company.company_size_name
-                    
-                    if data['personnel_2019'] is not None:
-                        company.personnel_2019 = data['personnel_2019']
-                    if data['revenue_2019'] is not None:
-                        company.revenue_2019 = data['revenue_2019']
-                    if data['profit_2019'] is not None:
-                        company.profit_2019 = data['profit_2019']
-                else:
-                    # Create new company with ALL fields
-                    company = Company(
-                        edrpou=edrpou,
-                        name=data['name'] if data['name'] else None,
-                        kved_code=data['kved_code'] if data['kved_code'] else None,
-                        kved_description=data['kved_description'] if data['kved_description'] else None,
-                        region_name=data['region_name'] if data['region_name'] else None,
-                        phone=data['phone'] if data['phone'] else None,
-                        address=data['address'] if data['address'] else None,
-                        company_size_name=data['company_size_name'] if data['company_size_name'] else None,
-                        personnel_2019=data['personnel_2019'],
-                        revenue_2019=data['revenue_2019'],
-                        profit_2019=data['profit_2019'],
-                        source='основний',
-                        actualized='ні'
-                    )
-                    db.session.add(company)
-                
-                success_count += 1
-                
-            except Exception as e:
-                logging.error(f"Error processing company {data['edrpou']}: {e}")
-                continue
-        
-        # Single commit for entire batch
-        db.session.commit()
-        
-    except Exception as e:
-        logging.error(f"Error in CSV batch processing: {e}")
-        db.session.rollback()
-        success_count = 0
-    
-    return success_count
+    return process_excel_data_optimized(file_path)
 
 @main.route('/companies')
 @login_required
@@ -1442,89 +647,80 @@ def companies():
         flash('У вас немає прав для перегляду компаній.', 'danger')
         return redirect(url_for('main.index'))
     
-    page = request.args.get('page', 1, type=int)
+    from pagination import keyset_page, offset_page, count_rows, SORT_COLUMNS, DEFAULT_SORT
+    from company_search import search_condition
+    
+    page = max(request.args.get('page', 1, type=int), 1)
     per_page = 20  # Changed to 20 per page as requested
+    after = request.args.get('after', type=str)
+    before = request.args.get('before', type=str)
     
     # Search functionality
     search_edrpou = request.args.get('search_edrpou', type=str, default='').strip()
     
-    # Build query with optional filters
-    query = db.select(Company)
+    # Filters as conditions: the same list is used for the page query and the count
+    conditions = []
     
-    # EDRPOU search
-    if search_edrpou:
-        query = query.where(Company.edrpou.ilike(f'%{search_edrpou}%'))
+    # EDRPOU or name search (company_search: prefix indexes, trigram indexes when pg_trgm is available)
+    search = search_condition(search_edrpou)
+    if search is not None:
+        conditions.append(search)
     
     # Filter by region name
     region_name = request.args.get('region_name', type=str)
     if region_name:
-        query = query.where(Company.region_name == region_name)
+        conditions.append(Company.region_name == region_name)
     
     # Filter by KVED code
     kved_code = request.args.get('kved_code', type=str)
     if kved_code and not search_edrpou:  # Don't apply filter if search is active
-        query = query.where(Company.kved_code == kved_code)
+        conditions.append(Company.kved_code == kved_code)
     
     # Filter by company size
     size_id = request.args.get('size_id', type=str)
     if size_id and not search_edrpou:  # Don't apply filter if search is active
-        query = query.where(Company.company_size_name == size_id)
-    
-    # Sorting
-    sort_by = request.args.get('sort_by', 'name')
-    sort_order = request.args.get('sort_order', 'asc')
-    
-    if sort_by == 'revenue':
-        query = query.order_by(desc(Company.revenue_2019) if sort_order == 'desc' else asc(Company.revenue_2019))
-    elif sort_by == 'profit':
-        query = query.order_by(desc(Company.profit_2019) if sort_order == 'desc' else asc(Company.profit_2019))
-    elif sort_by == 'personnel':
-        query = query.order_by(desc(Company.personnel_2019) if sort_order == 'desc' else asc(Company.personnel_2019))
-    elif sort_by == 'ranking':
-        query = query.order_by(asc(Company.ranking) if sort_order == 'asc' else desc(Company.ranking))
+        conditions.append(Company.company_size_name == size_id)
+    
+    # Sorting: name, revenue, profit, personnel, ranking (id - stable tiebreak)
+    sort_by = request.args.get('sort_by', DEFAULT_SORT)
+    if sort_by not in SORT_COLUMNS:
+        sort_by = DEFAULT_SORT
+    sort_order = 'desc' if request.args.get('sort_order', 'asc') == 'desc' else 'asc'
+    
+    query = db.select(Company).where(*conditions)
+    
+    # Keyset pagination by cursor; OFFSET only for direct ?page=N links without cursor
+    if after or before or page == 1:
+        result_page = keyset_page(query, sort_by, sort_order, per_page, after=after, before=before)
     else:
-        query = query.order_by(asc(Company.name) if sort_order == 'asc' else desc(Company.name))
-    
-    # Get total count for pagination
-    total_companies = len(db.session.execute(query).scalars().all())
-    
-    # Apply pagination
-    query = query.offset((page - 1) * per_page).limit(per_page)
-    companies = db.session.execute(query).scalars().all()
-    
-    # Get unique values for filters (filter out None values)
-    regions = db.session.execute(
-        db.select(Company.region_name).distinct().where(Company.region_name.isnot(None))
-    ).scalars().all()
-    kveds = db.session.execute(
-        db.select(Company.kved_code).distinct().where(Company.kved_code.isnot(None))
-    ).scalars().all()
-    sizes = db.session.execute(
-        db.select(Company.company_size_name).distinct().where(Company.company_size_name.isnot(None))
-    ).scalars().all()
-    
-    # Create proper pagination object
+        result_page = offset_page(query, sort_by, sort_order, page, per_page)
+    
+    # Count without loading ORM objects (estimate for the unfiltered table)
+    total_companies, total_estimated = count_rows(conditions)
+    
+    # Get unique values for filters (cached facets, None values excluded)
+    from facets import facet_values
+    regions = facet_values('regions')
+    kveds = facet_values('kved')
+    sizes = facet_values('sizes')
+    
+    # Pagination object for the template (page number is shown only, navigation goes by cursors)
     class Pagination:
-        def __init__(self, items, page, per_page, total):
-            self.items = items
+        def __init__(self, result_page, page, per_page, total, total_estimated):
+            self.items = result_page.items
             self.page = page
             self.per_page = per_page
             self.total = total
-            self.pages = (total + per_page - 1) // per_page
-            self.has_prev = page > 1
-            self.has_next = page < self.pages
+            self.total_estimated = total_estimated
+            self.pages = max((total + per_page - 1) // per_page, page)
+            self.has_prev = result_page.has_prev
+            self.has_next = result_page.has_next
             self.prev_num = page - 1 if self.has_prev else None
             self.next_num = page + 1 if self.has_next else None
-            
-        def iter_pages(self, left_edge=2, left_current=2, right_current=3, right_edge=2):
-            last = self.pages
-            for num in range(1, last + 1):
-                if num <= left_edge or \
-                   (num > self.page - left_current - 1 and num < self.page + right_current) or \
-                   num > last - right_edge:
-                    yield num
+            self.prev_cursor = result_page.prev_cursor
+            self.next_cursor = result_page.next_cursor
     
-    companies_paginated = Pagination(companies, page, per_page, total_companies)
+    companies_paginated = Pagination(result_page, page, per_page, total_companies, total_estimated)
     
     return render_template('companies.html', 
                          companies=companies_paginated,
@@ -1559,106 +755,65 @@ def filter_companies_route():
         selected_sizes = request.form.getlist('size_filter')
         
         try:
-            # Start with all companies
-            from sqlalchemy import select, and_
-            query = select(Company)
-            
-            # Apply basic filters (Stage 1)
-            filters = []
+            # Describe the criteria (Stage 1 basic, Stage 2 additional filters)
             filter_description = []
             
             if min_employees > 0:
-                filters.append(Company.personnel_2019 >= min_employees)
                 filter_description.append(f"Employees >= {min_employees}")
             if min_revenue > 0:
-                filters.append(Company.revenue_2019 >= min_revenue)
                 filter_description.append(f"Revenue >= {min_revenue:,.0f}")
             if min_profit is not None:
-                filters.append(Company.profit_2019 >= min_profit)
                 filter_description.append(f"Profit >= {min_profit:,.0f}")
                 
-            # Apply additional filters (Stage 2)
             if selected_regions:
-                filters.append(Company.region_name.in_(selected_regions))
                 filter_description.append(f"Regions: {', '.join(selected_regions[:3])}{'...' if len(selected_regions) > 3 else ''}")
             if selected_kved:
-                filters.append(Company.kved_code.in_(selected_kved))
                 filter_description.append(f"KVED: {', '.join(selected_kved)}")
             if selected_sizes:
-                filters.append(Company.company_size_name.in_(selected_sizes))
                 filter_description.append(f"Sizes: {', '.join(selected_sizes)}")
                 
-            # Combine all filters
-            if filters:
-                query = query.where(and_(*filters))
-                
-            # Use raw SQL to avoid SQLAlchemy UTF-8 issues
-            try:
-                # Build SQL query manually 
-                sql_conditions = []
-                sql_params = {}
-                
-                if min_employees > 0:
-                    sql_conditions.append("personnel_2019 >= :min_employees")
-                    sql_params['min_employees'] = min_employees
-                if min_revenue > 0:
-                    sql_conditions.append("revenue_2019 >= :min_revenue")
-                    sql_params['min_revenue'] = min_revenue
-                if min_profit is not None:
-                    sql_conditions.append("profit_2019 >= :min_profit")
-                    sql_params['min_profit'] = min_profit
-                
-                # Build WHERE clause
-                where_clause = " AND ".join(sql_conditions) if sql_conditions else "1=1"
-                
-                # Count query only (safer than loading full objects)
-                count_sql = f"SELECT COUNT(*) FROM companies WHERE {where_clause}"
-                count_result = db.session.execute(db.text(count_sql), sql_params)
-                count = count_result.scalar() or 0
-                
-                # Don't load actual company objects to avoid UTF-8 issues
-                selected_companies = []
-                
-                logging.info(f"Raw SQL count query successful: {count} companies found")
-                
-            except Exception as e:
-                logging.error(f"Error in SQL query: {e}")
-                count = 0
-                selected_companies = []
-                
             # Save selection criteria for display
             criteria_text = " | ".join(filter_description) if filter_description else "No filters"
             
-            # Create SelectionBase with minimal operations (avoid UTF-8 issues)
+            # Create SelectionBase and freeze its membership in selection_companies
+            # with one INSERT ... SELECT (selection_snapshot); later stages join the snapshot
             try:
-                # Include selection criteria in SelectionBase
+                from ranking_engine import selection_conditions
+                from selection_snapshot import materialize_selection
+                
                 selection_base = SelectionBase(
-                    name=f'Selection Base ({count} companies)',
-                    companies_count=count,
+                    name='Selection Base',
+                    companies_count=0,
                     min_employees=min_employees if min_employees > 0 else None,
                     min_revenue=min_revenue if min_revenue > 0 else None,
                     min_profit=min_profit if min_profit is not None else None,
                     is_active=True
                 )
-                
-                # Add and commit immediately
                 db.session.add(selection_base)
+                db.session.flush()
+                
+                where_clause, sql_params = selection_conditions(
+                    selection_base, kved_codes=selected_kved, regions=selected_regions, sizes=selected_sizes
+                )
+                count = materialize_selection(selection_base, where_clause, sql_params)
+                selection_base.name = f'Selection Base ({count} companies)'
                 db.session.commit()
                 logging.info(f"Created SelectionBase ID: {selection_base.id} with {count} companies")
                 
-                # Skip adding SelectionCompany records for now to avoid UTF-8 issues
-                # We'll store company IDs in session instead
-                logging.info(f"Skipping SelectionCompany creation - will use session storage")
-                
             except Exception as e:
                 db.session.rollback()
                 logging.error(f"Error creating SelectionBase: {e}")
                 flash('Error creating selection base.', 'danger')
                 return redirect(request.url)
             
+            try:
+                from dashboard_stats import refresh_selection_stats
+                refresh_selection_stats(selection_base.id)
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Dashboard stats refresh failed: {e}")
+            
             session['selection_criteria'] = criteria_text
-            # Store empty for now since we don't load company objects (avoiding UTF-8 issues)
-            session['selected_company_ids'] = []
             session['selection_count'] = count
             
             # Clear previous ranking info from session
@@ -1685,16 +840,11 @@ def filter_companies_route():
             flash('Error creating selection base.', 'danger')
             return redirect(request.url)
     
-    # Load filter options for GET request - using simplified structure
-    regions = db.session.execute(
-        db.select(Company.region_name).distinct().where(Company.region_name.isnot(None))
-    ).scalars().all()
-    kveds = db.session.execute(
-        db.select(Company.kved_code).distinct().where(Company.kved_code.isnot(None))
-    ).scalars().all()
-    sizes = db.session.execute(
-        db.select(Company.company_size_name).distinct().where(Company.company_size_name.isnot(None))
-    ).scalars().all()
+    # Load filter options for GET request - cached facets
+    from facets import facet_values
+    regions = facet_values('regions')
+    kveds = facet_values('kved')
+    sizes = facet_values('sizes')
     
     return render_template('filter.html', regions=regions, kveds=kveds, sizes=sizes)
 
@@ -1822,6 +972,8 @@ def get_company_details(company_id):
             'initials': company.initials,
             'source': company.source,
             'actualized': company.actualized,
+            'is_actualized': bool(company.is_actualized),
+            'actualized_at': company.actualized_at.isoformat() if company.actualized_at else None,
             'ranking': company.ranking,
             'ranking_criteria': getattr(company, 'ranking_criteria', None),
             'created_at': company.created_at.isoformat() if company.created_at else None,
@@ -1844,40 +996,13 @@ def rankings_list():
         return redirect(url_for('main.index'))
         
     try:
-        # Отримуємо всі рейтинги
-        rankings = db.session.execute(
-            db.select(Ranking).order_by(Ranking.created_at.desc())
-        ).scalars().all()
-        
-        rankings_data = []
-        for ranking in rankings:
-            # Окремо отримуємо SelectionBase для кожного рейтингу
-            selection_base = db.session.execute(
-                db.select(SelectionBase).where(SelectionBase.id == ranking.selection_base_id)
-            ).scalar_one_or_none()
-            # Отримуємо першу компанію з рейтингу для превью (спрощено)
-            first_ranking_company = db.session.execute(
-                db.select(RankingCompany)
-                .where(RankingCompany.ranking_id == ranking.id)
-                .order_by(RankingCompany.position)
-                .limit(1)
-            ).scalar_one_or_none()
-            
-            if first_ranking_company:
-                first_company = db.session.execute(
-                    db.select(Company).where(Company.id == first_ranking_company.company_id)
-                ).scalar_one_or_none()
-                first_company_name = first_company.name if first_company else "Немає компаній"
-            else:
-                first_company_name = "Немає компаній"
-            
-            rankings_data.append({
-                'ranking': ranking,
-                'selection_base': selection_base,
-                'first_company_name': first_company_name
-            })
+        # Одна сторінка списку одним запитом: база відбору, лідер (LATERAL) і підсумки
+        from ranking_read_model import RANKINGS_PER_PAGE, list_rankings
+        page = request.args.get('page', 1, type=int)
+        rankings_data, totals = list_rankings(page, RANKINGS_PER_PAGE)
         
-        return render_template('rankings_list.html', rankings=rankings_data)
+        return render_template('rankings_list.html', rankings=rankings_data, totals=totals,
+                               page=page, per_page=RANKINGS_PER_PAGE)
         
     except Exception as e:
         logging.error(f"Error loading rankings list: {e}")
@@ -1893,40 +1018,24 @@ def view_ranking(ranking_id):
         return redirect(url_for('main.index'))
         
     try:
-        # Отримуємо рейтинг
-        ranking = db.session.execute(
-            db.select(Ranking).where(Ranking.id == ranking_id)
-        ).scalar_one_or_none()
+        # Заголовок (рейтинг, база відбору, лідер) і сторінка позицій - два запити
+        from ranking_read_model import COMPANIES_PER_PAGE, ranking_companies_page, ranking_header
+        header = ranking_header(ranking_id)
         
-        if not ranking:
+        if not header:
             flash('Рейтинг не знайдено', 'error')
             return redirect(url_for('main.rankings_list'))
         
-        # Отримуємо компанії рейтингу (спрощено без JOIN)
-        ranking_companies_data = []
-        ranking_companies = db.session.execute(
-            db.select(RankingCompany)
-            .where(RankingCompany.ranking_id == ranking_id)
-            .order_by(RankingCompany.position)
-        ).scalars().all()
-        
-        for ranking_company in ranking_companies:
-            company = db.session.execute(
-                db.select(Company).where(Company.id == ranking_company.company_id)
-            ).scalar_one_or_none()
-            
-            if company:
-                ranking_companies_data.append((ranking_company, company))
-        
-        # Отримуємо базу відбору
-        selection_base = db.session.execute(
-            db.select(SelectionBase).where(SelectionBase.id == ranking.selection_base_id)
-        ).scalar_one_or_none()
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', COMPANIES_PER_PAGE, type=int)
+        companies_page = ranking_companies_page(ranking_id, page, per_page, total=header['companies_count'])
         
         return render_template('ranking_view.html', 
-                             ranking=ranking, 
-                             companies=ranking_companies_data,
-                             selection_base=selection_base)
+                             ranking=header['ranking'], 
+                             companies=companies_page.items,
+                             pagination=companies_page,
+                             header=header,
+                             selection_base=header['selection_base'])
         
     except Exception as e:
         logging.error(f"Error loading ranking {ranking_id}: {e}")
@@ -1963,8 +1072,13 @@ def ranking():
                     'size_filter': request.form.getlist('size_filter'),
                     'sort_criteria': request.form.get('sort_criteria'),
                     'sort_order': request.form.get('sort_order'),
+                    'rank_method': request.form.get('rank_method'),
                     'year_source': request.form.get('year_source'),
-                    'ranking_name': request.form.get('ranking_name')
+                    'financial_year': request.form.get('financial_year'),
+                    'base_year': request.form.get('base_year'),
+                    'ranking_name': request.form.get('ranking_name'),
+                    'partition_by': request.form.getlist('partition_by'),
+                    'apply_regional_kved_filter': request.form.get('apply_regional_kved_filter') in ('1', 'on', 'true')
                 }
                 logging.info(f"Form data converted to: {data}")
             
@@ -1985,163 +1099,51 @@ def ranking():
             selection_base = selection_base[0] if selection_base else None
             logging.info(f"Using SelectionBase ID: {selection_base.id if selection_base else 'None'}")
             
-            # Use raw SQL to recreate the base selection + additional filters
-            try:
-                # Build SQL conditions for base selection (from SelectionBase)
-                base_conditions = []
-                base_params = {}
-                
-                if selection_base.min_employees:
-                    base_conditions.append("personnel_2019 >= :min_employees")
-                    base_params['min_employees'] = selection_base.min_employees
-                if selection_base.min_revenue:
-                    base_conditions.append("revenue_2019 >= :min_revenue")
-                    base_params['min_revenue'] = selection_base.min_revenue
-                if selection_base.min_profit:
-                    base_conditions.append("profit_2019 >= :min_profit")
-                    base_params['min_profit'] = selection_base.min_profit
-                
-                # Add additional ranking filters
-                if data['kved_filter'] and data['kved_filter'] != ['']:
-                    kved_placeholders = ', '.join([f":kved_{i}" for i in range(len(data['kved_filter']))])
-                    base_conditions.append(f"kved_code IN ({kved_placeholders})")
-                    for i, kved in enumerate(data['kved_filter']):
-                        base_params[f'kved_{i}'] = kved
-                
-                if data['region_filter'] and data['region_filter'] != ['']:
-                    region_placeholders = ', '.join([f":region_{i}" for i in range(len(data['region_filter']))])
-                    base_conditions.append(f"region_name IN ({region_placeholders})")
-                    for i, region in enumerate(data['region_filter']):
-                        base_params[f'region_{i}'] = region
-                
-                # Build final query
-                where_clause = " AND ".join(base_conditions) if base_conditions else "1=1"
-                
-                # Log detailed information about the query
-                logging.info(f"SelectionBase criteria: min_employees={selection_base.min_employees}, min_revenue={selection_base.min_revenue}, min_profit={selection_base.min_profit}")
-                logging.info(f"Additional filters: kved={data.get('kved_filter')}, region={data.get('region_filter')}")
-                logging.info(f"SQL WHERE clause: {where_clause}")
-                logging.info(f"SQL parameters: {base_params}")
-                
-                # Use raw SQL to get all needed company fields
-                companies_sql = f"""SELECT id, edrpou, name, revenue_2019, profit_2019, personnel_2019, 
-                    kved_code, kved_description, region_name, phone, address,
-                    company_size_name, first_name, middle_name, last_name, work_phone,
-                    corporate_site, work_email, company_status, director, 
-                    government_purchases, tender_count, initials, actualized
-                    FROM companies WHERE {where_clause} ORDER BY revenue_2019 DESC NULLS LAST LIMIT 1000"""
-                
-                logging.info(f"Final SQL query: {companies_sql}")
-                
-                result = db.session.execute(db.text(companies_sql), base_params)
-                companies_raw = result.fetchall()
-                
-                logging.info(f"Raw SQL found {len(companies_raw)} companies for ranking")
-                
-                # Convert to objects for sorting
-                companies = []
-                for row in companies_raw:
-                    company_dict = {
-                        'id': row[0],
-                        'edrpou': row[1] or '',
-                        'name': row[2] or '',
-                        'revenue_2019': float(row[3]) if row[3] else 0,
-                        'profit_2019': float(row[4]) if row[4] else 0,
-                        'personnel_2019': int(row[5]) if row[5] else 0,
-                        'kved_code': row[6] or '',
-                        'kved_description': row[7] or '',
-                        'region_name': row[8] or '',
-                        'phone': row[9] or '',
-                        'address': row[10] or '',
-                        'company_size_name': row[11] or '',
-                        'first_name': row[12] or '',
-                        'middle_name': row[13] or '',
-                        'last_name': row[14] or '',
-                        'work_phone': row[15] or '',
-                        'corporate_site': row[16] or '',
-                        'work_email': row[17] or '',
-                        'company_status': row[18] or '',
-                        'director': row[19] or '',
-                        'government_purchases': float(row[20]) if row[20] else 0,
-                        'tender_count': int(row[21]) if row[21] else 0,
-                        'initials': row[22] or '',
-                        'actualized': row[23] or ''
-                    }
-                    companies.append(company_dict)
-                    
-            except Exception as e:
-                logging.error(f"Error in raw SQL companies query: {e}")
-                return jsonify({'success': False, 'error': f'Помилка при отриманні компаній: {str(e)}'})
-            
-            logging.info(f"Found {len(companies)} companies from SelectionBase after applying filters")
-            
-            # Sort by criteria
+            # Whole filtered selection is ranked in SQL with a window function (ranking_engine);
+            # only the top rows are read back for the page preview
+            from ranking_engine import (CRITERIA_NAMES, PREVIEW_LIMIT, create_ranking, partition_columns,
+                                        ranking_groups, ranking_order, ranking_preview, selection_conditions)
+
             sort_criteria = data['sort_criteria']
-            sort_order = data.get('sort_order', 'desc')
-            reverse_sort = sort_order == 'desc'
-            
-            # Sort companies (now using dictionary objects)
-            if sort_criteria == 'revenue':
-                sorted_companies = sorted(companies, key=lambda x: x['revenue_2019'] or 0, reverse=reverse_sort)
-            elif sort_criteria == 'profit':
-                sorted_companies = sorted(companies, key=lambda x: x['profit_2019'] or 0, reverse=reverse_sort)
-            elif sort_criteria == 'personnel':
-                sorted_companies = sorted(companies, key=lambda x: x['personnel_2019'] or 0, reverse=reverse_sort)
-            else:
-                sorted_companies = companies
-            
-            # Convert to JSON format with all fields
-            companies_data = []
-            year_source = data.get('year_source', '2025')
-            source_text = f"Україна {year_source}"
+            # Stored on the ranking and reused by ranking_refresh, so unknown values are rejected
+            try:
+                sort_order, rank_method = ranking_order(data.get('sort_order'), data.get('rank_method'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            try:
+                preview_limit = int(data.get('preview_limit') or PREVIEW_LIMIT)
+            except (TypeError, ValueError):
+                preview_limit = PREVIEW_LIMIT
             
-            for rank, company in enumerate(sorted_companies, 1):
-                companies_data.append({
-                    'ranking': rank,
-                    'source': source_text,
-                    'edrpou': company['edrpou'],
-                    'company_name': company['name'],
-                    'kved_code': company['kved_code'],
-                    'kved_description': company['kved_description'],
-                    'personnel_2019': company['personnel_2019'],
-                    'region_name': company['region_name'],
-                    'phone': company['phone'],
-                    'address': company['address'],
-                    'revenue_2019': company['revenue_2019'],
-                    'profit_2019': company['profit_2019'],
-                    'company_size_name': company['company_size_name'],
-                    'first_name': company['first_name'],
-                    'middle_name': company['middle_name'],
-                    'last_name': company['last_name'],
-                    'work_phone': company['work_phone'],
-                    'corporate_site': company['corporate_site'],
-                    'work_email': company['work_email'],
-                    'company_status': company['company_status'],
-                    'director': company['director'],
-                    'government_purchases': company['government_purchases'],
-                    'tender_count': company['tender_count'],
-                    'initials': company['initials'],
-                    'actualized': company['actualized']
-                })
+            # Partitioned ranking: positions are computed within each KVED/region/size group
+            try:
+                partition = partition_columns(data.get('partition_by'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)})
+            regional_kved_filter = bool(data.get('apply_regional_kved_filter'))
             
-            # Helper function to get sort value (now for dictionary objects)
-            def getCompanySortValue(company, criteria):
-                if criteria == 'revenue':
-                    return company['revenue_2019'] or 0
-                elif criteria == 'profit':
-                    return company['profit_2019'] or 0
-                elif criteria == 'personnel':
-                    return company['personnel_2019'] or 0
-                return 0
+            # Financial year of the criterion (company_financials); base_year - rank by growth base_year → year
+            from financials import LEGACY_YEAR, criteria_label, validate_year
+            try:
+                financial_year = validate_year(data.get('financial_year'))
+                base_year = validate_year(data.get('base_year'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)})
+            if base_year is not None and base_year == (financial_year or LEGACY_YEAR):
+                return jsonify({'success': False, 'error': 'Рік порівняння має відрізнятися від фінансового року'})
+
+            where_clause, base_params = selection_conditions(
+                selection_base,
+                kved_codes=data.get('kved_filter'),
+                regions=data.get('region_filter'),
+                sizes=data.get('size_filter')
+            )
+            logging.info(f"SelectionBase criteria: min_employees={selection_base.min_employees}, min_revenue={selection_base.min_revenue}, min_profit={selection_base.min_profit}")
+            logging.info(f"Additional filters: kved={data.get('kved_filter')}, region={data.get('region_filter')}, size={data.get('size_filter')}")
+            logging.info(f"SQL WHERE clause: {where_clause}")
             
-            # Save ranking to database 
             # Get human-readable criteria name
-            criteria_names = {
-                'revenue': 'Чистий дохід від реалізації',
-                'profit': 'Чистий фінансовий результат',
-                'personnel': 'Кількість працівників'
-            }
-            criteria_display = criteria_names.get(sort_criteria, sort_criteria)
+            criteria_display = criteria_label(CRITERIA_NAMES.get(sort_criteria, sort_criteria), financial_year, base_year)
             
             # Get ranking name from form data
             ranking_name = data['ranking_name']
@@ -2151,18 +1153,24 @@ def ranking():
             current_year = datetime.now().year
             source_name = f"Україна {current_year}"
             
-            logging.info(f"Creating ranking with data: {data}")
-            
-            # Use the same SelectionBase that we got earlier (no need to re-query)
-            logging.info(f"Using SelectionBase ID: {selection_base.id} for ranking creation")
-            
-            # Create Ranking record with minimal required fields
+            # Create Ranking record; companies_count is set after the positions are inserted
             try:
                 logging.info(f"Creating Ranking with name: {ranking_name}")
                 ranking = Ranking(
                     name=ranking_name,
                     selection_base_id=selection_base.id,
-                    companies_count=len(sorted_companies),
+                    partition_by=','.join(partition) or None,
+                    # Definition is kept so the ranking can be refreshed incrementally (ranking_refresh)
+                    kved_filter=','.join(value for value in data.get('kved_filter') or [] if value) or None,
+                    region_filter=','.join(value for value in data.get('region_filter') or [] if value) or None,
+                    size_filter=','.join(value for value in data.get('size_filter') or [] if value) or None,
+                    sort_criteria=sort_criteria,
+                    sort_order=sort_order,
+                    rank_method=rank_method,
+                    regional_kved_filter=regional_kved_filter,
+                    year_filter=financial_year,
+                    base_year=base_year,
+                    companies_count=0,
                     is_active=True
                 )
                 db.session.add(ranking)
@@ -2172,59 +1180,39 @@ def ranking():
                 logging.error(f"Error creating Ranking: {e}")
                 raise
             
-            # Clear all rankings first using raw SQL to avoid SQLAlchemy column issues
             try:
-                logging.info("Clearing existing rankings")
-                from sqlalchemy import text
-                db.session.execute(text("UPDATE companies SET ranking = NULL, ranking_criteria = NULL"))
-                logging.info("Existing rankings cleared")
+                stats = create_ranking(ranking.id, where_clause, base_params, sort_criteria,
+                                       ranking_name, criteria_display, source_name,
+                                       sort_order=sort_order, method=rank_method,
+                                       partition_by=partition, regional_kved_filter=regional_kved_filter,
+                                       year=financial_year, base_year=base_year)
+                ranking.companies_count = stats['positions']
+                preview = ranking_preview(ranking.id, preview_limit)
+                groups = ranking_groups(ranking.id) if partition else []
             except Exception as e:
-                logging.error(f"Error clearing rankings: {e}")
+                logging.error(f"Error ranking companies in SQL: {e}")
                 raise
             
-            # Create RankingCompany records and update companies table
-            logging.info(f"Processing {len(sorted_companies)} companies for ranking")
-            for rank, company in enumerate(sorted_companies, 1):
-                try:
-                    # Create RankingCompany record
-                    ranking_company = RankingCompany(
-                        ranking_id=ranking.id,
-                        company_id=company['id'],
-                        position=rank
-                    )
-                    db.session.add(ranking_company)
-                    
-                    # Update current ranking in companies table
-                    db.session.execute(text(
-                        "UPDATE companies SET ranking = :rank, ranking_criteria = :criteria WHERE id = :company_id"
-                    ), {
-                        'rank': rank,
-                        'criteria': criteria_display,
-                        'company_id': company['id']
-                    })
-                    
-                    # Save to ranking history
-                    db.session.execute(text(
-                        "INSERT INTO company_ranking_history (company_id, ranking_name, ranking_position, ranking_criteria, source_name) VALUES (:company_id, :name, :position, :criteria, :source_name)"
-                    ), {
-                        'company_id': company['id'],
-                        'name': ranking_name,
-                        'position': rank,
-                        'criteria': criteria_display,
-                        'source_name': source_name
-                    })
-                    
-                    if rank % 100 == 0:  # Log every 100 companies
-                        logging.info(f"Processed {rank} companies")
-                        
-                except Exception as e:
-                    logging.error(f"Error processing company {company['id']} at rank {rank}: {e}")
-                    raise
+            # Convert preview to JSON format with all fields
+            year_source = data.get('year_source', '2025')
+            source_text = f"Україна {year_source}"
+            companies_data = []
+            for company in preview:
+                company['company_name'] = company.pop('name')
+                company['source'] = source_text
+                companies_data.append(company)
             
             try:
                 logging.info("Committing transaction")
                 db.session.commit()
                 logging.info("Transaction committed successfully")
+                
+                try:
+                    from dashboard_stats import refresh_ranking_stats
+                    refresh_ranking_stats()
+                except Exception as e:
+                    db.session.rollback()
+                    logging.error(f"Dashboard stats refresh failed: {e}")
             except Exception as e:
                 logging.error(f"Error committing transaction: {e}")
                 raise
@@ -2233,8 +1221,12 @@ def ranking():
                 'success': True, 
                 'companies': companies_data,
                 'ranking_id': ranking.id,  # Add ranking ID for PDF export
-                'count': len(companies_data),
-                'message': f'Створено рейтинг "{data["ranking_name"]}" з {len(companies_data)} компаній'
+                'count': ranking.companies_count,
+                'preview_count': len(companies_data),
+                'partition_by': partition,
+                'groups': [{'label': label, 'count': count} for label, count in groups],
+                'message': f'Створено рейтинг "{data["ranking_name"]}" з {ranking.companies_count} компаній'
+                           + (f' у {len(groups)} групах' if partition else '')
             })
             
         except Exception as e:
@@ -2264,14 +1256,19 @@ def export():
         selected_sizes = request.form.getlist('size_filter')
         
         try:
-            # Get companies from selection base (stored in session)
-            selected_ids = session.get('selected_company_ids', [])
-            if not selected_ids:
+            # Companies of the active selection base: its snapshot or, for old bases, its criteria
+            from selection_snapshot import active_selection_base, is_materialized, snapshot_company_ids
+            selection_base = active_selection_base()
+            if not selection_base:
                 flash('Спочатку створіть базу відбору в розділі "Відбір компаній для рейтингу"', 'warning')
                 return redirect(url_for('main.filter_companies_route'))
             
-            # Start with selected companies
-            query = db.select(Company).where(Company.id.in_(selected_ids))
+            if is_materialized(selection_base):
+                query = db.select(Company).where(Company.id.in_(snapshot_company_ids(selection_base.id)))
+            else:
+                from ranking_engine import selection_conditions
+                where_clause, where_params = selection_conditions(selection_base)
+                query = db.select(Company).where(text(where_clause).bindparams(**where_params))
             
             # Apply additional ranking-stage filters if any
             filters = []
@@ -2299,15 +1296,18 @@ def export():
             else:
                 sorted_companies = ranking_companies
                 
-            # Clear all rankings first
-            db.session.execute(db.update(Company).values(ranking=None))
-            
-            # Assign new rankings
-            for rank, company in enumerate(sorted_companies, 1):
-                company.ranking = rank
-                
+            # Assign new rankings: one UPDATE of the rows whose position changes
+            from ranking_engine import sync_company_rankings
+            sync_company_rankings(sort_criteria, company_ids=[company.id for company in sorted_companies])
             db.session.commit()
             
+            try:
+                from dashboard_stats import refresh_ranking_stats
+                refresh_ranking_stats()
+            except Exception as e:
+                db.session.rollback()
+                logging.error(f"Dashboard stats refresh failed: {e}")
+            
             flash(f'Створено рейтинг "{ranking_name}" з {len(sorted_companies)} компаній за критерієм "{sort_criteria}"', 'success')
             
             # Update session with new ranking info
@@ -2338,7 +1338,6 @@ def export():
     # GET request - show ranking creation form
     try:
         # Get selection base info
-        selected_ids = session.get('selected_company_ids', [])
         selection_criteria = session.get('selection_criteria', 'Не визначено')
         selection_count = session.get('selection_count', 0)
         selection_info = session.get('selection_info', None)
@@ -2378,12 +1377,12 @@ def export_ranking_pdf(ranking_id):
         return redirect(url_for('main.companies'))
     
     try:
-        from pdf_export import export_ranking_to_pdf
+        from pdf_export import EXPORT_DIR, export_ranking_to_pdf
         success, filename, message = export_ranking_to_pdf(ranking_id)
         
         if success:
             # Повертаємо файл для завантаження
-            file_path = os.path.join('static/exports', filename)
+            file_path = os.path.join(EXPORT_DIR, filename)
             return send_file(
                 file_path,
                 as_attachment=True,
@@ -2425,12 +1424,22 @@ def get_current_selection_info():
         total_companies = db.session.execute(db.select(db.func.count(Company.id))).scalar() or 0
         
         # Отримуємо поточний відбір з бази даних (не з session)
-        active_selection = db.session.execute(
-            db.select(SelectionBase).where(SelectionBase.is_active == True)
-        ).scalar_one_or_none()
+        from selection_snapshot import active_selection_base
+        active_selection = active_selection_base()
         
         selection_count = active_selection.companies_count if active_selection else 0
         
+        # Count and membership test from the selection bitmap (no JOIN with selection_companies)
+        in_selection = None
+        if active_selection:
+            from selection_bitmap import get_selection_bitmap
+            bitmap = get_selection_bitmap(active_selection.id)
+            if bitmap is not None:
+                selection_count = len(bitmap)
+                company_id = request.args.get('company_id', type=int)
+                if company_id is not None:
+                    in_selection = company_id in bitmap
+        
         # Кількість проранжованих компаній
         ranked_companies_count = db.session.execute(
             db.select(db.func.count(Company.id))
@@ -2466,7 +1475,8 @@ def get_current_selection_info():
             'total_in_selection': selection_count,
             'companies_with_ranking': ranked_companies_count,
             'selection_criteria': selection_criteria,
-            'selection_info': selection_info
+            'selection_info': selection_info,
+            'in_selection': in_selection
         })
         
     except Exception as e:
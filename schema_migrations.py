@@ -0,0 +1,160 @@
+"""
+Ідемпотентні зміни схеми для існуючих баз.
+
+db.create_all() створює тільки відсутні таблиці і не додає колонки чи
+індекси в уже створені. Тут зібрані такі зміни; кожна інструкція безпечна
+для повторного запуску (IF NOT EXISTS) і виконується при старті додатку.
+
+Індекси великих таблиць сюди не входять: CREATE INDEX блокує запис на час
+побудови, тому вони будуються CONCURRENTLY у db_indexes.py. Зміни, що
+переписують велику таблицю, зібрані в MANUAL_MIGRATIONS і запускаються
+тільки вручну.
+"""
+
+import logging
+
+from actualization_flag import LEGACY_ACTUALIZED_CONDITION
+from app import db
+from company_names import SEARCH_NAME_SQL
+
+MIGRATIONS = [
+    # Критерій поточного рейтингу (раніше існував тільки в production базі)
+    "ALTER TABLE companies ADD COLUMN IF NOT EXISTS ranking_criteria TEXT",
+    # Історія рейтингів лише доповнюється (ranking_engine.record_ranking_history);
+    # обмеження з models.py забороняло повторний рейтинг з тією ж назвою
+    "ALTER TABLE company_ranking_history DROP CONSTRAINT IF EXISTS unique_company_ranking_history",
+    # Рейтинги в розрізі КВЕД/області/розміру
+    "ALTER TABLE rankings ADD COLUMN IF NOT EXISTS partition_by TEXT",
+    "ALTER TABLE ranking_companies ADD COLUMN IF NOT EXISTS group_label TEXT",
+    # Знімок складу бази відбору (selection_snapshot.py); унікальний індекс - db_indexes.py
+    "ALTER TABLE selection_bases ADD COLUMN IF NOT EXISTS materialized_at TIMESTAMP",
+    "ALTER TABLE selection_bases ADD COLUMN IF NOT EXISTS company_bitmap BYTEA",
+    # Інкрементальне оновлення рейтингів (ranking_refresh.py)
+    "ALTER TABLE rankings ADD COLUMN IF NOT EXISTS sort_criteria TEXT",
+    "ALTER TABLE rankings ADD COLUMN IF NOT EXISTS sort_order TEXT",
+    "ALTER TABLE rankings ADD COLUMN IF NOT EXISTS rank_method TEXT",
+    "ALTER TABLE rankings ADD COLUMN IF NOT EXISTS regional_kved_filter BOOLEAN DEFAULT false",
+    "ALTER TABLE rankings ADD COLUMN IF NOT EXISTS refreshed_at TIMESTAMP",
+    # Індекси позицій за компанією і значенням критерію - db_indexes.py
+    "ALTER TABLE ranking_companies ADD COLUMN IF NOT EXISTS sort_value NUMERIC(15, 2)",
+    # Фінансові показники по роках (financials.py); індекс (year, metric, value) - db_indexes.py,
+    # перенесення колонок *_2019 у фактові рядки - MANUAL_MIGRATIONS['financials_2019']
+    "ALTER TABLE rankings ADD COLUMN IF NOT EXISTS base_year INTEGER",
+    # Типізований стан актуалізації (actualization_flag.py) замість LOWER(TRIM(actualized)) IN (...)
+    "ALTER TABLE companies ADD COLUMN IF NOT EXISTS is_actualized BOOLEAN",
+    "ALTER TABLE companies ADD COLUMN IF NOT EXISTS actualized_at TIMESTAMP",
+    # Нові рядки - false; існуючі заповнює разова міграція MANUAL_MIGRATIONS['is_actualized'],
+    # до неї NULL означає «не актуалізовано»
+    "ALTER TABLE companies ALTER COLUMN is_actualized SET DEFAULT false",
+    # Виконані разові міграції (apply_manual_migration)
+    """CREATE TABLE IF NOT EXISTS manual_migrations (
+           name TEXT PRIMARY KEY,
+           applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+       )""",
+    # Нормалізована назва для пошуку (company_search.py) у порожню таблицю - без переписування;
+    # заповнена таблиця - разова міграція MANUAL_MIGRATIONS['search_name']
+    f"""DO $$ BEGIN
+           IF NOT EXISTS (SELECT 1 FROM companies) THEN
+               ALTER TABLE companies ADD COLUMN IF NOT EXISTS search_name TEXT
+                   GENERATED ALWAYS AS ({SEARCH_NAME_SQL}) STORED;
+           END IF;
+       END $$""",
+]
+
+# Разові міграції, що переписують або копіюють велику таблицю. Не виконуються при
+# старті - тільки явно, у вікно обслуговування; виконана міграція записується в
+# manual_migrations і повторно не запускається (крім --force):
+#     python schema_migrations.py <назва> [--force]
+# Текстові поля, які стара построкова актуалізація зберігала з подвоєними
+# апострофами (clean_text_for_sql готував значення для SQL у рядку, а їх
+# передавали параметрами); actualization_engine зберігає текст як є
+DOUBLED_QUOTE_FIELDS = ('first_name', 'middle_name', 'last_name', 'work_phone', 'corporate_site',
+                        'work_email', 'company_status', 'director', 'initials')
+
+MANUAL_MIGRATIONS = {
+    # Нормалізована назва для пошуку (company_search.py); індекси - db_indexes.py.
+    # До міграції пошук за назвою працює по name без індексу
+    'search_name': [
+        f"ALTER TABLE companies ADD COLUMN IF NOT EXISTS search_name TEXT GENERATED ALWAYS AS ({SEARCH_NAME_SQL}) STORED",
+        "ANALYZE companies",
+    ],
+    # Колонки companies.*_2019 у фактові рядки company_financials (financials.py). Факти 2019,
+    # уже записані імпортом, не перезаписуються
+    'financials_2019': [
+        """INSERT INTO company_financials (company_id, year, metric, edrpou, value)
+           SELECT c.id, 2019, m.metric, c.edrpou, m.value
+           FROM companies c
+           CROSS JOIN LATERAL (VALUES (1, c.revenue_2019), (2, c.profit_2019),
+                                      (3, CAST(c.personnel_2019 AS numeric))) AS m(metric, value)
+           WHERE m.value IS NOT NULL
+           ON CONFLICT DO NOTHING""",
+        "ANALYZE company_financials",
+    ],
+    # Стан актуалізації існуючих рядків з тексту actualized (actualization_flag.py)
+    'is_actualized': [
+        f"""UPDATE companies SET
+               is_actualized = COALESCE({LEGACY_ACTUALIZED_CONDITION}, false),
+               actualized_at = CASE WHEN {LEGACY_ACTUALIZED_CONDITION} THEN updated_at END
+           WHERE is_actualized IS NULL""",
+        "ALTER TABLE companies ALTER COLUMN is_actualized SET NOT NULL",
+    ],
+    # '' → ' у полях актуалізованих компаній, записаних до actualization_engine.
+    # Повторний запуск (--force) зменшив би й справжні подвійні апострофи
+    'actualization_quotes': [
+        f"""UPDATE companies SET
+               {', '.join(f"{field} = replace({field}, '''''', '''')" for field in DOUBLED_QUOTE_FIELDS)}
+           WHERE {LEGACY_ACTUALIZED_CONDITION}
+             AND ({' OR '.join(f"strpos({field}, '''''') > 0" for field in DOUBLED_QUOTE_FIELDS)})""",
+    ],
+}
+
+
+def apply_schema_migrations():
+    """Застосувати MIGRATIONS; помилка однієї інструкції не зупиняє решту"""
+    for statement in MIGRATIONS:
+        try:
+            db.session.execute(db.text(statement))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Schema migration failed: {statement}: {e}")
+
+
+APPLIED_SQL = "SELECT applied_at FROM manual_migrations WHERE name = :name"
+MARK_APPLIED_SQL = """
+    INSERT INTO manual_migrations (name) VALUES (:name)
+    ON CONFLICT (name) DO UPDATE SET applied_at = CURRENT_TIMESTAMP
+"""
+
+
+def apply_manual_migration(name, force=False):
+    """
+    Виконати разову міграцію MANUAL_MIGRATIONS[name] однією транзакцією разом
+    з позначкою в manual_migrations. Вже виконана міграція пропускається
+    (force - виконати знову). Повертає True, якщо міграцію виконано.
+    """
+    applied_at = db.session.execute(db.text(APPLIED_SQL), {'name': name}).scalar()
+    if applied_at and not force:
+        logging.info(f"Manual migration {name} was already applied at {applied_at}")
+        db.session.rollback()
+        return False
+    for statement in MANUAL_MIGRATIONS[name]:
+        logging.info(f"Manual migration {name}: {statement}")
+        db.session.execute(db.text(statement))
+    db.session.execute(db.text(MARK_APPLIED_SQL), {'name': name})
+    db.session.commit()
+    return True
+
+
+if __name__ == '__main__':
+    import sys
+
+    from app import app
+
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2 or sys.argv[1] not in MANUAL_MIGRATIONS:
+        print(f"Використання: python schema_migrations.py <{'|'.join(MANUAL_MIGRATIONS)}> [--force]")
+        sys.exit(1)
+    with app.app_context():
+        applied = apply_manual_migration(sys.argv[1], force='--force' in sys.argv)
+    print(f"✓ Міграцію {sys.argv[1]} виконано" if applied else f"Міграцію {sys.argv[1]} вже виконано раніше")
@@ -0,0 +1,333 @@
+"""
+Стиснуті бітмапи складу баз відбору і операції над множинами між ними.
+
+Множина id компаній бази зберігається як бітмап у стилі Roaring у колонці
+selection_bases.company_bitmap (bytea). id ділиться на старші 16 біт (ключ
+контейнера) і молодші 16 біт. Розріджений контейнер - відсортований масив
+uint16 (до ARRAY_MAX_SIZE значень), щільний - бітсет на 65536 біт (Python
+int, 8 КБ). 160K компаній займають десятки-сотні КБ замість рядка
+selection_companies на компанію.
+
+Кількість компаній бази - O(1), перевірка належності - O(log 4096),
+перетин/обʼєднання/різниця баз і кількість компаній відбору в групі КВЕД -
+порозрядні операції по контейнерах (O(n/64)) без JOIN з selection_companies.
+Бітмапи незмінні після запису знімку, тому кешуються в процесі за id бази.
+"""
+
+import logging
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+from sqlalchemy import text
+
+from app import db
+from facets import TTLCache, data_version
+
+ARRAY_MAX_SIZE = 4096
+CONTAINER_BITS = 1 << 16
+BITSET_BYTES = CONTAINER_BITS // 8
+
+MAGIC = b'RBM1'
+HEADER = struct.Struct('<4sI')  # magic, кількість контейнерів
+CONTAINER_HEADER = struct.Struct('<HBI')  # ключ, тип (0 - масив, 1 - бітсет), кількість значень
+ARRAY_CONTAINER = 0
+BITSET_CONTAINER = 1
+
+OPERATIONS = ('and', 'or', 'andnot')
+
+# Масиви контейнерів серіалізуються little-endian незалежно від платформи
+_SWAP_BYTES = sys.byteorder != 'little'
+
+BITMAP_CACHE_SIZE = 16
+BITMAP_CACHE_TTL = 3600
+
+
+def _array_to_bits(values):
+    bits = bytearray(BITSET_BYTES)
+    for value in values:
+        bits[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def _bits_to_array(bits):
+    values = array('H')
+    data = bits.to_bytes(BITSET_BYTES, 'little')
+    for index, byte in enumerate(data):
+        if byte:
+            base = index << 3
+            for bit in range(8):
+                if byte >> bit & 1:
+                    values.append(base + bit)
+    return values
+
+
+def _container(values=None, bits=None):
+    """Контейнер у компактному представленні: масив до ARRAY_MAX_SIZE, інакше бітсет"""
+    if bits is not None:
+        cardinality = bits.bit_count()
+        if cardinality == 0:
+            return None
+        if cardinality <= ARRAY_MAX_SIZE:
+            return _bits_to_array(bits)
+        return bits
+    if not values:
+        return None
+    if len(values) > ARRAY_MAX_SIZE:
+        return _array_to_bits(values)
+    return values if isinstance(values, array) else array('H', values)
+
+
+def _cardinality(container):
+    return container.bit_count() if isinstance(container, int) else len(container)
+
+
+def _contains(container, low):
+    if isinstance(container, int):
+        return container >> low & 1 == 1
+    index = bisect_left(container, low)
+    return index < len(container) and container[index] == low
+
+
+def _as_bits(container):
+    return container if isinstance(container, int) else _array_to_bits(container)
+
+
+def _combine(left, right, operation):
+    """Один контейнер результату операції (None - порожній)"""
+    if isinstance(left, int) or isinstance(right, int):
+        left_bits, right_bits = _as_bits(left), _as_bits(right)
+        if operation == 'and':
+            return _container(bits=left_bits & right_bits)
+        if operation == 'or':
+            return _container(bits=left_bits | right_bits)
+        return _container(bits=left_bits & ~right_bits)
+    if operation == 'and':
+        values = set(left).intersection(right)
+    elif operation == 'or':
+        values = set(left).union(right)
+    else:
+        values = set(left).difference(right)
+    return _container(sorted(values))
+
+
+def _intersection_cardinality(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        return (left & right).bit_count()
+    if isinstance(left, int):
+        left, right = right, left
+    if isinstance(right, int):
+        return sum(1 for value in left if right >> value & 1)
+    return len(set(left).intersection(right))
+
+
+class RoaringBitmap:
+    """Незмінна множина невідʼємних 32-бітних id у стилі Roaring"""
+
+    __slots__ = ('_containers', '_cardinality')
+
+    def __init__(self, containers=None):
+        self._containers = dict(sorted((containers or {}).items()))
+        self._cardinality = sum(_cardinality(container) for container in self._containers.values())
+
+    @classmethod
+    def from_ids(cls, ids):
+        """Бітмап з id (у будь-якому порядку, повтори ігноруються)"""
+        groups = {}
+        for company_id in ids:
+            groups.setdefault(company_id >> 16, set()).add(company_id & 0xFFFF)
+        return cls({key: _container(sorted(values)) for key, values in groups.items()})
+
+    def __len__(self):
+        return self._cardinality
+
+    def __contains__(self, company_id):
+        container = self._containers.get(company_id >> 16)
+        return container is not None and _contains(container, company_id & 0xFFFF)
+
+    def __iter__(self):
+        for key, container in self._containers.items():
+            base = key << 16
+            values = _bits_to_array(container) if isinstance(container, int) else container
+            for low in values:
+                yield base + low
+
+    def __eq__(self, other):
+        return isinstance(other, RoaringBitmap) and self._containers == other._containers
+
+    def _apply(self, other, operation):
+        if operation == 'and':
+            keys = self._containers.keys() & other._containers.keys()
+        elif operation == 'or':
+            keys = self._containers.keys() | other._containers.keys()
+        else:
+            keys = self._containers.keys()
+        containers = {}
+        for key in keys:
+            left, right = self._containers.get(key), other._containers.get(key)
+            if right is None:
+                result = left if operation != 'and' else None
+            elif left is None:
+                result = right if operation == 'or' else None
+            else:
+                result = _combine(left, right, operation)
+            if result is not None:
+                containers[key] = result
+        return RoaringBitmap(containers)
+
+    def __and__(self, other):
+        return self._apply(other, 'and')
+
+    def __or__(self, other):
+        return self._apply(other, 'or')
+
+    def __sub__(self, other):
+        return self._apply(other, 'andnot')
+
+    def combine(self, other, operation):
+        """Операція з OPERATIONS: and / or / andnot"""
+        if operation not in OPERATIONS:
+            raise ValueError(f"Невідома операція над відборами: {operation}")
+        return self._apply(other, operation)
+
+    def intersection_len(self, other):
+        """|self ∩ other| без побудови результату"""
+        total = 0
+        for key in self._containers.keys() & other._containers.keys():
+            total += _intersection_cardinality(self._containers[key], other._containers[key])
+        return total
+
+    def to_bytes(self):
+        parts = [HEADER.pack(MAGIC, len(self._containers))]
+        for key, container in self._containers.items():
+            if isinstance(container, int):
+                parts.append(CONTAINER_HEADER.pack(key, BITSET_CONTAINER, container.bit_count()))
+                parts.append(container.to_bytes(BITSET_BYTES, 'little'))
+            else:
+                values = array('H', container)
+                if _SWAP_BYTES:
+                    values.byteswap()
+                parts.append(CONTAINER_HEADER.pack(key, ARRAY_CONTAINER, len(values)))
+                parts.append(values.tobytes())
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data)
+        magic, count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError("Not a selection bitmap")
+        offset = HEADER.size
+        containers = {}
+        for _ in range(count):
+            key, kind, cardinality = CONTAINER_HEADER.unpack_from(data, offset)
+            offset += CONTAINER_HEADER.size
+            if kind == BITSET_CONTAINER:
+                containers[key] = int.from_bytes(data[offset:offset + BITSET_BYTES], 'little')
+                offset += BITSET_BYTES
+            else:
+                values = array('H')
+                values.frombytes(data[offset:offset + cardinality * 2])
+                if _SWAP_BYTES:
+                    values.byteswap()
+                containers[key] = values
+                offset += cardinality * 2
+        return cls(containers)
+
+
+_cache = TTLCache(maxsize=BITMAP_CACHE_SIZE, ttl=BITMAP_CACHE_TTL)
+
+
+def build_selection_bitmap(selection_base_id):
+    """Бітмап зі знімку selection_companies бази"""
+    rows = db.session.execute(
+        text("SELECT company_id FROM selection_companies WHERE selection_base_id = :selection_base_id"),
+        {'selection_base_id': selection_base_id}
+    )
+    return RoaringBitmap.from_ids(row[0] for row in rows)
+
+
+def store_selection_bitmap(selection_base, bitmap=None):
+    """Записати бітмап бази (за замовчуванням - побудований з її знімку)"""
+    if bitmap is None:
+        bitmap = build_selection_bitmap(selection_base.id)
+    selection_base.company_bitmap = bitmap.to_bytes()
+    _cache.set(('selection', selection_base.id), bitmap)
+    return bitmap
+
+
+def get_selection_bitmap(selection_base_id):
+    """Бітмап бази з кешу процесу або з selection_bases.company_bitmap (None - немає знімку)"""
+    key = ('selection', selection_base_id)
+    bitmap = _cache.get(key)
+    if bitmap is None:
+        data = db.session.execute(
+            text("SELECT company_bitmap FROM selection_bases WHERE id = :id AND materialized_at IS NOT NULL"),
+            {'id': selection_base_id}
+        ).scalar()
+        if data is None:
+            return None
+        bitmap = RoaringBitmap.from_bytes(data)
+        _cache.set(key, bitmap)
+    return bitmap
+
+
+def kved_bitmaps(version=None):
+    """
+    Бітмапи компаній кожного КВЕД ('' - без КВЕД) для версії даних
+    (facets.data_version: покоління і остання зміна companies - записи поза
+    задачами покоління не збільшують)
+    """
+    if version is None:
+        version = data_version()
+    key = ('kved', version)
+    bitmaps = _cache.get(key)
+    if bitmaps is None:
+        groups = {}
+        for company_id, kved_code in db.session.execute(text("SELECT id, COALESCE(kved_code, '') FROM companies")):
+            groups.setdefault(kved_code, []).append(company_id)
+        bitmaps = {kved_code: RoaringBitmap.from_ids(ids) for kved_code, ids in groups.items()}
+        _cache.set(key, bitmaps)
+    return bitmaps
+
+
+def selection_kved_counts(selection_base_id):
+    """Кількість компаній бази в кожному КВЕД перетином бітмапів (None - немає знімку)"""
+    bitmap = get_selection_bitmap(selection_base_id)
+    if bitmap is None:
+        return None
+    counts = {}
+    for kved_code, kved_bitmap in kved_bitmaps().items():
+        count = kved_bitmap.intersection_len(bitmap)
+        if count:
+            counts[kved_code] = count
+    return counts
+
+
+def combine_selections(left_id, right_id, operation, name=None):
+    """
+    Нова база відбору з двох існуючих: and (перетин), or (обʼєднання),
+    andnot (компанії лівої бази, яких немає в правій). Множини комбінуються
+    в памʼяті, знімок нової бази пишеться одним INSERT ... SELECT з unnest.
+    Нова база стає активною; транзакцію комітить викликач.
+    """
+    from models_full import SelectionBase
+    from selection_snapshot import materialize_selection
+
+    left, right = get_selection_bitmap(left_id), get_selection_bitmap(right_id)
+    if left is None or right is None:
+        missing = left_id if left is None else right_id
+        raise ValueError(f"База відбору {missing} не має знімку складу")
+    result = left.combine(right, operation)
+
+    selection_base = SelectionBase(
+        name=name or f'Selection Base #{left_id} {operation.upper()} #{right_id} ({len(result)} companies)',
+        companies_count=0,
+        is_active=True
+    )
+    db.session.add(selection_base)
+    db.session.flush()
+    materialize_selection(selection_base, "id = ANY(:company_ids)", {'company_ids': list(result)}, bitmap=result)
+    logging.info(f"SelectionBase {selection_base.id} = #{left_id} {operation} #{right_id}: {len(result)} companies")
+    return selection_base
@@ -0,0 +1,114 @@
+"""
+Знімок бази відбору в selection_companies.
+
+При створенні SelectionBase склад відбору записується одним
+INSERT INTO selection_companies SELECT ... FROM companies WHERE ...
+і більше не змінюється. Рейтинги, експорт і статистика дашборду беруть
+компанії зі знімку (напівзʼєднання по selection_companies) замість повторної
+перевірки критеріїв по всій companies, тож результати етапів відтворювані,
+навіть якщо між ними був імпорт.
+
+Разом зі знімком зберігається стиснутий бітмап складу (selection_bitmap.py)
+для операцій між базами і підрахунків без JOIN.
+
+Бази, створені до появи знімків (materialized_at IS NULL), і бази, знімок
+яких прибрано за SNAPSHOT_RETENTION, працюють як раніше - за критеріями.
+SelectionBase зберігає тільки пороги min_*, а не фільтри КВЕД/регіону/
+розміру (комбіновані бази - жодних критеріїв), тож відбір за критеріями
+ширший за знімок. Тому знімки баз, на які посилається рейтинг, не
+прибираються ніколи: рейтинг і його оновлення (ranking_refresh) читають
+склад тільки зі знімку.
+"""
+
+import logging
+
+from sqlalchemy import select, text
+
+from app import db
+from models_full import SelectionBase, SelectionCompany
+
+# Скільки останніх баз відбору зберігають знімок (як історія відборів на сторінці фільтрації)
+SNAPSHOT_RETENTION = 10
+
+MEMBERSHIP_CONDITION = (
+    "id IN (SELECT company_id FROM selection_companies WHERE selection_base_id = :selection_base_id)"
+)
+
+MATERIALIZE_SQL = """
+    INSERT INTO selection_companies (selection_base_id, company_id, created_at)
+    SELECT :selection_base_id, id, CURRENT_TIMESTAMP
+    FROM companies
+    WHERE {where}
+"""
+
+DEACTIVATE_SQL = "UPDATE selection_bases SET is_active = false WHERE is_active = true AND id <> :selection_base_id"
+
+# Бази поза SNAPSHOT_RETENTION останніх, що ще мають знімок і не використовуються рейтингами
+EXPIRED_SQL = """
+    SELECT id FROM selection_bases
+    WHERE materialized_at IS NOT NULL
+      AND id NOT IN (SELECT id FROM selection_bases ORDER BY id DESC LIMIT :keep)
+      AND NOT EXISTS (SELECT 1 FROM rankings r WHERE r.selection_base_id = selection_bases.id)
+"""
+
+
+def is_materialized(selection_base):
+    return selection_base is not None and getattr(selection_base, 'materialized_at', None) is not None
+
+
+def membership_condition(selection_base_id):
+    """(where_sql, params) для companies: тільки компанії зі знімку бази"""
+    return MEMBERSHIP_CONDITION, {'selection_base_id': selection_base_id}
+
+
+def snapshot_company_ids(selection_base_id):
+    """Підзапит company_id знімку для ORM запитів: Company.id.in_(...)"""
+    return select(SelectionCompany.company_id).where(SelectionCompany.selection_base_id == selection_base_id)
+
+
+def active_selection_base():
+    """Остання активна база відбору або None"""
+    return db.session.execute(
+        select(SelectionBase)
+        .where(SelectionBase.is_active == True)
+        .order_by(SelectionBase.created_at.desc(), SelectionBase.id.desc())
+        .limit(1)
+    ).scalar_one_or_none()
+
+
+def _expire_snapshots():
+    """
+    Прибрати знімки старих баз без рейтингів; вони повертаються до відбору
+    за критеріями
+    """
+    expired = [row[0] for row in db.session.execute(text(EXPIRED_SQL), {'keep': SNAPSHOT_RETENTION})]
+    if expired:
+        db.session.execute(text("DELETE FROM selection_companies WHERE selection_base_id = ANY(:ids)"),
+                           {'ids': expired})
+        db.session.execute(text("UPDATE selection_bases SET materialized_at = NULL, company_bitmap = NULL "
+                                "WHERE id = ANY(:ids)"),
+                           {'ids': expired})
+    return len(expired)
+
+
+def materialize_selection(selection_base, where, params, bitmap=None):
+    """
+    Записати склад відбору (companies WHERE where) в selection_companies і
+    його бітмап (selection_bitmap) в selection_bases.company_bitmap, зробити
+    базу єдиною активною і прибрати застарілі знімки. bitmap - вже відома
+    множина id (перевіряється за кількістю). Транзакцію комітить викликач.
+    Повертає кількість компаній у знімку.
+    """
+    from selection_bitmap import store_selection_bitmap
+
+    db.session.execute(text("DELETE FROM selection_companies WHERE selection_base_id = :selection_base_id"),
+                       {'selection_base_id': selection_base.id})
+    count = db.session.execute(text(MATERIALIZE_SQL.format(where=where)),
+                               dict(params, selection_base_id=selection_base.id)).rowcount
+    selection_base.companies_count = count
+    store_selection_bitmap(selection_base, bitmap if bitmap is not None and len(bitmap) == count else None)
+    selection_base.materialized_at = db.session.execute(text("SELECT LOCALTIMESTAMP")).scalar()
+    db.session.execute(text(DEACTIVATE_SQL), {'selection_base_id': selection_base.id})
+    expired = _expire_snapshots()
+    logging.info(f"SelectionBase {selection_base.id} materialized: {count} companies, {expired} old snapshots expired")
+    return count
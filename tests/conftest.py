@@ -0,0 +1,44 @@
+"""
+Спільні фікстури тестів.
+
+Тести з базою даних працюють з окремою PostgreSQL базою TEST_DATABASE_URL
+(DATABASE_URL підміняється до імпорту app, схема створюється initialize_app).
+Без неї або якщо база недоступна ці тести пропускаються.
+"""
+
+import os
+import sys
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app():
+    """Додаток, привʼязаний до тестової бази, з активним app context"""
+    database_url = os.environ.get('TEST_DATABASE_URL')
+    if not database_url:
+        pytest.skip('TEST_DATABASE_URL is not set (dedicated PostgreSQL database for tests)')
+    if 'app' in sys.modules and os.environ.get('DATABASE_URL') != database_url:
+        pytest.skip('app is already imported with another DATABASE_URL')
+    os.environ['DATABASE_URL'] = database_url
+
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    from app import app, db
+
+    with app.app_context():
+        try:
+            db.session.execute(text('SELECT 1'))
+        except OperationalError as e:
+            pytest.skip(f'Test database is unavailable: {e}')
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def db(app):
+    from app import db
+
+    yield db
+    db.session.rollback()
@@ -0,0 +1,144 @@
+"""
+Регресійна перевірка N+1 для ranking_read_model: список рейтингів і перегляд
+рейтингу виконують не більше LIST_QUERY_BUDGET / VIEW_QUERY_BUDGET запитів
+незалежно від кількості рейтингів і позицій.
+"""
+
+import pytest
+
+EDRPOU_PREFIX = '990015'
+
+
+def create_rankings(db, count, positions):
+    """count рейтингів по positions позицій на одній базі відбору; повертає id рейтингів"""
+    from models_full import Company, Ranking, RankingCompany, SelectionBase
+
+    base = SelectionBase(name='test ranking read model')
+    db.session.add(base)
+    db.session.flush()
+
+    existing = db.session.query(Company).filter(Company.edrpou.like(f'{EDRPOU_PREFIX}%')).count()
+    companies = [Company(edrpou=f'{EDRPOU_PREFIX}{existing + i:04d}', name=f'Test company {existing + i}')
+                 for i in range(positions)]
+    db.session.add_all(companies)
+    db.session.flush()
+
+    ranking_ids = []
+    for number in range(count):
+        ranking = Ranking(name=f'test ranking {number}', selection_base_id=base.id,
+                          sort_criteria='revenue', sort_order='desc', companies_count=positions)
+        db.session.add(ranking)
+        db.session.flush()
+        db.session.add_all(RankingCompany(ranking_id=ranking.id, company_id=company.id, position=position)
+                           for position, company in enumerate(companies, 1))
+        ranking_ids.append(ranking.id)
+    db.session.commit()
+    return ranking_ids
+
+
+@pytest.fixture
+def rankings(db):
+    """Створює тестові рейтинги (create_rankings) і прибирає їх після тесту"""
+    from models_full import Company, Ranking, RankingCompany, SelectionBase
+
+    created = []
+
+    def create(count, positions):
+        ranking_ids = create_rankings(db, count, positions)
+        created.extend(ranking_ids)
+        return ranking_ids
+
+    yield create
+
+    db.session.rollback()
+    base_ids = [row[0] for row in db.session.query(Ranking.selection_base_id).filter(Ranking.id.in_(created))]
+    db.session.query(RankingCompany).filter(RankingCompany.ranking_id.in_(created)).delete(synchronize_session=False)
+    db.session.query(Ranking).filter(Ranking.id.in_(created)).delete(synchronize_session=False)
+    db.session.query(SelectionBase).filter(SelectionBase.id.in_(base_ids)).delete(synchronize_session=False)
+    db.session.query(Company).filter(Company.edrpou.like(f'{EDRPOU_PREFIX}%')).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def view_queries(ranking_id):
+    """
+    Запити сторінки перегляду рейтингу, включно з читанням полів, які показує
+    шаблон. Повертає (запити, показані поля).
+    """
+    from ranking_read_model import count_queries, ranking_companies_page, ranking_header
+
+    with count_queries() as statements:
+        header = ranking_header(ranking_id)
+        page = ranking_companies_page(ranking_id, total=header['companies_count'])
+        shown = {
+            'names': (header['ranking'].name, header['selection_base'].name),
+            'leader': (header['leader_name'], header['leader_edrpou']),
+            'companies_count': header['companies_count'],
+            'rows': [(position.position, company.name, company.edrpou) for position, company in page.items],
+        }
+    return statements, shown
+
+
+def list_queries():
+    """
+    Запити сторінки списку рейтингів, включно з читанням полів, які показує
+    шаблон. Повертає (запити, {id рейтингу: рядок списку}, totals).
+    """
+    from ranking_read_model import count_queries, list_rankings
+
+    with count_queries() as statements:
+        items, totals = list_rankings(per_page=100)
+        rows = {item['ranking'].id: (item['ranking'].name, item['selection_base'].name,
+                                     item['first_company_name'], item['companies_count']) for item in items}
+    return statements, rows, totals
+
+
+def test_check_query_budget(db, rankings):
+    from ranking_read_model import LIST_QUERY_BUDGET, VIEW_QUERY_BUDGET, check_query_budget
+
+    ranking_id = rankings(3, 12)[0]
+    result = check_query_budget(ranking_id)
+
+    assert result['list_queries'] <= LIST_QUERY_BUDGET
+    assert result['view_queries'] <= VIEW_QUERY_BUDGET
+    assert result['positions'] == 12
+
+
+def test_list_queries_do_not_grow_with_rankings(db, rankings):
+    from ranking_read_model import LIST_QUERY_BUDGET
+
+    from models_full import Ranking
+
+    rankings(2, 3)
+    db.session.expire_all()
+    few, _, _ = list_queries()
+
+    created = rankings(20, 3)
+    db.session.expire_all()
+    many, rows, totals = list_queries()
+
+    assert len(many) == len(few) <= LIST_QUERY_BUDGET
+    assert totals == {'total': db.session.query(Ranking).count(),
+                      'active': db.session.query(Ranking).filter(Ranking.is_active == True).count()}
+    for ranking_id in created:
+        name, base_name, first_company_name, companies_count = rows[ranking_id]
+        assert name.startswith('test ranking ')
+        assert base_name == 'test ranking read model'
+        assert first_company_name.startswith('Test company')
+        assert companies_count == 3
+
+
+def test_view_queries_do_not_grow_with_positions(db, rankings):
+    from ranking_read_model import VIEW_QUERY_BUDGET
+
+    small = rankings(1, 3)[0]
+    large = rankings(1, 60)[0]
+    db.session.expire_all()
+    few, small_shown = view_queries(small)
+    many, large_shown = view_queries(large)
+
+    assert len(many) == len(few) <= VIEW_QUERY_BUDGET
+    for shown, positions in ((small_shown, 3), (large_shown, 60)):
+        assert shown['companies_count'] == positions
+        assert [row[0] for row in shown['rows']] == list(range(1, positions + 1))
+        assert shown['leader'] == shown['rows'][0][1:]
+        assert shown['names'] == ('test ranking 0', 'test ranking read model')
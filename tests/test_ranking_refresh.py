@@ -0,0 +1,186 @@
+"""
+Диференційна перевірка ranking_refresh: після вставки, вилучення і зміни
+значень компаній позиції refresh_ranking (інкрементальне оновлення чи повний
+перерахунок) збігаються з новим рейтингом rank_selection по тій самій вибірці.
+"""
+
+import random
+
+import pytest
+from sqlalchemy import text
+
+EDRPOU_PREFIX = '99019'
+COMPANIES = 120
+
+# Рейтинг бере тільки RANKED_KVED: перехід у них і з них - вставка і вилучення позиції
+RANKED_KVED = ['01.11', '01.12']
+OTHER_KVED = '46.90'
+REGIONS = ['Київська', 'Львівська', 'Одеська']
+# Мало різних значень - багато рівних позицій для RANK і tiebreak за ЄДРПОУ для ROW_NUMBER
+REVENUES = [None, 0, 100, 250, 250.5, 1000, 5000]
+
+CASES = [
+    ('row_number', 'desc', None),
+    ('rank', 'desc', None),
+    ('row_number', 'asc', 'region_name'),
+    ('rank', 'asc', 'region_name'),
+]
+CASE_IDS = ['-'.join(str(part) for part in case) for case in CASES]
+
+CHANGE_SQL = """
+    UPDATE companies SET kved_code = COALESCE(:kved_code, kved_code),
+                         revenue_2019 = CASE WHEN :revalue THEN :revenue ELSE revenue_2019 END,
+                         updated_at = LOCALTIMESTAMP
+    WHERE id = :id
+"""
+
+
+def create_ranking_case(db, rng, method, sort_order, partition_by):
+    """Компанії, база відбору зі знімком і рейтинг за збереженим визначенням; повертає рейтинг"""
+    from models_full import Company, Ranking, SelectionBase
+    from ranking_engine import create_ranking, selection_conditions
+    from selection_snapshot import materialize_selection
+
+    db.session.add_all(Company(edrpou=f'{EDRPOU_PREFIX}{number:03d}', name=f'Refresh company {number}',
+                               kved_code=rng.choice(RANKED_KVED + [OTHER_KVED]),
+                               region_name=rng.choice(REGIONS), revenue_2019=rng.choice(REVENUES))
+                       for number in range(COMPANIES))
+    db.session.commit()
+
+    base = SelectionBase(name='test ranking refresh', is_active=True)
+    db.session.add(base)
+    db.session.flush()
+    materialize_selection(base, 'edrpou LIKE :prefix', {'prefix': f'{EDRPOU_PREFIX}%'})
+
+    ranking = Ranking(name='test ranking refresh', selection_base_id=base.id, kved_filter=','.join(RANKED_KVED),
+                      partition_by=partition_by, sort_criteria='revenue', sort_order=sort_order,
+                      rank_method=method, companies_count=0, is_active=True)
+    db.session.add(ranking)
+    db.session.flush()
+    where, params = selection_conditions(base, kved_codes=RANKED_KVED)
+    stats = create_ranking(ranking.id, where, params, 'revenue', ranking.name, 'Чистий дохід', 'Україна',
+                           sort_order=sort_order, method=method, partition_by=partition_by)
+    ranking.companies_count = stats['positions']
+    db.session.commit()
+    return ranking
+
+
+@pytest.fixture
+def ranking_case(db):
+    """Створює рейтинг (create_ranking_case) і прибирає все створене після тесту"""
+    created = []
+
+    def create(*definition):
+        ranking = create_ranking_case(db, random.Random(19), *definition)
+        created.append(ranking.selection_base_id)
+        return ranking
+
+    yield create
+
+    db.session.rollback()
+    params = {'base_ids': created, 'prefix': f'{EDRPOU_PREFIX}%'}
+    for statement in (
+        "DELETE FROM ranking_companies WHERE ranking_id IN "
+        "(SELECT id FROM rankings WHERE selection_base_id = ANY(:base_ids))",
+        "DELETE FROM rankings WHERE selection_base_id = ANY(:base_ids)",
+        "DELETE FROM selection_companies WHERE selection_base_id = ANY(:base_ids)",
+        "DELETE FROM selection_bases WHERE id = ANY(:base_ids)",
+        "DELETE FROM company_ranking_history WHERE company_id IN "
+        "(SELECT id FROM companies WHERE edrpou LIKE :prefix)",
+        "DELETE FROM companies WHERE edrpou LIKE :prefix",
+    ):
+        db.session.execute(text(statement), params)
+    db.session.commit()
+
+
+def change_companies(db, rng, count):
+    """
+    Змінити count компаній після останнього оновлення рейтингу: по черзі
+    перевести в КВЕД рейтингу (вставка), вивести з нього (вилучення) і
+    змінити значення критерію
+    """
+    from models_full import Company
+
+    ids = [row[0] for row in db.session.query(Company.id).filter(Company.edrpou.like(f'{EDRPOU_PREFIX}%'))]
+    for index, company_id in enumerate(rng.sample(sorted(ids), count)):
+        kind = index % 3
+        db.session.execute(text(CHANGE_SQL), {
+            'id': company_id,
+            'kved_code': rng.choice(RANKED_KVED) if kind == 0 else OTHER_KVED if kind == 1 else None,
+            'revalue': kind != 1,
+            'revenue': rng.choice(REVENUES),
+        })
+    db.session.commit()
+
+
+def positions(db, ranking_id):
+    """{company_id: (позиція, група)} рейтингу"""
+    rows = db.session.execute(text(
+        "SELECT company_id, position, group_label FROM ranking_companies WHERE ranking_id = :ranking_id"
+    ), {'ranking_id': ranking_id})
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def full_recompute(db, ranking):
+    """Позиції нового рейтингу rank_selection за визначенням ranking (викликач робить rollback)"""
+    from models_full import Ranking
+    from ranking_engine import rank_selection
+    from ranking_refresh import ranking_definition
+
+    where, params, _ = ranking_definition(ranking)
+    fresh = Ranking(name='test ranking refresh recompute', selection_base_id=ranking.selection_base_id)
+    db.session.add(fresh)
+    db.session.flush()
+    rank_selection(fresh.id, where, params, ranking.sort_criteria, ranking.sort_order, ranking.rank_method,
+                   ranking.partition_by)
+    return positions(db, fresh.id)
+
+
+def refresh_and_compare(db, ranking):
+    from ranking_refresh import refresh_ranking
+
+    stats = refresh_ranking(ranking.id)
+    db.session.commit()
+    expected = full_recompute(db, ranking)
+    db.session.rollback()
+
+    assert positions(db, ranking.id) == expected
+    assert stats['companies_count'] == len(expected)
+    return stats
+
+
+@pytest.mark.parametrize('method, sort_order, partition_by', CASES, ids=CASE_IDS)
+def test_incremental_refresh_matches_full_recompute(db, ranking_case, method, sort_order, partition_by):
+    from ranking_refresh import INCREMENTAL_MAX_SHARE
+
+    ranking = ranking_case(method, sort_order, partition_by)
+    rng = random.Random(2019)
+    for _ in range(4):
+        change_companies(db, rng, 6)
+        assert 6 <= INCREMENTAL_MAX_SHARE * ranking.companies_count
+        stats = refresh_and_compare(db, ranking)
+        assert stats['mode'] == 'incremental'
+        assert stats['changed_companies'] > 0
+
+
+@pytest.mark.parametrize('method, sort_order, partition_by', CASES, ids=CASE_IDS)
+def test_large_change_falls_back_to_full_refresh(db, ranking_case, method, sort_order, partition_by):
+    from ranking_refresh import INCREMENTAL_MAX_SHARE
+
+    ranking = ranking_case(method, sort_order, partition_by)
+    threshold = INCREMENTAL_MAX_SHARE * ranking.companies_count
+    change_companies(db, random.Random(7), int(COMPANIES * 0.6))
+    stats = refresh_and_compare(db, ranking)
+
+    assert stats['changed_companies'] > threshold
+    assert stats['mode'] == 'full'
+
+
+def test_refresh_without_changes_keeps_positions(db, ranking_case):
+    ranking = ranking_case('row_number', 'desc', None)
+    before = positions(db, ranking.id)
+    stats = refresh_and_compare(db, ranking)
+
+    assert stats['mode'] == 'incremental'
+    assert stats['positions_changed'] == 0
+    assert positions(db, ranking.id) == before
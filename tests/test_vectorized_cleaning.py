@@ -0,0 +1,56 @@
+"""
+Диференційна перевірка колонкових функцій vectorized_cleaning проти скалярних:
+для кожного значення результат колонки має збігатися з scalar(value).
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from vectorized_cleaning import COLUMN_FUNCTIONS, _same, generate_import_values, generate_test_values
+
+# Крайні випадки швидких шляхів: знак і експонента для '-'→'0', слова float(),
+# комбіновані знаки кирилиці (U+0483) і символи, які змінює NFKC
+EDGE_VALUES = [
+    None, np.nan, '', '   ', 'nan', 'NaN', 'None', 'none ', True, 0, -0.0, 2 ** 70,
+    float('inf'), float('-inf'), 1e-5, -1e-5, '-inf', 'inf', 'Infinity', '-1e-5', '1e-3', ' -5 ',
+    '-', '.', '-.', '+', 'e5', '1e', '1_000', '-1_0', '١٢', '-٥', '１２', '1 000,50 грн', '₴120',
+    '12\x00', 'ТОВ\t"Агро"\r\n', "O'Brien\\", 'ИЙ҃а', 'а́', 'ﬁＡБ', '😀', 'Ж' * 600,
+]
+
+FUNCTION_IDS = [name for name, _, _ in COLUMN_FUNCTIONS]
+
+
+def mismatches(scalar, column, values):
+    vectorized = column(pd.Series(values, dtype=object)).tolist()
+    return [(value, scalar(value), actual) for value, actual in zip(values, vectorized)
+            if not _same(scalar(value), actual)]
+
+
+@pytest.mark.parametrize('seed', [42, 7, 2024])
+@pytest.mark.parametrize('name, scalar, column', COLUMN_FUNCTIONS, ids=FUNCTION_IDS)
+def test_column_matches_scalar_on_generated_values(name, scalar, column, seed):
+    assert mismatches(scalar, column, generate_test_values(5000, seed)) == []
+
+
+@pytest.mark.parametrize('name, scalar, column', COLUMN_FUNCTIONS, ids=FUNCTION_IDS)
+def test_column_matches_scalar_on_import_values(name, scalar, column):
+    names, numbers = generate_import_values(5000)
+    values = numbers if name in ('clean_numeric_value', 'parse_amount_value', 'clean_numeric_for_sql') else names
+    assert mismatches(scalar, column, values.tolist()) == []
+
+
+@pytest.mark.parametrize('name, scalar, column', COLUMN_FUNCTIONS, ids=FUNCTION_IDS)
+def test_column_matches_scalar_on_edge_values(name, scalar, column):
+    assert mismatches(scalar, column, EDGE_VALUES) == []
+
+
+@pytest.mark.parametrize('name, scalar, column', COLUMN_FUNCTIONS, ids=FUNCTION_IDS)
+def test_column_keeps_index(name, scalar, column):
+    series = pd.Series(['1 000', None, 'ТОВ "Агро"'], index=[10, 5, 7], dtype=object)
+    assert column(series).index.tolist() == [10, 5, 7]
+
+
+@pytest.mark.parametrize('name, scalar, column', COLUMN_FUNCTIONS, ids=FUNCTION_IDS)
+def test_column_accepts_empty_input(name, scalar, column):
+    assert column(pd.Series([], dtype=object)).tolist() == []
@@ -0,0 +1,565 @@
+#!/usr/bin/env python3
+"""
+Векторизоване очищення колонок для завантаження компаній.
+
+Містить скалярні функції очищення (еталон, раніше продубльовані в routes.py,
+data_processor.py і data_processor_full.py) та їх аналоги для цілих колонок
+pandas. Колонкові версії дають той самий результат, що й скалярні:
+текст - object Series з None, числа - float64 Series з NaN замість None.
+
+Швидкий шлях шукає рядки, що потребують змін, одним проходом регулярного
+виразу по склеєній колонці й перетворює числа через astype (float() для
+кожного значення); значення, які так не розбираються, передаються скалярній
+функції, тому рідкісні крайні випадки збігаються за побудовою.
+
+Запуск як скрипт виконує диференційну перевірку на згенерованих даних
+і порівняння швидкодії: python vectorized_cleaning.py [rows]
+"""
+
+import re
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+NULL_TEXT_VALUES = ['nan', 'none']
+MAX_TEXT_LENGTH = 500
+MAX_SQL_AMOUNT = 1000000000000
+
+NON_CYRILLIC_PATTERN = r'[^\x00-\x7FЀ-ӿ]'
+
+
+# ===== Скалярні функції (еталон) =====
+
+def clean_text_value(value):
+    """Clean text value for safe database storage"""
+    if value is None or str(value).lower() in NULL_TEXT_VALUES:
+        return None
+
+    text = str(value).strip()
+    if text.lower() == 'nan' or text == '':
+        return None
+
+    # Remove problematic characters
+    text = text.replace('\x00', '').replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
+    text = text.replace('\t', ' ')
+
+    # Limit length to prevent database errors
+    if len(text) > MAX_TEXT_LENGTH:
+        text = text[:MAX_TEXT_LENGTH]
+
+    return text
+
+
+def clean_numeric_value(value):
+    """Clean numeric value for safe database storage"""
+    if value is None or str(value).lower() in NULL_TEXT_VALUES:
+        return None
+
+    try:
+        text = str(value).strip().replace(',', '').replace(' ', '').replace('-', '0')
+        if text == '' or text.lower() == 'nan':
+            return None
+        return float(text)
+    except:
+        return None
+
+
+def normalize_text_value(value):
+    """Clean text values to avoid UTF-8 encoding issues (NFKC + ASCII/Cyrillic only)"""
+    if pd.isna(value) or value is None:
+        return None
+
+    try:
+        text = str(value).strip()
+        # Normalize unicode characters
+        text = unicodedata.normalize('NFKC', text)
+        # Remove problematic characters that cause encoding issues
+        text = re.sub(NON_CYRILLIC_PATTERN, '', text)  # Keep ASCII and Cyrillic
+        return text if text else None
+    except Exception:
+        return None
+
+
+def parse_amount_value(value):
+    """Clean and convert numeric values from Excel"""
+    if pd.isna(value) or value == '' or value is None:
+        return None
+
+    if isinstance(value, str):
+        # Remove spaces, commas, and other non-numeric characters except decimal points
+        value = value.replace(' ', '').replace(',', '').replace('₴', '').replace('грн', '')
+
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def clean_text_for_sql(value):
+    """Clean text value for SQL insertion"""
+    if pd.isna(value) or value is None or str(value).lower() == 'nan':
+        return None
+
+    text = str(value).strip()
+
+    # Remove NULL bytes and other problematic characters
+    text = text.replace('\x00', '').replace('\r\n', ' ').replace('\n', ' ').replace('\r', ' ')
+    text = text.replace('\t', ' ').replace('\\', '/').replace("'", "''")  # Escape single quotes
+
+    # Limit length
+    if len(text) > MAX_TEXT_LENGTH:
+        text = text[:MAX_TEXT_LENGTH]
+
+    return text if text and text.lower() != 'nan' else None
+
+
+def clean_numeric_for_sql(value):
+    """Clean numeric value for SQL insertion"""
+    if pd.isna(value) or value is None or value == '':
+        return None
+
+    try:
+        str_value = str(value).strip()
+        str_value = str_value.replace(',', '').replace(' ', '').replace('₴', '').replace('грн', '')
+
+        numeric_value = float(str_value)
+
+        if numeric_value < 0 or numeric_value > MAX_SQL_AMOUNT:
+            return None
+
+        return numeric_value
+    except (ValueError, TypeError):
+        return None
+
+
+# ===== Допоміжні функції для колонок =====
+
+def _as_object_series(values):
+    """Series/масив/список → (object Series з RangeIndex, початковий індекс)"""
+    if isinstance(values, pd.Series):
+        return values.astype(object).reset_index(drop=True), values.index
+    series = pd.Series(values, dtype=object)
+    return series, series.index
+
+
+def _lengths(values):
+    """Довжини рядків object-масиву"""
+    return np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+
+
+def _apply(values, mask, func):
+    """Застосувати рядкову операцію Series → Series лише до позицій mask"""
+    if mask.any():
+        values[mask] = func(pd.Series(values[mask], dtype=object)).to_numpy(dtype=object)
+
+
+def _strip(values):
+    """str.strip() для кожного рядка object-масиву"""
+    return np.fromiter(map(str.strip, values), dtype=object, count=len(values))
+
+
+def _has_chars(values, lengths, char_class):
+    """
+    Маска рядків object-масиву, що містять символ з char_class.
+
+    Рядки склеюються в один і переглядаються одним проходом регулярного
+    виразу; позиції збігів переводяться в номери рядків за довжинами.
+    char_class - клас з одного символу, тому збіг не перетинає межу рядків.
+    """
+    result = np.zeros(len(values), dtype=bool)
+    positions = [match.start() for match in re.finditer(char_class, ''.join(values))]
+    if positions:
+        result[np.searchsorted(np.cumsum(lengths), positions, side='right')] = True
+    return result
+
+
+def _replace_control(text):
+    """Заміни з clean_text_value: NULL-байти, переноси рядків, табуляції"""
+    return (text.str.replace('\x00', '', regex=False)
+                .str.replace('\r\n', ' ', regex=False)
+                .str.replace('\n', ' ', regex=False)
+                .str.replace('\r', ' ', regex=False)
+                .str.replace('\t', ' ', regex=False))
+
+
+def _replace_sql(text):
+    """Заміни з clean_text_for_sql: керуючі символи, '\\' → '/', подвоєння лапок"""
+    return (_replace_control(text)
+            .str.replace('\\', '/', regex=False)
+            .str.replace("'", "''", regex=False))
+
+
+def _truncate(values, lengths, max_length):
+    """Обрізати рядки, довші за max_length"""
+    _apply(values, lengths > max_length, lambda text: text.str.slice(0, max_length))
+
+
+def _lower_equals(values, mask, word):
+    """Маска позицій mask, де рядок у нижньому регістрі дорівнює word"""
+    result = np.zeros(len(values), dtype=bool)
+    if mask.any():
+        result[mask] = pd.Series(values[mask], dtype=object).str.lower().to_numpy() == word
+    return result
+
+
+def _value_kinds(series):
+    """Маски позицій з рядками та з числами float/int (bool не вважається числом)"""
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return np.zeros(len(series), dtype=bool), np.ones(len(series), dtype=bool)
+    kinds = series.map(type).to_numpy()
+    return kinds == str, (kinds == float) | (kinds == int)
+
+
+def _number_values(series, mask):
+    """Числові значення позицій mask як float64; None, якщо int не вміщується у float"""
+    try:
+        return series[mask].to_numpy(dtype=np.float64, na_value=np.nan)
+    except OverflowError:
+        return None
+
+
+def _fallback(result, values, positions, scalar):
+    """Обчислити позиції positions скалярною функцією"""
+    for position in positions:
+        value = scalar(values[position])
+        result[position] = np.nan if value is None else value
+
+
+def _float_values(values):
+    """
+    float() для кожного рядка object-масиву → (float64 масив, маска розібраних).
+
+    Спершу весь масив перетворюється astype (float() для кожного значення);
+    якщо якийсь рядок не розбирається, кандидатів відбирає pd.to_numeric,
+    а значення все одно дає astype - тож вони збігаються з float().
+    """
+    result = np.full(len(values), np.nan)
+    try:
+        result[:] = values.astype(np.float64)
+        return result, np.ones(len(values), dtype=bool)
+    except (ValueError, TypeError, OverflowError):
+        pass
+
+    parsed = ~np.isnan(np.asarray(pd.to_numeric(values, errors='coerce'), dtype=np.float64))
+    try:
+        result[parsed] = values[parsed].astype(np.float64)
+    except (ValueError, TypeError, OverflowError):
+        parsed[:] = False
+    return result, parsed
+
+
+def _parse_strings(strings, prepare, scalar, altered=None):
+    """
+    Розібрати рядки як float64.
+
+    Рядки, які float() розбирає без змін, не потребують замін скалярної
+    функції: ті прибирають лише пробіли, що float() і так ігнорує по краях,
+    та символи, з якими float() не працює. Виняток - символи altered, заміна
+    яких змінює число; такі рядки, як і нерозібрані, проходять prepare (ті
+    самі заміни, що й у скалярній функції) і розбираються повторно. Те, що
+    лишилось, обчислює scalar().
+    """
+    values = strings.to_numpy(dtype=object)
+    result, parsed = _float_values(values)
+    if altered is not None:
+        parsed &= ~_has_chars(values, _lengths(values), altered)
+
+    rest = np.flatnonzero(~parsed)
+    if rest.size:
+        prepared, matched = _float_values(prepare(strings.iloc[rest]).to_numpy(dtype=object))
+        result[rest[matched]] = prepared[matched]
+        _fallback(result, values, rest[~matched], scalar)
+    return result
+
+
+def _numeric_column(values, prepare, scalar, convert_numbers, altered=None):
+    """
+    Загальна схема колонкових числових функцій: рядки - через _parse_strings,
+    числа float/int - через convert_numbers(float64 array) → (значення, маска
+    тих, що треба віддати scalar), усе інше - scalar().
+    """
+    index = values.index if isinstance(values, pd.Series) else None
+    series = values.reset_index(drop=True) if index is not None else pd.Series(values, dtype=object)
+    result = np.full(len(series), np.nan)
+    is_str, is_number = _value_kinds(series)
+    fallback = ~is_str & ~is_number
+
+    if is_str.any():
+        result[is_str] = _parse_strings(series[is_str], prepare, scalar, altered)
+
+    numbers = _number_values(series, is_number) if is_number.any() else None
+    if numbers is not None:
+        converted, irregular = convert_numbers(numbers)
+        positions = np.flatnonzero(is_number)
+        result[positions] = converted
+        fallback[positions[irregular]] = True
+    elif is_number.any():
+        fallback |= is_number
+
+    if fallback.any():
+        _fallback(result, series.to_numpy(dtype=object), np.flatnonzero(fallback), scalar)
+    return pd.Series(result, index=index if index is not None else series.index)
+
+
+def _strip_numeric_separators(text):
+    """Заміни з clean_numeric_value"""
+    return (text.str.strip()
+                .str.replace(',', '', regex=False)
+                .str.replace(' ', '', regex=False)
+                .str.replace('-', '0', regex=False))
+
+
+def _strip_amount_separators(text):
+    """Заміни з parse_amount_value"""
+    return (text.str.replace(' ', '', regex=False)
+                .str.replace(',', '', regex=False)
+                .str.replace('₴', '', regex=False)
+                .str.replace('грн', '', regex=False))
+
+
+def _strip_sql_amount_separators(text):
+    """Заміни з clean_numeric_for_sql"""
+    return (text.str.strip()
+                .str.replace(',', '', regex=False)
+                .str.replace(' ', '', regex=False)
+                .str.replace('₴', '', regex=False)
+                .str.replace('грн', '', regex=False))
+
+
+def _within_sql_bounds(numbers):
+    """Відкинути значення поза [0, MAX_SQL_AMOUNT], як clean_numeric_for_sql"""
+    with np.errstate(invalid='ignore'):
+        return np.where((numbers < 0) | (numbers > MAX_SQL_AMOUNT), np.nan, numbers)
+
+
+# ===== Векторизовані функції =====
+
+def clean_text_column(values, max_length=MAX_TEXT_LENGTH):
+    """Колонковий аналог clean_text_value"""
+    series, index = _as_object_series(values)
+    raw = series.astype(str).to_numpy(dtype=object)
+    text = _strip(raw)
+    lengths = _lengths(text)
+
+    # str(value).lower() in ['nan', 'none'] або порожній/'nan' рядок після strip
+    short = (lengths == 3) | (lengths == 4)
+    null = (lengths == 0) | _lower_equals(text, short, 'nan')
+    null |= _lower_equals(text, short, 'none') & (raw == text)
+
+    dirty = _has_chars(text, lengths, r'[\x00\r\n\t]')
+    _apply(text, dirty, _replace_control)
+    lengths[dirty] = _lengths(text[dirty])
+    _truncate(text, lengths, max_length)
+
+    text[null] = None
+    return pd.Series(text, index=index)
+
+
+def clean_numeric_column(values):
+    """Колонковий аналог clean_numeric_value"""
+    def convert_numbers(numbers):
+        # str(value) дає експоненту з '-' для |x| < 1e-4, а '-inf' стає '0inf'
+        irregular = ~np.isnan(numbers) & ~(np.isfinite(numbers)
+                                           & ((np.abs(numbers) >= 1e-4) | (numbers == 0)))
+        return np.abs(numbers), irregular
+
+    # '-' замінюється на '0': перед числом це abs(), але в експоненті чи '-inf' -
+    # інше значення, тому рядки з експонентою та словами - через заміни
+    result = _numeric_column(values, _strip_numeric_separators, clean_numeric_value,
+                             convert_numbers, altered=r'[eEiInN]')
+    # '-' замінюється на '0', тому знак мінус зникає
+    return result.abs()
+
+
+def normalize_text_column(values):
+    """Колонковий аналог normalize_text_value (NFKC + фільтр ASCII/кирилиці)"""
+    series, index = _as_object_series(values)
+    null = series.isna().to_numpy()
+    text = _strip(series.astype(str).to_numpy(dtype=object))
+    lengths = _lengths(text)
+
+    # ASCII і кирилиця стабільні щодо NFKC і проходять фільтр; виняток -
+    # комбіновані знаки U+0483-U+0487, з ними рядок обробляється повністю
+    irregular = _has_chars(text, lengths, r'[^\x00-\x7FЀ-҂҈-ӿ]')
+    _apply(text, irregular, lambda part: part.str.normalize('NFKC')
+                                              .str.replace(NON_CYRILLIC_PATTERN, '', regex=True))
+    lengths[irregular] = _lengths(text[irregular])
+
+    null |= lengths == 0
+    text[null] = None
+    return pd.Series(text, index=index)
+
+
+def parse_amount_column(values):
+    """
+    Колонковий аналог parse_amount_value (пробіли, коми, '₴', 'грн').
+    Не швидша за map(parse_amount_value): обидві впираються у float(), тому
+    конвеєр імпорту використовує скалярну функцію.
+    """
+    def convert_numbers(numbers):
+        return numbers, np.zeros(len(numbers), dtype=bool)
+
+    return _numeric_column(values, _strip_amount_separators, parse_amount_value, convert_numbers)
+
+
+def clean_text_for_sql_column(values, max_length=MAX_TEXT_LENGTH):
+    """Колонковий аналог clean_text_for_sql"""
+    series, index = _as_object_series(values)
+    raw = series.astype(str).to_numpy(dtype=object)
+    text = _strip(raw)
+    null = series.isna().to_numpy()
+    null |= _lower_equals(raw, _lengths(raw) == 3, 'nan')
+
+    dirty = _has_chars(text, _lengths(text), r"[\x00\r\n\t\\']")
+    _apply(text, dirty, _replace_sql)
+    lengths = _lengths(text)
+    _truncate(text, lengths, max_length)
+    lengths = np.minimum(lengths, max_length)
+
+    null |= (lengths == 0) | _lower_equals(text, lengths == 3, 'nan')
+    text[null] = None
+    return pd.Series(text, index=index)
+
+
+def clean_numeric_for_sql_column(values):
+    """Колонковий аналог clean_numeric_for_sql (з відсіканням < 0 та > 1e12)"""
+    def convert_numbers(numbers):
+        # float(str(x)) == x для float і int; inf/-inf відсікаються межами
+        return numbers, np.zeros(len(numbers), dtype=bool)
+
+    result = _numeric_column(values, _strip_sql_amount_separators, clean_numeric_for_sql,
+                             convert_numbers)
+    return pd.Series(_within_sql_bounds(result.to_numpy()), index=result.index)
+
+
+# ===== Диференційна перевірка та бенчмарк =====
+
+COLUMN_FUNCTIONS = [
+    ('clean_text_value', clean_text_value, clean_text_column),
+    ('clean_numeric_value', clean_numeric_value, clean_numeric_column),
+    ('normalize_text_value', normalize_text_value, normalize_text_column),
+    ('parse_amount_value', parse_amount_value, parse_amount_column),
+    ('clean_text_for_sql', clean_text_for_sql, clean_text_for_sql_column),
+    ('clean_numeric_for_sql', clean_numeric_for_sql, clean_numeric_for_sql_column),
+]
+NUMERIC_COLUMN_FUNCTIONS = [clean_numeric_column, parse_amount_column, clean_numeric_for_sql_column]
+
+
+def generate_test_values(rows, seed=42):
+    """Згенерувати змішані значення, схожі на клітинки Excel/CSV"""
+    rng = np.random.default_rng(seed)
+    fragments = ['ТОВ', '"Агро"', 'ПрАТ', 'Київ', 'Company', 'ЄДРПОУ', 'грн', '₴', 'ﬁ', 'Ａ', '１２',
+                 '😀', 'ñ', '\t', '\n', '\r\n', '\x00', "'", '\\', '  ', '-', ',', '.', 'nan', 'None']
+    generators = [
+        lambda: None,
+        lambda: np.nan,
+        lambda: '',
+        lambda: 'nan',
+        lambda: 'NaN',
+        lambda: 'None',
+        lambda: '   ',
+        lambda: float(rng.normal(0, 1e6)),
+        lambda: int(rng.integers(-10 ** 6, 10 ** 9)),
+        lambda: f"{rng.normal(0, 1e7):,.2f}",
+        lambda: f"{rng.integers(0, 10 ** 9):,}".replace(',', ' '),
+        lambda: f"{rng.uniform(0, 1e6):.2f}".replace('.', ','),
+        lambda: f"{rng.uniform(0, 1e6):.2f} грн",
+        lambda: f"₴{rng.uniform(0, 1e6):.0f}",
+        lambda: f"{rng.uniform(0, 1e13):.3e}",
+        lambda: f" {rng.integers(0, 10 ** 8)} ",
+        lambda: f"{rng.integers(0, 10 ** 6)}\xa0{rng.integers(100, 999)}",
+        lambda: '1_000',
+        lambda: 'inf',
+        lambda: '-',
+        lambda: str(rng.integers(10 ** 7, 10 ** 8)),
+        lambda: ''.join(rng.choice(fragments, size=int(rng.integers(1, 8)))),
+        lambda: 'Ж' * int(rng.integers(490, 520)),
+        lambda: True,
+    ]
+    choices = rng.integers(0, len(generators), size=rows)
+    return [generators[choice]() for choice in choices]
+
+
+def _same(expected, actual):
+    if expected is None:
+        return actual is None or (isinstance(actual, float) and np.isnan(actual))
+    if isinstance(expected, float):
+        if np.isnan(expected):
+            return actual is None or (isinstance(actual, float) and np.isnan(actual))
+        return isinstance(actual, float) and actual == expected
+    return actual == expected
+
+
+def verify_against_scalar(rows=20000, seed=42):
+    """Порівняти колонкові функції зі скалярними. Повертає {name: [розбіжності]}"""
+    values = generate_test_values(rows, seed)
+    series = pd.Series(values, dtype=object)
+    mismatches = {}
+    for name, scalar, column in COLUMN_FUNCTIONS:
+        vectorized = column(series).tolist()
+        mismatches[name] = [
+            (values[i], expected, vectorized[i])
+            for i, expected in enumerate(scalar(v) for v in values)
+            if not _same(expected, vectorized[i])
+        ]
+    return mismatches
+
+
+def generate_import_values(rows, seed=7):
+    """
+    Типові значення колонок імпорту: назви компаній для текстових функцій,
+    суми для числових (половина - числа з xlsx, половина - рядки з CSV),
+    з 5% значень із generate_test_values.
+    """
+    rng = np.random.default_rng(seed)
+    prefixes = ['ТОВ', 'ПП', 'ПрАТ', 'ФГ', 'ТДВ']
+    names = [f'{prefixes[i % len(prefixes)]} "Компанія {i}"' for i in range(rows)]
+    amounts = rng.normal(1e6, 5e6, rows).round(2)
+    numbers = [float(x) if i % 2 else f'{x:.2f}' for i, x in enumerate(amounts)]
+
+    messy = generate_test_values(rows // 20, seed)
+    positions = rng.choice(rows, size=len(messy), replace=False)
+    for position, value in zip(positions, messy):
+        names[position] = value
+        numbers[position] = value
+    return pd.Series(names, dtype=object), pd.Series(numbers, dtype=object)
+
+
+def benchmark(rows=160000, seed=7):
+    """Час скалярного map() проти колонкової функції. Повертає {name: (scalar_s, vector_s)}"""
+    names, numbers = generate_import_values(rows, seed)
+    timings = {}
+    for name, scalar, column in COLUMN_FUNCTIONS:
+        series = numbers if column in NUMERIC_COLUMN_FUNCTIONS else names
+        started = time.perf_counter()
+        series.map(scalar)
+        scalar_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        column(series)
+        timings[name] = (scalar_seconds, time.perf_counter() - started)
+    return timings
+
+
+if __name__ == '__main__':
+    import sys
+
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 160000
+
+    print("=== Диференційна перевірка ===")
+    failed = False
+    for name, problems in verify_against_scalar().items():
+        status = '✓' if not problems else f'✗ {len(problems)} розбіжностей'
+        print(f"{name}: {status}")
+        for value, expected, actual in problems[:5]:
+            print(f"    {value!r}: очікувалось {expected!r}, отримано {actual!r}")
+        failed = failed or bool(problems)
+
+    print(f"\n=== Бенчмарк ({rows} рядків) ===")
+    for name, (scalar_seconds, vector_seconds) in benchmark(rows).items():
+        print(f"{name}: скалярно {scalar_seconds:.3f}s, колонково {vector_seconds:.3f}s "
+              f"(x{scalar_seconds / max(vector_seconds, 1e-9):.1f})")
+
+    sys.exit(1 if failed else 0)